@@ -0,0 +1,427 @@
+"""
+Admission control of model calls against the rate limits of the Anthropic account.
+
+Every model call reserves one request, its estimated input tokens and its expected output
+tokens (the predicted size of the response, not max_tokens) in three token buckets of the model -
+requests, input tokens and output tokens per minute - which refill continuously like the limits
+of the API. A call that does not fit waits in a queue with a predicted wait time instead of
+running into a 429 error. When the call ends - finished, aborted or failed - the reservation is
+corrected to the tokens it actually consumed, so an aborted call gives back what it did not use.
+The continuation of a response cut off by max_tokens has already been paid for in part, so it
+is admitted right away instead of waiting behind the queue.
+
+When several clients wait for the same model, the call of the client with the fewest calls
+admitted within the last minute is admitted first, so a batch of one user does not starve
+interactive users.
+
+The limits apply to the whole account, so bucket levels and the queue are stored in SQLite
+and shared by all server processes. Capacities start from the configured limits and follow
+the anthropic-ratelimit-* headers of API responses.
+"""
+import os
+import time
+import uuid
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Bucket kinds, named like the anthropic-ratelimit-<kind>-limit / -remaining response headers
+BUCKET_KINDS = ("requests", "input-tokens", "output-tokens")
+HEADER_PREFIX = "anthropic-ratelimit-"
+
+# Rough characters-per-token ratio of the input estimate (same as main.CHARS_PER_TOKEN)
+CHARS_PER_TOKEN = 3.5
+
+# Waiting tickets not polled for this long belong to a stopped process
+WAITING_TTL = 30.0
+# Admitted tickets are forgotten after this long (longer than any generation, see GUNICORN_TIMEOUT)
+RUNNING_TTL = 900.0
+# Finished calls count towards the fair share of their client for this long
+FAIR_SHARE_WINDOW = 60.0
+
+# Ticket states stored in the admitted column
+WAITING, RUNNING, FINISHED = 0, 1, 2
+
+
+class AdmissionRejected(Exception):
+    """Raised when a call has waited longer than the maximum wait time."""
+
+    def __init__(self, wait):
+        super().__init__(f"Wait of {wait:.0f}s exceeds the limit")
+        self.wait = wait
+
+
+def estimate_input_tokens(*texts):
+    """Estimate input tokens of a call from its system prompt and message texts."""
+    return int(sum(len(text or "") for text in texts) / CHARS_PER_TOKEN) + 1
+
+
+class Ticket:
+    """A model call waiting for admission or running; wait and position are updated while it waits."""
+
+    def __init__(self, model, client, input_tokens, output_tokens):
+        self.id = uuid.uuid4().hex
+        self.model = model
+        self.client = client
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.created_at = time.time()
+        self.admitted = False
+        self.admitted_at = None
+        self.released = False
+        self.wait = 0.0
+        self.position = 0
+
+    def needs(self):
+        return {"requests": 1, "input-tokens": self.input_tokens, "output-tokens": self.output_tokens}
+
+
+class AdmissionController:
+    """
+    Token buckets per model and a fair-share queue of waiting calls.
+
+    limits maps a model id to {"requests", "input-tokens", "output-tokens"} per minute; models
+    without limits are admitted immediately. Waiting calls stay in the queue until they fit;
+    only with max_wait set, a call that has actually waited longer is rejected with AdmissionRejected.
+    """
+
+    def __init__(self, db_path, limits=None, max_wait=None, poll_interval=0.5, enabled=True):
+        self.db_path = db_path
+        self.limits = limits or {}
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._counters = {"admitted": 0, "queued": 0, "rejected": 0, "wait_seconds": 0.0, "header_updates": 0}
+
+        self._db_ready = False
+        self._db_lock = threading.Lock()
+
+    def _connect(self):
+        """Open a new SQLite connection; the database is created on first use, not when the object is made."""
+        if not self._db_ready:
+            with self._db_lock:
+                if not self._db_ready:
+                    self._init_db()
+                    self._db_ready = True
+        return self._open()
+
+    def _open(self):
+        """Open a new SQLite connection in autocommit mode - transactions are started explicitly."""
+        return sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+
+    def _init_db(self):
+        """Create the admission database and tables if they do not exist yet."""
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = self._open()
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    model TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    capacity REAL NOT NULL,
+                    level REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (model, kind)
+                )
+            """)
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS tickets (
+                    id TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    client TEXT NOT NULL,
+                    input_tokens INTEGER NOT NULL,
+                    output_tokens INTEGER NOT NULL,
+                    admitted INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    heartbeat REAL NOT NULL
+                )
+            """)
+        finally:
+            connection.close()
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def _active(self, model):
+        return self.enabled and bool(self.db_path) and model in self.limits
+
+    def _transaction(self, work):
+        """Run work(connection) in a write transaction, so processes do not interleave bucket updates."""
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            result = work(connection)
+            connection.execute("COMMIT")
+            return result
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def _buckets(self, connection, model, now):
+        """Return {kind: [capacity, level]} of the model, refilled up to now."""
+        rows = {kind: [capacity, level, updated_at] for kind, capacity, level, updated_at in connection.execute(
+            "SELECT kind, capacity, level, updated_at FROM buckets WHERE model = ?", (model,)
+        )}
+        buckets = {}
+        for kind in BUCKET_KINDS:
+            if kind in rows:
+                capacity, level, updated_at = rows[kind]
+                level = min(capacity, level + max(0.0, now - updated_at) * capacity / 60.0)
+            else:
+                capacity = level = float(self.limits[model][kind])
+            buckets[kind] = [capacity, level]
+        return buckets
+
+    def _save_buckets(self, connection, model, buckets, now):
+        connection.executemany(
+            "INSERT OR REPLACE INTO buckets (model, kind, capacity, level, updated_at) VALUES (?, ?, ?, ?, ?)",
+            [(model, kind, capacity, level, now) for kind, (capacity, level) in buckets.items()]
+        )
+
+    # Queue
+
+    def enqueue(self, model, client, input_tokens, output_tokens, priority=False):
+        """
+        Put a call in the queue of the model and return its Ticket (admitted right away if it fits).
+        output_tokens is the expected size of the response. A priority call (continuation of a
+        response) is admitted right away even when the buckets go below zero.
+        """
+        ticket = Ticket(model, client or "anonymous", input_tokens, output_tokens)
+        if not self._active(model):
+            ticket.admitted = True
+            return ticket
+
+        def insert(connection):
+            self._insert(connection, ticket)
+            if priority:
+                return self._admit(connection, ticket, self._buckets(connection, model, ticket.created_at), ticket.created_at)
+            return self._try_admit(connection, ticket)
+
+        try:
+            admitted = self._transaction(insert)
+        except sqlite3.Error as e:
+            # Without the shared state the call is not held back
+            logger.warning(f"Admission check failed: {str(e)}")
+            ticket.admitted = True
+            return ticket
+        if not admitted:
+            self._count("queued")
+            logger.info(f"Call to {model} queued at position {ticket.position}, expected wait {ticket.wait:.1f}s")
+        return ticket
+
+    def try_admit(self, model, client, input_tokens, output_tokens):
+        """
+        Admit an optional call (e.g. a hedged attempt) only if it fits right away without
+        overtaking waiting calls. Returns the admitted Ticket, or None when it does not fit.
+        """
+        ticket = Ticket(model, client or "anonymous", input_tokens, output_tokens)
+        if not self._active(model):
+            ticket.admitted = True
+            return ticket
+
+        def insert(connection):
+            self._insert(connection, ticket)
+            if self._try_admit(connection, ticket):
+                return True
+            connection.execute("DELETE FROM tickets WHERE id = ?", (ticket.id,))
+            return False
+
+        try:
+            return ticket if self._transaction(insert) else None
+        except sqlite3.Error as e:
+            logger.warning(f"Admission check failed: {str(e)}")
+            return None
+
+    def _insert(self, connection, ticket):
+        connection.execute(
+            "INSERT INTO tickets (id, model, client, input_tokens, output_tokens, created_at, heartbeat) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (ticket.id, ticket.model, ticket.client, ticket.input_tokens, ticket.output_tokens, ticket.created_at, ticket.created_at)
+        )
+
+    def _try_admit(self, connection, ticket):
+        """
+        Admit the ticket if it is first in the fair-share order and fits the buckets; otherwise
+        update its position and predicted wait. Returns True when admitted.
+        """
+        now = time.time()
+        for state, ttl in ((WAITING, WAITING_TTL), (RUNNING, RUNNING_TTL), (FINISHED, FAIR_SHARE_WINDOW)):
+            connection.execute("DELETE FROM tickets WHERE admitted = ? AND heartbeat < ?", (state, now - ttl))
+        connection.execute("UPDATE tickets SET heartbeat = ? WHERE id = ?", (now, ticket.id))
+
+        # Fair share - clients with fewer calls running or finished within the window go first,
+        # then the order of arrival
+        waiting = connection.execute("""
+            SELECT t.id, t.input_tokens, t.output_tokens FROM tickets t
+            WHERE t.model = ? AND t.admitted = ?
+            ORDER BY (SELECT COUNT(*) FROM tickets r WHERE r.client = t.client AND r.admitted != ?), t.created_at
+        """, (ticket.model, WAITING, WAITING)).fetchall()
+        if ticket.id not in [row[0] for row in waiting]:
+            # Removed as stale (the process was busy for a long time) - put it back in the queue
+            connection.execute(
+                "INSERT OR REPLACE INTO tickets (id, model, client, input_tokens, output_tokens, created_at, heartbeat) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (ticket.id, ticket.model, ticket.client, ticket.input_tokens, ticket.output_tokens, ticket.created_at, now)
+            )
+            waiting.append((ticket.id, ticket.input_tokens, ticket.output_tokens))
+        buckets = self._buckets(connection, ticket.model, now)
+
+        # Tokens needed by the calls up to this one - the predicted wait is the time to refill them
+        ahead = {kind: 0.0 for kind in BUCKET_KINDS}
+        for position, (ticket_id, input_tokens, output_tokens) in enumerate(waiting, start=1):
+            needs = {"requests": 1, "input-tokens": input_tokens, "output-tokens": output_tokens}
+            for kind in BUCKET_KINDS:
+                # A call larger than the whole bucket needs only a full bucket (the level goes below zero)
+                ahead[kind] += min(needs[kind], buckets[kind][0])
+            if ticket_id == ticket.id:
+                break
+
+        ticket.position = position
+        ticket.wait = max(0.0, *(
+            (ahead[kind] - level) / (capacity / 60.0) if capacity > 0 else 60.0
+            for kind, (capacity, level) in buckets.items()
+        ))
+        if position > 1 or ticket.wait > 0:
+            return False
+        return self._admit(connection, ticket, buckets, now)
+
+    def _admit(self, connection, ticket, buckets, now):
+        """Take the reservation of the ticket from the buckets and mark it running."""
+        needs = ticket.needs()
+        for kind in BUCKET_KINDS:
+            buckets[kind][1] -= needs[kind]
+        self._save_buckets(connection, ticket.model, buckets, now)
+        connection.execute("UPDATE tickets SET admitted = ?, heartbeat = ? WHERE id = ?", (RUNNING, now, ticket.id))
+        ticket.admitted = True
+        ticket.admitted_at = now
+        self._count("admitted")
+        return True
+
+    def wait(self, ticket, timeout=None):
+        """
+        Wait until the ticket is admitted; returns False when timeout passes first, so the caller
+        can report the predicted wait. Raises AdmissionRejected when max_wait is set and the call
+        has waited longer.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while not ticket.admitted:
+            waited = time.time() - ticket.created_at
+            if self.max_wait is not None and waited > self.max_wait:
+                self.release(ticket)
+                self._count("rejected")
+                logger.warning(f"Call to {ticket.model} rejected after waiting {waited:.0f}s")
+                raise AdmissionRejected(waited)
+
+            remaining = deadline - time.monotonic() if deadline is not None else self.poll_interval
+            if remaining <= 0:
+                return False
+            time.sleep(max(0.01, min(self.poll_interval, ticket.wait or self.poll_interval, remaining)))
+            try:
+                if self._transaction(lambda connection: self._try_admit(connection, ticket)):
+                    self._count("wait_seconds", ticket.admitted_at - ticket.created_at)
+            except sqlite3.Error as e:
+                logger.warning(f"Admission check failed: {str(e)}")
+                ticket.admitted = True
+        return True
+
+    def release(self, ticket, input_tokens=0, output_tokens=0):
+        """
+        Remove the ticket when its call has ended or was abandoned. input_tokens and output_tokens
+        are the tokens the call consumed - of a finished call its usage, of an aborted call what it
+        received so far, 0 when it failed before the API accepted it. The difference to the
+        reservation is returned to (or taken from) the buckets. Only the first release of a ticket counts.
+        """
+        if not self._active(ticket.model) or ticket.released:
+            return
+        ticket.released = True
+
+        def finish(connection):
+            now = time.time()
+            if not ticket.admitted:
+                connection.execute("DELETE FROM tickets WHERE id = ?", (ticket.id,))
+                return
+            # Kept for the fair share window of the client
+            connection.execute("UPDATE tickets SET admitted = ?, heartbeat = ? WHERE id = ?", (FINISHED, now, ticket.id))
+            buckets = self._buckets(connection, ticket.model, now)
+            for kind, reserved, used in (("input-tokens", ticket.input_tokens, input_tokens),
+                                         ("output-tokens", ticket.output_tokens, output_tokens)):
+                capacity, level = buckets[kind]
+                buckets[kind][1] = min(capacity, level + reserved - (used or 0))
+            self._save_buckets(connection, ticket.model, buckets, now)
+
+        try:
+            self._transaction(finish)
+        except sqlite3.Error as e:
+            logger.warning(f"Admission release failed: {str(e)}")
+
+    # Rate limit headers
+
+    def update_from_headers(self, model, headers):
+        """
+        Adjust the buckets of a model to the anthropic-ratelimit-* headers of an API response.
+        A changed limit replaces the capacity and the level; otherwise the level never exceeds
+        the remaining amount reported by the API (other users of the account also consume it).
+        """
+        if not self._active(model):
+            return
+        reported = {}
+        for kind in BUCKET_KINDS:
+            try:
+                reported[kind] = (float(headers[f"{HEADER_PREFIX}{kind}-limit"]), float(headers[f"{HEADER_PREFIX}{kind}-remaining"]))
+            except (KeyError, TypeError, ValueError):
+                continue
+        if not reported:
+            return
+
+        def update(connection):
+            now = time.time()
+            buckets = self._buckets(connection, model, now)
+            for kind, (limit, remaining) in reported.items():
+                capacity, level = buckets[kind]
+                if limit != capacity:
+                    logger.info(f"Rate limit of {model} for {kind} is {limit:.0f} per minute")
+                    buckets[kind] = [limit, remaining]
+                else:
+                    buckets[kind][1] = min(level, remaining)
+            self._save_buckets(connection, model, buckets, now)
+
+        try:
+            self._transaction(update)
+            self._count("header_updates")
+        except sqlite3.Error as e:
+            logger.warning(f"Admission header update failed: {str(e)}")
+
+    def stats(self):
+        """Return admission counters, bucket levels and queue lengths per model."""
+        with self._lock:
+            counters = dict(self._counters)
+        counters["wait_seconds"] = round(counters["wait_seconds"], 2)
+        if not (self.enabled and self.db_path):
+            return {**counters, "models": {}}
+
+        now = time.time()
+        models = {}
+        connection = self._connect()
+        try:
+            for model in self.limits:
+                buckets = self._buckets(connection, model, now)
+                waiting, running = connection.execute(
+                    "SELECT COALESCE(SUM(admitted = ?), 0), COALESCE(SUM(admitted = ?), 0) FROM tickets WHERE model = ?", (WAITING, RUNNING, model)
+                ).fetchone()
+                models[model] = {
+                    "waiting": waiting,
+                    "running": running,
+                    **{kind: {"capacity": capacity, "available": round(level)} for kind, (capacity, level) in buckets.items()},
+                }
+        finally:
+            connection.close()
+        return {**counters, "models": models}
@@ -1,23 +1,86 @@
-from flask import Flask, render_template, send_from_directory, request, flash
+from flask import Flask, render_template, send_from_directory, request, flash, Response, stream_with_context, send_file, g, session, url_for
 import os
-import uuid
+import json
+import math
+import shutil
+import asyncio
+import logging
+import zipfile
+import tempfile
 from dotenv import load_dotenv
 import main
+import logs
+from metrics import begin_spans, current_spans
+from jobs import JobManager, JobQueueFull, DONE, FINISHED_STATES
+from diagram_store import DiagramStore, make_backend
+from assets import AssetManifest, CachedResponse, IMMUTABLE_CACHE_CONTROL
+import preview
+import batch
 import re
 import time
 
 load_dotenv()
 
+# Application logs as JSON lines carrying the request id (LOG_FORMAT=text for plain lines)
+logs.configure_logging()
+logger = logging.getLogger(__name__)
+
 # Initialize Flask application with secret key from environment variables
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "default_secret_key")
 
-# Path to BPMN files directory - temporary storage for generated diagrams
-app.config['BPMN_FOLDER'] = 'bpmn_files'
-os.makedirs(app.config['BPMN_FOLDER'], exist_ok=True)
+# Generated diagrams - inlined into the rendered page and kept for a while at /bpmn/<id>
+# (DIAGRAM_STORE: "sqlite" shared by all processes, "memory" per process or a redis:// URL)
+diagram_store = DiagramStore(
+    make_backend(
+        os.getenv("DIAGRAM_STORE", "sqlite"),
+        db_path=os.getenv("DIAGRAM_STORE_DB", os.path.join(main.DATA_DIR, "diagrams.sqlite3")),
+        max_bytes=int(os.getenv("DIAGRAM_STORE_MAX_BYTES", 100 * 1024 * 1024))
+    ),
+    ttl=int(os.getenv("DIAGRAM_STORE_TTL", 3600)),
+    compress=os.getenv("DIAGRAM_STORE_COMPRESS", "1") != "0"
+)
+app.config['INLINE_DIAGRAMS'] = os.getenv("DIAGRAM_INLINE", "1") != "0"
+
+# SVG/PNG previews of stored diagrams rendered on the server, per process, by content hash of the diagram
+preview_cache = preview.PreviewCache(max_bytes=int(os.getenv("PREVIEW_CACHE_MAX_BYTES", 32 * 1024 * 1024)))
+
+# Static files with content-hashed URLs and gzip/brotli variants prepared at startup
+# (in debug mode the plain /static/ files are used, so edits show up without a restart)
+assets = AssetManifest(os.path.join(app.root_path, 'static'))
+
+# Rendered pages that are the same for every visitor (GET of the main page), per process
+page_cache = {}
+
+# Paths to system prompt files per generation mode - contain instructions for the AI model
+app.config['SYSTEM_PROMPT_FILES'] = {
+    mode: os.path.join(app.root_path, filename) for mode, filename in main.SYSTEM_PROMPT_FILES.items()
+}
+
+# System prompt for refinement of the current diagram - the model answers with edit operations
+app.config['REFINE_PROMPT_FILE'] = os.path.join(app.root_path, main.REFINE_PROMPT_FILE)
 
-# Path to system prompt file - contains instructions for the AI model
-app.config['SYSTEM_PROMPT_FILE'] = 'system_prompt.txt'
+# Load system prompts once at startup - later requests reuse them until the file changes
+app.config['PLAN_PROMPT_FILE'] = os.path.join(app.root_path, main.PLAN_PROMPT_FILE)
+for system_prompt_file in [*main.PROMPTS.paths(), app.config['REFINE_PROMPT_FILE'], app.config['PLAN_PROMPT_FILE']]:
+    main.load_system_prompt(system_prompt_file)
+
+# Background generation jobs - bounded worker pool and queue, job records shared through SQLite
+job_manager = JobManager(
+    db_path=os.getenv("JOBS_DB", os.path.join(main.DATA_DIR, "jobs.sqlite3")),
+    workers=int(os.getenv("JOB_WORKERS", 4)),
+    max_queue=int(os.getenv("JOB_MAX_QUEUE", 32)),
+    ttl=int(os.getenv("JOB_TTL", 3600))
+)
+# A subscription to job events ends after this many seconds (the client subscribes again if the job still runs)
+JOB_EVENTS_TIMEOUT = int(os.getenv("JOB_EVENTS_TIMEOUT", 600))
+
+# Batch generation runs as a job - uploads are extracted and the result archive is written to BATCH_DIR
+BATCH_DIR = os.getenv("BATCH_DIR", os.path.join(main.DATA_DIR, "batches"))
+# Limits of a batch upload: request size, number of descriptions and their total uncompressed size
+BATCH_MAX_UPLOAD_BYTES = int(os.getenv("BATCH_MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 200))
+BATCH_MAX_EXTRACTED_BYTES = int(os.getenv("BATCH_MAX_EXTRACTED_BYTES", 20 * 1024 * 1024))
 
 
 def format_message_by_sentences(message):
@@ -32,8 +95,11 @@ def format_message_by_sentences(message):
     if not message:
         return ""
     
-    # Find all sentences (text ending with .!? followed by space or end of text)
-    sentences = re.findall(r'[^.!?]+[.!?](?:\s|$)', message)
+    # Split into sentences (text ending with .!? followed by space or end of text) - text without
+    # an ending stays in its sentence, nothing is dropped ("bpmn.io", "<?xml" do not end a sentence)
+    sentences = [s for s in re.split(r'(?<=[.!?])\s+', message) if s.strip()]
+    if len(sentences) == 1 and not re.search(r'[.!?]$', message):
+        sentences = []
     
     # If no sentences found using regex (maybe they don't have periods), split by other criteria
     if not sentences:
@@ -57,29 +123,241 @@ def read_file_contents(file):
     try:
         return file.read().decode('utf-8')
     except UnicodeDecodeError:
-        print("ERROR: Error reading file - UnicodeDecodeError")
+        logger.error("Error reading file - UnicodeDecodeError")
         raise ValueError("Error reading file. Please check that it is a text file.")
 
 def handle_file_upload(file_input, existing_text=''):
     """Process uploaded file and return its contents or keep existing text if no file."""
     if file_input and file_input.filename != '':
-        print(f"INFO: Processing uploaded file: {file_input.filename}")
+        logger.info(f"Processing uploaded file: {file_input.filename}")
         return read_file_contents(file_input)
     return existing_text
 
 def validate_tokens(max_tokens_raw):
-    """Validate max_tokens parameter, ensuring minimum value of 1."""
+    """
+    Validate max_tokens parameter, ensuring minimum value of 1.
+    Returns None for an empty or invalid value - the limit is then predicted for the description (main.TOKEN_PREDICTOR).
+    """
     try:
         max_tokens = int(max_tokens_raw)
         # Ensure minimum value
         if max_tokens < 1:
             max_tokens = 1
     except (ValueError, TypeError):
-        # If conversion to integer fails, use default value
-        max_tokens = 10000
+        # If conversion to integer fails, the limit is predicted
+        max_tokens = None
     
     return max_tokens
 
+def validate_temperature(temperature_raw):
+    """
+    Validate temperature parameter - a number between 0 and 1, 0 when the field is empty.
+    Raises ValueError with a user-facing message for other values.
+    """
+    if temperature_raw is None or str(temperature_raw).strip() == '':
+        return 0.0
+    try:
+        temperature = float(temperature_raw)
+    except (ValueError, TypeError):
+        temperature = math.nan
+    if not 0 <= temperature <= 1:
+        raise ValueError('Temperature must be a number between 0 and 1.')
+    return temperature
+
+
+def read_generation_mode():
+    """Return generation mode selected in the form, or the default mode for unknown values."""
+    generation_mode = request.form.get('generation_mode', '').strip()
+    return generation_mode if generation_mode in main.GENERATION_MODES else main.DEFAULT_GENERATION_MODE
+
+def read_prompt_variant():
+    """Return the prompt variant selected in the form, or None for the default variant of the server."""
+    return request.form.get('prompt_variant', '').strip() or None
+
+def read_previous_diagram():
+    """Return the current diagram sent for refinement, or an empty string for a new generation."""
+    if not request.form.get('refine'):
+        return ''
+    return request.form.get('previous_bpmn', '').strip()
+
+def generation_settings(generation_mode, previous_bpmn='', prompt_variant=None):
+    """
+    Return system prompt path and the remaining generation options for a generation mode.
+    The prompt is the selected variant of the mode (unknown variants fall back to the default one).
+    With the previous diagram the model is asked only for the changes (refinement).
+    """
+    if previous_bpmn:
+        return app.config['REFINE_PROMPT_FILE'], {'previous_bpmn': previous_bpmn}
+    return main.PROMPTS.path(generation_mode, prompt_variant), main.generation_options(generation_mode)
+
+
+def request_client_id():
+    """Return the client whose generations share a fair-share queue - X-Client-ID header or the remote address."""
+    return request.headers.get('X-Client-ID') or request.remote_addr or 'anonymous'
+
+
+def read_generation_request():
+    """
+    Read process description and generation options from the submitted form.
+    Raises ValueError with a user-facing message when the input is missing or unreadable.
+    """
+    input_mode = request.form.get('input_mode', 'SIMPLE')
+    
+    if input_mode == 'SIMPLE':
+        simple_text = request.form.get('simple_text_input', '').strip()
+        simple_text = handle_file_upload(request.files.get('file_input'), simple_text)
+        if not simple_text:
+            raise ValueError('Please enter text or upload a file.')
+        text_input = main.compose_text_input(input_mode, simple_text=simple_text)
+    else:
+        process_name = request.form.get('structured_name_input', '').strip()
+        process_flow = request.form.get('structured_flow_input', '').strip()
+        process_flow = handle_file_upload(request.files.get('file_input'), process_flow)
+        if not process_flow:
+            raise ValueError('Please enter process flow.')
+        text_input = main.compose_text_input(input_mode, process_name=process_name, process_flow=process_flow)
+    
+    return {
+        'input_mode': input_mode,
+        'text_input': text_input,
+        'model': request.form.get('model_selection', '').strip() or main.DEFAULT_MODEL,
+        'temperature': validate_temperature(request.form.get('temperature')),
+        'max_tokens': validate_tokens(request.form.get('max_tokens')),
+        'use_cache': not request.form.get('bypass_cache'),
+        'generation_mode': read_generation_mode(),
+        'prompt_variant': read_prompt_variant(),
+        'previous_bpmn': read_previous_diagram(),
+        'client_id': request_client_id(),
+    }
+
+def build_generation_stats(result, generation_time, temperature, max_tokens):
+    """
+    Build the statistics shown in the UI stats panel after a successful generation.
+    For cached results the token counts are the stored ones and the cost is reported as saved.
+    """
+    available_models = main.get_available_models()
+    used_model = result['model']
+    cached = result.get('cached', False)
+    
+    # Get chosen model name for display
+    model_name = next((m["name"] for m in available_models if m["id"] == used_model), "Claude")
+    
+    # Prompt cache token counts (missing in results cached before prompt caching was used)
+    cache_write_tokens = result.get('cache_creation_input_tokens', 0)
+    cache_read_tokens = result.get('cache_read_input_tokens', 0)
+    
+    # Calculate cost in USD based on token usage
+    generation_cost = main.calculate_cost(used_model, result['input_tokens'], result['output_tokens'], cache_write_tokens, cache_read_tokens)
+    # Attempts whose output was not used (failed, timed out, losing hedged attempts) are paid as well
+    discarded_cost = 0.0 if cached else result.get('discarded_cost', 0.0)
+    estimated_cost = 0.0 if cached else generation_cost + discarded_cost
+    saved_cost = generation_cost if cached else 0.0
+    logger.info(f"Estimated cost: ${estimated_cost:.6f}" + (f" (saved ${saved_cost:.6f} by cache)" if cached else ""))
+    
+    return {
+        'selected_model': used_model,
+        'selected_model_name': model_name,
+        'input_tokens': result['input_tokens'],
+        'output_tokens': result['output_tokens'],
+        'cache_write_tokens': cache_write_tokens,
+        'cache_read_tokens': cache_read_tokens,
+        'total_tokens': result['input_tokens'] + cache_write_tokens + cache_read_tokens + result['output_tokens'],
+        'generation_time': generation_time,
+        'temperature': temperature,
+        'max_tokens': max_tokens,
+        'continuations': result.get('continuations', 0),
+        'segments': result.get('segments', 0),
+        'estimated_cost': estimated_cost,
+        'discarded_tokens': 0 if cached else result.get('discarded_tokens', 0),
+        'discarded_cost': discarded_cost,
+        'cached': cached,
+        'saved_cost': saved_cost
+    }
+
+def format_generation_error(e):
+    """Turn an exception from BPMN generation into a user-facing message."""
+    error_str = str(e)
+    if isinstance(e, ValueError) and "model_problem" in error_str:
+        return format_message_by_sentences(error_str.split(':', 1)[1].strip())
+    
+    logger.error(f"{error_str}")
+    return f'Error generating BPMN diagram: {error_str}'
+
+def sse_event(event, data):
+    """Format one Server-Sent Events message with JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.before_request
+def start_request():
+    """Assign the request id (X-Request-ID header or a new one) and start timing the request."""
+    logs.set_request_id(request.headers.get('X-Request-ID') or logs.new_request_id())
+    begin_spans()
+    g.start_time = time.perf_counter()
+    g.route = request.url_rule.rule if request.url_rule else 'unmatched'
+    main.METRICS.inc('processflow_http_requests_in_flight', route=g.route)
+
+@app.after_request
+def add_request_id(response):
+    """Return the request id to the client and remember the status for the request log."""
+    response.headers['X-Request-ID'] = logs.current_request_id() or ''
+    g.status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request(error=None):
+    """
+    Record duration, status and stage timings of the request.
+    For streamed responses this runs when the stream ends, so the duration covers the whole generation.
+    """
+    if 'start_time' not in g:
+        return
+    duration = time.perf_counter() - g.start_time
+    status = str(g.get('status', 500))
+    main.METRICS.dec('processflow_http_requests_in_flight', route=g.route)
+    main.METRICS.inc('processflow_http_requests_total', route=g.route, method=request.method, status=status)
+    main.METRICS.observe('processflow_http_request_duration_seconds', duration, route=g.route)
+    logger.info("Request finished", extra={
+        'method': request.method,
+        'route': g.route,
+        'status': int(status),
+        'duration': round(duration, 4),
+        'stages': current_spans()
+    })
+    logs.set_request_id(None)
+
+
+@app.template_global()
+def asset_url(filename):
+    """URL of a static file - content-hashed and cacheable for a year outside debug mode."""
+    if app.debug:
+        return url_for('static', filename=filename)
+    return assets.url(filename)
+
+def send_cached(cached, cache_control):
+    """
+    Send a CachedResponse in the smallest encoding the client accepts.
+    Each encoding has its own ETag, so If-None-Match of a repeat visit gets 304 without a body.
+    """
+    encoding, body = cached.negotiate(request.accept_encodings)
+    response = Response(body, content_type=cached.content_type)
+    if encoding == 'identity':
+        response.set_etag(cached.etag)
+    else:
+        response.headers['Content-Encoding'] = encoding
+        response.set_etag(f"{cached.etag}-{encoding}")
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = cache_control
+    return response.make_conditional(request)
+
+
+@app.context_processor
+def generation_mode_defaults():
+    """Generation mode preselected in Advanced Options when the page does not set one, and the prompt variants to offer."""
+    return {
+        'default_generation_mode': main.DEFAULT_GENERATION_MODE,
+        'prompt_variants': sorted({variant for mode in main.GENERATION_MODES for variant in main.PROMPTS.variants(mode)} - {'default'}),
+    }
+
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
@@ -87,11 +365,11 @@ def index():
     available_models = main.get_available_models()
     
     if request.method == 'POST':
-        print("INFO: POST request to generate diagram")
+        logger.info("POST request to generate diagram")
         
         # Get input mode (SIMPLE or STRUCTURED)
         input_mode = request.form.get('input_mode', 'SIMPLE')
-        print(f"INFO: Input mode: {input_mode}")
+        logger.info(f"Input mode: {input_mode}")
         
         text_input = ''
         
@@ -104,7 +382,7 @@ def index():
                 try:
                     simple_text = handle_file_upload(request.files.get('file_input'), simple_text)
                 except ValueError as e:
-                    print(f"ERROR: {str(e)}")
+                    logger.error(f"{str(e)}")
                     flash(str(e), 'error')
                     return render_template('index.html', 
                                            input_mode=input_mode, 
@@ -112,15 +390,14 @@ def index():
                                            available_models=available_models)
                 
                 if not simple_text:
-                    print("WARNING: Empty input")
+                    logger.warning("Empty input")
                     flash('Please enter text or upload a file.', 'error')
                     return render_template('index.html', 
                                            input_mode=input_mode, 
                                            part_input_text=request.form.get('simple_text_input', ''),
                                            available_models=available_models)
                 
-                # Format for SIMPLE mode - just prefix with a label
-                text_input = f"Process Description:\n{simple_text}"
+                text_input = main.compose_text_input(input_mode, simple_text=simple_text)
                 
             else:  # STRUCTURED mode
                 # Process STRUCTURED input - has separate name and flow fields
@@ -131,7 +408,7 @@ def index():
                 try:
                     process_flow = handle_file_upload(request.files.get('file_input'), process_flow)
                 except ValueError as e:
-                    print(f"ERROR: {str(e)}")
+                    logger.error(f"{str(e)}")
                     flash(str(e), 'error')
                     return render_template('index.html', 
                                            input_mode=input_mode,
@@ -140,7 +417,7 @@ def index():
                                            available_models=available_models)
                 
                 if not process_flow:
-                    print("WARNING: Empty input")
+                    logger.warning("Empty input")
                     flash('Please enter process flow.', 'error')
                     return render_template('index.html', 
                                            input_mode=input_mode,
@@ -148,20 +425,38 @@ def index():
                                            full_flow_input=process_flow,
                                            available_models=available_models)
                 
-                # Format for STRUCTURED mode - includes both name and flow with labels
-                text_input = f"Process Name: {process_name}\n\n"
-                text_input += f"Process Flow:\n{process_flow}"
+                text_input = main.compose_text_input(input_mode, process_name=process_name, process_flow=process_flow)
             
             # Get the selected AI model
             selected_model = request.form.get('model_selection', '').strip() or main.DEFAULT_MODEL
             is_default = selected_model == main.DEFAULT_MODEL
-            print(f"INFO: Model: {selected_model}" + (" (default)" if is_default else ""))
+            logger.info(f"Model: {selected_model}" + (" (default)" if is_default else ""))
             
             # Get advanced generation options
-            temperature = float(request.form.get('temperature', 0))
-            max_tokens = validate_tokens(request.form.get('max_tokens', 4000))
+            try:
+                temperature = validate_temperature(request.form.get('temperature'))
+            except ValueError as e:
+                logger.warning(f"{str(e)}")
+                flash(str(e), 'error')
+                return render_template('index.html',
+                                       input_mode=input_mode,
+                                       part_input_text=request.form.get('simple_text_input', ''),
+                                       full_name_input=request.form.get('structured_name_input', ''),
+                                       full_flow_input=request.form.get('structured_flow_input', ''),
+                                       available_models=available_models,
+                                       selected_model=selected_model)
+            max_tokens = validate_tokens(request.form.get('max_tokens'))
+            
+            # Bypass flag - always call the model, even if the same request is cached
+            use_cache = not request.form.get('bypass_cache')
+            
+            # Generation mode - diagram layout computed automatically or written by the model, XML or compact output
+            generation_mode = read_generation_mode()
+            previous_bpmn = read_previous_diagram()
+            prompt_variant = read_prompt_variant()
+            system_prompt_path, generation_options = generation_settings(generation_mode, previous_bpmn, prompt_variant)
             
-            print(f"INFO: Parameters: temp={temperature}, max_tokens={max_tokens}")
+            logger.info(f"Parameters: temp={temperature}, max_tokens={max_tokens}, use_cache={use_cache}, mode={generation_mode}, prompt={prompt_variant or 'default'}, refine={bool(previous_bpmn)}")
             
             # Measure generation time for performance tracking
             start_time = time.time()
@@ -169,50 +464,40 @@ def index():
             # Start of BPMN generation process
             try:
                 # Generate BPMN using the function from main.py
-                print("INFO: Starting BPMN generation...")
-                system_prompt_path = app.config['SYSTEM_PROMPT_FILE']
-                bpmn_content, input_tokens, output_tokens, used_model = main.generate_bpmn_from_text(
+                logger.info("Starting BPMN generation...")
+                result = main.generate_bpmn_from_text(
                     text_input, 
                     system_prompt_file=system_prompt_path,
                     model=selected_model,
                     temperature=temperature,
-                    max_tokens=max_tokens
+                    max_tokens=max_tokens,
+                    use_cache=use_cache,
+                    client_id=request_client_id(),
+                    **generation_options
                 )
+                bpmn_content = result['bpmn_content']
+                used_model = result['model']
                 
                 # Calculate generation time (in seconds)
                 generation_time = round(time.time() - start_time, 2)
-                print(f"INFO: BPMN generated successfully in {generation_time}s")
+                logger.info(f"BPMN generated successfully in {generation_time}s")
                 
-                # Save BPMN to file with unique name using UUID
-                bpmn_filename = f"{uuid.uuid4()}.bpmn"
-                with open(os.path.join(app.config['BPMN_FOLDER'], bpmn_filename), 'w', encoding='utf-8') as f:
-                    f.write(bpmn_content)
+                # Store the diagram - the page gets it inlined, /bpmn/<id> serves it until it expires
+                with main.METRICS.stage('store_write'):
+                    diagram_id = diagram_store.put(bpmn_content)
                 
-                print(f"INFO: Saved BPMN file: {bpmn_filename}")
-                
-                # Get chosen model name for display
-                model_name = next((m["name"] for m in available_models if m["id"] == used_model), "Claude")
+                logger.info(f"Stored BPMN diagram: {diagram_id}")
                 
                 # Template parameters common to both modes
                 template_params = {
-                    'bpmn_filename': bpmn_filename,
+                    'bpmn_id': diagram_id or '',
+                    'bpmn_content': bpmn_content if app.config['INLINE_DIAGRAMS'] or not diagram_id else '',
                     'input_mode': input_mode,
+                    'generation_mode': generation_mode,
+                    'prompt_variant': prompt_variant,
                     'available_models': available_models,
-                    'selected_model': used_model,
-                    'selected_model_name': model_name,
-                    'input_tokens': input_tokens,
-                    'output_tokens': output_tokens,
-                    'generation_time': generation_time,
-                    'temperature': temperature,
-                    'max_tokens': max_tokens
+                    **build_generation_stats(result, generation_time, temperature, max_tokens)
                 }
-
-                # Calculate cost in USD based on token usage
-                estimated_cost = main.calculate_cost(used_model, input_tokens, output_tokens)
-                print(f"INFO: Estimated cost: ${estimated_cost:.6f}")
-
-                # Add estimated cost to template parameters
-                template_params['estimated_cost'] = estimated_cost
                 
                 # Add mode-specific parameters to preserve user input
                 if input_mode == 'SIMPLE':
@@ -221,7 +506,8 @@ def index():
                     template_params['full_name_input'] = process_name
                     template_params['full_flow_input'] = process_flow
                 
-                return render_template('index.html', **template_params)
+                with main.METRICS.stage('render'):
+                    return render_template('index.html', **template_params)
                                     
             except ValueError as e:
                 generation_time = round(time.time() - start_time, 2)
@@ -229,17 +515,19 @@ def index():
                 
                 # Handle special error cases from main.py
                 if "model_problem" in error_str:
-                    problem_message = error_str.split(':')[1].strip()
+                    problem_message = error_str.split(':', 1)[1].strip()
                     formatted_message = format_message_by_sentences(problem_message)
                     flash(formatted_message, 'error')
                 
                 else:
-                    print(f"ERROR: {error_str}")
+                    logger.error(f"{error_str}")
                     flash(f'Error generating BPMN diagram: {error_str}', 'error')
                 
                 # Common template parameters for error state
                 template_params = {
                     'input_mode': input_mode,
+                    'generation_mode': generation_mode,
+                    'prompt_variant': prompt_variant,
                     'available_models': available_models,
                     'selected_model': selected_model,
                     'generation_time': generation_time,
@@ -256,7 +544,7 @@ def index():
                 return render_template('index.html', **template_params)
                 
         except Exception as e:
-            print(f"ERROR: Unexpected exception: {str(e)}")
+            logger.error(f"Unexpected exception: {str(e)}")
             flash(f'Error generating BPMN diagram: {str(e)}', 'error')
             
             # Common template parameters for general error
@@ -276,31 +564,509 @@ def index():
             return render_template('index.html', **template_params)
     
     # GET request - use default model from Python on first load
-    return render_template('index.html', input_mode="STRUCTURED", available_models=available_models, selected_model=main.DEFAULT_MODEL)
+    # The page is the same for every visitor, so it is rendered once; pending flash messages need a fresh render
+    if app.debug or session.get('_flashes'):
+        return render_template('index.html', input_mode="STRUCTURED", available_models=available_models, selected_model=main.DEFAULT_MODEL)
+    page = page_cache.get('index')
+    if page is None:
+        with main.METRICS.stage('render'):
+            html = render_template('index.html', input_mode="STRUCTURED", available_models=available_models, selected_model=main.DEFAULT_MODEL)
+        page = page_cache['index'] = CachedResponse(html.encode('utf-8'), 'text/html; charset=utf-8')
+    return send_cached(page, 'no-cache')
 
 
-@app.route('/bpmn/<filename>')
-def bpmn_file(filename):
-    """Serve the BPMN file from the storage directory."""
-    print(f"INFO: Loading BPMN file: {filename}")
-    return send_from_directory(app.config['BPMN_FOLDER'], filename)
+@app.route('/generate-stream', methods=['POST'])
+def generate_stream():
+    """
+    Generate BPMN diagram and stream progress to the browser as Server-Sent Events.
+    Sends "start" and "progress" events while the model is writing, then either
+    a "result" event with the validated XML and statistics or an "error" event.
+    """
+    logger.info("POST request to stream diagram generation")
+    
+    try:
+        params = read_generation_request()
+    except ValueError as e:
+        logger.warning(f"{str(e)}")
+        return {"success": False, "message": str(e)}, 400
+    
+    logger.info(f"Input mode: {params['input_mode']}, model: {params['model']}")
+    logger.info(f"Parameters: temp={params['temperature']}, max_tokens={params['max_tokens']}, mode={params['generation_mode']}, prompt={params['prompt_variant'] or 'default'}, refine={bool(params['previous_bpmn'])}")
+    system_prompt_path, generation_options = generation_settings(params['generation_mode'], params['previous_bpmn'], params['prompt_variant'])
+    
+    def generate():
+        start_time = time.time()
+        try:
+            for event in main.stream_bpmn_from_text(
+                params['text_input'],
+                system_prompt_file=system_prompt_path,
+                model=params['model'],
+                temperature=params['temperature'],
+                max_tokens=params['max_tokens'],
+                use_cache=params['use_cache'],
+                client_id=params['client_id'],
+                **generation_options
+            ):
+                event_type = event.pop('event')
+                
+                if event_type != 'result':
+                    event['elapsed'] = round(time.time() - start_time, 2)
+                    yield sse_event(event_type, event)
+                    continue
+                
+                generation_time = round(time.time() - start_time, 2)
+                logger.info(f"BPMN generated successfully in {generation_time}s")
+                
+                stats = build_generation_stats(event, generation_time, params['temperature'], params['max_tokens'])
+                yield sse_event('result', {'bpmn_content': event['bpmn_content'], 'stats': stats})
+        
+        except ValueError as e:
+            yield sse_event('error', {'message': format_generation_error(e), 'generation_time': round(time.time() - start_time, 2)})
+        
+        except Exception as e:
+            logger.error(f"Unexpected exception: {str(e)}")
+            yield sse_event('error', {'message': f'Error generating BPMN diagram: {str(e)}'})
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    # Disable caching and proxy buffering so events reach the browser immediately
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 
-@app.route('/delete-bpmn/<filename>', methods=['POST'])
-def delete_bpmn_file(filename):
-    """Delete a BPMN file from the server after it's been loaded."""
+def run_generation_job(job_id, report_progress, params):
+    """
+    Generate BPMN diagram for a background job.
+    Streaming progress is stored on the job; returns BPMN content with the same statistics
+    that index() shows in the stats panel.
+    """
+    # Logs and stage timings of the job belong to the request that submitted it
+    logs.set_request_id(params.get('request_id'))
+    begin_spans()
+    main.METRICS.set('processflow_job_queue_depth', job_manager.queue_depth())
+    if 'submitted_at' in params:
+        main.METRICS.record_stage('queue_wait', time.time() - params['submitted_at'])
+    
+    system_prompt_path, generation_options = generation_settings(params['generation_mode'], params['previous_bpmn'], params.get('prompt_variant'))
+    start_time = time.time()
     try:
-        print(f"INFO: Deleting BPMN file: {filename}")
-        file_path = os.path.join(app.config['BPMN_FOLDER'], filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            print("INFO: File deleted successfully")
-            return {"success": True, "message": f"File {filename} deleted successfully"}, 200
-        else:
-            print("WARNING: File not found")
-            return {"success": False, "message": f"File {filename} not found"}, 404
+        for event in main.stream_bpmn_from_text(
+            params['text_input'],
+            system_prompt_file=system_prompt_path,
+            model=params['model'],
+            temperature=params['temperature'],
+            max_tokens=params['max_tokens'],
+            use_cache=params['use_cache'],
+            client_id=params.get('client_id'),
+            progress_interval=1.0,
+            **generation_options
+        ):
+            if event['event'] == 'progress':
+                report_progress({key: value for key, value in event.items() if key != 'event'})
+            elif event['event'] == 'queued':
+                report_progress({'queued': True, 'position': event['position'], 'wait': event['wait']})
+            elif event['event'] == 'result':
+                generation_time = round(time.time() - start_time, 2)
+                logger.info("Job generation finished", extra={'job_id': job_id, 'stages': current_spans()})
+                return {
+                    'bpmn_content': event['bpmn_content'],
+                    'stats': build_generation_stats(event, generation_time, params['temperature'], params['max_tokens'])
+                }
     except Exception as e:
-        print(f"ERROR: Error deleting file: {str(e)}")
-        return {"success": False, "message": f"Error: {str(e)}"}, 500
+        # Store user-facing message as job error
+        raise RuntimeError(format_generation_error(e)) from e
+    
+    raise RuntimeError('Error generating BPMN diagram: no result received.')
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Submit a diagram generation job and return its id immediately.
+    The form fields are the same as for the main page. Returns 503 when the job queue is full.
+    """
+    try:
+        params = read_generation_request()
+    except ValueError as e:
+        logger.warning(f"{str(e)}")
+        return {"success": False, "message": str(e)}, 400
+    
+    params['request_id'] = logs.current_request_id()
+    params['submitted_at'] = time.time()
+    try:
+        job_id = job_manager.submit(run_generation_job, params)
+        main.METRICS.set('processflow_job_queue_depth', job_manager.queue_depth())
+    except JobQueueFull as e:
+        logger.warning(f"{str(e)}")
+        return {"success": False, "message": str(e)}, 503, {"Retry-After": "10"}
+    
+    return {
+        "success": True,
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events"
+    }, 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Return job status, progress and - when finished - BPMN content with statistics or error."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return {"success": False, "message": f"Job {job_id} not found"}, 404
+    return {"success": True, **job}
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """
+    Subscribe to job progress as Server-Sent Events until the job finishes, or until
+    JOB_EVENTS_TIMEOUT passes - then a "timeout" event with the current status ends the stream.
+    """
+    if job_manager.get(job_id) is None:
+        return {"success": False, "message": f"Job {job_id} not found"}, 404
+    
+    def generate():
+        last_progress = None
+        last_status = None
+        deadline = time.monotonic() + JOB_EVENTS_TIMEOUT
+        while True:
+            job = job_manager.get(job_id)
+            if job is None:
+                yield sse_event('error', {'message': f'Job {job_id} expired'})
+                return
+            
+            if job['status'] != last_status:
+                last_status = job['status']
+                yield sse_event('status', {'status': job['status'], 'queue_time': job['queue_time']})
+            
+            if job['progress'] and job['progress'] != last_progress:
+                last_progress = job['progress']
+                yield sse_event('progress', job['progress'])
+            
+            if job['status'] in FINISHED_STATES:
+                if job['result']:
+                    yield sse_event('result', job['result'])
+                else:
+                    yield sse_event('error', {'message': job['error']})
+                return
+            
+            if time.monotonic() >= deadline:
+                yield sse_event('timeout', {'status': job['status'], 'status_url': f'/jobs/{job_id}'})
+                return
+            
+            time.sleep(0.5)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def extract_batch_uploads(target_dir):
+    """
+    Save uploaded description files into target_dir.
+    Accepts a zip archive ("archive" field) and/or multiple text files ("files" field).
+    Only .txt entries are extracted; paths are kept inside target_dir. Raises ValueError when
+    the upload holds more than BATCH_MAX_FILES descriptions or more than BATCH_MAX_EXTRACTED_BYTES
+    of text - checked on the bytes actually written, not on the sizes declared by the archive.
+    """
+    files = 0
+    remaining = BATCH_MAX_EXTRACTED_BYTES
+    
+    def save(source, destination):
+        nonlocal files, remaining
+        files += 1
+        if files > BATCH_MAX_FILES:
+            raise ValueError(f'Too many descriptions in the upload (at most {BATCH_MAX_FILES}).')
+        content = source.read(remaining + 1)
+        remaining -= len(content)
+        if remaining < 0:
+            raise ValueError(f'Uploaded descriptions are too large (at most {BATCH_MAX_EXTRACTED_BYTES // (1024 * 1024)} MB of text).')
+        with open(destination, 'wb') as f:
+            f.write(content)
+    
+    archive = request.files.get('archive')
+    if archive and archive.filename:
+        try:
+            with zipfile.ZipFile(archive.stream) as zip_file:
+                for member in zip_file.infolist():
+                    name = os.path.normpath(member.filename)
+                    if member.is_dir() or not name.lower().endswith('.txt') or name.startswith(('..', os.sep)) or os.path.isabs(name):
+                        continue
+                    destination = os.path.join(target_dir, name)
+                    os.makedirs(os.path.dirname(destination), exist_ok=True)
+                    with zip_file.open(member) as source:
+                        save(source, destination)
+        except zipfile.BadZipFile:
+            raise ValueError('Uploaded archive is not a valid zip file.')
+    
+    for index, upload in enumerate(request.files.getlist('files')):
+        if not upload or not upload.filename:
+            continue
+        filename = os.path.basename(upload.filename) or f'description_{index}.txt'
+        if not filename.lower().endswith('.txt'):
+            filename += '.txt'
+        save(upload.stream, os.path.join(target_dir, f'{index:04d}_{filename}'))
+
+
+def add_batch_preview(zip_file, path, name):
+    """Add an SVG preview of a generated diagram next to it in the batch archive (skipped when it cannot be drawn)."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            zip_file.writestr(os.path.splitext(name)[0] + '.svg', preview.render_svg(f.read()))
+    except preview.PreviewError as e:
+        logger.warning(f"No preview of {name}: {str(e)}")
+
+def batch_archive_path(job_id):
+    """Return the path of the result archive of a batch job."""
+    return os.path.join(BATCH_DIR, f'{job_id}.zip')
+
+def purge_batch_files():
+    """Delete batch archives and upload directories older than the job TTL (left by expired or abandoned jobs)."""
+    if not os.path.isdir(BATCH_DIR):
+        return
+    expired = time.time() - job_manager.ttl
+    for name in os.listdir(BATCH_DIR):
+        path = os.path.join(BATCH_DIR, name)
+        try:
+            if os.path.getmtime(path) >= expired:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+        except OSError:
+            continue
+
+
+def run_batch_job(job_id, report_progress, params):
+    """
+    Generate diagrams for the descriptions extracted into params['work_dir'] as a background job.
+    Writes a zip with the generated .bpmn files, their SVG previews and a CSV/JSON summary
+    (tokens, cost, latency, validation) to BATCH_DIR and returns the totals with its URL.
+    The upload directory is removed when the job ends.
+    """
+    logs.set_request_id(params.get('request_id'))
+    work_dir = params['work_dir']
+    try:
+        paths = batch.find_descriptions(work_dir)
+        system_prompt_path, generation_options = generation_settings(params['generation_mode'], prompt_variant=params.get('prompt_variant'))
+        logger.info(f"Batch of {len(paths)} descriptions, concurrency {params['concurrency']}", extra={'job_id': job_id})
+        
+        finished = 0
+        def file_finished(row):
+            nonlocal finished
+            finished += 1
+            report_progress({'files': len(paths), 'finished': finished})
+        
+        start_time = time.time()
+        rows = asyncio.run(batch.run_batch(
+            paths,
+            concurrency=params['concurrency'],
+            on_result=file_finished,
+            system_prompt_file=system_prompt_path,
+            model=params['model'],
+            temperature=params['temperature'],
+            max_tokens=params['max_tokens'],
+            use_cache=params['use_cache'],
+            client_id=params['client_id'],
+            **generation_options
+        ))
+        totals = batch.summarize(rows, time.time() - start_time)
+        
+        # Report paths relative to the upload, not to the working directory
+        for row in rows:
+            row['file'] = os.path.relpath(row['file'], work_dir)
+            if row['output']:
+                row['output'] = os.path.relpath(row['output'], work_dir)
+        
+        batch.write_summary(rows, totals, os.path.join(work_dir, 'batch_summary.csv'), os.path.join(work_dir, 'batch_summary.json'))
+        
+        # Written under a temporary name, so the archive URL never serves a partial file
+        archive_path = batch_archive_path(job_id)
+        with zipfile.ZipFile(archive_path + '.tmp', 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for row in rows:
+                if row['output']:
+                    zip_file.write(os.path.join(work_dir, row['output']), row['output'])
+                    add_batch_preview(zip_file, os.path.join(work_dir, row['output']), row['output'])
+            zip_file.write(os.path.join(work_dir, 'batch_summary.csv'), 'batch_summary.csv')
+            zip_file.write(os.path.join(work_dir, 'batch_summary.json'), 'batch_summary.json')
+        os.replace(archive_path + '.tmp', archive_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    logger.info(f"Batch finished: {totals['succeeded']}/{totals['files']} succeeded in {totals['wall_time']}s", extra={'job_id': job_id})
+    return {'totals': totals, 'archive_url': f'/batch/{job_id}/archive'}
+
+
+@app.route('/batch', methods=['POST'])
+def batch_generate():
+    """
+    Submit generation of diagrams for many process descriptions at once and return the job id immediately.
+    Accepts a zip archive or multiple .txt files; the batch runs as a job (GET /jobs/<job_id> for its progress)
+    and its zip with the generated .bpmn files and the summary is then served at /batch/<job_id>/archive.
+    """
+    if request.content_length is not None and request.content_length > BATCH_MAX_UPLOAD_BYTES:
+        return {"success": False, "message": f"Upload is too large (at most {BATCH_MAX_UPLOAD_BYTES // (1024 * 1024)} MB)."}, 413
+    
+    max_concurrency = int(os.getenv("BATCH_MAX_CONCURRENCY", 8))
+    try:
+        concurrency = min(max(int(request.form.get('concurrency', 4)), 1), max_concurrency)
+    except ValueError:
+        concurrency = 4
+    
+    try:
+        temperature = validate_temperature(request.form.get('temperature'))
+    except ValueError as e:
+        logger.warning(f"{str(e)}")
+        return {"success": False, "message": str(e)}, 400
+    
+    purge_batch_files()
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='upload-', dir=BATCH_DIR)
+    try:
+        extract_batch_uploads(work_dir)
+        if not batch.find_descriptions(work_dir):
+            raise ValueError("Please upload a zip archive or text files with process descriptions.")
+    except ValueError as e:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        logger.warning(f"{str(e)}")
+        return {"success": False, "message": str(e)}, 400
+    
+    params = {
+        'work_dir': work_dir,
+        'concurrency': concurrency,
+        'model': request.form.get('model_selection', '').strip() or main.DEFAULT_MODEL,
+        'temperature': temperature,
+        'max_tokens': validate_tokens(request.form.get('max_tokens')),
+        'use_cache': not request.form.get('bypass_cache'),
+        'generation_mode': read_generation_mode(),
+        'prompt_variant': read_prompt_variant(),
+        'client_id': f'batch:{request_client_id()}',
+        'request_id': logs.current_request_id(),
+    }
+    try:
+        job_id = job_manager.submit(run_batch_job, params)
+    except JobQueueFull as e:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        logger.warning(f"{str(e)}")
+        return {"success": False, "message": str(e)}, 503, {"Retry-After": "10"}
+    
+    return {
+        "success": True,
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+        "archive_url": f"/batch/{job_id}/archive"
+    }, 202
+
+@app.route('/batch/<job_id>/archive')
+def batch_archive(job_id):
+    """Return the zip with the generated diagrams and the summary of a finished batch job."""
+    job = job_manager.get(job_id) if re.fullmatch(r'[0-9a-f]{32}', job_id) else None
+    if job is None:
+        return {"success": False, "message": f"Job {job_id} not found"}, 404
+    if job['status'] != DONE or not os.path.isfile(batch_archive_path(job_id)):
+        return {"success": False, "message": f"Batch {job_id} is not finished ({job['status']})"}, 409
+    return send_file(os.path.abspath(batch_archive_path(job_id)), mimetype='application/zip', as_attachment=True, download_name='bpmn_batch.zip')
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Return result cache hit/miss counters and tier sizes."""
+    return main.RESULT_CACHE.stats()
+
+
+@app.route('/scheduler/stats')
+def scheduler_stats():
+    """Return model call retry, hedge and fallback counters and latency percentiles."""
+    return main.SCHEDULER.stats()
+
+
+@app.route('/admission/stats')
+def admission_stats():
+    """Return admission counters, rate limit buckets and queue lengths per model."""
+    return main.ADMISSION.stats()
+
+
+@app.route('/prompts')
+def prompt_variants():
+    """Return the prompt variants of every generation mode with their size and the active one."""
+    return main.PROMPTS.describe()
+
+
+@app.route('/metrics')
+def metrics():
+    """Return request, stage, generation, token, cost and error metrics in the Prometheus text format."""
+    main.METRICS.set('processflow_job_queue_depth', job_manager.queue_depth())
+    return Response(main.METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/diagrams/stats')
+def diagram_stats():
+    """Return diagram store counters and size and preview cache counters."""
+    return {**diagram_store.stats(), 'previews': preview_cache.stats()}
+
+
+@app.route('/bpmn/<diagram_id>')
+def bpmn_file(diagram_id):
+    """
+    Serve a stored diagram. The content of an id never changes, so the response carries an ETag
+    (If-None-Match gets 304) and is sent gzip-compressed to clients that accept it.
+    """
+    diagram = diagram_store.get(diagram_id)
+    if diagram is None:
+        logger.warning(f"BPMN diagram not found: {diagram_id}")
+        return {"success": False, "message": f"Diagram {diagram_id} not found"}, 404
+    
+    gzipped = request.accept_encodings['gzip'] > 0
+    # Each encoding is a different representation with its own ETag
+    response = Response(diagram.gzipped() if gzipped else diagram.xml(), mimetype='application/xml')
+    response.set_etag(f"{diagram.etag}-gzip" if gzipped else diagram.etag)
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+@app.route('/preview/<diagram_id>.<image_format>')
+def diagram_preview(diagram_id, image_format):
+    """
+    Serve a stored diagram rendered as SVG or PNG (?width= scales it) without loading the modeler.
+    Renders are cached by the content hash of the diagram.
+    """
+    if image_format not in preview.FORMATS:
+        return {"success": False, "message": f"Unknown preview format {image_format}"}, 404
+    if image_format == 'png' and preview.cairosvg is None:
+        return {"success": False, "message": "PNG previews are not available, use .svg"}, 501
+    
+    diagram = diagram_store.get(diagram_id)
+    if diagram is None:
+        logger.warning(f"BPMN diagram not found: {diagram_id}")
+        return {"success": False, "message": f"Diagram {diagram_id} not found"}, 404
+    
+    try:
+        with main.METRICS.stage('preview'):
+            cached = preview_cache.get(diagram.etag, diagram.text, image_format,
+                                       preview.clamp_width(request.args.get('width', type=int)))
+    except preview.PreviewError as e:
+        return {"success": False, "message": f"Diagram {diagram_id} cannot be previewed: {str(e)}"}, 422
+    return send_cached(cached, 'private, no-cache')
+
+@app.route('/delete-bpmn/<diagram_id>', methods=['POST'])
+def delete_bpmn_file(diagram_id):
+    """Delete a stored diagram before it expires."""
+    logger.info(f"Deleting BPMN diagram: {diagram_id}")
+    if diagram_store.delete(diagram_id):
+        return {"success": True, "message": f"Diagram {diagram_id} deleted successfully"}, 200
+    return {"success": False, "message": f"Diagram {diagram_id} not found"}, 404
+
+@app.route('/assets/<path:filename>')
+def asset_file(filename):
+    """Serve a content-hashed static file - its URL changes with the content, so it never needs revalidation."""
+    cached = assets.get(filename)
+    if cached is None:
+        return {"success": False, "message": f"Asset {filename} not found"}, 404
+    return send_cached(cached, IMMUTABLE_CACHE_CONTROL)
 
 @app.route('/static/<path:filename>')
 def static_files(filename):
@@ -308,4 +1074,5 @@ def static_files(filename):
     return send_from_directory('static', filename)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', debug=True)
\ No newline at end of file
+    # Development server only - production runs through gunicorn (see gunicorn.conf.py)
+    app.run(host='0.0.0.0', debug=os.getenv("FLASK_DEBUG", "1") == "1")
\ No newline at end of file
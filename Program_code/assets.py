@@ -0,0 +1,115 @@
+"""
+Static assets with content-hashed file names and precompressed variants.
+
+At startup every file in the static folder is read once: its URL gets a hash of the content
+(js/main.js -> /assets/js/main.3f2a1b9c0d1e.js) and its gzip and brotli variants are computed
+in memory. Because the URL changes with the content, responses can be cached by browsers
+for a year as immutable - a repeat visit does not ask for them again - and the server only
+picks the variant matching Accept-Encoding, without touching the disk or compressing per request.
+
+Brotli variants need the brotli package; without it only gzip variants are served.
+
+The same negotiation is used for cached page renders (CachedResponse).
+"""
+import os
+import gzip
+import hashlib
+import logging
+import mimetypes
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Files smaller than this are served only uncompressed
+MIN_COMPRESS_BYTES = 512
+# Types that do not shrink when compressed again
+COMPRESSED_TYPES = ("image/png", "image/jpeg", "image/gif", "image/webp", "font/woff2")
+
+HASH_LENGTH = 12
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class CachedResponse:
+    """Response body with its precompressed variants ({encoding: bytes}), content type and ETag."""
+
+    def __init__(self, body, content_type, etag=None):
+        self.content_type = content_type
+        self.etag = etag or hashlib.sha256(body).hexdigest()[:HASH_LENGTH * 2]
+        self.variants = {"identity": body}
+        if len(body) >= MIN_COMPRESS_BYTES and content_type.split(";")[0] not in COMPRESSED_TYPES:
+            self.variants["gzip"] = gzip.compress(body, 9)
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(body, quality=11)
+
+    def negotiate(self, accept_encodings):
+        """
+        Return (encoding, body) of the smallest variant the client accepts.
+        accept_encodings is the parsed Accept-Encoding header (werkzeug MIMEAccept-like: encoding -> quality).
+        """
+        accepted = [(encoding, body) for encoding, body in self.variants.items()
+                    if encoding == "identity" or accept_encodings[encoding] > 0]
+        return min(accepted, key=lambda item: len(item[1]))
+
+    def size(self):
+        return sum(len(body) for body in self.variants.values())
+
+
+class AssetManifest:
+    """
+    Content-hashed URLs of the files in a static folder and their precompressed variants.
+    url(filename) returns the hashed URL; get(hashed_name) the CachedResponse for it.
+    """
+
+    def __init__(self, static_folder, url_prefix="/assets/"):
+        self.static_folder = static_folder
+        self.url_prefix = url_prefix
+        self.urls = {}  # static file name -> hashed file name
+        self.files = {}  # hashed file name -> CachedResponse
+        self.build()
+
+    def build(self):
+        """Read all static files, hash their names and compress them."""
+        urls, files = {}, {}
+        for directory, _, filenames in os.walk(self.static_folder):
+            for filename in sorted(filenames):
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, self.static_folder).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    body = f.read()
+
+                digest = hashlib.sha256(body).hexdigest()
+                stem, extension = os.path.splitext(name)
+                hashed_name = f"{stem}.{digest[:HASH_LENGTH]}{extension}"
+                content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                if content_type.startswith("text/") or content_type in ("application/javascript", "application/json"):
+                    content_type += "; charset=utf-8"
+
+                urls[name] = hashed_name
+                files[hashed_name] = CachedResponse(body, content_type, etag=digest[:HASH_LENGTH * 2])
+
+        self.urls, self.files = urls, files
+        logger.info(f"Prepared {len(files)} static assets ({sum(item.size() for item in files.values())} bytes with "
+                    f"{'gzip and brotli' if brotli is not None else 'gzip'} variants)")
+
+    def url(self, filename):
+        """Return the content-hashed URL of a static file (the plain /static/ URL for unknown files)."""
+        hashed_name = self.urls.get(filename)
+        if hashed_name is None:
+            return f"/static/{filename}"
+        return self.url_prefix + hashed_name
+
+    def get(self, hashed_name):
+        """Return the CachedResponse of a hashed file name, or None."""
+        return self.files.get(hashed_name)
+
+    def stats(self):
+        return {
+            "files": len(self.files),
+            "bytes": {encoding: sum(len(item.variants[encoding]) for item in self.files.values() if encoding in item.variants)
+                      for encoding in ("identity", "gzip", "br")},
+            "brotli": brotli is not None,
+        }
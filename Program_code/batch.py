@@ -0,0 +1,197 @@
+"""
+Bulk generation of BPMN diagrams for a directory of process descriptions.
+
+Every description file (*.txt) is sent through main.generate_bpmn_from_text, the generated
+diagram is written next to it and a CSV and JSON summary with tokens, cost, latency and
+validation status per file is written at the end.
+
+Usage:
+    python batch.py ../Evaluation_data/AI_data --concurrency 8 --model claude-3-5-haiku-20241022
+"""
+import os
+import sys
+import csv
+import json
+import glob
+import time
+import asyncio
+import argparse
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+import logs
+
+# Columns of the CSV summary, in order
+SUMMARY_FIELDS = [
+    "file", "output", "status", "validation", "model", "cached",
+    "input_tokens", "cache_creation_input_tokens", "cache_read_input_tokens", "output_tokens",
+    "cost", "latency", "error",
+]
+
+
+def find_descriptions(directory, pattern="**/*.txt"):
+    """Return sorted list of description files in directory matching the glob pattern."""
+    return sorted(glob.glob(os.path.join(directory, pattern), recursive=True))
+
+def output_path_for(description_path, suffix="_generated"):
+    """Return path of the .bpmn file generated for a description file (next to the input)."""
+    return os.path.splitext(description_path)[0] + suffix + ".bpmn"
+
+def check_xml(bpmn_content):
+    """Return "valid" if the BPMN content is well-formed XML, otherwise "malformed_xml"."""
+    try:
+        ET.fromstring(bpmn_content.encode("utf-8"))
+        return "valid"
+    except ET.ParseError:
+        return "malformed_xml"
+
+
+def generate_one(path, suffix, **options):
+    """
+    Generate diagram for one description file and write it next to the input.
+    Returns summary row for the file; errors are recorded in the row, not raised.
+    """
+    row = {"file": path, "output": "", "model": options.get("model") or main.DEFAULT_MODEL, "cached": False, "error": ""}
+    start_time = time.time()
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            description = f.read().strip()
+
+        result = main.generate_bpmn_from_text(main.compose_text_input("SIMPLE", simple_text=description), **options)
+
+        output = output_path_for(path, suffix)
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(result["bpmn_content"])
+
+        cost = main.calculate_cost(
+            result["model"], result["input_tokens"], result["output_tokens"],
+            result.get("cache_creation_input_tokens", 0), result.get("cache_read_input_tokens", 0)
+        )
+        row.update({
+            "output": output,
+            "status": "ok",
+            "validation": check_xml(result["bpmn_content"]),
+            "model": result["model"],
+            "cached": result["cached"],
+            "input_tokens": result["input_tokens"],
+            "cache_creation_input_tokens": result.get("cache_creation_input_tokens", 0),
+            "cache_read_input_tokens": result.get("cache_read_input_tokens", 0),
+            "output_tokens": result["output_tokens"],
+            # Failed and losing hedged attempts of the generation are paid as well
+            "cost": 0.0 if result["cached"] else round(cost + result.get("discarded_cost", 0.0), 6),
+        })
+
+    except main.BpmnValidationError as e:
+        row.update({"status": "failed", "validation": "rejected", "error": str(e).split(":", 1)[-1]})
+    except Exception as e:
+        row.update({"status": "failed", "validation": "not_generated", "error": str(e).split(":", 1)[-1]})
+
+    row["latency"] = round(time.time() - start_time, 2)
+    print(f"INFO: [{row['status']}] {path} ({row['latency']}s)")
+    return row
+
+
+async def run_batch(paths, concurrency=4, suffix="_generated", on_result=None, **options):
+    """
+    Generate diagrams for all description files, at most `concurrency` at the same time.
+    Options are passed to main.generate_bpmn_from_text; on_result(row) is called as every file finishes.
+    Returns list of summary rows in input order.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    # Model calls are blocking, so they run in a thread pool sized to the concurrency cap
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+
+        async def limited(path):
+            async with semaphore:
+                row = await loop.run_in_executor(executor, lambda: generate_one(path, suffix, **options))
+            if on_result:
+                on_result(row)
+            return row
+
+        return await asyncio.gather(*(limited(path) for path in paths))
+
+
+def summarize(rows, wall_time):
+    """Return totals over all summary rows."""
+    return {
+        "files": len(rows),
+        "succeeded": sum(1 for row in rows if row["status"] == "ok"),
+        "failed": sum(1 for row in rows if row["status"] != "ok"),
+        "valid": sum(1 for row in rows if row.get("validation") == "valid"),
+        "input_tokens": sum(row.get("input_tokens", 0) for row in rows),
+        "output_tokens": sum(row.get("output_tokens", 0) for row in rows),
+        "cost": round(sum(row.get("cost", 0.0) for row in rows), 6),
+        "wall_time": round(wall_time, 2),
+    }
+
+def write_summary(rows, totals, csv_path=None, json_path=None):
+    """Write per-file summary rows to CSV and rows with totals to JSON."""
+    if csv_path:
+        with open(csv_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"totals": totals, "files": rows}, f, ensure_ascii=False, indent=2)
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Generate BPMN diagrams for a directory of process descriptions.")
+    parser.add_argument("directory", help="Directory with process descriptions")
+    parser.add_argument("--pattern", default="**/*.txt", help="Glob pattern of description files (default: **/*.txt)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of simultaneous model calls")
+    parser.add_argument("--model", default=main.DEFAULT_MODEL)
+    parser.add_argument("--temperature", type=float, default=0)
+    parser.add_argument("--max-tokens", type=int, default=None, help="Output token limit per API call (default: predicted from the description)")
+    parser.add_argument("--mode", choices=main.GENERATION_MODES, default=main.DEFAULT_GENERATION_MODE,
+                        help="full: layout written by the model (default), semantic: layout computed by layout.py, "
+                             "dsl: compact process format compiled to BPMN XML, parallel: large processes split into "
+                             "segments generated concurrently")
+    parser.add_argument("--system-prompt", help="System prompt file (default: prompt of the generation mode)")
+    parser.add_argument("--prompt-variant", default=None, help="Named prompt variant of the generation mode (prompts/<mode>/<variant>.txt)")
+    parser.add_argument("--suffix", default="_generated", help="Suffix of output files, '' overwrites <name>.bpmn")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the model, even for cached descriptions")
+    parser.add_argument("--base-url", help="Anthropic API base URL, e.g. a local fake_api.py server")
+    parser.add_argument("--summary", default=None, help="Summary file path without extension (default: <directory>/batch_summary)")
+    args = parser.parse_args(argv)
+    logs.configure_logging()
+
+    if args.base_url:
+        os.environ["ANTHROPIC_BASE_URL"] = args.base_url
+    system_prompt = args.system_prompt or main.PROMPTS.path(args.mode, args.prompt_variant)
+
+    paths = find_descriptions(args.directory, args.pattern)
+    if not paths:
+        print(f"WARNING: No description files found in {args.directory}")
+        return 1
+    print(f"INFO: Generating {len(paths)} diagrams with concurrency {args.concurrency}")
+
+    start_time = time.time()
+    rows = asyncio.run(run_batch(
+        paths,
+        concurrency=args.concurrency,
+        suffix=args.suffix,
+        system_prompt_file=system_prompt,
+        model=args.model,
+        temperature=args.temperature,
+        max_tokens=args.max_tokens,
+        use_cache=not args.no_cache,
+        client_id="batch",
+        **main.generation_options(args.mode)
+    ))
+    totals = summarize(rows, time.time() - start_time)
+
+    summary_base = args.summary or os.path.join(args.directory, "batch_summary")
+    write_summary(rows, totals, summary_base + ".csv", summary_base + ".json")
+    print(f"INFO: Batch finished: {totals['succeeded']}/{totals['files']} succeeded, "
+          f"cost ${totals['cost']:.4f}, {totals['wall_time']}s - summary in {summary_base}.csv/.json")
+    return 0 if totals["failed"] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,312 @@
+"""
+Offline benchmark of the server-side code paths.
+
+The Anthropic client is replaced with fake_api.ReplayTransport, which answers with the recorded
+Evaluation_data responses, so no API key is needed and nothing is paid. Measured:
+
+- overhead of the "/" (index) and "/generate-stream" routes without model waiting time
+- validate_bpmn_content time per document
+- layout.layout_bpmn time per document
+- process_dsl.compile_dsl time per document (recorded responses converted to the compact format)
+- diagram store write, serve (/bpmn/<id>) and delete time
+- memory allocated per request (tracemalloc peak)
+- throughput and latency at N concurrent clients with simulated model latency
+
+The report is a JSON file; compare two reports to find regressions between commits:
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import threading
+import subprocess
+import tracemalloc
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from werkzeug.serving import make_server
+
+import main
+import layout
+import fake_api
+import process_dsl
+
+# Metrics where a higher value is better (all other metrics are times/sizes - lower is better)
+HIGHER_IS_BETTER = ("throughput",)
+
+
+def percentiles(samples):
+    """Return mean, median, p95 and max of a list of samples (seconds are converted to ms)."""
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+@contextlib.contextmanager
+def quiet():
+    """Suppress application log output while measuring."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def git_revision():
+    """Return current git commit hash, or None outside of a git checkout."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def form_for(description):
+    """Form fields of the main page for a description; the cache is bypassed so every request generates."""
+    return {
+        "input_mode": "SIMPLE",
+        "simple_text_input": description,
+        "temperature": "0",
+        "max_tokens": "10000",
+        "bypass_cache": "1",
+    }
+
+def load_descriptions(corpus):
+    """Return texts of all recorded descriptions."""
+    descriptions = []
+    for _, _, txt_path in corpus.entries:
+        with open(txt_path, "r", encoding="utf-8") as f:
+            descriptions.append(f.read().strip())
+    return descriptions
+
+
+def bench_routes(flask_app, descriptions, iterations):
+    """Measure full request time of index and streaming routes with zero model latency."""
+    client = flask_app.test_client()
+    results = {}
+
+    for route in ("/", "/generate-stream"):
+        samples = []
+        with quiet():
+            for i in range(iterations):
+                description = descriptions[i % len(descriptions)]
+                start = time.perf_counter()
+                response = client.post(route, data=form_for(description))
+                response.get_data()
+                samples.append(time.perf_counter() - start)
+        results[route] = percentiles(samples)
+    return results
+
+def bench_validation(corpus, iterations):
+    """Measure validate_bpmn_content per document over all recorded responses."""
+    documents = corpus.responses()
+    samples = []
+    with quiet():
+        for i in range(iterations):
+            document = documents[i % len(documents)]
+            start = time.perf_counter()
+            main.validate_bpmn_content(document, main.DEFAULT_MODEL)
+            samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+def bench_layout(corpus, iterations):
+    """Measure layout.layout_bpmn per document over all recorded responses."""
+    documents = corpus.responses()
+    samples = []
+    for i in range(iterations):
+        document = documents[i % len(documents)]
+        start = time.perf_counter()
+        layout.layout_bpmn(document)
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+def bench_dsl_compile(corpus, iterations):
+    """Measure process_dsl.compile_dsl per document; recorded responses are decompiled to the compact format first."""
+    descriptions = [process_dsl.decompile_bpmn(document) for document in corpus.responses()]
+    samples = []
+    for i in range(iterations):
+        description = descriptions[i % len(descriptions)]
+        start = time.perf_counter()
+        process_dsl.compile_dsl(description)
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+def bench_file_roundtrip(flask_app, diagram_store, corpus, iterations):
+    """Measure storing a diagram, serving it through /bpmn/<id> (gzip) and deleting it."""
+    client = flask_app.test_client()
+    documents = corpus.responses()
+    write, serve, delete = [], [], []
+
+    with quiet():
+        for i in range(iterations):
+            start = time.perf_counter()
+            diagram_id = diagram_store.put(documents[i % len(documents)])
+            write.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            client.get(f"/bpmn/{diagram_id}", headers={"Accept-Encoding": "gzip"}).get_data()
+            serve.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            client.post(f"/delete-bpmn/{diagram_id}")
+            delete.append(time.perf_counter() - start)
+
+    return {"write": percentiles(write), "serve": percentiles(serve), "delete": percentiles(delete)}
+
+def bench_memory(flask_app, descriptions):
+    """Measure peak memory allocated while handling one index request per description."""
+    client = flask_app.test_client()
+    peaks = []
+    with quiet():
+        # Warm up imports, template compilation and the client
+        client.post("/", data=form_for(descriptions[0]))
+        for description in descriptions:
+            tracemalloc.start()
+            client.post("/", data=form_for(description)).get_data()
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+    return {
+        "mean_peak_kb": round(statistics.fmean(peaks) / 1024, 1),
+        "max_peak_kb": round(max(peaks) / 1024, 1),
+    }
+
+def bench_throughput(flask_app, descriptions, clients, requests_per_client, latency, tokens_per_second, corpus):
+    """
+    Run the app in a threaded HTTP server and measure throughput at N concurrent clients.
+    The replay transport simulates model latency, so results show how well waiting requests overlap.
+    """
+    main.set_client(fake_api.make_replay_client(corpus, latency, tokens_per_second))
+    server = make_server("127.0.0.1", 0, flask_app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    def run_client(index):
+        samples = []
+        with httpx.Client(base_url=base_url, timeout=300) as http:
+            for i in range(requests_per_client):
+                description = descriptions[(index + i) % len(descriptions)]
+                start = time.perf_counter()
+                http.post("/", data=form_for(description)).raise_for_status()
+                samples.append(time.perf_counter() - start)
+        return samples
+
+    results = {}
+    try:
+        with quiet():
+            for count in clients:
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=count) as executor:
+                    samples = [s for client_samples in executor.map(run_client, range(count)) for s in client_samples]
+                elapsed = time.perf_counter() - start
+                results[str(count)] = {
+                    "throughput": round(len(samples) / elapsed, 3),
+                    **percentiles(samples),
+                }
+    finally:
+        server.shutdown()
+        main.set_client(None)
+    return results
+
+
+def flatten(report, prefix=""):
+    """Flatten nested report dictionary into {"a.b.c": value} for comparison."""
+    items = {}
+    for key, value in report.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            items.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            items[name] = value
+    return items
+
+def compare(current, previous, threshold=10.0):
+    """Print metric changes between two reports, marking regressions above threshold percent."""
+    current_metrics = flatten(current["results"])
+    previous_metrics = flatten(previous["results"])
+    print(f"\nComparison with {previous.get('revision') or 'previous report'} (regression threshold {threshold}%):")
+
+    regressions = 0
+    for name in sorted(current_metrics):
+        if name not in previous_metrics or not previous_metrics[name]:
+            continue
+        change = (current_metrics[name] - previous_metrics[name]) / previous_metrics[name] * 100
+        worse = -change if name.rsplit(".", 1)[-1] in HIGHER_IS_BETTER else change
+        marker = "REGRESSION" if worse > threshold else ""
+        regressions += bool(marker)
+        print(f"  {name:60s} {previous_metrics[name]:>12} -> {current_metrics[name]:>12} ({change:+.1f}%) {marker}")
+    return regressions
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of ProcessFlow AI server-side code.")
+    parser.add_argument("--corpus", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Evaluation_data", "AI_data"))
+    parser.add_argument("--iterations", type=int, default=50, help="Requests per route / validations measured")
+    parser.add_argument("--clients", default="1,4,16", help="Comma separated numbers of concurrent clients")
+    parser.add_argument("--requests-per-client", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.5, help="Simulated time to first token for throughput test")
+    parser.add_argument("--tokens-per-second", type=float, default=2000, help="Simulated output speed for throughput test")
+    parser.add_argument("--output", default="benchmark_report.json")
+    parser.add_argument("--compare", help="Previous report to compare with")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent")
+    args = parser.parse_args(argv)
+
+    import app as web_app
+
+    # Benchmark runs must neither read nor pollute the result cache
+    main.RESULT_CACHE.enabled = False
+    # Server overhead is measured without waiting for the rate limits of a real account
+    main.ADMISSION.enabled = False
+
+    corpus = fake_api.ReplayCorpus(args.corpus)
+    if not corpus.entries:
+        print(f"ERROR: No recorded responses found in {args.corpus}")
+        return 1
+    descriptions = load_descriptions(corpus)
+
+    flask_app = web_app.app
+    main.set_client(fake_api.make_replay_client(corpus))
+
+    print(f"INFO: Benchmarking with {len(corpus.entries)} recorded responses")
+    results = {
+        "routes": bench_routes(flask_app, descriptions, args.iterations),
+        "validation": bench_validation(corpus, args.iterations * 10),
+        "layout": bench_layout(corpus, args.iterations),
+        "dsl_compile": bench_dsl_compile(corpus, args.iterations),
+        "file_roundtrip": bench_file_roundtrip(flask_app, web_app.diagram_store, corpus, args.iterations),
+        "memory": bench_memory(flask_app, descriptions),
+        "concurrency": bench_throughput(
+            flask_app, descriptions,
+            [int(count) for count in args.clients.split(",")],
+            args.requests_per_client, args.latency, args.tokens_per_second, corpus
+        ),
+    }
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(json.dumps(results, indent=2, sort_keys=True))
+    print(f"INFO: Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        if compare(report, previous, args.threshold):
+            return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,224 @@
+"""
+Comparison of system prompt variants on the evaluation corpus.
+
+Every description (*.txt) is generated with every selected prompt variant (prompts.py) and model,
+always with a new model call (the result cache is bypassed). For each variant and model the report
+shows input and output tokens, time to first token, total latency, validation pass rate and cost -
+and with --score the mean quality score of scoring.py against the *_OPRAVENE.bpmn reference
+solutions - so a shorter prompt can be judged on the same descriptions before it is deployed.
+
+Time to first token is measured from the start of the generation, so it includes waiting for the
+rate limits of the account (keep --concurrency within them).
+
+Usage:
+    python compare_prompts.py ../Evaluation_data/AI_data --mode full --variants default compact \\
+        --models claude-3-5-haiku-20241022 claude-3-7-sonnet-20250219 --concurrency 4 --score
+    python compare_prompts.py ../Evaluation_data/AI_data --mode full --replay   # recorded responses, no API key
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+import logs
+import batch
+import fake_api
+
+# Columns of the CSV with one row per generation, in order
+RUN_FIELDS = [
+    "variant", "model", "file", "status", "validation", "used_model",
+    "input_tokens", "cache_creation_input_tokens", "cache_read_input_tokens", "output_tokens",
+    "first_token", "latency", "cost", "score", "error",
+]
+
+
+def run_one(path, variant, model, system_prompt_file, generation_options, temperature=0, max_tokens=None, score=False):
+    """
+    Generate the diagram of one description with one prompt variant and model.
+    Returns the run row; errors are recorded in the row, not raised.
+    """
+    row = {"variant": variant, "model": model, "file": path, "used_model": "", "first_token": None, "score": None, "error": ""}
+    start_time = time.perf_counter()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            description = f.read().strip()
+
+        result = None
+        for event in main.stream_bpmn_from_text(
+            main.compose_text_input("SIMPLE", simple_text=description),
+            system_prompt_file=system_prompt_file,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            use_cache=False,
+            client_id=f"compare:{variant}",
+            **generation_options
+        ):
+            if event["event"] == "progress" and row["first_token"] is None:
+                row["first_token"] = round(time.perf_counter() - start_time, 3)
+            elif event["event"] == "result":
+                result = event
+        if result is None:
+            raise ValueError(f"model_problem:{main.UNEXPECTED_MESSAGE}")
+
+        row.update({
+            "status": "ok",
+            "validation": batch.check_xml(result["bpmn_content"]),
+            "used_model": result["model"],
+            **{field: result.get(field, 0) for field in main.USAGE_FIELDS},
+            "cost": round(main.calculate_cost(
+                result["model"], result["input_tokens"], result["output_tokens"],
+                result.get("cache_creation_input_tokens", 0), result.get("cache_read_input_tokens", 0)
+            ) + result.get("discarded_cost", 0.0), 6),
+        })
+        if score:
+            row["score"] = score_result(path, result["bpmn_content"])
+
+    except main.BpmnValidationError as e:
+        row.update({"status": "failed", "validation": "rejected", "error": str(e).split(":", 1)[-1]})
+    except Exception as e:
+        row.update({"status": "failed", "validation": "not_generated", "error": str(e).split(":", 1)[-1]})
+
+    row["latency"] = round(time.perf_counter() - start_time, 3)
+    print(f"INFO: [{variant} / {model}] [{row['status']}] {path} ({row['latency']}s)")
+    return row
+
+def score_result(path, bpmn_content):
+    """Return the quality score of a generated diagram against the reference solution next to the description."""
+    import scoring  # only used with --score
+
+    try:
+        return scoring.score_document(bpmn_content, scoring.find_reference(path))["score"]
+    except Exception as e:
+        print(f"WARNING: {path} cannot be scored: {str(e)}")
+        return 0.0
+
+
+def _mean(values):
+    values = [value for value in values if value is not None]
+    return round(statistics.fmean(values), 3) if values else None
+
+def _percentile(values, q):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def summarize(rows):
+    """Return one summary per (variant, model) in the order of the runs."""
+    groups = {}
+    for row in rows:
+        groups.setdefault((row["variant"], row["model"]), []).append(row)
+
+    summaries = []
+    for (variant, model), group in groups.items():
+        succeeded = [row for row in group if row["status"] == "ok"]
+        summaries.append({
+            "variant": variant,
+            "model": model,
+            "runs": len(group),
+            "pass_rate": round(sum(1 for row in group if row.get("validation") == "valid") / len(group), 3),
+            "input_tokens": _mean([row["input_tokens"] + row["cache_creation_input_tokens"] + row["cache_read_input_tokens"]
+                                   for row in succeeded]),
+            "output_tokens": _mean([row["output_tokens"] for row in succeeded]),
+            "first_token": _mean([row["first_token"] for row in succeeded]),
+            "first_token_p95": _percentile([row["first_token"] for row in succeeded], 0.95),
+            "latency": _mean([row["latency"] for row in succeeded]),
+            "latency_p95": _percentile([row["latency"] for row in succeeded], 0.95),
+            "cost": round(sum(row.get("cost", 0.0) for row in succeeded), 6),
+            "score": _mean([row["score"] for row in succeeded]),
+        })
+    return summaries
+
+def print_summary(summaries):
+    """Print the comparison table; token and latency changes are relative to the first variant of the model."""
+    print(f"{'variant':<16} {'model':<30} {'pass':>5} {'input':>8} {'output':>8} {'ttft s':>7} {'latency s':>9} "
+          f"{'cost $':>8} {'score':>6}")
+    baselines = {}
+    for summary in summaries:
+        baseline = baselines.setdefault(summary["model"], summary)
+        change = ""
+        if summary is not baseline and baseline["input_tokens"] and summary["input_tokens"]:
+            change = f"  input {(summary['input_tokens'] / baseline['input_tokens'] - 1) * 100:+.0f}% vs {baseline['variant']}"
+
+        def cell(value, width, digits=1):
+            return f"{value:>{width}.{digits}f}" if value is not None else f"{'-':>{width}}"
+
+        print(f"{summary['variant']:<16} {summary['model']:<30} {summary['pass_rate']:>5.0%} {cell(summary['input_tokens'], 8, 0)} "
+              f"{cell(summary['output_tokens'], 8, 0)} {cell(summary['first_token'], 7, 2)} {cell(summary['latency'], 9, 2)} "
+              f"{summary['cost']:>8.4f} {cell(summary['score'], 6, 3)}{change}")
+
+def write_report(rows, summaries, csv_path=None, json_path=None):
+    """Write one row per generation to CSV and the rows with the summaries to JSON."""
+    if csv_path:
+        with open(csv_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=RUN_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"summaries": summaries, "runs": rows}, f, ensure_ascii=False, indent=2)
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Compare system prompt variants on a directory of process descriptions.")
+    parser.add_argument("directory", help="Directory with process descriptions (and reference solutions for --score)")
+    parser.add_argument("--pattern", default="**/*.txt", help="Glob pattern of description files (default: **/*.txt)")
+    parser.add_argument("--mode", choices=main.GENERATION_MODES, default=main.DEFAULT_GENERATION_MODE)
+    parser.add_argument("--variants", nargs="+", default=None, help="Prompt variants to compare (default: all variants of the mode)")
+    parser.add_argument("--models", nargs="+", default=[main.DEFAULT_MODEL])
+    parser.add_argument("--temperature", type=float, default=0)
+    parser.add_argument("--max-tokens", type=int, default=None, help="Output token limit per API call (default: predicted from the description)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of simultaneous model calls")
+    parser.add_argument("--limit", type=int, default=None, help="Use only the first N descriptions")
+    parser.add_argument("--score", action="store_true", help="Score generated diagrams with scoring.py")
+    parser.add_argument("--base-url", help="Anthropic API base URL, e.g. a local fake_api.py server")
+    parser.add_argument("--replay", action="store_true", help="Answer with the recorded responses of the corpus (no API key, tokens only)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated model latency in seconds with --replay")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="Simulated output speed with --replay (0 = instant)")
+    parser.add_argument("--output", default=None, help="Report path without extension (default: <directory>/prompt_comparison)")
+    args = parser.parse_args(argv)
+    logs.configure_logging()
+
+    if args.base_url:
+        os.environ["ANTHROPIC_BASE_URL"] = args.base_url
+    if args.replay:
+        main.set_client(fake_api.make_replay_client(fake_api.ReplayCorpus(args.directory), args.latency, args.tokens_per_second))
+
+    variants = args.variants or main.PROMPTS.variants(args.mode)
+    unknown = [variant for variant in variants if not main.PROMPTS.has_variant(args.mode, variant)]
+    if unknown:
+        print(f"ERROR: Unknown prompt variants of mode {args.mode}: {', '.join(unknown)} "
+              f"(available: {', '.join(main.PROMPTS.variants(args.mode))})")
+        return 1
+
+    paths = batch.find_descriptions(args.directory, args.pattern)[:args.limit]
+    if not paths:
+        print(f"WARNING: No description files found in {args.directory}")
+        return 1
+
+    runs = [(path, variant, model) for variant in variants for model in args.models for path in paths]
+    print(f"INFO: {len(runs)} generations - {len(paths)} descriptions, variants {', '.join(variants)}, "
+          f"models {', '.join(args.models)}, concurrency {args.concurrency}")
+    generation_options = main.generation_options(args.mode)
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="compare") as executor:
+        rows = list(executor.map(lambda run: run_one(
+            run[0], run[1], run[2], main.PROMPTS.path(args.mode, run[1]), generation_options,
+            temperature=args.temperature, max_tokens=args.max_tokens, score=args.score
+        ), runs))
+
+    summaries = summarize(rows)
+    output_base = args.output or os.path.join(args.directory, "prompt_comparison")
+    write_report(rows, summaries, output_base + ".csv", output_base + ".json")
+    print_summary(summaries)
+    print(f"INFO: Report in {output_base}.csv/.json")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,253 @@
+"""
+Decomposition of large processes into segments generated in parallel.
+
+A long description produces a document that takes a single model call minutes to write. In the
+"parallel" generation mode a cheap planning call first splits the process into segments with
+explicit hand-off points (system_prompt_plan.txt):
+
+    process Zavedenie nového produktu
+    lane Produktový manažér
+    lane Vedenie spoločnosti
+    segment A Návrh a posúdenie konceptu
+      scope Kroky 1 až 3 - od predstavenia konceptu po rozhodnutie vedenia
+      in H2
+      out H1 Koncept schválený
+    segment B Vývoj a testovanie
+      scope Kroky 3.1 až 5 - paralelný vývoj, testovanie a úpravy
+      in H1
+      out H2 Koncept zamietnutý
+
+Each segment is then generated concurrently in the compact process format (process_dsl.py,
+system_prompt_segment.txt): an incoming hand-off is a start event and an outgoing hand-off an
+end event with the id of the hand-off. merge_segments joins the segments into one process - ids
+get the segment id as prefix, lanes with the same name are shared and the hand-off events are
+replaced by sequence flows between the elements around them - and compiles it to BPMN XML with
+the layout computed by layout.py. Wall-clock time then follows the largest segment instead of
+the whole process.
+"""
+import re
+
+import layout
+import process_dsl
+from process_dsl import DslError, ID_PATTERN
+
+ID_REFERENCE = re.compile(rf"^{ID_PATTERN}$")
+SEGMENT_LINE = re.compile(rf"^(?P<id>{ID_PATTERN})(?:\s+(?P<name>.*))?$")
+
+# Hand-off events of a segment - incoming hand-offs start it, outgoing hand-offs end it
+HANDOFF_TAGS = ("startEvent", "endEvent")
+
+
+class Segment:
+    """Planned segment: id, name, scope in the description and incoming/outgoing hand-offs."""
+
+    def __init__(self, segment_id, name):
+        self.id = segment_id
+        self.name = name
+        self.scope = ""
+        self.inputs = []  # hand-off ids
+        self.outputs = []  # (hand-off id, name)
+
+
+class Plan:
+    """Parsed decomposition plan: process name, lanes and segments."""
+
+    def __init__(self):
+        self.name = ""
+        self.lanes = []
+        self.segments = []
+
+    def handoffs(self):
+        """Return {hand-off id: name} of all outgoing hand-offs."""
+        return {handoff_id: name for segment in self.segments for handoff_id, name in segment.outputs}
+
+
+class PlanParser:
+    """
+    Line-by-line parser of decomposition plans, usable while the plan is streamed (same interface
+    as process_dsl.DslParser). References between segments are checked by finish().
+    """
+
+    def __init__(self):
+        self.plan = Plan()
+        self.line_number = 0
+
+    def feed_line(self, line):
+        """Parse one line. Returns the keyword of the line or None for ignored lines."""
+        self.line_number += 1
+        line = line.strip()
+
+        # Empty lines, comments and code fences around the plan are ignored
+        if not line or line.startswith(("#", "```")):
+            return None
+
+        keyword, _, rest = line.partition(" ")
+        rest = rest.strip()
+        if keyword == "process":
+            self.plan.name = rest
+        elif keyword == "lane":
+            if not rest:
+                raise DslError("lane needs a name", self.line_number)
+            self.plan.lanes.append(rest.rstrip(":"))
+        elif keyword == "segment":
+            match = SEGMENT_LINE.match(rest)
+            if not match:
+                raise DslError(f"cannot parse segment '{rest[:60]}'", self.line_number)
+            if any(segment.id == match.group("id") for segment in self.plan.segments):
+                raise DslError(f"duplicate segment id '{match.group('id')}'", self.line_number)
+            self.plan.segments.append(Segment(match.group("id"), (match.group("name") or "").strip()))
+        elif keyword in ("scope", "in", "out"):
+            self._add_to_segment(keyword, rest)
+        else:
+            raise DslError(f"unknown plan line '{line[:60]}'", self.line_number)
+        return keyword
+
+    def _add_to_segment(self, keyword, rest):
+        if not self.plan.segments:
+            raise DslError(f"'{keyword}' before the first segment", self.line_number)
+        segment = self.plan.segments[-1]
+        if keyword == "scope":
+            segment.scope = rest
+            return
+
+        handoff_id, _, name = rest.partition(" ")
+        if not ID_REFERENCE.match(handoff_id):
+            raise DslError(f"invalid hand-off id '{handoff_id[:30]}'", self.line_number)
+        if keyword == "in":
+            segment.inputs.append(handoff_id)
+        else:
+            if handoff_id in self.plan.handoffs():
+                raise DslError(f"duplicate hand-off id '{handoff_id}'", self.line_number)
+            segment.outputs.append((handoff_id, name.strip()))
+
+    def finish(self):
+        """Check references between segments and return the parsed Plan."""
+        if not self.plan.lanes:
+            raise DslError("plan contains no lanes")
+        if not self.plan.segments:
+            raise DslError("plan contains no segments")
+
+        handoffs = self.plan.handoffs()
+        for segment in self.plan.segments:
+            for handoff_id in segment.inputs:
+                if handoff_id not in handoffs:
+                    raise DslError(f"segment '{segment.id}' starts with unknown hand-off '{handoff_id}'")
+                if handoff_id in dict(segment.outputs):
+                    raise DslError(f"segment '{segment.id}' hands off to itself with '{handoff_id}'")
+        return self.plan
+
+
+def parse_plan(text):
+    """Parse a complete decomposition plan. Raises DslError."""
+    parser = PlanParser()
+    for line in text.splitlines():
+        parser.feed_line(line)
+    return parser.finish()
+
+
+def compose_segment_input(text, plan, segment):
+    """
+    Compose the user message of a segment generation: whole description, scope, roles and hand-offs.
+    The first segment of the plan starts the process.
+    """
+    handoffs = plan.handoffs()
+    inputs = "\n".join(f"  start {handoff_id} {handoffs[handoff_id]}" for handoff_id in segment.inputs)
+    outputs = "\n".join(f"  end {handoff_id} {name}" for handoff_id, name in segment.outputs)
+    return f"""OPIS PROCESU:
+{text}
+ČASŤ PROCESU: {segment.name}
+Rozsah: {segment.scope}
+Roly: {"; ".join(plan.lanes)}
+Začiatok procesu: {"áno" if segment is plan.segments[0] else "nie"}
+Vstupné odovzdania:
+{inputs or "  žiadne"}
+Výstupné odovzdania:
+{outputs or "  žiadne"}"""
+
+
+def _lane_key(name):
+    return " ".join((name or "").split()).lower()
+
+def merge_segments(plan, segment_documents):
+    """
+    Merge the BPMN documents of the segments ([(Segment, BPMN XML)]) into one ProcessModel.
+    Every hand-off becomes flows from the elements before its end event to the elements after its
+    start event. A hand-off whose end or start event is missing in all segments is not connected;
+    its events are kept as ordinary start and end events, so no element is left without a flow.
+    Returns (model, unconnected hand-off ids). Raises DslError when a segment cannot be read.
+    """
+    model = process_dsl.ProcessModel()
+    model.name = plan.name
+    lane_index = {}
+    for lane_name in plan.lanes:
+        lane_index[_lane_key(lane_name)] = len(model.lanes)
+        model.lanes.append([lane_name, []])
+
+    handoff_ids = set(plan.handoffs())
+    handoff_events = {}  # hand-off id -> ids of its start and end events in the merged model
+    for segment, document in segment_documents:
+        try:
+            part = process_dsl.parse_dsl(process_dsl.decompile_bpmn(document))
+        except DslError as e:
+            raise DslError(f"segment '{segment.id}': {str(e)}")
+
+        new_ids = {element_id: f"{segment.id}_{element_id}" for element_id in part.elements}
+        for element_id, element in part.elements.items():
+            if element_id in handoff_ids and element["tag"] in HANDOFF_TAGS:
+                handoff_events.setdefault(element_id, set()).add(new_ids[element_id])
+
+        for lane_name, element_ids in part.lanes:
+            key = _lane_key(lane_name)
+            if key not in lane_index:
+                lane_index[key] = len(model.lanes)
+                model.lanes.append([lane_name, []])
+            model.lanes[lane_index[key]][1].extend(new_ids[element_id] for element_id in element_ids)
+
+        # Elements outside of all lanes are kept outside (layout.py puts them in the lane of their predecessor)
+        for element_id, element in part.elements.items():
+            element = dict(element, lane=None)
+            if element["host"]:
+                element["host"] = new_ids[element["host"]]
+            model.elements[new_ids[element_id]] = element
+
+        model.flows.extend((new_ids[source], new_ids[target], label, line) for source, target, label, line in part.flows)
+
+    # Hand-off events are replaced by flows from the elements before the end event to the elements after the start event
+    unconnected = []
+    for handoff_id in plan.handoffs():
+        events = handoff_events.get(handoff_id, set())
+        incoming = [(source, label) for source, target, label, _ in model.flows if target in events and source not in events]
+        outgoing = [(target, label) for source, target, label, _ in model.flows if source in events and target not in events]
+        if not incoming or not outgoing:
+            unconnected.append(handoff_id)
+            continue
+
+        model.flows = [flow for flow in model.flows if flow[0] not in events and flow[1] not in events]
+        for source, source_label in incoming:
+            for target, target_label in outgoing:
+                model.flows.append((source, target, source_label or target_label, None))
+        for event_id in events:
+            del model.elements[event_id]
+        for lane in model.lanes:
+            lane[1] = [element_id for element_id in lane[1] if element_id not in events]
+
+    # Lanes of the plan that no segment used are not drawn
+    model.lanes = [lane for lane in model.lanes if lane[1]]
+    for index, (_, element_ids) in enumerate(model.lanes):
+        for element_id in element_ids:
+            model.elements[element_id]["lane"] = index
+
+    tags = {element["tag"] for element in model.elements.values()}
+    if "startEvent" not in tags or "endEvent" not in tags:
+        raise DslError("merged process has no start or no end event")
+    return model, unconnected
+
+def merge_to_bpmn(plan, segment_documents):
+    """Merge the segment documents and compile the process to BPMN XML with the layout of layout.py."""
+    model, unconnected = merge_segments(plan, segment_documents)
+    return layout.layout_tree(process_dsl.build_document(model)), unconnected
+
+
+def describe_plan(plan):
+    """Return a short summary of the plan for logs and progress events."""
+    return [{"id": segment.id, "name": segment.name} for segment in plan.segments]
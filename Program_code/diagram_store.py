@@ -0,0 +1,354 @@
+"""
+Short-lived storage of generated diagrams for the browser.
+
+A diagram generated by the form submission is put into the store and its XML is inlined into the
+rendered page, so the page does not fetch it again. The stored copy stays available at
+/bpmn/<id> (with ETag and gzip) until it expires. Entries are kept gzip-compressed at rest,
+bounded by their total size (least recently used entries are evicted first) and by age - a reaper
+thread in every process removes expired entries, so diagrams of closed tabs do not pile up.
+
+Backends:
+    MemoryBackend - bounded LRU dictionary local to the process
+    SqliteBackend - SQLite database shared by all processes using the same file (default)
+    RedisBackend  - Redis server shared by several containers (needs the redis package);
+                    size limit and eviction follow the maxmemory policy of the server
+"""
+import os
+import gzip
+import time
+import uuid
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Diagrams smaller than this are stored uncompressed - gzip would not save anything worth the time
+MIN_COMPRESS_BYTES = 1024
+COMPRESS_LEVEL = 6
+
+
+class StoredDiagram:
+    """Stored diagram: data as stored (gzip or plain UTF-8 XML), ETag and creation time."""
+
+    def __init__(self, data, compressed, etag, created_at):
+        self.data = data
+        self.compressed = compressed
+        self.etag = etag
+        self.created_at = created_at
+
+    def xml(self):
+        """Return the diagram as plain UTF-8 bytes."""
+        return gzip.decompress(self.data) if self.compressed else self.data
+
+    def gzipped(self):
+        """Return the diagram gzip-compressed (compressing it now if it is stored plain)."""
+        return self.data if self.compressed else gzip.compress(self.data, COMPRESS_LEVEL)
+
+    def text(self):
+        """Return the diagram as a string."""
+        return self.xml().decode("utf-8")
+
+
+class MemoryBackend:
+    """Bounded LRU dictionary local to the process, limited by the total size of stored data."""
+
+    def __init__(self, max_bytes=50 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def put(self, diagram_id, diagram, ttl):
+        with self._lock:
+            self._entries[diagram_id] = diagram
+            self._size += len(diagram.data)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.data)
+                self.evictions += 1
+
+    def get(self, diagram_id):
+        with self._lock:
+            diagram = self._entries.get(diagram_id)
+            if diagram is not None:
+                self._entries.move_to_end(diagram_id)
+            return diagram
+
+    def delete(self, diagram_id):
+        with self._lock:
+            diagram = self._entries.pop(diagram_id, None)
+            if diagram is None:
+                return False
+            self._size -= len(diagram.data)
+            return True
+
+    def expire(self, created_before):
+        with self._lock:
+            expired = [key for key, diagram in self._entries.items() if diagram.created_at < created_before]
+            for key in expired:
+                self._size -= len(self._entries.pop(key).data)
+            return len(expired)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "evictions": self.evictions}
+
+
+class SqliteBackend:
+    """
+    SQLite database shared by all processes using the same file, limited by the total size of stored
+    data - least recently read entries are evicted first.
+    """
+
+    def __init__(self, db_path, max_bytes=100 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._db_ready = False
+        self._db_lock = threading.Lock()
+
+    def _connect(self):
+        """Open a new SQLite connection; the database is created on first use, not when the object is made."""
+        if not self._db_ready:
+            with self._db_lock:
+                if not self._db_ready:
+                    self._init_db()
+                    self._db_ready = True
+        return self._open()
+
+    def _open(self):
+        """Open a new SQLite connection - one per operation keeps it safe across threads and processes."""
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def _init_db(self):
+        """Create the diagram database and table if they do not exist yet."""
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._open() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS diagrams (
+                    id TEXT PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    compressed INTEGER NOT NULL,
+                    etag TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS diagrams_accessed_at ON diagrams (accessed_at)")
+
+    def put(self, diagram_id, diagram, ttl):
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO diagrams (id, data, compressed, etag, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (diagram_id, diagram.data, int(diagram.compressed), diagram.etag, len(diagram.data), diagram.created_at, diagram.created_at)
+            )
+            self._evict(connection)
+
+    def _evict(self, connection):
+        """Remove least recently read entries over the size limit."""
+        total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM diagrams").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+
+        excess = total_size - self.max_bytes
+        removed = 0
+        for diagram_id, size in connection.execute("SELECT id, size FROM diagrams ORDER BY accessed_at ASC").fetchall():
+            if removed >= excess:
+                break
+            connection.execute("DELETE FROM diagrams WHERE id = ?", (diagram_id,))
+            removed += size
+
+    def get(self, diagram_id):
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT data, compressed, etag, created_at FROM diagrams WHERE id = ?", (diagram_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE diagrams SET accessed_at = ? WHERE id = ?", (time.time(), diagram_id))
+        return StoredDiagram(bytes(row[0]), bool(row[1]), row[2], row[3])
+
+    def delete(self, diagram_id):
+        with self._connect() as connection:
+            return connection.execute("DELETE FROM diagrams WHERE id = ?", (diagram_id,)).rowcount > 0
+
+    def expire(self, created_before):
+        with self._connect() as connection:
+            return connection.execute("DELETE FROM diagrams WHERE created_at < ?", (created_before,)).rowcount
+
+    def stats(self):
+        with self._connect() as connection:
+            entries, size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM diagrams").fetchone()
+        return {"entries": entries, "bytes": size}
+
+
+class RedisBackend:
+    """
+    Redis server shared by several containers. Entries expire through the TTL of their keys;
+    the size limit is the maxmemory setting of the server (use an LRU eviction policy).
+    """
+
+    def __init__(self, url, prefix="processflow:diagram:"):
+        import redis  # only needed when this backend is configured
+
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+
+    def put(self, diagram_id, diagram, ttl):
+        key = self.prefix + diagram_id
+        with self._redis.pipeline() as pipeline:
+            pipeline.hset(key, mapping={
+                "data": diagram.data,
+                "compressed": int(diagram.compressed),
+                "etag": diagram.etag,
+                "created_at": diagram.created_at,
+            })
+            pipeline.expire(key, max(1, int(ttl)))
+            pipeline.execute()
+
+    def get(self, diagram_id):
+        fields = self._redis.hgetall(self.prefix + diagram_id)
+        if not fields:
+            return None
+        return StoredDiagram(fields[b"data"], fields[b"compressed"] == b"1", fields[b"etag"].decode("ascii"),
+                             float(fields[b"created_at"]))
+
+    def delete(self, diagram_id):
+        return self._redis.delete(self.prefix + diagram_id) > 0
+
+    def expire(self, created_before):
+        # Keys expire on the server
+        return 0
+
+    def stats(self):
+        return {"entries": sum(1 for _ in self._redis.scan_iter(match=self.prefix + "*", count=1000))}
+
+
+def make_backend(spec, db_path=None, max_bytes=100 * 1024 * 1024):
+    """
+    Create a backend from its name: "memory", "sqlite" (database at db_path) or a redis:// URL.
+    Raises ValueError for unknown names.
+    """
+    if spec == "memory":
+        return MemoryBackend(max_bytes)
+    if spec == "sqlite":
+        return SqliteBackend(db_path, max_bytes)
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(spec)
+    raise ValueError(f"Unknown diagram store backend '{spec}'")
+
+
+class DiagramStore:
+    """
+    Generated diagrams by random id, kept for ttl seconds.
+
+    Diagrams are gzip-compressed at rest (compress=False keeps them plain). The ETag is derived from
+    the content. The reaper thread that removes expired entries starts with the first stored diagram
+    in every process (again after a fork).
+    """
+
+    def __init__(self, backend, ttl=3600, compress=True, reap_interval=60.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.compress = compress
+        self.reap_interval = reap_interval
+
+        self._lock = threading.Lock()
+        self._counters = {"stores": 0, "hits": 0, "misses": 0, "deletes": 0, "expired": 0, "errors": 0}
+        self._reaper_pid = None
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def put(self, content):
+        """Store a diagram and return its id; None when the backend fails (the diagram is then only inlined)."""
+        data = content.encode("utf-8")
+        etag = hashlib.sha256(data).hexdigest()[:32]
+        compressed = self.compress and len(data) >= MIN_COMPRESS_BYTES
+        if compressed:
+            data = gzip.compress(data, COMPRESS_LEVEL)
+
+        diagram_id = uuid.uuid4().hex
+        try:
+            self.backend.put(diagram_id, StoredDiagram(data, compressed, etag, time.time()), self.ttl)
+        except Exception as e:
+            logger.warning(f"Diagram store write failed: {str(e)}")
+            self._count("errors")
+            return None
+
+        self._count("stores")
+        self._ensure_reaper()
+        return diagram_id
+
+    def get(self, diagram_id):
+        """Return the StoredDiagram, or None for unknown and expired ids."""
+        try:
+            diagram = self.backend.get(diagram_id)
+        except Exception as e:
+            logger.warning(f"Diagram store read failed: {str(e)}")
+            self._count("errors")
+            diagram = None
+
+        if diagram is None or diagram.created_at < time.time() - self.ttl:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return diagram
+
+    def delete(self, diagram_id):
+        """Remove a diagram. Returns False if it was not stored."""
+        try:
+            deleted = self.backend.delete(diagram_id)
+        except Exception as e:
+            logger.warning(f"Diagram store delete failed: {str(e)}")
+            self._count("errors")
+            return False
+        if deleted:
+            self._count("deletes")
+        return deleted
+
+    def reap(self):
+        """Remove expired diagrams and return how many were removed."""
+        removed = self.backend.expire(time.time() - self.ttl)
+        if removed:
+            self._count("expired", removed)
+            logger.info(f"Removed {removed} expired diagrams")
+        return removed
+
+    def _ensure_reaper(self):
+        """Start the reaper thread in this process (again after a fork)."""
+        if self._reaper_pid == os.getpid():
+            return
+        with self._lock:
+            if self._reaper_pid == os.getpid():
+                return
+            self._reaper_pid = os.getpid()
+            threading.Thread(target=self._reap_loop, name="diagram-reaper", daemon=True).start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(self.reap_interval)
+            try:
+                self.reap()
+            except Exception as e:
+                logger.warning(f"Diagram store cleanup failed: {str(e)}")
+
+    def stats(self):
+        """Return store counters and the size of the backend."""
+        with self._lock:
+            stats = dict(self._counters)
+        stats["backend"] = type(self.backend).__name__
+        try:
+            stats.update(self.backend.stats())
+        except Exception:
+            pass
+        return stats
@@ -0,0 +1,284 @@
+"""
+Local fake of the Anthropic Messages API for offline batch runs and tests.
+
+Answers POST /v1/messages (streaming and non-streaming) with BPMN documents from a corpus
+directory: a request whose prompt contains the text of a description file gets the .bpmn
+file stored next to that description. Latency and output token rate can be simulated.
+
+The same responses are available in-process through ReplayTransport, an httpx transport
+that can be plugged into the Anthropic client (see make_replay_client) without any server.
+
+Usage:
+    python fake_api.py --corpus ../Evaluation_data/AI_data --port 8089 --latency 1 --tokens-per-second 150
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8089 ANTHROPIC_API_KEY=fake python batch.py ../Evaluation_data/AI_data
+"""
+import os
+import sys
+import json
+import time
+import glob
+import uuid
+import argparse
+import httpx
+from anthropic import Anthropic
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from result_cache import normalize_text
+
+# Rough characters-per-token ratio used for simulated usage (same as main.CHARS_PER_TOKEN)
+CHARS_PER_TOKEN = 3.5
+
+# Rate limits per minute reported in the anthropic-ratelimit-* headers (a generous account, so
+# admission control of the server adapts to them after the first response)
+RATE_LIMITS = {"requests": 4000, "input-tokens": 2000000, "output-tokens": 400000}
+
+# Returned when no corpus entry matches the prompt
+FALLBACK_RESPONSE = "PROBLÉM - Fake API has no recorded response for this process description."
+
+
+def estimate_tokens(text):
+    """Estimate token count of a text for simulated usage."""
+    return max(1, int(len(text) / CHARS_PER_TOKEN))
+
+
+def rate_limit_headers():
+    """Return anthropic-ratelimit-* headers of a response - nothing is ever used up."""
+    headers = {}
+    for kind, limit in RATE_LIMITS.items():
+        headers[f"anthropic-ratelimit-{kind}-limit"] = str(limit)
+        headers[f"anthropic-ratelimit-{kind}-remaining"] = str(limit)
+    return headers
+
+
+class ReplayCorpus:
+    """
+    Recorded responses: maps description texts (*.txt) to the BPMN file generated for them.
+    Reference solutions (*_OPRAVENE.bpmn) and batch outputs with a suffix are not used as responses.
+    """
+
+    def __init__(self, root, suffix=""):
+        self.entries = []
+        for txt_path in sorted(glob.glob(os.path.join(root, "**", "*.txt"), recursive=True)):
+            bpmn_path = os.path.splitext(txt_path)[0] + suffix + ".bpmn"
+            if not os.path.exists(bpmn_path):
+                continue
+            with open(txt_path, "r", encoding="utf-8") as f:
+                description = normalize_text(f.read())
+            with open(bpmn_path, "r", encoding="utf-8") as f:
+                response = f.read()
+            self.entries.append((description, response, txt_path))
+
+    def lookup(self, prompt):
+        """Return the recorded response for a prompt, or the fallback response."""
+        prompt = normalize_text(prompt)
+        for description, response, _ in self.entries:
+            if description and description in prompt:
+                return response
+        return FALLBACK_RESPONSE
+
+    def responses(self):
+        """Return all recorded responses."""
+        return [response for _, response, _ in self.entries]
+
+
+def request_prompt(body):
+    """Return system and user text of a Messages API request body."""
+    system = body.get("system") or ""
+    if isinstance(system, list):
+        system = "".join(block.get("text", "") for block in system)
+
+    parts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(block.get("text", "") for block in content or [])
+    return system, "\n".join(parts)
+
+
+def answer(corpus, body):
+    """
+    Return model, response text, input tokens and stop reason for a Messages API request body.
+    The response is cut off at max_tokens; a request ending with an assistant message (continuation
+    of a cut off response) gets the rest of the recorded response after that prefix.
+    """
+    system, prompt = request_prompt(body)
+    text = corpus.lookup(prompt)
+    messages = body.get("messages") or []
+    if messages and messages[-1].get("role") == "assistant" and isinstance(messages[-1].get("content"), str):
+        prefix = messages[-1]["content"]
+        if text.startswith(prefix):
+            text = text[len(prefix):]
+
+    stop_reason = "end_turn"
+    max_chars = int(body.get("max_tokens", 0) * CHARS_PER_TOKEN)
+    if max_chars and len(text) > max_chars:
+        text = text[:max_chars]
+        stop_reason = "max_tokens"
+    return body.get("model", "fake-model"), text, estimate_tokens(system + prompt), stop_reason
+
+
+def build_message(model, text, input_tokens, stop_reason="end_turn"):
+    """Build a non-streaming Messages API response body."""
+    return {
+        "id": f"msg_fake_{uuid.uuid4().hex[:16]}",
+        "type": "message",
+        "role": "assistant",
+        "model": model,
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": {"input_tokens": input_tokens, "output_tokens": estimate_tokens(text)},
+    }
+
+
+def iter_sse_events(model, text, input_tokens, tokens_per_second=0, chunk_tokens=4, stop_reason="end_turn"):
+    """
+    Yield a streaming Messages API response as encoded Server-Sent Events.
+    With tokens_per_second set, text deltas are paced to simulate model output speed.
+    """
+    def event(name, data):
+        return f"event: {name}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+    message = build_message(model, "", input_tokens)
+    message["content"] = []
+    message["stop_reason"] = None
+    message["usage"]["output_tokens"] = 1
+    yield event("message_start", {"type": "message_start", "message": message})
+    yield event("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+
+    chunk_chars = max(1, int(chunk_tokens * CHARS_PER_TOKEN))
+    delay = chunk_tokens / tokens_per_second if tokens_per_second else 0
+    for start in range(0, len(text), chunk_chars):
+        if delay:
+            time.sleep(delay)
+        delta = {"type": "text_delta", "text": text[start:start + chunk_chars]}
+        yield event("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": delta})
+
+    yield event("content_block_stop", {"type": "content_block_stop", "index": 0})
+    yield event("message_delta", {
+        "type": "message_delta",
+        "delta": {"stop_reason": stop_reason, "stop_sequence": None},
+        "usage": {"output_tokens": estimate_tokens(text)},
+    })
+    yield event("message_stop", {"type": "message_stop"})
+
+
+class ReplayTransport(httpx.BaseTransport):
+    """
+    httpx transport answering Messages API requests from a ReplayCorpus in-process.
+    Simulates time to first token (latency) and output speed (tokens_per_second) with sleeps,
+    so server-side code can be measured under realistic waiting without network or API costs.
+    """
+
+    def __init__(self, corpus, latency=0.0, tokens_per_second=0):
+        self.corpus = corpus
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+
+    def handle_request(self, request):
+        if not request.url.path.startswith("/v1/messages"):
+            return httpx.Response(404, json={"type": "error", "error": {"type": "not_found_error", "message": "Not found"}})
+
+        body = json.loads(request.read() or b"{}")
+        model, text, input_tokens, stop_reason = answer(self.corpus, body)
+
+        # Simulated time to first token
+        if self.latency:
+            time.sleep(self.latency)
+
+        if body.get("stream"):
+            events = iter_sse_events(model, text, input_tokens, self.tokens_per_second, stop_reason=stop_reason)
+            return httpx.Response(200, headers={"Content-Type": "text/event-stream", **rate_limit_headers()}, content=events)
+
+        if self.tokens_per_second:
+            time.sleep(estimate_tokens(text) / self.tokens_per_second)
+        return httpx.Response(200, headers=rate_limit_headers(), json=build_message(model, text, input_tokens, stop_reason))
+
+
+def make_replay_client(corpus, latency=0.0, tokens_per_second=0):
+    """Create an Anthropic client whose requests are answered by ReplayTransport."""
+    transport = ReplayTransport(corpus, latency, tokens_per_second)
+    return Anthropic(api_key="fake", http_client=httpx.Client(transport=transport), max_retries=0)
+
+
+def make_handler(corpus, latency=0.0, tokens_per_second=0):
+    """Create HTTP request handler class serving responses from the corpus."""
+
+    class FakeApiHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            # Keep output quiet - one line per request is printed in do_POST
+            pass
+
+        def do_POST(self):
+            if not self.path.startswith("/v1/messages"):
+                self.send_error(404)
+                return
+
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            model, text, input_tokens, stop_reason = answer(corpus, body)
+
+            # Simulated time to first token
+            if latency:
+                time.sleep(latency)
+
+            if body.get("stream"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                for name, value in rate_limit_headers().items():
+                    self.send_header(name, value)
+                self.end_headers()
+                for chunk in iter_sse_events(model, text, input_tokens, tokens_per_second, stop_reason=stop_reason):
+                    self.wfile.write(f"{len(chunk):X}\r\n".encode() + chunk + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+            else:
+                if tokens_per_second:
+                    time.sleep(estimate_tokens(text) / tokens_per_second)
+                payload = json.dumps(build_message(model, text, input_tokens, stop_reason)).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in rate_limit_headers().items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            print(f"INFO: Fake API answered {'stream' if body.get('stream') else 'message'} for model {model}")
+
+    return FakeApiHandler
+
+
+def serve(corpus_dir, host="127.0.0.1", port=8089, latency=0.0, tokens_per_second=0):
+    """Start the fake API server and block until interrupted."""
+    corpus = ReplayCorpus(corpus_dir)
+    server = ThreadingHTTPServer((host, port), make_handler(corpus, latency, tokens_per_second))
+    server.daemon_threads = True
+    print(f"INFO: Fake Anthropic API with {len(corpus.entries)} recorded responses on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local fake Anthropic Messages API serving recorded BPMN responses.")
+    parser.add_argument("--corpus", default=os.path.join("..", "Evaluation_data", "AI_data"), help="Directory with *.txt descriptions and *.bpmn responses")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated time to first token in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="Simulated output speed (0 = unlimited)")
+    args = parser.parse_args(argv)
+
+    serve(args.corpus, args.host, args.port, args.latency, args.tokens_per_second)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
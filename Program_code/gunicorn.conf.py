@@ -0,0 +1,27 @@
+# Gunicorn configuration for production serving of ProcessFlow AI
+# Run with: gunicorn --config gunicorn.conf.py app:app
+import os
+import multiprocessing
+
+# Address the server listens on
+bind = os.getenv("BIND", "0.0.0.0:5000")
+
+# Generation requests spend tens of seconds waiting for the Anthropic API, so each
+# worker process runs many threads - a waiting request does not block other users
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2, 4)))
+threads = int(os.getenv("GUNICORN_THREADS", 16))
+
+# Long generations (and streamed responses) must not be killed by the worker timeout
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 300))
+graceful_timeout = 30
+keepalive = 5
+
+# Restart workers periodically to keep memory usage stable
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = 100
+
+# Log to stdout/stderr so container logs contain requests and errors
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import uuid
+import queue
+import atexit
+import socket
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED_STATES = (DONE, FAILED)
+
+# Seconds between heartbeats of the process that owns queued and running jobs
+HEARTBEAT_INTERVAL = 10.0
+# Jobs whose owner has not sent a heartbeat for this long belong to a stopped process
+STALE_AFTER = 60.0
+
+ORPHANED_MESSAGE = "The server process running the job stopped before it finished. Please submit the job again."
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue already holds the maximum number of jobs."""
+
+
+class JobManager:
+    """
+    Runs diagram generation jobs on a bounded pool of worker threads.
+
+    Jobs wait in a queue with limited depth - submitting while max_queue jobs are waiting in
+    all server processes raises JobQueueFull, so bursts are rejected quickly instead of piling
+    up. Job records (status, progress, result, error) are stored in SQLite, so any server process
+    can answer status requests for a job that runs in another process.
+
+    Jobs run in the process that accepted them. The process keeps a heartbeat on its unfinished
+    jobs; jobs left queued or running by a process that stopped (e.g. a worker recycled by
+    gunicorn max_requests) are marked failed once the heartbeat is older than STALE_AFTER.
+    """
+
+    def __init__(self, db_path, workers=4, max_queue=32, ttl=3600):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_queue = max_queue
+        self.ttl = ttl
+
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._owner = None
+        self._last_sweep = 0.0
+
+        self._db_ready = False
+        self._db_lock = threading.Lock()
+
+    def _connect(self):
+        """Open a new SQLite connection; the database is created on first use, not when the object is made."""
+        if not self._db_ready:
+            with self._db_lock:
+                if not self._db_ready:
+                    self._init_db()
+                    self._db_ready = True
+        return self._open()
+
+    def _open(self):
+        """Open a new SQLite connection - one per operation keeps it safe across threads and processes."""
+        connection = sqlite3.connect(self.db_path, timeout=10)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def _init_db(self):
+        """Create the jobs database and table if they do not exist yet."""
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._open() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    progress TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            # Owner process and its heartbeat, added to databases created before them
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(jobs)")}
+            if "owner" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            if "heartbeat" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+
+    def _start_workers(self):
+        """Start worker threads on first use (not at import, so forked server processes get their own)."""
+        with self._lock:
+            if self._threads:
+                return
+            # Started in the server process itself (not at import), so the owner is the process that runs the jobs
+            self._owner = f"{socket.gethostname()}:{os.getpid()}"
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"job-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+            atexit.register(self._abandon)
+            logger.info(f"Started {self.workers} job workers (queue limit {self.max_queue})")
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue func(job_id, report_progress, *args, **kwargs) for execution and return the job id.
+        func returns the job result (JSON serializable); report_progress(dict) updates job progress.
+        Raises JobQueueFull when the queue limit is reached.
+        """
+        self._start_workers()
+        self._purge()
+        self._sweep(force=True)
+
+        # The limit counts the waiting jobs of all server processes, not only of this one
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            waiting = connection.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+            if waiting >= self.max_queue:
+                raise JobQueueFull(f"Job queue is full ({self.max_queue} jobs waiting). Please try again later.")
+            connection.execute(
+                "INSERT INTO jobs (id, status, created_at, owner, heartbeat) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, now, self._owner, now)
+            )
+
+        self._queue.put_nowait((job_id, func, args, kwargs))
+        logger.info(f"Job queued: {job_id} (queue depth {self._queue.qsize()})")
+        return job_id
+
+    def get(self, job_id):
+        """Return job record as dictionary, or None if the job does not exist."""
+        self._sweep()
+        with self._connect() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        for field in ("owner", "heartbeat"):
+            job.pop(field, None)
+        for field in ("progress", "result"):
+            job[field] = json.loads(job[field]) if job[field] else None
+
+        # Time spent waiting in queue and running, for display and monitoring
+        now = time.time()
+        job["queue_time"] = round((job["started_at"] or now) - job["created_at"], 2)
+        if job["started_at"]:
+            job["run_time"] = round((job["finished_at"] or now) - job["started_at"], 2)
+        return job
+
+    def queue_depth(self):
+        """Return number of jobs waiting for a worker in this process."""
+        return self._queue.qsize()
+
+    def _update(self, job_id, **fields):
+        """Update selected columns of a job record."""
+        for field in ("progress", "result"):
+            if field in fields and fields[field] is not None:
+                fields[field] = json.dumps(fields[field], ensure_ascii=False)
+
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as connection:
+            connection.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _worker(self):
+        """Worker thread loop - takes jobs from the queue and runs them one at a time."""
+        while True:
+            job_id, func, args, kwargs = self._queue.get()
+            self._update(job_id, status=RUNNING, started_at=time.time())
+            logger.info(f"Job started: {job_id}")
+
+            def report_progress(progress):
+                self._update(job_id, progress=progress)
+
+            try:
+                result = func(job_id, report_progress, *args, **kwargs)
+                self._update(job_id, status=DONE, result=result, finished_at=time.time())
+                logger.info(f"Job finished: {job_id}")
+            except Exception as e:
+                self._update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+                logger.error(f"Job failed: {job_id}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def _heartbeat(self):
+        """Mark the unfinished jobs of this process as alive, every HEARTBEAT_INTERVAL seconds."""
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            try:
+                with self._connect() as connection:
+                    connection.execute(
+                        "UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status IN (?, ?)",
+                        (time.time(), self._owner, QUEUED, RUNNING)
+                    )
+            except sqlite3.Error as e:
+                logger.warning(f"Job heartbeat failed: {str(e)}")
+
+    def _sweep(self, force=False):
+        """Mark jobs of stopped processes (no heartbeat for STALE_AFTER seconds) as failed."""
+        now = time.time()
+        if not force and now - self._last_sweep < HEARTBEAT_INTERVAL:
+            return
+        self._last_sweep = now
+        try:
+            with self._connect() as connection:
+                orphaned = connection.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status IN (?, ?) AND COALESCE(heartbeat, created_at) < ?",
+                    (FAILED, ORPHANED_MESSAGE, now, QUEUED, RUNNING, now - STALE_AFTER)
+                ).rowcount
+            if orphaned:
+                logger.warning(f"{orphaned} jobs of stopped server processes marked as failed")
+        except sqlite3.Error as e:
+            logger.warning(f"Job sweep failed: {str(e)}")
+
+    def _abandon(self):
+        """Mark the unfinished jobs of this process as failed when it exits."""
+        try:
+            with self._connect() as connection:
+                connection.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE owner = ? AND status IN (?, ?)",
+                    (FAILED, ORPHANED_MESSAGE, time.time(), self._owner, QUEUED, RUNNING)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Job cleanup failed: {str(e)}")
+
+    def _purge(self):
+        """Delete finished jobs older than the TTL."""
+        with self._connect() as connection:
+            connection.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (*FINISHED_STATES, time.time() - self.ttl)
+            )
@@ -0,0 +1,594 @@
+"""
+Automatic layout of BPMN diagrams.
+
+In the "semantic" generation mode the model writes only the process model (pool, lanes,
+flow nodes and sequence flows) and this module computes the diagram interchange (DI)
+section: pool and lane sizes, element positions and orthogonal edge routing. The result
+is deterministic - the same process model always gets the same diagram.
+
+Layout of every pool:
+1. loops are found by depth-first search from the start events; their back edges are set aside
+2. flow nodes get columns by the longest path over the remaining acyclic graph
+3. inside a lane, nodes of the same column get separate rows - a branch keeps the row
+   of its predecessor, further branches of a split go to the rows below
+4. lane heights follow from the number of rows, pool width from the number of columns
+5. sequence flows are routed orthogonally; loops run back in the gaps between rows
+"""
+import io
+import math
+import xml.etree.ElementTree as ET
+
+# Namespaces of a BPMN 2.0 document
+BPMN_MODEL_NS = "http://www.omg.org/spec/BPMN/20100524/MODEL"
+BPMN_DI_NS = "http://www.omg.org/spec/BPMN/20100524/DI"
+DC_NS = "http://www.omg.org/spec/DD/20100524/DC"
+DI_NS = "http://www.omg.org/spec/DD/20100524/DI"
+XSI_NS = "http://www.w3.org/2001/XMLSchema-instance"
+
+# Prefixes used when the document is written back (same as in the system prompt template)
+NAMESPACE_PREFIXES = {"bpmn": BPMN_MODEL_NS, "bpmndi": BPMN_DI_NS, "dc": DC_NS, "di": DI_NS, "xsi": XSI_NS}
+
+# Pool position and grid dimensions
+POOL_X = 160
+POOL_Y = 80
+POOL_GAP = 60  # vertical space between pools
+POOL_HEADER = 30  # pool name stripe on the left side
+LANE_HEADER = 30  # lane name stripe on the left side
+LANE_PADDING = 20  # free space above the first and below the last row of a lane
+CONTENT_MARGIN = 30  # free space left of the first and right of the last column
+COLUMN_WIDTH = 160
+ROW_HEIGHT = 130
+
+# Shape sizes (width, height) as used by bpmn.js
+TASK_SIZE = (100, 80)
+EVENT_SIZE = (36, 36)
+GATEWAY_SIZE = (50, 50)
+
+# Label text metrics - rough estimate of the bpmn.js default font
+LABEL_CHAR_WIDTH = 6
+LABEL_LINE_HEIGHT = 14
+LABEL_MAX_WIDTH = 90
+
+# Distance between loop edges sharing the same gap between rows
+LOOP_SPACING = 8
+
+ACTIVITY_TAGS = ("task", "subProcess", "callActivity", "transaction", "adHocSubProcess")
+
+
+class LayoutError(Exception):
+    """Raised when the document has no process that could be laid out."""
+
+
+def qname(namespace, name):
+    """Return ElementTree tag "{namespace}name"."""
+    return f"{{{namespace}}}{name}"
+
+def split_tag(tag):
+    """Split "{namespace}name" into (namespace, name)."""
+    if tag.startswith("{"):
+        namespace, name = tag[1:].split("}", 1)
+        return namespace, name
+    return "", tag
+
+def is_flow_node(name):
+    """Return True for BPMN element names drawn as shapes in the process flow."""
+    return name in ACTIVITY_TAGS or name.endswith(("Task", "Event", "Gateway"))
+
+def shape_size(name):
+    """Return (width, height) of the shape of a flow node element."""
+    if name.endswith("Event"):
+        return EVENT_SIZE
+    if name.endswith("Gateway"):
+        return GATEWAY_SIZE
+    return TASK_SIZE
+
+def label_size(text):
+    """Estimate (width, height) of an external label for the given text."""
+    width = min(LABEL_MAX_WIDTH, max(20, len(text) * LABEL_CHAR_WIDTH))
+    lines = max(1, math.ceil(len(text) * LABEL_CHAR_WIDTH / LABEL_MAX_WIDTH))
+    return width, lines * LABEL_LINE_HEIGHT
+
+
+class Shape:
+    """Flow node of a process with its grid position and computed bounds."""
+
+    def __init__(self, element_id, kind, name):
+        self.id = element_id
+        self.kind = kind
+        self.name = name
+        self.width, self.height = shape_size(kind)
+
+        self.lane = None
+        self.column = 0
+        self.row = 0
+        self.host = None  # boundary events: shape of the activity they are attached to
+
+        # Bounds and grid cell, set by PoolLayout.place
+        self.x = self.y = 0
+        self.cell_top = self.cell_bottom = 0
+
+    @property
+    def cx(self):
+        return self.x + self.width // 2
+
+    @property
+    def cy(self):
+        return self.y + self.height // 2
+
+    @property
+    def right(self):
+        return self.x + self.width
+
+    @property
+    def bottom(self):
+        return self.y + self.height
+
+    @property
+    def is_gateway(self):
+        return self.kind.endswith("Gateway")
+
+
+class PoolLayout:
+    """Computes positions of one process (pool) and the routes of its sequence flows."""
+
+    def __init__(self, process, participant_id=None):
+        self.process = process
+        self.participant_id = participant_id
+        self.shapes = {}
+        self.flows = []  # (flow id, source id, target id, name)
+        self.lanes = []  # (lane id, name)
+
+        self._read_process()
+
+    def _read_process(self):
+        """Collect flow nodes, sequence flows and lanes of the process."""
+        boundary_hosts = {}
+        for child in self.process:
+            namespace, name = split_tag(child.tag)
+            if namespace != BPMN_MODEL_NS or not child.get("id"):
+                continue
+            if is_flow_node(name):
+                self.shapes[child.get("id")] = Shape(child.get("id"), name, child.get("name") or "")
+                if name == "boundaryEvent" and child.get("attachedToRef"):
+                    boundary_hosts[child.get("id")] = child.get("attachedToRef")
+            elif name == "sequenceFlow":
+                self.flows.append((child.get("id"), child.get("sourceRef"), child.get("targetRef"), child.get("name") or ""))
+
+        for shape_id, host_id in boundary_hosts.items():
+            if host_id in self.shapes:
+                self.shapes[shape_id].host = self.shapes[host_id]
+
+        # Flows referencing unknown elements cannot be drawn
+        self.flows = [flow for flow in self.flows if flow[1] in self.shapes and flow[2] in self.shapes]
+
+        lane_set = self.process.find(qname(BPMN_MODEL_NS, "laneSet"))
+        if lane_set is not None:
+            for index, lane in enumerate(lane_set.findall(qname(BPMN_MODEL_NS, "lane"))):
+                self.lanes.append((lane.get("id"), lane.get("name") or ""))
+                # Nodes of nested lanes belong to the top-level lane for layout purposes
+                for ref in lane.iter(qname(BPMN_MODEL_NS, "flowNodeRef")):
+                    shape = self.shapes.get((ref.text or "").strip())
+                    if shape is not None and shape.lane is None:
+                        shape.lane = index
+
+    def _flow_source(self, source_id):
+        """Boundary events take part in the layout through the activity they are attached to."""
+        shape = self.shapes[source_id]
+        return shape.host or shape
+
+    def layout(self, x, y):
+        """Compute positions with the pool's top-left corner at (x, y); returns pool (width, height)."""
+        nodes = [shape for shape in self.shapes.values() if shape.host is None]
+        successors = {shape.id: [] for shape in nodes}
+        for flow_id, source_id, target_id, _ in self.flows:
+            source, target = self._flow_source(source_id), self.shapes[target_id]
+            if target.host is None and source is not target:
+                successors[source.id].append((flow_id, target))
+
+        self.back_edges = self._find_back_edges(nodes, successors)
+        order = self._topological_order(nodes, successors)
+        self._assign_lanes(order, successors)
+        self._assign_columns(order, successors)
+        self._assign_rows(order, successors)
+        return self._place(x, y)
+
+    def _find_back_edges(self, nodes, successors):
+        """Return ids of flows closing a loop, found by depth-first search from the start nodes."""
+        has_incoming = {target.id for edges in successors.values() for _, target in edges}
+        starts = [shape for shape in nodes if shape.id not in has_incoming]
+        # Nodes reachable only through a loop are visited last, in document order
+        roots = starts + [shape for shape in nodes if shape not in starts]
+
+        back_edges = set()
+        state = {}  # 1 - on the current path, 2 - finished
+        for root in roots:
+            if root.id in state:
+                continue
+            state[root.id] = 1
+            stack = [(root, iter(successors[root.id]))]
+            while stack:
+                shape, edges = stack[-1]
+                for flow_id, target in edges:
+                    if state.get(target.id) == 1:
+                        back_edges.add(flow_id)
+                    elif target.id not in state:
+                        state[target.id] = 1
+                        stack.append((target, iter(successors[target.id])))
+                        break
+                else:
+                    state[shape.id] = 2
+                    stack.pop()
+        return back_edges
+
+    def _topological_order(self, nodes, successors):
+        """Return nodes ordered so that every forward flow goes from an earlier to a later node."""
+        incoming = {shape.id: 0 for shape in nodes}
+        for edges in successors.values():
+            for flow_id, target in edges:
+                if flow_id not in self.back_edges:
+                    incoming[target.id] += 1
+
+        ready = [shape for shape in nodes if incoming[shape.id] == 0]
+        order = []
+        while ready:
+            shape = ready.pop(0)
+            order.append(shape)
+            for flow_id, target in successors[shape.id]:
+                if flow_id in self.back_edges:
+                    continue
+                incoming[target.id] -= 1
+                if incoming[target.id] == 0:
+                    ready.append(target)
+        return order
+
+    def _assign_lanes(self, order, successors):
+        """Nodes missing in the lane set are put in the lane of their predecessor (or the first lane)."""
+        for shape in order:
+            if shape.lane is None:
+                shape.lane = 0
+            for _, target in successors[shape.id]:
+                if target.lane is None:
+                    target.lane = shape.lane
+        for shape in self.shapes.values():
+            if shape.host is not None:
+                shape.lane = shape.host.lane
+
+    def _assign_columns(self, order, successors):
+        """Longest path layering - every node is one column right of its furthest predecessor."""
+        for shape in order:
+            for flow_id, target in successors[shape.id]:
+                if flow_id not in self.back_edges:
+                    target.column = max(target.column, shape.column + 1)
+
+    def _assign_rows(self, order, successors):
+        """Give nodes sharing a lane and a column separate rows, keeping branches on straight lines."""
+        predecessors = {shape.id: [] for shape in order}
+        for shape in order:
+            for flow_id, target in successors[shape.id]:
+                if flow_id not in self.back_edges:
+                    predecessors[target.id].append(shape)
+
+        occupied = set()
+        for shape in order:
+            preferred = 0
+            for predecessor in predecessors[shape.id]:
+                if predecessor.lane != shape.lane:
+                    continue
+                # Branches of a split are stacked below the first one
+                branches = [target for flow_id, target in successors[predecessor.id]
+                            if flow_id not in self.back_edges and target.lane == shape.lane]
+                preferred = predecessor.row + (branches.index(shape) if shape in branches else 0)
+                break
+
+            row = preferred
+            while (shape.lane, shape.column, row) in occupied:
+                row += 1
+            shape.row = row
+            occupied.add((shape.lane, shape.column, row))
+
+    def _place(self, x, y):
+        """Compute bounds of all shapes, lanes and the pool from the grid positions."""
+        lane_count = max(1, len(self.lanes))
+        nodes = [shape for shape in self.shapes.values() if shape.host is None]
+        rows = [1 + max([shape.row for shape in nodes if shape.lane == lane] or [0]) for lane in range(lane_count)]
+        columns = 1 + max([shape.column for shape in nodes] or [0])
+
+        self.content_x = x + POOL_HEADER + LANE_HEADER + CONTENT_MARGIN
+        width = POOL_HEADER + LANE_HEADER + 2 * CONTENT_MARGIN + columns * COLUMN_WIDTH
+
+        self.lane_bounds = []
+        lane_y = y
+        for lane in range(lane_count):
+            height = rows[lane] * ROW_HEIGHT + 2 * LANE_PADDING
+            self.lane_bounds.append((x + POOL_HEADER, lane_y, width - POOL_HEADER, height))
+
+            for shape in nodes:
+                if shape.lane != lane:
+                    continue
+                cx = self.column_x(shape.column) + COLUMN_WIDTH // 2
+                cy = lane_y + LANE_PADDING + shape.row * ROW_HEIGHT + ROW_HEIGHT // 2
+                shape.x, shape.y = cx - shape.width // 2, cy - shape.height // 2
+                shape.cell_top, shape.cell_bottom = cy - ROW_HEIGHT // 2, cy + ROW_HEIGHT // 2
+            lane_y += height
+
+        # Boundary events sit on the bottom border of their activity
+        attached = {}
+        for shape in self.shapes.values():
+            if shape.host is not None:
+                index = attached.get(shape.host.id, 0)
+                attached[shape.host.id] = index + 1
+                shape.x = shape.host.x + 10 + index * (shape.width + 4)
+                shape.y = shape.host.bottom - shape.height // 2
+                shape.column, shape.row = shape.host.column, shape.host.row
+                shape.cell_top, shape.cell_bottom = shape.host.cell_top, shape.host.cell_bottom
+
+        self.bounds = (x, y, width, lane_y - y)
+        return width, lane_y - y
+
+    def column_x(self, column):
+        """Return x coordinate of the left border of a grid column."""
+        return self.content_x + column * COLUMN_WIDTH
+
+    def route(self, flow_id, source, target, channels):
+        """
+        Return waypoints of a sequence flow. channels counts loop edges per gap to keep them apart.
+        Of the candidate routes the first one crossing the fewest shapes is used.
+        """
+        if flow_id in self.back_edges or (source.host is None and target.column <= source.column):
+            candidates = self._loop_routes(source, target)
+            points = min(candidates, key=lambda points: self._crossings(points, source, target))
+            # Loop routes run back along points[1] -> points[2]
+            gap = points[1][1]
+            offset = self._channel_offset(channels, gap)
+            points[1], points[2] = (points[1][0], gap + offset), (points[2][0], gap + offset)
+            return points
+
+        candidates = self._forward_routes(source, target)
+        return min(candidates, key=lambda points: self._crossings(points, source, target))
+
+    def _loop_routes(self, source, target):
+        """Candidate routes of a loop, each running back horizontally in a gap between rows."""
+        if target.cy < source.cy:
+            # Towards the row above: along the target row, or along the source row
+            return [
+                [(source.cx, source.y), (source.cx, target.cell_bottom), (target.cx, target.cell_bottom), (target.cx, target.bottom)],
+                [(source.cx, source.bottom), (source.cx, source.cell_bottom), (target.cx, source.cell_bottom), (target.cx, target.bottom)],
+                [(source.cx, source.y), (source.cx, source.cell_top), (target.cx, source.cell_top), (target.cx, target.bottom)],
+            ]
+        if target.cy > source.cy:
+            return [
+                [(source.cx, source.bottom), (source.cx, target.cell_top), (target.cx, target.cell_top), (target.cx, target.y)],
+                [(source.cx, source.y), (source.cx, source.cell_top), (target.cx, source.cell_top), (target.cx, target.y)],
+                [(source.cx, source.bottom), (source.cx, source.cell_bottom), (target.cx, source.cell_bottom), (target.cx, target.y)],
+            ]
+        return [
+            [(source.cx, source.bottom), (source.cx, source.cell_bottom), (target.cx, source.cell_bottom), (target.cx, target.bottom)],
+            [(source.cx, source.y), (source.cx, source.cell_top), (target.cx, source.cell_top), (target.cx, target.y)],
+        ]
+
+    def _forward_routes(self, source, target):
+        """Candidate routes of a flow to a column on the right, preferred route first."""
+        target_column = self.column_x(target.column)
+        source_column = self.column_x(source.column + 1)
+
+        if source.host is not None:
+            # Boundary event - down into the gap below the activity, then to the target column
+            gap = source.cell_bottom
+            return [[(source.cx, source.bottom), (source.cx, gap), (target_column, gap), (target_column, target.cy), (target.x, target.cy)]]
+
+        if source.cy == target.cy:
+            return [
+                [(source.right, source.cy), (target.x, target.cy)],
+                # Around shapes in between, through the gap below the row
+                [(source.right, source.cy), (source_column, source.cy), (source_column, source.cell_bottom),
+                 (target_column, source.cell_bottom), (target_column, target.cy), (target.x, target.cy)],
+            ]
+
+        candidates = []
+        if source.is_gateway:
+            # Split - leave the gateway from the top or bottom corner towards the branch
+            start_y = source.bottom if target.cy > source.cy else source.y
+            candidates.append([(source.cx, start_y), (source.cx, target.cy), (target.x, target.cy)])
+        if target.is_gateway:
+            # Join - enter the gateway from the top or bottom corner
+            end_y = target.y if source.cy < target.cy else target.bottom
+            candidates.append([(source.right, source.cy), (target.cx, source.cy), (target.cx, end_y)])
+
+        # Vertical segment just before the target column or just after the source column
+        candidates.append([(source.right, source.cy), (target_column, source.cy), (target_column, target.cy), (target.x, target.cy)])
+        candidates.append([(source.right, source.cy), (source_column, source.cy), (source_column, target.cy), (target.x, target.cy)])
+
+        # Around shapes in between, through the gap next to the target row or next to the source row
+        for gap in ((target.cell_top, source.cell_bottom) if target.cy > source.cy else (target.cell_bottom, source.cell_top)):
+            candidates.append([(source.right, source.cy), (source_column, source.cy), (source_column, gap),
+                               (target_column, gap), (target_column, target.cy), (target.x, target.cy)])
+        return candidates
+
+    def _crossings(self, points, source, target):
+        """Count shapes (other than the connected ones) that a route passes through."""
+        ignored = {source.id, target.id}
+        if source.host is not None:
+            ignored.add(source.host.id)
+
+        count = 0
+        for (x1, y1), (x2, y2) in zip(points, points[1:]):
+            left, right, top, bottom = min(x1, x2), max(x1, x2), min(y1, y2), max(y1, y2)
+            for shape in self.shapes.values():
+                if shape.id in ignored:
+                    continue
+                if left < shape.right and right > shape.x and top < shape.bottom and bottom > shape.y:
+                    count += 1
+        return count
+
+    @staticmethod
+    def _channel_offset(channels, gap):
+        """Alternate loop edges sharing a gap around its middle: 0, +8, -8, +16, -16, ..."""
+        count = channels.get(gap, 0)
+        channels[gap] = count + 1
+        step = (count + 1) // 2 * LOOP_SPACING
+        return step if count % 2 else -step
+
+
+def _simplify(points):
+    """Remove duplicate and collinear waypoints."""
+    result = []
+    for point in points:
+        if result and result[-1] == point:
+            continue
+        if len(result) >= 2:
+            (x1, y1), (x2, y2) = result[-2], result[-1]
+            if (x1 == x2 == point[0]) or (y1 == y2 == point[1]):
+                result[-1] = point
+                continue
+        result.append(point)
+    return result
+
+def _add_bounds(parent, x, y, width, height):
+    ET.SubElement(parent, qname(DC_NS, "Bounds"), x=str(int(x)), y=str(int(y)), width=str(int(width)), height=str(int(height)))
+
+def _add_shape(plane, element_id, x, y, width, height, **attributes):
+    shape = ET.SubElement(plane, qname(BPMN_DI_NS, "BPMNShape"), id=f"{element_id}_di", bpmnElement=element_id, **attributes)
+    _add_bounds(shape, x, y, width, height)
+    return shape
+
+def _add_edge(plane, element_id, points, name=""):
+    edge = ET.SubElement(plane, qname(BPMN_DI_NS, "BPMNEdge"), id=f"{element_id}_di", bpmnElement=element_id)
+    for x, y in points:
+        ET.SubElement(edge, qname(DI_NS, "waypoint"), x=str(int(x)), y=str(int(y)))
+    if name:
+        # Label next to the middle of the first segment
+        (x1, y1), (x2, y2) = points[0], points[1]
+        width, height = label_size(name)
+        label = ET.SubElement(edge, qname(BPMN_DI_NS, "BPMNLabel"))
+        _add_bounds(label, (x1 + x2) // 2 + 4, (y1 + y2) // 2 - height - 2, width, height)
+    return edge
+
+def _add_node_shape(plane, shape):
+    attributes = {"isMarkerVisible": "true"} if shape.kind == "exclusiveGateway" else {}
+    element = _add_shape(plane, shape.id, shape.x, shape.y, shape.width, shape.height, **attributes)
+
+    # Events and gateways have external labels - events below, gateways above the shape
+    if shape.name and shape.kind != "boundaryEvent" and (shape.kind.endswith("Event") or shape.is_gateway):
+        width, height = label_size(shape.name)
+        label_y = shape.bottom + 7 if shape.kind.endswith("Event") else shape.y - height - 5
+        label = ET.SubElement(element, qname(BPMN_DI_NS, "BPMNLabel"))
+        _add_bounds(label, shape.cx - width // 2, label_y, width, height)
+
+def add_node_shape(plane, element_id, kind, name, x, y):
+    """
+    Draw a flow node at the given position, with the external label of events and gateways.
+    Used when an element is added to a diagram whose layout is kept. Returns the BPMNShape element.
+    """
+    shape = Shape(element_id, kind, name)
+    shape.x, shape.y = x, y
+    _add_node_shape(plane, shape)
+    return plane[-1]
+
+def add_flow_edge(plane, flow_id, source, target, name=""):
+    """
+    Draw a sequence flow between two shapes that are already placed, given as (x, y, width, height).
+    Used when a flow is added to a diagram whose layout is kept: forward flows leave the source
+    on the right and enter the target on the left, backward flows run below both shapes.
+    """
+    sx, sy, sw, sh = source
+    tx, ty, tw, th = target
+    if tx >= sx + sw:
+        middle = (sx + sw + tx) // 2
+        points = [(sx + sw, sy + sh // 2), (middle, sy + sh // 2), (middle, ty + th // 2), (tx, ty + th // 2)]
+    else:
+        below = max(sy + sh, ty + th) + ROW_HEIGHT // 4
+        points = [(sx + sw // 2, sy + sh), (sx + sw // 2, below), (tx + tw // 2, below), (tx + tw // 2, ty + th)]
+    return _add_edge(plane, flow_id, _simplify(points), name)
+
+
+def parse_document(xml_text):
+    """Parse BPMN XML and register its namespace prefixes so that they are kept on output."""
+    for _, (prefix, uri) in ET.iterparse(io.StringIO(xml_text), events=("start-ns",)):
+        if prefix and prefix not in NAMESPACE_PREFIXES:
+            ET.register_namespace(prefix, uri)
+    return ET.fromstring(xml_text)
+
+def layout_bpmn(xml_text):
+    """
+    Compute the diagram (DI) section for a BPMN document and return the complete document.
+    An existing diagram section is replaced. Raises LayoutError if there is no process.
+    """
+    try:
+        root = parse_document(xml_text)
+    except ET.ParseError as e:
+        raise LayoutError(f"Malformed XML: {str(e)}")
+    return layout_tree(root)
+
+def layout_tree(root):
+    """Like layout_bpmn, for an already parsed document (root element of ElementTree)."""
+    processes = {process.get("id"): process for process in root.findall(qname(BPMN_MODEL_NS, "process"))}
+    if not processes:
+        raise LayoutError("Document has no process")
+
+    for diagram in root.findall(qname(BPMN_DI_NS, "BPMNDiagram")):
+        root.remove(diagram)
+
+    collaboration = root.find(qname(BPMN_MODEL_NS, "collaboration"))
+    participants = collaboration.findall(qname(BPMN_MODEL_NS, "participant")) if collaboration is not None else []
+
+    # Pools in collaboration order, processes without a pool are drawn without one
+    pools = [PoolLayout(processes[p.get("processRef")], p.get("id")) for p in participants if p.get("processRef") in processes]
+    drawn = {pool.process.get("id") for pool in pools}
+    pools += [PoolLayout(process) for process_id, process in processes.items() if process_id not in drawn]
+
+    diagram = ET.SubElement(root, qname(BPMN_DI_NS, "BPMNDiagram"), id="BPMNDiagram_1")
+    plane_element = collaboration.get("id") if collaboration is not None and collaboration.get("id") else pools[0].process.get("id")
+    plane = ET.SubElement(diagram, qname(BPMN_DI_NS, "BPMNPlane"), id="BPMNPlane_1", bpmnElement=plane_element)
+
+    y = POOL_Y
+    for pool in pools:
+        width, height = pool.layout(POOL_X, y)
+        if pool.participant_id:
+            element = _add_shape(plane, pool.participant_id, POOL_X, y, width, height, isHorizontal="true")
+            ET.SubElement(element, qname(BPMN_DI_NS, "BPMNLabel"))
+        for (lane_id, _), bounds in zip(pool.lanes, pool.lane_bounds):
+            element = _add_shape(plane, lane_id, *bounds, isHorizontal="true")
+            ET.SubElement(element, qname(BPMN_DI_NS, "BPMNLabel"))
+        y += height + POOL_GAP
+
+    # Shapes first, then edges, so edges are drawn on top
+    for pool in pools:
+        for shape in pool.shapes.values():
+            _add_node_shape(plane, shape)
+
+    for pool in pools:
+        channels = {}
+        for flow_id, source_id, target_id, name in pool.flows:
+            points = pool.route(flow_id, pool.shapes[source_id], pool.shapes[target_id], channels)
+            _add_edge(plane, flow_id, _simplify(points), name)
+
+    if collaboration is not None:
+        _add_message_flows(plane, collaboration, pools)
+
+    ET.indent(root, space="  ")
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding="unicode")
+
+def _add_message_flows(plane, collaboration, pools):
+    """Route message flows between pools as vertical connections with one horizontal jog."""
+    bounds = {}
+    for pool in pools:
+        if pool.participant_id:
+            bounds[pool.participant_id] = pool.bounds
+        for shape in pool.shapes.values():
+            bounds[shape.id] = (shape.x, shape.y, shape.width, shape.height)
+
+    for flow in collaboration.findall(qname(BPMN_MODEL_NS, "messageFlow")):
+        source, target = bounds.get(flow.get("sourceRef")), bounds.get(flow.get("targetRef"))
+        if not flow.get("id") or source is None or target is None:
+            continue
+        sx, tx = source[0] + source[2] // 2, target[0] + target[2] // 2
+        if source[1] < target[1]:
+            start_y, end_y = source[1] + source[3], target[1]
+        else:
+            start_y, end_y = source[1], target[1] + target[3]
+        middle_y = (start_y + end_y) // 2
+        _add_edge(plane, flow.get("id"), _simplify([(sx, start_y), (sx, middle_y), (tx, middle_y), (tx, end_y)]), flow.get("name") or "")
+
+
+for _prefix, _uri in NAMESPACE_PREFIXES.items():
+    ET.register_namespace(_prefix, _uri)
@@ -0,0 +1,96 @@
+"""
+Structured logging of the application: one JSON object per line with the id of the request.
+
+The request id is kept in a context variable - app.py sets it for every HTTP request (from the
+X-Request-ID header or a new one) and background jobs carry the id of the request that
+submitted them, so all lines of one generation can be found in the logs. Fields passed in
+extra={...} are added to the JSON object.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import contextvars
+
+# Id of the request handled in the current context
+_request_id = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has - anything else was passed in extra and is logged as a field
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+
+def new_request_id():
+    """Return a new random request id."""
+    return uuid.uuid4().hex[:16]
+
+def set_request_id(request_id):
+    """Set the request id of the current context (None clears it)."""
+    _request_id.set(request_id)
+    return request_id
+
+def current_request_id():
+    """Return the request id of the current context, or None outside of a request."""
+    return _request_id.get()
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds the request id of the current context to every record."""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+class StdoutHandler(logging.StreamHandler):
+    """Writes to the current sys.stdout, also when it is redirected after the logging is configured."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one line of JSON with time, level, logger, message, request id and extra fields."""
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level=None, json_format=None):
+    """
+    Send application logs to stdout, as JSON lines or (LOG_FORMAT=text) as plain "LEVEL: message" lines.
+    Safe to call more than once - the handler is replaced, not added again.
+    """
+    level = (level or os.getenv("LOG_LEVEL", "info")).upper()
+    if json_format is None:
+        json_format = os.getenv("LOG_FORMAT", "json") != "text"
+
+    handler = StdoutHandler()
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(JsonFormatter() if json_format else logging.Formatter("%(levelname)s: %(message)s"))
+    handler.processflow = True
+
+    root = logging.getLogger()
+    for existing in [item for item in root.handlers if getattr(item, "processflow", False)]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
@@ -1,7 +1,26 @@
 import os
+import re
+import time
 import logging
+import queue
+import threading
+import contextlib
+import contextvars
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from anthropic import Anthropic, AnthropicError
+from anthropic import Anthropic, AnthropicError, NOT_GIVEN, DefaultHttpxClient
+from result_cache import ResultCache, make_cache_key
+from scheduler import ModelCallScheduler, FirstTokenTimeout, parse_hedge_models
+from admission import AdmissionController, AdmissionRejected, estimate_input_tokens
+from token_budget import TokenBudgetPredictor, count_features
+from metrics import Metrics
+from prompts import PromptRegistry, DEFAULT_VARIANT, CUSTOM_VARIANT
+from stream_validator import IncrementalBpmnValidator, IncrementalDslValidator, StreamValidationError
+import layout
+import process_dsl
+import refine
+import decompose
 
 load_dotenv()
 
@@ -13,33 +32,53 @@ AVAILABLE_MODELS = [
     {
         "id": "claude-3-7-sonnet-20250219", 
         "name": "Sonnet 3.7",
+        "fallback": ["claude-3-5-sonnet-20241022"],  # models tried when this one is overloaded or failing
+        "max_output_tokens": 64000,  # output token limit of one API call
+        "rate_limits": {"requests": 50, "input-tokens": 20000, "output-tokens": 8000},  # per minute, adjusted to the API response headers
         "pricing": {
             "input": 0.000003,  # $ per token for input text
-            "output": 0.000015  # $ per token for output generation
+            "output": 0.000015,  # $ per token for output generation
+            "cache_write": 0.00000375,  # $ per token written to prompt cache (1.25x input)
+            "cache_read": 0.0000003  # $ per token read from prompt cache (0.1x input)
         }
     },
     {
         "id": "claude-3-opus-20240229", 
         "name": "Opus 3",
+        "fallback": ["claude-3-7-sonnet-20250219"],
+        "max_output_tokens": 4096,
+        "rate_limits": {"requests": 50, "input-tokens": 20000, "output-tokens": 4000},
         "pricing": {
             "input": 0.000015,
-            "output": 0.000075
+            "output": 0.000075,
+            "cache_write": 0.00001875,
+            "cache_read": 0.0000015
         }
     },
     {
         "id": "claude-3-5-sonnet-20241022", 
         "name": "Sonnet 3.5",
+        "fallback": ["claude-3-7-sonnet-20250219"],
+        "max_output_tokens": 8192,
+        "rate_limits": {"requests": 50, "input-tokens": 40000, "output-tokens": 8000},
         "pricing": {
             "input": 0.000003,
-            "output": 0.000015
+            "output": 0.000015,
+            "cache_write": 0.00000375,
+            "cache_read": 0.0000003
         }
     },
     {
         "id": "claude-3-5-haiku-20241022", 
         "name": "Haiku 3.5",
+        "fallback": ["claude-3-5-sonnet-20241022"],
+        "max_output_tokens": 8192,
+        "rate_limits": {"requests": 50, "input-tokens": 50000, "output-tokens": 10000},
         "pricing": {
             "input": 0.0000008,
-            "output": 0.000004
+            "output": 0.000004,
+            "cache_write": 0.000001,
+            "cache_read": 0.00000008
         }
     },
 ]
@@ -47,14 +86,135 @@ AVAILABLE_MODELS = [
 # Default model (first in list)
 DEFAULT_MODEL = AVAILABLE_MODELS[0]["id"]
 
+# Directory of the application and of its SQLite databases - the default paths do not depend on the working
+# directory of the server, and the databases are created on first use (importing this module writes nothing)
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(APP_DIR, "cache"))
+
+# Admission control - model calls wait in a queue while the rate limits of the account are used up,
+# the buckets follow the anthropic-ratelimit-* headers of the responses
+ADMISSION = AdmissionController(
+    db_path=os.getenv("ADMISSION_DB", os.path.join(DATA_DIR, "admission.sqlite3")),
+    limits={m["id"]: m["rate_limits"] for m in AVAILABLE_MODELS if m.get("rate_limits")},
+    max_wait=float(os.getenv("ADMISSION_MAX_WAIT")) if os.getenv("ADMISSION_MAX_WAIT") else None,
+    enabled=os.getenv("ADMISSION_ENABLED", "1") != "0"
+)
+
+# Scheduling of model calls - retries with backoff, timeouts from observed latency, hedged requests
+# (only for the models in HEDGE_MODELS, e.g. "claude-3-7-sonnet-20250219=claude-3-5-haiku-20241022")
+# and fallback to the models listed in "fallback" when a model is overloaded or keeps failing
+SCHEDULER = ModelCallScheduler(
+    fallbacks={m["id"]: m.get("fallback", []) for m in AVAILABLE_MODELS} if os.getenv("MODEL_FALLBACK_ENABLED", "1") != "0" else {},
+    hedge_models=parse_hedge_models(os.getenv("HEDGE_MODELS", "")),
+    attempts_per_model=int(os.getenv("MODEL_ATTEMPTS_PER_MODEL", 2)),
+    max_attempts=int(os.getenv("MODEL_MAX_ATTEMPTS", 4)),
+    first_token_timeout=float(os.getenv("MODEL_FIRST_TOKEN_TIMEOUT", 60)),
+    stream_idle_timeout=float(os.getenv("MODEL_STREAM_IDLE_TIMEOUT", 60)),
+    hedge_delay=float(os.getenv("HEDGE_DELAY", 10)),
+    hedge_percentile=float(os.getenv("HEDGE_PERCENTILE", 95)),
+    on_response=ADMISSION.update_from_headers,
+    admission=ADMISSION
+)
+
+# Prediction of max_tokens from the process description and past generations, used when no limit is given
+TOKEN_PREDICTOR = TokenBudgetPredictor(
+    db_path=os.getenv("TOKEN_HISTORY_DB", os.path.join(DATA_DIR, "token_history.sqlite3")),
+    margin=float(os.getenv("TOKEN_PREDICTION_MARGIN", 1.2)),
+    max_tokens=int(os.getenv("TOKEN_PREDICTION_MAX", 32000)),
+    enabled=os.getenv("TOKEN_PREDICTION_ENABLED", "1") != "0"
+)
+
+# Continuation of responses cut off by max_tokens - the partial response is sent back as the start
+# of the answer and the model continues it, until the total output reaches the budget
+MAX_CONTINUATIONS = int(os.getenv("MAX_CONTINUATIONS", 3))
+CONTINUATION_TOKEN_BUDGET = int(os.getenv("CONTINUATION_TOKEN_BUDGET", 32000))
+
+# Seconds between "queued" events of a call waiting for admission
+QUEUE_EVENT_INTERVAL = 1.0
+
+# Prometheus metrics - latency of request stages, tokens, cost and errors per model; the values of all
+# server processes are shared through SQLite (METRICS_DB set to an empty value keeps them per process)
+METRICS = Metrics(db_path=os.getenv("METRICS_DB", os.path.join(DATA_DIR, "metrics.sqlite3")) or None)
+
+# Cache of generated diagrams - repeated descriptions are served without calling the API
+RESULT_CACHE = ResultCache(
+    db_path=os.getenv("RESULT_CACHE_DB", os.path.join(DATA_DIR, "results.sqlite3")),
+    memory_entries=int(os.getenv("RESULT_CACHE_MEMORY_ENTRIES", 128)),
+    max_disk_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", 200 * 1024 * 1024)),
+    ttl=int(os.getenv("RESULT_CACHE_TTL", 7 * 24 * 3600)),
+    enabled=os.getenv("RESULT_CACHE_ENABLED", "1") != "0"
+)
+
+# Generation modes and their system prompts (file names relative to the application directory):
+# "full" - the model writes the whole document including diagram coordinates (default)
+# "semantic" - the model writes only the process model, diagram layout is computed by layout.py
+# "dsl" - the model writes the compact process format (process_dsl.py), compiled to BPMN XML on the server
+# "parallel" - large processes are split into segments generated concurrently in the compact format (decompose.py)
+SYSTEM_PROMPT_FILES = {
+    "full": "system_prompt.txt",
+    "semantic": "system_prompt_semantic.txt",
+    "dsl": "system_prompt_dsl.txt",
+    "parallel": "system_prompt_segment.txt",
+}
+GENERATION_MODES = tuple(SYSTEM_PROMPT_FILES)
+DEFAULT_GENERATION_MODE = os.getenv("GENERATION_MODE", "full")
+
+# Named variants of the system prompts of the generation modes (prompts/<mode>/<variant>.txt, prompts.py),
+# selectable per request - PROMPT_VARIANT is the variant used when a request does not choose one
+PROMPTS = PromptRegistry(
+    APP_DIR,
+    SYSTEM_PROMPT_FILES,
+    default_variant=os.getenv("PROMPT_VARIANT", DEFAULT_VARIANT)
+)
+
+# System prompt for refinement of an existing diagram - the model answers with edit operations (refine.py)
+REFINE_PROMPT_FILE = "system_prompt_refine.txt"
+
+# Decomposition of large processes ("parallel" mode) - a planning call on a cheap model splits descriptions
+# with at least DECOMPOSE_MIN_STEPS steps into segments, at most DECOMPOSE_MAX_PARALLEL are generated at once
+PLAN_PROMPT_FILE = "system_prompt_plan.txt"
+PLAN_MODEL = os.getenv("PLAN_MODEL", "claude-3-5-haiku-20241022")
+DECOMPOSE_MIN_STEPS = int(os.getenv("DECOMPOSE_MIN_STEPS", 20))
+DECOMPOSE_MAX_PARALLEL = int(os.getenv("DECOMPOSE_MAX_PARALLEL", 6))
+
+# Print every validated BPMN document to stdout - for debugging only, it is heavy log output under load
+DEBUG_BPMN_OUTPUT = os.getenv("BPMN_DEBUG_OUTPUT", "0") == "1"
+
 def get_available_models():
     """Return models for UI display"""
     return AVAILABLE_MODELS
 
-def calculate_cost(model_id, input_tokens, output_tokens):
+def generation_options(generation_mode):
+    """Return generate_bpmn_from_text arguments (besides the system prompt) for a generation mode."""
+    return {
+        "auto_layout": generation_mode == "semantic",
+        "output_format": "dsl" if generation_mode in ("dsl", "parallel") else "xml",
+        "parallel": generation_mode == "parallel",
+    }
+
+def compose_refinement_input(text, previous_description):
+    """Compose the user message of a refinement: current diagram in the compact format and the new description."""
+    return f"""AKTUÁLNY MODEL:
+{previous_description}
+NOVÝ OPIS PROCESU:
+{text}"""
+
+def compose_text_input(input_mode, simple_text='', process_name='', process_flow=''):
+    """Format user input into the text sent to the AI model for the given input mode."""
+    if input_mode == 'SIMPLE':
+        # Format for SIMPLE mode - just prefix with a label
+        return f"Process Description:\n{simple_text}"
+    
+    # Format for STRUCTURED mode - includes both name and flow with labels
+    text_input = f"Process Name: {process_name}\n\n"
+    text_input += f"Process Flow:\n{process_flow}"
+    return text_input
+
+def calculate_cost(model_id, input_tokens, output_tokens, cache_creation_tokens=0, cache_read_tokens=0):
     """
     Calculate the cost of API usage based on token counts in USD.
     Uses the pricing information from the model definitions.
+    input_tokens are the uncached input tokens, prompt cache writes and reads are priced separately.
     """
     # Find the model in AVAILABLE_MODELS
     model_info = next((model for model in AVAILABLE_MODELS if model["id"] == model_id), None)
@@ -68,7 +228,8 @@ def calculate_cost(model_id, input_tokens, output_tokens):
     # Calculate costs in USD
     input_cost_usd = input_tokens * pricing["input"]
     output_cost_usd = output_tokens * pricing["output"]
-    total_cost_usd = input_cost_usd + output_cost_usd
+    cache_cost_usd = cache_creation_tokens * pricing["cache_write"] + cache_read_tokens * pricing["cache_read"]
+    total_cost_usd = input_cost_usd + output_cost_usd + cache_cost_usd
     
     return total_cost_usd
 
@@ -76,153 +237,981 @@ def init_client():
     """
     Initialize the Anthropic client with API key from environment variables.
     Raises an error if the API key is not set.
+    The HTTP connection pool keeps connections alive, so following requests skip TCP/TLS setup.
     """
     api_key = os.getenv("ANTHROPIC_API_KEY")
     if not api_key:
-        print("ERROR: Missing API key")
+        logger.error("Missing API key")
         raise ValueError("ANTHROPIC_API_KEY environment variable is not set")
-    return Anthropic(api_key=api_key)
+    
+    http_client = DefaultHttpxClient(
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("ANTHROPIC_MAX_CONNECTIONS", 100)),
+            max_keepalive_connections=int(os.getenv("ANTHROPIC_MAX_KEEPALIVE", 20)),
+            keepalive_expiry=float(os.getenv("ANTHROPIC_KEEPALIVE_EXPIRY", 60))
+        )
+    )
+    # Optional custom endpoint, e.g. a local fake API server for batch and benchmark runs
+    base_url = os.getenv("ANTHROPIC_BASE_URL") or None
+    return Anthropic(api_key=api_key, base_url=base_url, http_client=http_client)
+
+# Process-wide client shared by all requests and threads (the Anthropic client is thread-safe)
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the process-wide Anthropic client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = init_client()
+                logger.info("Anthropic client initialized")
+    return _client
+
+def set_client(client):
+    """
+    Replace the process-wide Anthropic client, e.g. with a client using fake_api.ReplayTransport
+    for benchmarks and offline runs. Passing None makes the next request create a real client again.
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+# Loaded system prompts by path: path -> (modification time, content)
+_system_prompts = {}
+_system_prompts_lock = threading.Lock()
 
 def load_system_prompt(system_prompt_file):
     """
     Load system prompt from file if available.
     The system prompt contains instructions for the AI model on how to generate BPMN.
+    The content is kept in memory and read from disk again only when the file's modification time changes.
     """
     system_prompt = None
     if system_prompt_file:
         try:
             if os.path.exists(system_prompt_file):
-                with open(system_prompt_file, 'r', encoding='utf-8') as f:
-                    system_prompt = f.read()
-                print("INFO: System prompt loaded")
+                mtime = os.path.getmtime(system_prompt_file)
+                cached = _system_prompts.get(system_prompt_file)
+                if cached and cached[0] == mtime:
+                    return cached[1]
+                
+                with _system_prompts_lock:
+                    with open(system_prompt_file, 'r', encoding='utf-8') as f:
+                        system_prompt = f.read()
+                    _system_prompts[system_prompt_file] = (mtime, system_prompt)
+                logger.info(f"System prompt loaded: {system_prompt_file}")
             else:
-                print(f"WARNING: System prompt file not found: {system_prompt_file}")
+                logger.warning(f"System prompt file not found: {system_prompt_file}")
         except Exception as e:
-            print(f"ERROR: Error loading system prompt: {str(e)}")
+            logger.error(f"Error loading system prompt: {str(e)}")
     return system_prompt
 
-def validate_bpmn_content(content, model):
+class BpmnValidationError(ValueError):
+    """
+    Raised when the model response is not a usable BPMN document.
+    Subclass of ValueError with the same "model_problem:" message format, so callers
+    can tell validation failures apart from API errors.
+    """
+
+
+# Messages shown to the user when the model response is not usable
+PROBLEM_MESSAGE = "The selected AI model could not create the process model. We recommend switch to better available AI model or to specify process flow."
+MAX_TOKENS_MESSAGE = "Due to the low amount of 'Max Tokens' selected AI model cold not create process model. We recommend to increse the 'Max Tokens' limit."
+INVALID_STRUCTURE_MESSAGE = "The selected AI model created an invalid process model ({reason}). Please try again or switch to better available AI model."
+INVALID_EDITS_MESSAGE = "The selected AI model returned changes that cannot be applied to the current diagram ({reason}). Please try again or generate a new diagram."
+REFINE_SOURCE_MESSAGE = "The current diagram cannot be refined ({reason}). Please generate a new diagram."
+TIMEOUT_MESSAGE = "The AI model did not respond in time. Please try again in a few minutes or consider using a different model."
+OVERLOADED_MESSAGE = "The Anthropic API is currently overloaded. Please try again in a few minutes or consider using a different model."
+MODEL_NOT_FOUND_MESSAGE = "Model '{model}' not available. Check if you entered the correct model name."
+RATE_LIMITED_MESSAGE = "The rate limit of the Anthropic API for the selected AI model was reached. Please try again in a minute or consider using a different model."
+ADMISSION_REJECTED_MESSAGE = "Too many generations are waiting for the selected AI model (waited {wait} s). Please try again later or consider using a different model."
+API_ERROR_MESSAGE = "An error with API occurred during generation."
+UNEXPECTED_MESSAGE = "Unexpected error during generation."
+
+# Error classes reported in metrics, by the start of the user-facing message
+ERROR_CLASSES = (
+    (PROBLEM_MESSAGE, "problem"),
+    (MAX_TOKENS_MESSAGE, "max_tokens"),
+    (INVALID_STRUCTURE_MESSAGE.split("(")[0], "invalid_structure"),
+    (INVALID_EDITS_MESSAGE.split("(")[0], "invalid_edits"),
+    (REFINE_SOURCE_MESSAGE.split("(")[0], "refine_source"),
+    (TIMEOUT_MESSAGE, "timeout"),
+    (OVERLOADED_MESSAGE, "overloaded"),
+    (MODEL_NOT_FOUND_MESSAGE.split("'")[0], "model_not_found"),
+    (RATE_LIMITED_MESSAGE, "rate_limited"),
+    (ADMISSION_REJECTED_MESSAGE.split("(")[0], "admission_rejected"),
+    (API_ERROR_MESSAGE, "api_error"),
+)
+
+def problem_reason(error):
+    """
+    Reason of a parser or validator error for the messages above: one line, and sentence ends inside
+    it become semicolons, so the reason stays within its sentence when the message is split into
+    sentences (app.format_message_by_sentences).
+    """
+    reason = " ".join(str(error).split())
+    return re.sub(r"[.!?]+(\s|$)", r";\1", reason).strip().rstrip(";")
+
+def error_class(error):
+    """Return the class of a generation error for metrics ("problem", "max_tokens", "timeout", ...)."""
+    message = str(error)
+    if not message.startswith("model_problem:"):
+        return "unexpected"
+    message = message.split(":", 1)[1]
+    return next((name for prefix, name in ERROR_CLASSES if message.startswith(prefix)), "unexpected")
+
+def validate_bpmn_content(content, model, debug=None):
     """
     Validate BPMN content and check for common issues.
     Ensures the generated XML is complete and handles error cases.
+    The validated document is printed only with debug=True (default: BPMN_DEBUG_OUTPUT environment variable).
     """
     content = content.strip()
-
-    # print(50*'=')
-    # print("BPMN CONTENT RECEIVED:")
-    # print(content)
-    # print(50*'=')
     
     # CASE 1: Detect "PROBLÉM" message - model can't create diagram
     if "PROBLÉM" in content:
-        problem_msg = "The selected AI model could not create the process model. We recommend switch to better available AI model or to specify process flow."
-        print(f"ERROR: {problem_msg}")
-        raise ValueError(f"model_problem:{problem_msg}")
+        logger.error(f"{PROBLEM_MESSAGE}")
+        raise BpmnValidationError(f"model_problem:{PROBLEM_MESSAGE}")
     
     # CASE 2: Diagram is not complete
-    if '</bpmn:definitions>' not in content and '</definitions>' not in content:
-        problem_msg = "Due to the low amount of 'Max Tokens' selected AI model cold not create process model. We recommend to increse the 'Max Tokens' limit."
-        print(f"ERROR: {problem_msg}")
-        raise ValueError(f"model_problem:{problem_msg}")
+    # The end tag could be either </bpmn:definitions> or </definitions>
+    end_tag = '</bpmn:definitions>'
+    end_position = content.find(end_tag)
+    if end_position == -1:
+        end_tag = '</definitions>'
+        end_position = content.find(end_tag)
+    if end_position == -1:
+        logger.error(f"{MAX_TOKENS_MESSAGE}")
+        raise BpmnValidationError(f"model_problem:{MAX_TOKENS_MESSAGE}")
     
     # ONLY BPMN code allowed
-    # Extract content from XML declaration to end of definitions
-    xml_start = content.find('<?xml version="1.0" encoding="UTF-8"?>')
-    
-    # Find the end tag - could be either </bpmn:definitions> or </definitions>
-    if '</bpmn:definitions>' in content:
-        xml_end = content.find('</bpmn:definitions>') + len('</bpmn:definitions>')
-    else:
-        xml_end = content.find('</definitions>') + len('</definitions>')
+    # Extract content from XML declaration (or the root element if it is missing) to end of definitions
+    xml_start = content.find('<?xml version="1.0" encoding="UTF-8"?>', 0, end_position)
+    if xml_start == -1:
+        xml_start = max(content.rfind('<bpmn:definitions', 0, end_position), content.rfind('<definitions', 0, end_position), 0)
     
     # Extract only the BPMN XML content
-    content = content[xml_start:xml_end]
+    content = content[xml_start:end_position + len(end_tag)]
+
+    if DEBUG_BPMN_OUTPUT if debug is None else debug:
+        logger.info(f"VALIDATED BPMN CONTENT:\n{content}")
+    
+    return content
+
+def stream_validation_error(error):
+    """Translate a StreamValidationError into the BpmnValidationError shown to the user."""
+    if error.problem:
+        logger.error(f"{PROBLEM_MESSAGE}")
+        return BpmnValidationError(f"model_problem:{PROBLEM_MESSAGE}")
+    
+    logger.error(f"Invalid BPMN structure: {str(error)}")
+    return BpmnValidationError(f"model_problem:{INVALID_STRUCTURE_MESSAGE.format(reason=problem_reason(error))}")
+
+def apply_layout(content):
+    """
+    Compute the diagram section of a document generated in the "semantic" mode.
+    Documents that cannot be laid out are reported the same way as invalid model output.
+    """
+    start_time = time.perf_counter()
+    try:
+        content = layout.layout_bpmn(content)
+    except layout.LayoutError as e:
+        logger.error(f"Layout failed: {str(e)}")
+        raise BpmnValidationError(f"model_problem:{INVALID_STRUCTURE_MESSAGE.format(reason=problem_reason(e))}")
+    
+    logger.info(f"Layout computed in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+    return content
+
+def check_line_response(content, stop_reason):
+    """Common checks of line-based responses (compact process format, edit operations)."""
+    if "PROBLÉM" in content:
+        logger.error(f"{PROBLEM_MESSAGE}")
+        raise BpmnValidationError(f"model_problem:{PROBLEM_MESSAGE}")
+    
+    # A cut off answer may still parse, so the stop reason is checked explicitly
+    if stop_reason == "max_tokens":
+        logger.error(f"{MAX_TOKENS_MESSAGE}")
+        raise BpmnValidationError(f"model_problem:{MAX_TOKENS_MESSAGE}")
+
+def compile_dsl_response(content, stop_reason, debug=None, with_layout=True):
+    """
+    Compile a response in the compact process format ("dsl" mode) into a BPMN document.
+    The diagram section is computed by layout.py - not for segments of a parallel generation, which
+    are merged and laid out as a whole. Invalid descriptions are reported like invalid BPMN.
+    """
+    content = content.strip()
+    check_line_response(content, stop_reason)
+    
+    start_time = time.perf_counter()
+    try:
+        bpmn_content = process_dsl.compile_dsl(content, with_layout=with_layout)
+    except (process_dsl.DslError, layout.LayoutError) as e:
+        logger.error(f"Invalid process description: {str(e)}")
+        raise BpmnValidationError(f"model_problem:{INVALID_STRUCTURE_MESSAGE.format(reason=problem_reason(e))}")
+    
+    logger.info(f"Process description compiled in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+    if DEBUG_BPMN_OUTPUT if debug is None else debug:
+        logger.info(f"COMPILED PROCESS DESCRIPTION:\n{content}")
+    
+    return bpmn_content
 
-    print(50*'=')
-    print("VALIDATED BPMN CONTENT:")
-    print(content)
-    print(50*'=')
+def apply_edit_response(previous_bpmn, content, stop_reason, debug=None):
+    """
+    Apply a refinement response (edit operations of refine.py) to the previous diagram.
+    Operations that do not fit the diagram are reported like invalid model output.
+    """
+    content = content.strip()
+    check_line_response(content, stop_reason)
+    
+    start_time = time.perf_counter()
+    try:
+        operations = refine.parse_edits(content)
+        bpmn_content = refine.apply_edits(previous_bpmn, operations)
+    except process_dsl.DslError as e:
+        logger.error(f"Invalid edit operations: {str(e)}")
+        raise BpmnValidationError(f"model_problem:{INVALID_EDITS_MESSAGE.format(reason=problem_reason(e))}")
     
+    logger.info(f"{len(operations)} edit operations applied in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+    if DEBUG_BPMN_OUTPUT if debug is None else debug:
+        logger.info(f"APPLIED EDIT OPERATIONS:\n{content}")
+    
+    return bpmn_content
+
+def apply_cached_edits(cached_result, previous_bpmn):
+    """
+    Return a cached refinement result with its edit operations applied to previous_bpmn - the
+    cached document was made from a diagram with the same content, but maybe another layout.
+    Returns None (a cache miss) for entries without operations or operations that do not apply.
+    """
+    edits = cached_result.get("edits")
+    if not edits:
+        return None
+    try:
+        bpmn_content = apply_edit_response(previous_bpmn, edits, "end_turn", debug=False)
+    except BpmnValidationError as e:
+        logger.warning(f"Cached edit operations cannot be applied: {str(e)}")
+        return None
+    result = {name: value for name, value in cached_result.items() if name != "edits"}
+    return {**result, "bpmn_content": bpmn_content}
+
+def check_plan_response(content, stop_reason):
+    """
+    Check a decomposition plan ("parallel" mode) and return its text.
+    Plans with broken references between segments are reported like invalid model output.
+    """
+    content = content.strip()
+    check_line_response(content, stop_reason)
+
+    try:
+        decompose.parse_plan(content)
+    except process_dsl.DslError as e:
+        logger.error(f"Invalid decomposition plan: {str(e)}")
+        raise BpmnValidationError(f"model_problem:{INVALID_STRUCTURE_MESSAGE.format(reason=problem_reason(e))}")
+
     return content
 
-def generate_bpmn_from_text(text, system_prompt_file=None, model=None, temperature=0, max_tokens=10000):
+def build_system_blocks(system_prompt):
+    """
+    Build the system parameter for the API call.
+    The system prompt is fixed and long, so it is sent as a cacheable block - requests
+    within the cache lifetime read it from the prompt cache instead of processing it again.
+    """
+    if not system_prompt:
+        return NOT_GIVEN
+    return [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+
+# Token counts of a generation result, summed over continuations and segments
+USAGE_FIELDS = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+
+def usage_to_dict(usage):
+    """Extract token counts, including prompt cache writes and reads, from API usage object."""
+    return {
+        "input_tokens": usage.input_tokens,
+        "output_tokens": usage.output_tokens,
+        "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+        "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+    }
+
+def translate_api_error(e):
+    """
+    Translate an AnthropicError into the ValueError with "model_problem:" prefix
+    that the web layer knows how to display.
+    """
+    logger.error(f"API error: {str(e)}")
+    error_str = str(e).lower()
+    
+    # Model did not start writing in time (also after retries and fallback models)
+    if isinstance(e, FirstTokenTimeout):
+        return ValueError(f"model_problem:{TIMEOUT_MESSAGE}")
+    
+    # Check for overloaded error (error code 529)
+    if '529' in error_str and 'overloaded_error' in error_str:
+        logger.error("Anthropic API is currently overloaded. Please try again in a few minutes.")
+        return ValueError(f"model_problem:{OVERLOADED_MESSAGE}")
+    
+    # Rate limit of the account (error code 429), also after the retries of the scheduler
+    if '429' in error_str or 'rate_limit_error' in error_str:
+        return ValueError(f"model_problem:{RATE_LIMITED_MESSAGE}")
+    
+    # Incorrect model name
+    if '404' in error_str and 'not_found_error' in error_str and 'model:' in error_str:
+        # Extract the model name from the error message
+        model_name = error_str.split('model:', 1)[1].strip().rstrip('}').strip("'")
+        logger.error(f"Model '{model_name}' not available")
+        return ValueError(f"model_problem:{MODEL_NOT_FOUND_MESSAGE.format(model=model_name)}")
+    
+    # General API error - includes all other cases of AnthropicError
+    logger.error(f"General API error: {error_str}")
+    return ValueError(f"model_problem:{API_ERROR_MESSAGE}")
+
+def generate_bpmn_from_text(text, system_prompt_file=None, model=None, temperature=0, max_tokens=None, use_cache=True, force_cache=False, auto_layout=False, output_format="xml", previous_bpmn=None, client_id=None, parallel=False):
     """
     Generate BPMN diagram from text description using Claude API.
+    Runs the streaming generation to the end and returns only its result.
     
     Args:
         text: The process description text input
         system_prompt_file: Path to the system prompt file
         model: The AI model ID to use
         temperature: Creativity setting (0-1)
-        max_tokens: Maximum output tokens allowed
+        max_tokens: Maximum output tokens allowed per API call (None - predicted from the description)
+        use_cache: Serve a stored result if available (new results are stored either way)
+        force_cache: Serve cached result even for temperature above 0
+        auto_layout: Compute diagram layout with layout.py (for the "semantic" generation mode)
+        output_format: "xml" for BPMN XML responses, "dsl" for the compact process format of process_dsl.py
+        previous_bpmn: Current diagram to refine - the model returns only edit operations (refine.py)
+        client_id: Client (user, batch) the call is queued for when the rate limits are used up
+        parallel: Split a large process into segments generated concurrently (decompose.py)
         
     Returns:
-        Tuple of (bpmn_content, input_tokens, output_tokens, model_used)
+        Dictionary with bpmn_content, input_tokens, output_tokens, model, max_tokens, continuations and cached flag
+    """
+    # The streaming path validates the response while it arrives and stops bad generations early
+    for event in stream_bpmn_from_text(
+        text,
+        system_prompt_file=system_prompt_file,
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        use_cache=use_cache,
+        force_cache=force_cache,
+        auto_layout=auto_layout,
+        output_format=output_format,
+        previous_bpmn=previous_bpmn,
+        client_id=client_id,
+        parallel=parallel
+    ):
+        if event["event"] == "result":
+            result = dict(event)
+            del result["event"]
+            return result
+    
+    raise ValueError(f"model_problem:{UNEXPECTED_MESSAGE}")
+
+# Flow node tags counted as "elements" in streaming progress updates
+FLOW_NODE_TAGS = (
+    "task", "userTask", "serviceTask", "manualTask", "sendTask", "receiveTask",
+    "scriptTask", "businessRuleTask", "subProcess", "callActivity",
+    "startEvent", "endEvent", "intermediateCatchEvent", "intermediateThrowEvent", "boundaryEvent",
+    "exclusiveGateway", "parallelGateway", "inclusiveGateway", "eventBasedGateway", "complexGateway",
+)
+FLOW_NODE_PATTERN = re.compile(r'<(?:bpmn:)?(' + '|'.join(FLOW_NODE_TAGS) + r')\b[^>]*>')
+LANE_PATTERN = re.compile(r'<(?:bpmn:)?lane\b[^>]*?name="([^"]*)"[^>]*>')
+FLOW_PATTERN = re.compile(r'<(?:bpmn:)?sequenceFlow\b')
+DIAGRAM_PATTERN = re.compile(r'<(?:bpmndi:)?BPMNDiagram\b')
+
+# Rough characters-per-token ratio for BPMN XML, used only for the live token estimate
+CHARS_PER_TOKEN = 3.5
+
+
+class StreamProgress:
+    """
+    Tracks what the model has produced so far while the response streams in.
+    Only complete tags are scanned, each exactly once, so the cost per chunk
+    stays proportional to the chunk size and not to the whole document.
+    """
+
+    def __init__(self):
+        self.buffer = []
+        self.length = 0
+        self.scanned_text = ""
+        self.elements = 0
+        self.flows = 0
+        self.lanes = []
+        self.section = "process"
+
+    def feed(self, text):
+        """Add a streamed text chunk and update counters for all newly completed tags."""
+        self.buffer.append(text)
+        self.length += len(text)
+        
+        # Scan only up to the last complete tag, keep the rest for the next chunk
+        pending = self.scanned_text + text
+        last_close = pending.rfind('>')
+        if last_close == -1:
+            self.scanned_text = pending
+            return
+        
+        complete, self.scanned_text = pending[:last_close + 1], pending[last_close + 1:]
+        self.elements += len(FLOW_NODE_PATTERN.findall(complete))
+        self.flows += len(FLOW_PATTERN.findall(complete))
+        self.lanes.extend(LANE_PATTERN.findall(complete))
+        if DIAGRAM_PATTERN.search(complete):
+            self.section = "layout"
+
+    def text(self):
+        """Return the full text received so far."""
+        return "".join(self.buffer)
+
+    def snapshot(self, input_tokens=0):
+        """Return progress information suitable for sending to the browser."""
+        return {
+            "elements": self.elements,
+            "flows": self.flows,
+            "lanes": list(self.lanes),
+            "section": self.section,
+            "input_tokens": input_tokens,
+            "output_tokens": int(self.length / CHARS_PER_TOKEN),
+        }
+
+
+class DslStreamProgress(StreamProgress):
+    """StreamProgress for responses in the compact process format - counts complete lines instead of tags."""
+
+    def feed(self, text):
+        """Add a streamed text chunk and update counters for all newly completed lines."""
+        self.buffer.append(text)
+        self.length += len(text)
+        
+        *lines, self.scanned_text = (self.scanned_text + text).split("\n")
+        for line in lines:
+            self.feed_line(line.strip())
+
+    def feed_line(self, line):
+        keyword, _, rest = line.partition(" ")
+        if keyword == "lane":
+            self.lanes.append(rest.strip())
+        elif process_dsl.FLOW_LINE.match(line):
+            self.flows += len(process_dsl.FLOW_STEP.findall(line))
+        elif keyword.split(":", 1)[0] in process_dsl.ELEMENT_KINDS:
+            self.elements += 1
+
+
+class EditStreamProgress(DslStreamProgress):
+    """StreamProgress for refinement responses - counts added elements, added flows and lanes used by the edits."""
+
+    def feed_line(self, line):
+        keyword, _, rest = line.partition(" ")
+        if keyword in ("add", "connect"):
+            super().feed_line(rest.strip())
+        elif keyword == "lane":
+            super().feed_line(line)
+
+
+def make_stream_checks(output_format, prefix=""):
+    """
+    Return progress tracker and incremental validator for a response format ("xml", "dsl", "edits",
+    "plan" or "segment"). prefix is the part of the response received before (continuation of a cut off response).
+    """
+    if output_format == "edits":
+        progress, validator = EditStreamProgress(), IncrementalDslValidator(refine.EditParser())
+    elif output_format == "plan":
+        progress, validator = DslStreamProgress(), IncrementalDslValidator(decompose.PlanParser())
+    elif output_format in ("dsl", "segment"):
+        progress, validator = DslStreamProgress(), IncrementalDslValidator()
+    else:
+        progress, validator = StreamProgress(), IncrementalBpmnValidator()
+    if prefix:
+        progress.feed(prefix)
+        validator.feed(prefix)
+    return progress, validator
+
+def predict_max_tokens(text, output_format, model):
+    """Predict max_tokens for a generation without a limit set by the user, within the output limit of the model."""
+    limit = next((m.get("max_output_tokens") for m in AVAILABLE_MODELS if m["id"] == model), None)
+    max_tokens = TOKEN_PREDICTOR.predict(text, output_format, model, limit)
+    logger.info(f"Predicted max_tokens={max_tokens} for {output_format} output")
+    return max_tokens
+
+def add_usage(total, usage):
+    """Sum token counts of the calls of one generation (continuations)."""
+    if total is None:
+        return dict(usage)
+    return {name: total[name] + usage[name] for name in total}
+
+def admit_call(model, client_id, system_prompt, messages, output_tokens, continuation=False):
+    """
+    Wait until ADMISSION lets a model call through the rate limits of the account.
+    output_tokens is the expected size of the response; the continuation of a cut off response
+    is admitted right away. Yields "queued" events with the queue position and expected wait in
+    seconds meanwhile and returns the admission ticket, which is released with the tokens the
+    call consumed when it ends (by the scheduler, see ModelCallScheduler.stream).
+    """
+    input_tokens = estimate_input_tokens(system_prompt, *(message["content"] for message in messages))
+    ticket = ADMISSION.enqueue(model, client_id, input_tokens, output_tokens, priority=continuation)
+    try:
+        while not ticket.admitted:
+            yield {"event": "queued", "position": ticket.position, "wait": round(ticket.wait, 1)}
+            ADMISSION.wait(ticket, timeout=QUEUE_EVENT_INTERVAL)
+    finally:
+        # Also when the client went away while waiting - the place in the queue is given up
+        if not ticket.admitted:
+            ADMISSION.release(ticket)
+    METRICS.record_stage("admission_wait", time.time() - ticket.created_at, model)
+    return ticket
+
+def record_generation(result, output_format, seconds, cached=False, prompt=DEFAULT_VARIANT):
+    """Count a finished generation with its tokens and cost in METRICS (by model and prompt variant) and log it."""
+    model = result["model"]
+    METRICS.inc("processflow_generations_total", model=model, output_format=output_format, cached=str(cached).lower(), prompt=prompt)
+    cost = calculate_cost(model, result["input_tokens"], result["output_tokens"],
+                          result.get("cache_creation_input_tokens", 0), result.get("cache_read_input_tokens", 0))
+    if not cached:
+        METRICS.observe("processflow_generation_duration_seconds", seconds, model=model, prompt=prompt)
+        for token_type, field in (("input", "input_tokens"), ("output", "output_tokens"),
+                                  ("cache_write", "cache_creation_input_tokens"), ("cache_read", "cache_read_input_tokens")):
+            METRICS.inc("processflow_tokens_total", result.get(field, 0), model=model, type=token_type, prompt=prompt)
+        METRICS.inc("processflow_cost_dollars_total", cost, model=model)
+    
+    logger.info("Generation finished", extra={
+        "model": model,
+        "output_format": output_format,
+        "prompt_variant": prompt,
+        "cached": cached,
+        "duration": round(seconds, 3),
+        "input_tokens": result["input_tokens"],
+        "output_tokens": result["output_tokens"],
+        "cost": round(cost, 6),
+        "continuations": result.get("continuations", 0),
+    })
+
+def record_discarded_usage(model, usage, prompt=DEFAULT_VARIANT):
+    """
+    Count the tokens and cost of a model call attempt whose output was not used (failed, timed out,
+    losing hedged attempt) in METRICS. Returns the cost of the attempt.
+    """
+    for token_type, field in (("input", "input_tokens"), ("output", "output_tokens"),
+                              ("cache_write", "cache_creation_input_tokens"), ("cache_read", "cache_read_input_tokens")):
+        METRICS.inc("processflow_tokens_total", usage[field], model=model, type=token_type, prompt=prompt)
+    cost = calculate_cost(model, usage["input_tokens"], usage["output_tokens"],
+                          usage["cache_creation_input_tokens"], usage["cache_read_input_tokens"])
+    METRICS.inc("processflow_cost_dollars_total", cost, model=model)
+    logger.info(f"Discarded attempt on {model}: input_tokens={usage['input_tokens']}, output_tokens={usage['output_tokens']}, cost=${cost:.6f}")
+    return cost
+
+def record_error(error, model, prompt=DEFAULT_VARIANT):
+    """Count a failed generation by its error class in METRICS and return the error."""
+    METRICS.inc("processflow_errors_total", error_class=error_class(error), model=model, prompt=prompt)
+    return error
+
+def is_complete_response(content, output_format):
+    """Return True if a response cut off by max_tokens already contains the whole BPMN document."""
+    return output_format == "xml" and ("</bpmn:definitions>" in content or "</definitions>" in content)
+
+
+def stream_bpmn_from_text(text, system_prompt_file=None, model=None, temperature=0, max_tokens=None, progress_interval=0.25, use_cache=True, force_cache=False, auto_layout=False, output_format="xml", previous_bpmn=None, client_id=None, parallel=False):
+    """
+    Generate BPMN diagram from text description using the Claude streaming API.
+    
+    Works like generate_bpmn_from_text, but yields events while the model is writing:
+        {"event": "start", ...}     - request accepted, model call started
+        {"event": "queued", ...}    - waiting for the rate limits of the account (position, wait)
+        {"event": "progress", ...}  - elements and lanes found so far, estimated output tokens
+        {"event": "result", ...}    - validated BPMN content with exact token usage
+    
+    Cached results are returned as "start" and "result" events without calling the API
+    unless use_cache is False.
+    The response is validated incrementally - a PROBLÉM answer or broken BPMN structure
+    cancels the stream right away instead of waiting for (and paying) the rest of the output.
+    With auto_layout the diagram section is computed by layout.py after validation.
+    With output_format "dsl" the response is a compact process description compiled to BPMN XML.
+    With previous_bpmn the current diagram is sent in the compact format and the model answers
+    only with edit operations, which are applied to previous_bpmn (system_prompt_file should be
+    the refinement prompt); output_format and auto_layout do not apply.
+    Without max_tokens the limit is predicted by TOKEN_PREDICTOR. A response cut off by max_tokens
+    is continued (up to MAX_CONTINUATIONS times and CONTINUATION_TOKEN_BUDGET output tokens in total).
+    Every model call is admitted by ADMISSION - calls of client_id wait in a fair-share queue
+    while the rate limits of the account are used up.
+    With parallel a large process is generated in segments by stream_decomposed_bpmn (system_prompt_file
+    should be the segment prompt).
+    Errors are raised as ValueError with "model_problem:" prefix, same as in generate_bpmn_from_text.
     """
     # Use default model if none specified
     if not model:
         model = DEFAULT_MODEL
     
-    print(f"INFO: Generating with model: {model}")
-    client = init_client()
+    if parallel and not previous_bpmn:
+        yield from stream_decomposed_bpmn(text, system_prompt_file, model, temperature, max_tokens,
+                                          progress_interval, use_cache, force_cache, client_id)
+        return
+    start_time = time.perf_counter()
     
     # Load system prompt
-    system_prompt = load_system_prompt(system_prompt_file)
+    with METRICS.stage("prompt_load"):
+        system_prompt = load_system_prompt(system_prompt_file)
+    prompt_variant = PROMPTS.variant_of(system_prompt_file)
+    
+    # Refinement - the model gets the current diagram and answers only with the changes
+    if previous_bpmn:
+        try:
+            with METRICS.stage("describe_diagram"):
+                text = compose_refinement_input(text, refine.describe_diagram(previous_bpmn))
+        except process_dsl.DslError as e:
+            logger.warning(f"Diagram cannot be refined: {str(e)}")
+            raise record_error(ValueError(f"model_problem:{REFINE_SOURCE_MESSAGE.format(reason=problem_reason(e))}"), model, prompt_variant)
+        output_format = "edits"
+    
+    if output_format == "xml":
+        variant = "layout" if auto_layout else ""
+    else:
+        variant = output_format
+    # A predicted limit changes with the history, so it is not part of the key
+    cache_key = make_cache_key(system_prompt, text, model, temperature, max_tokens or 0, variant=variant)
+    if use_cache:
+        with METRICS.stage("cache_lookup"):
+            cached_result = RESULT_CACHE.get(cache_key, temperature, force_cache)
+        if cached_result and output_format == "edits":
+            cached_result = apply_cached_edits(cached_result, previous_bpmn)
+        if cached_result:
+            logger.info(f"Result served from cache: {cache_key[:12]}")
+            record_generation(cached_result, output_format, time.perf_counter() - start_time, cached=True, prompt=prompt_variant)
+            yield {"event": "start", "model": model, "cached": True}
+            yield {"event": "result", **cached_result, "cached": True}
+            return
+    
+    logger.info(f"Streaming with model: {model}")
+    with METRICS.stage("client_init"):
+        client = get_client()
     
     # Construct the prompt
     prompt = f""" {text} """
-    
-    # Create the message with system prompt if available
     messages = [{"role": "user", "content": prompt}]
     
+    yield {"event": "start", "model": model}
+    
+    # No limit set by the user - predicted from the size of the process and past generations
+    if not max_tokens:
+        max_tokens = predict_max_tokens(text, output_format, model)
+    budget = max(CONTINUATION_TOKEN_BUDGET, max_tokens)
+    # Rate limits are reserved for the expected size of the response, not for the limit
+    expected_tokens = TOKEN_PREDICTOR.expected(text, output_format, model)
+    
+    progress, validator = make_stream_checks(output_format)
+    used_model = model
+    usage = None
+    continuations = 0
+    input_tokens = 0
+    last_sent = 0.0
+    ticket = None
+    # Tokens and cost of attempts whose output was not used (failed, timed out or losing hedged attempts)
+    discarded = {"discarded_tokens": 0, "discarded_cost": 0.0}
+    
+    def on_discarded(attempt_model, attempt_usage):
+        discarded["discarded_tokens"] += sum(attempt_usage.values())
+        discarded["discarded_cost"] += record_discarded_usage(attempt_model, attempt_usage, prompt_variant)
+    
+    METRICS.inc("processflow_generations_in_flight", model=model)
+    
     try:
-        # Make the API call
-        print("INFO: Calling Anthropic API...")
-        print(f"INFO: Using temperature={temperature}, max_tokens={max_tokens}")
+        logger.info("Calling Anthropic streaming API...")
+        logger.info(f"Using temperature={temperature}, max_tokens={max_tokens}")
         
-        response = client.messages.create(
-            model=model,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            system=system_prompt,
-            messages=messages
-        )
-        
-        # Extract content from response
-        content = response.content[0].text
-        print(f"INFO: Response received: input_tokens={response.usage.input_tokens}, output_tokens={response.usage.output_tokens}")
+        while True:
+            # Continuation - the partial response is the start of the answer and the model writes the rest
+            # (the API does not accept an assistant message ending with whitespace)
+            prefix = progress.text().rstrip() if usage else ""
+            round_messages = messages + [{"role": "assistant", "content": prefix}] if prefix else messages
+            progress, validator = make_stream_checks(output_format, prefix)
+            round_max_tokens = min(max_tokens, budget - (usage["output_tokens"] if usage else 0))
+            round_expected_tokens = min(round_max_tokens, expected_tokens)
+            ticket = yield from admit_call(used_model, client_id, system_prompt, round_messages, round_expected_tokens,
+                                           continuation=bool(usage))
+            call_start = time.perf_counter()
+            first_token_at = None
+            
+            # The scheduler retries failed calls, hedges slow ones and falls back to other models;
+            # closing it (also on a validation error) cancels the call, so the API stops generating.
+            # It owns the admission ticket from here and releases it with the tokens the call consumed
+            with contextlib.closing(SCHEDULER.stream(
+                client,
+                used_model,
+                ticket=ticket,
+                client_id=client_id,
+                expected_tokens=round_expected_tokens,
+                on_discarded=on_discarded,
+                max_tokens=round_max_tokens,
+                temperature=temperature,
+                system=build_system_blocks(system_prompt),
+                messages=round_messages
+            )) as stream:
+                ticket = None
+                for kind, event in stream:
+                    if kind == "queued":
+                        # A retry waits for the rate limits
+                        yield {"event": "queued", **event}
+                        continue
+                    if kind == "attempt":
+                        # Output of a new attempt - anything received from a failed attempt is discarded
+                        used_model = event["model"]
+                        progress, validator = make_stream_checks(output_format, prefix)
+                        continue
+                    if kind == "final":
+                        final_message = event
+                        continue
+                    
+                    if event.type == "message_start":
+                        # Prompt cache reads and writes are reported separately from uncached input
+                        start_usage = usage_to_dict(event.message.usage)
+                        input_tokens = start_usage["input_tokens"] + start_usage["cache_creation_input_tokens"] + start_usage["cache_read_input_tokens"]
+                    elif event.type == "text":
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                            METRICS.record_stage("first_token", first_token_at - call_start, used_model)
+                            METRICS.observe("processflow_first_token_seconds", first_token_at - call_start,
+                                            model=used_model, prompt=prompt_variant)
+                        progress.feed(event.text)
+                        
+                        try:
+                            validator.feed(event.text)
+                        except StreamValidationError as e:
+                            logger.warning(f"Generation aborted after {validator.chars} characters: {str(e)}")
+                            raise stream_validation_error(e)
+                        
+                        # Throttle progress events so the browser is not flooded with updates
+                        now = time.monotonic()
+                        if now - last_sent >= progress_interval:
+                            last_sent = now
+                            yield {"event": "progress", **progress.snapshot(input_tokens)}
+            
+            METRICS.record_stage("streaming", time.perf_counter() - (first_token_at or call_start), used_model)
+            usage = add_usage(usage, usage_to_dict(final_message.usage))
+            stop_reason = final_message.stop_reason
+            logger.info(f"Stream finished: input_tokens={usage['input_tokens']}, output_tokens={usage['output_tokens']}, "
+                        f"cache_write={usage['cache_creation_input_tokens']}, cache_read={usage['cache_read_input_tokens']}")
+            
+            if (stop_reason != "max_tokens" or is_complete_response(progress.text(), output_format)
+                    or continuations >= MAX_CONTINUATIONS or usage["output_tokens"] >= budget):
+                break
+            continuations += 1
+            logger.warning(f"Response cut off by max_tokens after {usage['output_tokens']} output tokens, "
+                           f"continuing ({continuations}/{MAX_CONTINUATIONS})")
         
         # Validate the BPMN content
-        validated_content = validate_bpmn_content(content, model)
-        
-        return validated_content, response.usage.input_tokens, response.usage.output_tokens, model
-    
-    except AnthropicError as e:
-        print(f"ERROR: API error: {str(e)}")
-        error_str = str(e).lower()
+        if output_format == "edits":
+            with METRICS.stage("apply_edits", used_model):
+                validated_content = apply_edit_response(previous_bpmn, progress.text(), stop_reason)
+        elif output_format == "plan":
+            validated_content = check_plan_response(progress.text(), stop_reason)
+        elif output_format in ("dsl", "segment"):
+            with METRICS.stage("compile", used_model):
+                validated_content = compile_dsl_response(progress.text(), stop_reason, with_layout=output_format != "segment")
+        else:
+            with METRICS.stage("validation", used_model):
+                validated_content = validate_bpmn_content(progress.text(), used_model)
+            if auto_layout:
+                with METRICS.stage("layout", used_model):
+                    validated_content = apply_layout(validated_content)
         
-        # Check for overloaded error (error code 529)
-        if '529' in error_str and 'overloaded_error' in error_str:
-            print("ERROR: Anthropic API is currently overloaded. Please try again in a few minutes.")
-            raise ValueError(f"model_problem:The Anthropic API is currently overloaded. Please try again in a few minutes or consider using a different model.")
+        result = {
+            "bpmn_content": validated_content,
+            **usage,
+            "model": used_model,
+            "max_tokens": max_tokens,
+            "continuations": continuations,
+        }
+        TOKEN_PREDICTOR.record(text, output_format, used_model, usage["output_tokens"])
         
-        # Incorrect model name
-        if '404' in error_str and 'not_found_error' in error_str and 'model:' in error_str:
-            # Extract the model name from the error message
-            model_name = error_str.split('model:', 1)[1].strip().rstrip('}').strip("'")
-            print(f"ERROR: Model '{model_name}' not available")
-            raise ValueError(f"model_problem:Model '{model_name}' not available. Check if you entered the correct model name.")
+        # A diagram from a fallback model is not stored under the key of the requested model
+        if used_model == model:
+            # Edit operations are stored with the result and applied again to the diagram of a later request,
+            # whose layout may differ from this one (the key holds only the compact description)
+            RESULT_CACHE.put(cache_key, {**result, "edits": progress.text()} if output_format == "edits" else result)
+        else:
+            logger.info(f"Generated by fallback model {used_model} instead of {model}, result not cached")
         
-        # General API error - includes all other cases of AnthropicError
-        print(f"ERROR: General API error: {error_str}")
-        raise ValueError(f"model_problem:An error with API occurred during generation.")
+        record_generation(result, output_format, time.perf_counter() - start_time, prompt=prompt_variant)
+        # Discarded attempts are part of the cost of this generation, not of a later cache hit
+        yield {"event": "result", **result, "discarded_tokens": discarded["discarded_tokens"],
+               "discarded_cost": round(discarded["discarded_cost"], 6), "cached": False}
+    
+    except AnthropicError as e:
+        raise record_error(translate_api_error(e), model, prompt_variant)
+
+    except AdmissionRejected as e:
+        raise record_error(ValueError(f"model_problem:{ADMISSION_REJECTED_MESSAGE.format(wait=round(e.wait))}"), model, prompt_variant)
 
     except Exception as e:
-        #print(f"ERROR: General error: {str(e)}")
-        
         # If already a custom error message, pass it through unchanged
         if isinstance(e, ValueError) and "model_problem:" in str(e):
-            raise  # Re-raise current exception without change
+            record_error(e, model, prompt_variant)
+            raise
         
-        # General error - catch everything else
-        raise ValueError(f"model_problem:Unexpected error during generation.")
\ No newline at end of file
+        logger.error(f"Unexpected error during streaming: {str(e)}")
+        raise record_error(ValueError(f"model_problem:{UNEXPECTED_MESSAGE}"), model, prompt_variant)
+    
+    finally:
+        # Admitted, but never handed to the scheduler - nothing was consumed
+        if ticket is not None:
+            ADMISSION.release(ticket, 0, 0)
+        METRICS.dec("processflow_generations_in_flight", model=model)
+
+
+def stream_decomposed_bpmn(text, system_prompt_file, model, temperature=0, max_tokens=None, progress_interval=0.25, use_cache=True, force_cache=False, client_id=None):
+    """
+    Generate a large process in segments ("parallel" mode, decompose.py).
+    
+    A planning call on PLAN_MODEL splits the description into segments, which are generated
+    concurrently in the compact process format (at most DECOMPOSE_MAX_PARALLEL at once) and merged
+    into one diagram. Yields the same events as stream_bpmn_from_text plus
+        {"event": "plan", "segments": [...]}  - segments of the plan, before their generation starts
+    Progress events sum all segments and carry the number of segments and finished segments.
+    Descriptions with fewer than DECOMPOSE_MIN_STEPS steps, or that the plan does not split into at
+    least two segments, are generated in one call in the "dsl" mode.
+    The result sums the tokens of the planning call and of all segments.
+    """
+    # The planning and single-call prompts are next to the segment prompt (in the application directory for variants)
+    prompt_variant = PROMPTS.variant_of(system_prompt_file)
+    prompt_directory = os.path.dirname(system_prompt_file or "") if prompt_variant == CUSTOM_VARIANT else PROMPTS.base_dir
+    single_call = dict(
+        model=model, temperature=temperature, max_tokens=max_tokens, progress_interval=progress_interval,
+        use_cache=use_cache, force_cache=force_cache, output_format="dsl", client_id=client_id
+    )
+    dsl_prompt_file = os.path.join(prompt_directory, SYSTEM_PROMPT_FILES["dsl"])
+    
+    steps = count_features(text)["steps"]
+    if steps < DECOMPOSE_MIN_STEPS:
+        logger.info(f"Process with {steps} steps generated in one call")
+        yield from stream_bpmn_from_text(text, dsl_prompt_file, **single_call)
+        return
+    
+    start_time = time.perf_counter()
+    plan_result = None
+    try:
+        with contextlib.closing(stream_bpmn_from_text(
+            text,
+            os.path.join(prompt_directory, PLAN_PROMPT_FILE),
+            model=PLAN_MODEL,
+            progress_interval=progress_interval,
+            use_cache=use_cache,
+            force_cache=force_cache,
+            output_format="plan",
+            client_id=client_id
+        )) as planning:
+            for event in planning:
+                if event["event"] == "queued":
+                    yield event
+                elif event["event"] == "result":
+                    plan_result = event
+        plan = decompose.parse_plan(plan_result["bpmn_content"])
+    except (ValueError, process_dsl.DslError) as e:
+        logger.warning(f"Decomposition plan failed, process generated in one call: {str(e)}")
+        plan = None
+    
+    if plan is None or len(plan.segments) < 2:
+        if plan is not None:
+            logger.info("Plan has a single segment, process generated in one call")
+        yield from stream_bpmn_from_text(text, dsl_prompt_file, **single_call)
+        return
+    
+    logger.info(f"Process split into {len(plan.segments)} segments", extra={"segments": [segment.id for segment in plan.segments]})
+    yield {"event": "start", "model": model}
+    yield {"event": "plan", "segments": decompose.describe_plan(plan)}
+    
+    # Segment generations run in worker threads and pass their events (or errors) through the queue
+    events = queue.Queue()
+    cancelled = threading.Event()
+    
+    def generate_segment(segment):
+        generation = stream_bpmn_from_text(
+            decompose.compose_segment_input(text, plan, segment),
+            system_prompt_file,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            progress_interval=progress_interval,
+            use_cache=use_cache,
+            force_cache=force_cache,
+            output_format="segment",
+            client_id=client_id
+        )
+        try:
+            # Closing the generation after a failed segment cancels the model call
+            with contextlib.closing(generation):
+                for event in generation:
+                    if cancelled.is_set():
+                        return
+                    events.put((segment, event))
+        except Exception as e:
+            events.put((segment, e))
+    
+    executor = ThreadPoolExecutor(max_workers=min(DECOMPOSE_MAX_PARALLEL, len(plan.segments)), thread_name_prefix="segment")
+    try:
+        for segment in plan.segments:
+            # Each segment runs in a copy of the request context (request id, stage spans)
+            executor.submit(contextvars.copy_context().run, generate_segment, segment)
+        
+        progress, results = {}, {}
+        last_sent = 0.0
+        while len(results) < len(plan.segments):
+            segment, event = events.get()
+            if isinstance(event, Exception):
+                logger.error(f"Segment {segment.id} failed: {str(event)}")
+                raise event
+            if event["event"] == "progress":
+                progress[segment.id] = event
+            elif event["event"] == "result":
+                results[segment.id] = event
+            else:
+                continue
+            
+            now = time.monotonic()
+            if now - last_sent >= progress_interval or len(results) == len(plan.segments):
+                last_sent = now
+                yield {"event": "progress", **merge_segment_progress(progress.values()),
+                       "segments": len(plan.segments), "segments_done": len(results)}
+        
+        documents = [(segment, results[segment.id]["bpmn_content"]) for segment in plan.segments]
+        try:
+            with METRICS.stage("merge", model):
+                bpmn_content, unconnected = decompose.merge_to_bpmn(plan, documents)
+        except (process_dsl.DslError, layout.LayoutError) as e:
+            logger.error(f"Segments cannot be merged: {str(e)}")
+            raise record_error(BpmnValidationError(f"model_problem:{INVALID_STRUCTURE_MESSAGE.format(reason=problem_reason(e))}"), model, prompt_variant)
+        if unconnected:
+            logger.warning(f"Hand-offs without both ends, kept as start and end events: {', '.join(unconnected)}")
+    
+    finally:
+        # Also when the client went away - running segments stop at their next event, waiting ones are dropped
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    parts = [plan_result] + [results[segment.id] for segment in plan.segments]
+    usage = None
+    for part in parts:
+        usage = add_usage(usage, {name: part.get(name, 0) for name in USAGE_FIELDS})
+    # A segment generated by a fallback model is reported the same way as a whole diagram
+    used_models = [results[segment.id]["model"] for segment in plan.segments]
+    result = {
+        "bpmn_content": bpmn_content,
+        **usage,
+        "model": next((used for used in used_models if used != model), model),
+        "max_tokens": max(part.get("max_tokens") or 0 for part in parts),
+        "continuations": sum(part.get("continuations", 0) for part in parts),
+        "segments": len(plan.segments),
+        "discarded_tokens": sum(part.get("discarded_tokens", 0) for part in parts),
+        "discarded_cost": round(sum(part.get("discarded_cost", 0.0) for part in parts), 6),
+    }
+    logger.info(f"Process generated in {len(plan.segments)} segments in {time.perf_counter() - start_time:.1f} s")
+    # Tokens and cost were recorded by the planning call and the segments already
+    yield {"event": "result", **result, "cached": all(part.get("cached") for part in parts)}
+
+def merge_segment_progress(snapshots):
+    """Sum progress snapshots of the segments of a decomposed generation."""
+    merged = {"elements": 0, "flows": 0, "lanes": [], "section": "process", "input_tokens": 0, "output_tokens": 0}
+    for snapshot in snapshots:
+        for name in ("elements", "flows", "input_tokens", "output_tokens"):
+            merged[name] += snapshot[name]
+        merged["lanes"].extend(lane for lane in snapshot["lanes"] if lane not in merged["lanes"])
+    return merged
@@ -0,0 +1,332 @@
+"""
+Application metrics in the Prometheus text format and timing of request stages.
+
+Counters, gauges and histograms are kept in memory of every process. With db_path set, each
+process also writes a snapshot of its values to SQLite every few seconds and the /metrics
+output sums the snapshots of all processes, so every gunicorn worker reports the same totals.
+Snapshots of processes that stopped writing are folded into one archived row - their counters
+and histograms keep counting, their gauges (in-flight values) are dropped.
+
+Stages (prompt loading, time to first token, validation, ...) are timed with Metrics.stage or
+Metrics.record_stage; each stage is observed in a histogram and added to the spans of the
+current request, which app.py writes to the request log.
+"""
+import os
+import json
+import time
+import uuid
+import bisect
+import logging
+import sqlite3
+import threading
+import contextlib
+import contextvars
+
+# Latency buckets in seconds - from template rendering (ms) to long model calls (minutes)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+# Metric name: (type, help text)
+METRICS = {
+    "processflow_http_requests_total": ("counter", "HTTP requests by route, method and status code"),
+    "processflow_http_request_duration_seconds": ("histogram", "HTTP request duration by route (streamed responses until the stream ends)"),
+    "processflow_http_requests_in_flight": ("gauge", "HTTP requests being handled by route"),
+    "processflow_stage_duration_seconds": ("histogram", "Duration of request stages by stage and model"),
+    "processflow_generations_total": ("counter", "Finished diagram generations by model, output format, cache use and prompt variant"),
+    "processflow_generation_duration_seconds": ("histogram", "Duration of diagram generations by model and prompt variant"),
+    "processflow_first_token_seconds": ("histogram", "Time from the model call to its first output token by model and prompt variant"),
+    "processflow_generations_in_flight": ("gauge", "Diagram generations waiting for the model by model"),
+    "processflow_tokens_total": ("counter", "Tokens used by model, type (input, output, cache_write, cache_read) and prompt variant"),
+    "processflow_cost_dollars_total": ("counter", "Estimated API cost in USD by model"),
+    "processflow_errors_total": ("counter", "Failed generations by error class, model and prompt variant"),
+    "processflow_job_queue_depth": ("gauge", "Background jobs waiting for a worker"),
+}
+
+logger = logging.getLogger(__name__)
+
+# Snapshot row that collects counters of processes that are gone
+ARCHIVE_ROW = "archive"
+
+# Spans (stage name, seconds) of the request or job handled in the current context
+_spans = contextvars.ContextVar("spans", default=None)
+
+
+def begin_spans():
+    """Start collecting stage spans for the request or job handled in the current context."""
+    spans = []
+    _spans.set(spans)
+    return spans
+
+def current_spans():
+    """Return stage spans of the current request as {stage: seconds} (repeated stages are summed)."""
+    summary = {}
+    for name, seconds in _spans.get() or []:
+        summary[name] = round(summary.get(name, 0.0) + seconds, 4)
+    return summary
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metrics:
+    """
+    Process-wide metric registry.
+
+    Values are keyed by metric name and label set. Histograms use LATENCY_BUCKETS and
+    store per-bucket counts, sum and count.
+    """
+
+    def __init__(self, db_path=None, flush_interval=5.0, stale_after=60.0):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.stale_after = stale_after
+
+        self._lock = threading.Lock()
+        self._values = {}
+        self._histograms = {}
+        self._pid = None
+        self._token = None
+        self._flusher = None
+
+        self._db_ready = False
+        self._db_lock = threading.Lock()
+
+    # Recording
+
+    def inc(self, name, amount=1.0, **labels):
+        """Increase a counter (or change a gauge by amount)."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+        self._ensure_flusher()
+
+    def dec(self, name, amount=1.0, **labels):
+        """Decrease a gauge."""
+        self.inc(name, -amount, **labels)
+
+    def set(self, name, value, **labels):
+        """Set a gauge."""
+        with self._lock:
+            self._values[(name, _label_key(labels))] = float(value)
+        self._ensure_flusher()
+
+    def observe(self, name, value, **labels):
+        """Add an observation to a histogram."""
+        key = (name, _label_key(labels))
+        index = bisect.bisect_left(LATENCY_BUCKETS, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += value
+        self._ensure_flusher()
+
+    @contextlib.contextmanager
+    def in_flight(self, name, **labels):
+        """Count the block as in flight in a gauge."""
+        self.inc(name, **labels)
+        try:
+            yield
+        finally:
+            self.dec(name, **labels)
+
+    def record_stage(self, stage, seconds, model=""):
+        """Observe the duration of a stage and add it to the spans of the current request."""
+        self.observe("processflow_stage_duration_seconds", seconds, stage=stage, model=model or "")
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((stage, seconds))
+
+    @contextlib.contextmanager
+    def stage(self, stage, model=""):
+        """Time the block as a stage of the current request."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, time.perf_counter() - start, model)
+
+    # Snapshots shared between processes
+
+    def _connect(self):
+        """Open a new SQLite connection; the database is created on first use, not when the object is made."""
+        if not self._db_ready:
+            with self._db_lock:
+                if not self._db_ready:
+                    self._init_db()
+                    self._db_ready = True
+        return self._open()
+
+    def _open(self):
+        """Open a new SQLite connection - one per operation keeps it safe across threads and processes."""
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def _init_db(self):
+        """Create the metrics database and table if they do not exist yet."""
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._open() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    process TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def _ensure_flusher(self):
+        """Start the snapshot thread in this process (again after a fork)."""
+        if not self.db_path or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Forked child - values of the parent are reported by the parent
+                self._values, self._histograms = {}, {}
+            self._pid = os.getpid()
+            self._token = f"{self._pid}-{uuid.uuid4().hex[:8]}"
+            self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.warning(f"Metrics snapshot failed: {str(e)}")
+
+    def _snapshot(self):
+        with self._lock:
+            return {
+                "values": [[name, list(map(list, labels)), value] for (name, labels), value in self._values.items()],
+                "histograms": [[name, list(map(list, labels)), values] for (name, labels), values in self._histograms.items()],
+            }
+
+    def flush(self):
+        """Write the snapshot of this process (also when unchanged - it marks the process as alive)."""
+        if not self.db_path or self._token is None:
+            return
+        data = json.dumps(self._snapshot())
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO snapshots (process, data, updated_at) VALUES (?, ?, ?)",
+                (self._token, data, time.time())
+            )
+
+    def _collect(self):
+        """Return (values, histograms) summed over all processes."""
+        if not self.db_path:
+            with self._lock:
+                return dict(self._values), {key: list(values) for key, values in self._histograms.items()}
+
+        self.flush()
+        values, histograms = {}, {}
+        with self._connect() as connection:
+            rows = connection.execute("SELECT process, data, updated_at FROM snapshots").fetchall()
+        if any(self._is_stale(row) for row in rows):
+            rows = self._archive()
+
+        for _, data, _ in rows:
+            self._merge(values, histograms, json.loads(data))
+        return values, histograms
+
+    def _is_stale(self, row):
+        return row[0] != ARCHIVE_ROW and row[2] < time.time() - self.stale_after
+
+    def _archive(self):
+        """
+        Fold snapshots of stopped processes into the archive row; their gauges are dropped.
+        Runs in a write transaction, so concurrent scrapes do not archive the same snapshot twice.
+        Returns the remaining rows.
+        """
+        connection = self._connect()
+        connection.isolation_level = None
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            rows = connection.execute("SELECT process, data, updated_at FROM snapshots").fetchall()
+            stale = [row for row in rows if self._is_stale(row)]
+            if stale:
+                self._fold(connection, rows, stale)
+                rows = connection.execute("SELECT process, data, updated_at FROM snapshots").fetchall()
+            connection.execute("COMMIT")
+            return rows
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def _fold(self, connection, rows, stale):
+        archive = next((json.loads(data) for process, data, _ in rows if process == ARCHIVE_ROW), {"values": [], "histograms": []})
+        values, histograms = {}, {}
+        self._merge(values, histograms, archive)
+        for _, data, _ in stale:
+            snapshot = json.loads(data)
+            snapshot["values"] = [item for item in snapshot["values"] if METRICS.get(item[0], ("counter",))[0] == "counter"]
+            self._merge(values, histograms, snapshot)
+
+        merged = {
+            "values": [[name, list(map(list, labels)), value] for (name, labels), value in values.items()],
+            "histograms": [[name, list(map(list, labels)), counts] for (name, labels), counts in histograms.items()],
+        }
+        connection.execute(
+            "INSERT OR REPLACE INTO snapshots (process, data, updated_at) VALUES (?, ?, ?)",
+            (ARCHIVE_ROW, json.dumps(merged), time.time())
+        )
+        connection.executemany("DELETE FROM snapshots WHERE process = ?", [(row[0],) for row in stale])
+
+    @staticmethod
+    def _merge(values, histograms, snapshot):
+        for name, labels, value in snapshot["values"]:
+            key = (name, tuple(map(tuple, labels)))
+            values[key] = values.get(key, 0.0) + value
+        for name, labels, counts in snapshot["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], counts)]
+            else:
+                histograms[key] = list(counts)
+
+    # Output
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        values, histograms = self._collect()
+        lines = []
+        for name, (metric_type, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type == "histogram":
+                for (metric, labels), counts in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS, counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels, [('le', _format_value(bound))])} {cumulative}")
+                    cumulative += counts[len(LATENCY_BUCKETS)]
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(counts[-1])}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+            else:
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
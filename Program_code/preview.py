@@ -0,0 +1,407 @@
+"""
+Server-side previews of BPMN diagrams.
+
+The diagram section (DI) of a document is drawn as SVG without a browser: pools and lanes with
+their name stripes, tasks, events and gateways with their markers, sequence flows with arrows,
+message flows, data objects and text annotations, with labels placed by their BPMNLabel bounds
+(or under the shape, as bpmn.js does). A diagram is rendered in about a millisecond, so history
+and batch views can show previews without loading the modeler.
+
+PNG previews are rasterized from the SVG by the cairosvg package (requirements.txt, with the cairo
+library installed in the Docker image); where it cannot be loaded only SVG is available.
+
+Renders are cached by the content hash of the document (PreviewCache) - the same diagram is
+never rendered twice while it stays in the cache.
+
+Usage (thumbnails next to every diagram of a directory):
+    python preview.py ../Evaluation_data/AI_data --format svg --width 480
+"""
+import os
+import sys
+import glob
+import time
+import hashlib
+import argparse
+import textwrap
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+
+try:
+    import cairosvg
+except (ImportError, OSError):  # OSError: cairosvg installed without the cairo library
+    cairosvg = None
+
+from layout import BPMN_MODEL_NS, BPMN_DI_NS, DC_NS, DI_NS, LABEL_LINE_HEIGHT, LABEL_MAX_WIDTH, qname, split_tag
+from assets import CachedResponse
+
+FORMATS = ("svg", "png")
+CONTENT_TYPES = {"svg": "image/svg+xml; charset=utf-8", "png": "image/png"}
+
+# Free space around the drawing
+MARGIN = 20
+FONT_SIZE = 11
+# Average character width of the label font, used to wrap names
+CHAR_WIDTH = 6
+
+STROKE = "#22242a"
+FILL = "#ffffff"
+POOL_FILL = "#fafafa"
+
+# Width limits of requested previews (px)
+MIN_WIDTH = 32
+MAX_WIDTH = 4096
+
+
+class PreviewError(Exception):
+    """Raised when a document cannot be previewed (no diagram section, PNG without cairosvg)."""
+
+
+def _bounds(element):
+    bounds = element.find(qname(DC_NS, "Bounds"))
+    if bounds is None:
+        return None
+    return tuple(float(bounds.get(name, 0)) for name in ("x", "y", "width", "height"))
+
+def _label_bounds(element):
+    label = element.find(qname(BPMN_DI_NS, "BPMNLabel"))
+    return _bounds(label) if label is not None else None
+
+def _wrap(text, width):
+    return textwrap.wrap(" ".join(text.split()), max(1, int(width // CHAR_WIDTH)), break_long_words=False) or [""]
+
+
+class SvgCanvas:
+    """SVG elements of a preview and the extent of the drawing."""
+
+    def __init__(self):
+        self.parts = []
+        self.min_x = self.min_y = float("inf")
+        self.max_x = self.max_y = float("-inf")
+
+    def extend(self, x, y, width=0, height=0):
+        self.min_x, self.min_y = min(self.min_x, x), min(self.min_y, y)
+        self.max_x, self.max_y = max(self.max_x, x + width), max(self.max_y, y + height)
+
+    def add(self, markup):
+        self.parts.append(markup)
+
+    def text(self, lines, x, y, anchor="middle", rotate=False):
+        """Add lines of text centred vertically on (x, y)."""
+        if not any(lines):
+            return
+        top = y - (len(lines) - 1) * LABEL_LINE_HEIGHT / 2
+        spans = "".join(f'<tspan x="{x:g}" y="{top + index * LABEL_LINE_HEIGHT:g}">{escape(line)}</tspan>'
+                        for index, line in enumerate(lines))
+        transform = f' transform="rotate(-90 {x:g} {y:g})"' if rotate else ""
+        self.add(f'<text text-anchor="{anchor}" dominant-baseline="central"{transform}>{spans}</text>')
+
+    def render(self, width=None):
+        """Return the SVG document; width scales it (height follows the aspect ratio)."""
+        if not self.parts:
+            raise PreviewError("document has no diagram section")
+        x, y = self.min_x - MARGIN, self.min_y - MARGIN
+        view_width, view_height = self.max_x - self.min_x + 2 * MARGIN, self.max_y - self.min_y + 2 * MARGIN
+        if width:
+            size = f'width="{width}" height="{round(width * view_height / view_width)}"'
+        else:
+            size = f'width="{view_width:g}" height="{view_height:g}"'
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" {size} viewBox="{x:g} {y:g} {view_width:g} {view_height:g}">'
+            '<defs>'
+            f'<marker id="arrow" viewBox="0 0 10 10" refX="10" refY="5" markerWidth="8" markerHeight="8" orient="auto">'
+            f'<path d="M0,0 L10,5 L0,10 z" fill="{STROKE}"/></marker>'
+            f'<marker id="open-arrow" viewBox="0 0 10 10" refX="10" refY="5" markerWidth="8" markerHeight="8" orient="auto">'
+            f'<path d="M0,0 L10,5 L0,10 z" fill="{FILL}" stroke="{STROKE}"/></marker>'
+            f'<marker id="message-start" viewBox="0 0 10 10" refX="5" refY="5" markerWidth="6" markerHeight="6">'
+            f'<circle cx="5" cy="5" r="4" fill="{FILL}" stroke="{STROKE}"/></marker>'
+            '</defs>'
+            f'<rect x="{x:g}" y="{y:g}" width="{view_width:g}" height="{view_height:g}" fill="{FILL}"/>'
+            f'<g font-family="Arial, Helvetica, sans-serif" font-size="{FONT_SIZE}" fill="none" stroke="{STROKE}" stroke-width="1.5">'
+            f'{"".join(self.parts)}</g></svg>'
+        )
+
+
+def _draw_container(canvas, bounds, name, fill):
+    """Draw a pool or lane with its name in the stripe on the left side."""
+    x, y, width, height = bounds
+    canvas.add(f'<rect x="{x:g}" y="{y:g}" width="{width:g}" height="{height:g}" fill="{fill}"/>')
+    canvas.add(f'<line x1="{x + 30:g}" y1="{y:g}" x2="{x + 30:g}" y2="{y + height:g}"/>')
+    canvas.add('<g fill="#22242a" stroke="none">')
+    canvas.text(_wrap(name, max(height - 10, CHAR_WIDTH))[:2], x + 15, y + height / 2, rotate=True)
+    canvas.add('</g>')
+
+def _draw_activity(canvas, bounds, tag, name):
+    x, y, width, height = bounds
+    stroke_width = 4 if tag == "callActivity" else 1.5
+    dash = ' stroke-dasharray="6 3"' if tag in ("subProcess", "adHocSubProcess") and height > 120 else ""
+    canvas.add(f'<rect x="{x:g}" y="{y:g}" width="{width:g}" height="{height:g}" rx="10" fill="{FILL}" '
+               f'stroke-width="{stroke_width}"{dash}/>')
+    if tag == "transaction":
+        canvas.add(f'<rect x="{x + 3:g}" y="{y + 3:g}" width="{width - 6:g}" height="{height - 6:g}" rx="8"/>')
+    if tag in ("subProcess", "callActivity", "adHocSubProcess") and height <= 120:
+        # Collapsed sub-process marker
+        canvas.add(f'<rect x="{x + width / 2 - 7:g}" y="{y + height - 16:g}" width="14" height="14" stroke-width="1"/>'
+                   f'<path d="M{x + width / 2:g},{y + height - 13:g} v8 M{x + width / 2 - 4:g},{y + height - 9:g} h8" stroke-width="1"/>')
+    canvas.add('<g fill="#22242a" stroke="none">')
+    lines = _wrap(name, width - 10)[:max(1, int((height - 8) // LABEL_LINE_HEIGHT))]
+    canvas.text(lines, x + width / 2, y + height / 2)
+    canvas.add('</g>')
+
+def _draw_event(canvas, bounds, tag, element):
+    x, y, width, height = bounds
+    cx, cy, r = x + width / 2, y + height / 2, min(width, height) / 2
+    dash = ' stroke-dasharray="5 3"' if element.get("cancelActivity") == "false" else ""
+    if tag == "endEvent":
+        canvas.add(f'<circle cx="{cx:g}" cy="{cy:g}" r="{r - 1.5:g}" fill="{FILL}" stroke-width="4"/>')
+    else:
+        canvas.add(f'<circle cx="{cx:g}" cy="{cy:g}" r="{r:g}" fill="{FILL}"{dash}/>')
+    if tag in ("intermediateCatchEvent", "intermediateThrowEvent", "boundaryEvent"):
+        canvas.add(f'<circle cx="{cx:g}" cy="{cy:g}" r="{r - 3:g}"{dash}/>')
+
+    # Markers of the most common event definitions
+    definitions = {split_tag(child.tag)[1] for child in element}
+    filled = tag in ("endEvent", "intermediateThrowEvent")
+    if "messageEventDefinition" in definitions:
+        fill = STROKE if filled else FILL
+        canvas.add(f'<rect x="{cx - 8:g}" y="{cy - 5.5:g}" width="16" height="11" fill="{fill}" stroke-width="1"/>'
+                   f'<path d="M{cx - 8:g},{cy - 5.5:g} L{cx:g},{cy + 1:g} L{cx + 8:g},{cy - 5.5:g}" '
+                   f'stroke="{FILL if filled else STROKE}" stroke-width="1"/>')
+    elif "timerEventDefinition" in definitions:
+        canvas.add(f'<circle cx="{cx:g}" cy="{cy:g}" r="{r - 7:g}" stroke-width="1"/>'
+                   f'<path d="M{cx:g},{cy:g} v{-(r - 10):g} M{cx:g},{cy:g} h{r - 12:g}" stroke-width="1"/>')
+    elif "errorEventDefinition" in definitions:
+        canvas.add(f'<path d="M{cx - 7:g},{cy + 7:g} L{cx - 3:g},{cy - 6:g} L{cx + 2:g},{cy + 2:g} L{cx + 7:g},{cy - 7:g} '
+                   f'L{cx + 3:g},{cy + 6:g} L{cx - 2:g},{cy - 2:g} z" fill="{STROKE if filled else FILL}" stroke-width="1"/>')
+    elif "terminateEventDefinition" in definitions:
+        canvas.add(f'<circle cx="{cx:g}" cy="{cy:g}" r="{r - 8:g}" fill="{STROKE}" stroke="none"/>')
+
+def _draw_gateway(canvas, bounds, tag):
+    x, y, width, height = bounds
+    cx, cy = x + width / 2, y + height / 2
+    canvas.add(f'<path d="M{cx:g},{y:g} L{x + width:g},{cy:g} L{cx:g},{y + height:g} L{x:g},{cy:g} z" fill="{FILL}"/>')
+    size = width / 5
+    if tag == "exclusiveGateway":
+        canvas.add(f'<path d="M{cx - size:g},{cy - size:g} L{cx + size:g},{cy + size:g} '
+                   f'M{cx + size:g},{cy - size:g} L{cx - size:g},{cy + size:g}" stroke-width="3"/>')
+    elif tag == "parallelGateway":
+        canvas.add(f'<path d="M{cx:g},{cy - size * 1.3:g} v{size * 2.6:g} M{cx - size * 1.3:g},{cy:g} h{size * 2.6:g}" stroke-width="3"/>')
+    elif tag == "inclusiveGateway":
+        canvas.add(f'<circle cx="{cx:g}" cy="{cy:g}" r="{size * 1.2:g}" stroke-width="2.5"/>')
+    elif tag in ("eventBasedGateway", "complexGateway"):
+        canvas.add(f'<circle cx="{cx:g}" cy="{cy:g}" r="{size * 1.3:g}" stroke-width="1"/>'
+                   f'<circle cx="{cx:g}" cy="{cy:g}" r="{size:g}" stroke-width="1"/>')
+
+def _draw_data(canvas, bounds, tag):
+    x, y, width, height = bounds
+    if tag == "dataStoreReference":
+        canvas.add(f'<path d="M{x:g},{y + 6:g} v{height - 12:g} a{width / 2:g},6 0 0 0 {width:g},0 v{-(height - 12):g} '
+                   f'a{width / 2:g},6 0 0 0 {-width:g},0 a{width / 2:g},6 0 0 0 {width:g},0" fill="{FILL}"/>')
+    else:
+        fold = min(width, height) / 4
+        canvas.add(f'<path d="M{x:g},{y:g} h{width - fold:g} l{fold:g},{fold:g} v{height - fold:g} h{-width:g} z '
+                   f'M{x + width - fold:g},{y:g} v{fold:g} h{fold:g}" fill="{FILL}"/>')
+
+def _draw_annotation(canvas, bounds, element):
+    x, y, width, height = bounds
+    canvas.add(f'<path d="M{x + 10:g},{y:g} h-10 v{height:g} h10"/>')
+    text = element.findtext(qname(BPMN_MODEL_NS, "text")) or ""
+    canvas.add('<g fill="#22242a" stroke="none">')
+    canvas.text(_wrap(text, width - 8)[:max(1, int(height // LABEL_LINE_HEIGHT))], x + 5, y + height / 2, anchor="start")
+    canvas.add('</g>')
+
+def _draw_label(canvas, name, label_bounds, x, y):
+    """Draw an external label in its bounds, or centred under (x, y)."""
+    if not name.strip():
+        return
+    if label_bounds is not None:
+        label_x, label_y, width, height = label_bounds
+        lines = _wrap(name, max(width, CHAR_WIDTH * 4))
+        center_y = label_y + height / 2
+    else:
+        lines = _wrap(name, LABEL_MAX_WIDTH)
+        label_x, width = x - LABEL_MAX_WIDTH / 2, LABEL_MAX_WIDTH
+        center_y = y + len(lines) * LABEL_LINE_HEIGHT / 2
+    canvas.extend(label_x, center_y - len(lines) * LABEL_LINE_HEIGHT / 2, width, len(lines) * LABEL_LINE_HEIGHT)
+    canvas.add('<g fill="#22242a" stroke="none">')
+    canvas.text(lines, label_x + width / 2, center_y)
+    canvas.add('</g>')
+
+
+def render_svg(xml_text, width=None):
+    """
+    Render the diagram section of a BPMN document as SVG.
+    width scales the preview (None keeps the diagram coordinates). Raises PreviewError.
+    """
+    try:
+        root = ET.fromstring(xml_text.encode("utf-8") if isinstance(xml_text, str) else xml_text)
+    except ET.ParseError as e:
+        raise PreviewError(f"document is not valid XML: {str(e)}")
+
+    elements = {element.get("id"): element for element in root.iter() if element.get("id")}
+    plane = root.find(f".//{qname(BPMN_DI_NS, 'BPMNPlane')}")
+    if plane is None:
+        raise PreviewError("document has no diagram section")
+
+    canvas = SvgCanvas()
+    # Pools and lanes first, so shapes and flows are drawn over them
+    shapes = []
+    for shape in plane.iter(qname(BPMN_DI_NS, "BPMNShape")):
+        element = elements.get(shape.get("bpmnElement"))
+        bounds = _bounds(shape)
+        if element is None or bounds is None:
+            continue
+        tag = split_tag(element.tag)[1]
+        canvas.extend(*bounds)
+        if tag == "participant":
+            _draw_container(canvas, bounds, element.get("name") or "", POOL_FILL)
+        elif tag == "lane":
+            _draw_container(canvas, bounds, element.get("name") or "", "none")
+        else:
+            shapes.append((shape, element, tag, bounds))
+
+    for edge in plane.iter(qname(BPMN_DI_NS, "BPMNEdge")):
+        element = elements.get(edge.get("bpmnElement"))
+        points = [(float(point.get("x", 0)), float(point.get("y", 0))) for point in edge.findall(qname(DI_NS, "waypoint"))]
+        if element is None or len(points) < 2:
+            continue
+        for x, y in points:
+            canvas.extend(x, y)
+        tag = split_tag(element.tag)[1]
+        path = " ".join(f"{x:g},{y:g}" for x, y in points)
+        if tag == "messageFlow":
+            canvas.add(f'<polyline points="{path}" stroke-dasharray="8 5" marker-start="url(#message-start)" marker-end="url(#open-arrow)"/>')
+        elif tag in ("association", "dataInputAssociation", "dataOutputAssociation"):
+            marker = ' marker-end="url(#open-arrow)"' if tag != "association" else ""
+            canvas.add(f'<polyline points="{path}" stroke-dasharray="2 4" stroke-width="1"{marker}/>')
+        else:
+            canvas.add(f'<polyline points="{path}" marker-end="url(#arrow)"/>')
+
+        middle = len(points) // 2
+        (x1, y1), (x2, y2) = points[middle - 1], points[middle]
+        _draw_label(canvas, element.get("name") or "", _label_bounds(edge), (x1 + x2) / 2, (y1 + y2) / 2 + 4)
+
+    # Boundary events are drawn over the border of their activity
+    shapes.sort(key=lambda item: item[2] == "boundaryEvent")
+    for shape, element, tag, bounds in shapes:
+        x, y, shape_width, shape_height = bounds
+        name = element.get("name") or ""
+        if tag.endswith("Event"):
+            _draw_event(canvas, bounds, tag, element)
+            _draw_label(canvas, name, _label_bounds(shape), x + shape_width / 2, y + shape_height + 6)
+        elif tag.endswith("Gateway"):
+            _draw_gateway(canvas, bounds, tag)
+            _draw_label(canvas, name, _label_bounds(shape), x + shape_width / 2, y + shape_height + 6)
+        elif tag in ("dataObjectReference", "dataStoreReference"):
+            _draw_data(canvas, bounds, tag)
+            _draw_label(canvas, name, _label_bounds(shape), x + shape_width / 2, y + shape_height + 6)
+        elif tag == "textAnnotation":
+            _draw_annotation(canvas, bounds, element)
+        else:
+            _draw_activity(canvas, bounds, tag, name)
+
+    return canvas.render(width)
+
+def render_png(xml_text, width=None):
+    """Render the diagram as PNG bytes (needs cairosvg). Raises PreviewError."""
+    if cairosvg is None:
+        raise PreviewError("PNG previews need the cairosvg package")
+    return cairosvg.svg2png(bytestring=render_svg(xml_text, width).encode("utf-8"))
+
+def render(xml_text, image_format="svg", width=None):
+    """Return the preview as bytes in the given format ("svg" or "png"). Raises PreviewError."""
+    if image_format == "png":
+        return render_png(xml_text, width)
+    return render_svg(xml_text, width).encode("utf-8")
+
+def clamp_width(width):
+    """Return a requested preview width limited to MIN_WIDTH..MAX_WIDTH, None for no width."""
+    if not width:
+        return None
+    return min(max(int(width), MIN_WIDTH), MAX_WIDTH)
+
+
+class PreviewCache:
+    """
+    Rendered previews by content hash of the document, format and width, in the process memory.
+    Bounded LRU by the total size of the stored variants; values are CachedResponses (with gzip variants
+    of SVG), so they are served with ETags without compressing again.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, content_hash, load_xml, image_format="svg", width=None):
+        """
+        Return the CachedResponse of a preview; load_xml() is called only when it is not cached.
+        Raises PreviewError.
+        """
+        key = (content_hash, image_format, width)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return cached
+            self._counters["misses"] += 1
+
+        body = render(load_xml(), image_format, width)
+        # The ETag is derived from the document, so the same diagram keeps its ETag in every process
+        etag = hashlib.sha256(f"{content_hash}:{image_format}:{width}".encode("utf-8")).hexdigest()[:32]
+        cached = CachedResponse(body, CONTENT_TYPES[image_format], etag=etag)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = cached
+                self._size += cached.size()
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size()
+                self._counters["evictions"] += 1
+        return cached
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries), "bytes": self._size, "png": cairosvg is not None}
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Render previews of all BPMN diagrams in a directory.")
+    parser.add_argument("directory", help="Directory with .bpmn files")
+    parser.add_argument("--pattern", default="**/*.bpmn", help="Glob pattern of diagram files (default: **/*.bpmn)")
+    parser.add_argument("--format", choices=FORMATS, default="svg")
+    parser.add_argument("--width", type=int, default=None, help="Preview width in px (default: diagram size)")
+    parser.add_argument("--output", default=None, help="Output directory (default: next to each diagram)")
+    args = parser.parse_args(argv)
+
+    paths = sorted(glob.glob(os.path.join(args.directory, args.pattern), recursive=True))
+    if not paths:
+        print(f"WARNING: No diagrams found in {args.directory}")
+        return 1
+
+    start_time = time.time()
+    failed = 0
+    for path in paths:
+        target_dir = args.output or os.path.dirname(path)
+        os.makedirs(target_dir, exist_ok=True)
+        target = os.path.join(target_dir, os.path.splitext(os.path.basename(path))[0] + "." + args.format)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                body = render(f.read(), args.format, clamp_width(args.width))
+        except (PreviewError, OSError) as e:
+            print(f"ERROR: {path}: {str(e)}")
+            failed += 1
+            continue
+        with open(target, "wb") as f:
+            f.write(body)
+
+    print(f"INFO: Rendered {len(paths) - failed}/{len(paths)} previews in {time.time() - start_time:.2f}s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,402 @@
+"""
+Compact text format of process models, with a compiler to BPMN 2.0 XML and a decompiler back.
+
+Instead of verbose XML the model can describe a process in a few lines (system_prompt_dsl.txt):
+
+    process Schválenie dokumentu
+    lane Autor dokumentu
+      start S1 Začiatok procesu
+      task T1 Vytvor prvú verziu dokumentu
+    lane Recenzent
+      task T2 Skontroluj obsah dokumentu
+      xor G1 Je dokument v poriadku?
+      end E1 Koniec procesu
+    flow
+      S1 -> T1 -> T2 -> G1
+      G1 -[Áno]-> E1
+      G1 -[Nie]-> T1
+
+Element lines are "<kind>[:<event definition>] <id> [@<attached to>] <name>", flow lines are chains
+of ids joined by "->" or "-[label]->". compile_dsl turns the description into a BPMN document
+(the diagram section is computed by layout.py), decompile_bpmn converts an existing BPMN
+document back - e.g. the reference solutions in Evaluation_data.
+
+Usage:
+    python process_dsl.py decompile Schvalenie_dokumentu_OPRAVENE.bpmn > Schvalenie_dokumentu.dsl
+    python process_dsl.py compile Schvalenie_dokumentu.dsl > Schvalenie_dokumentu.bpmn
+"""
+import re
+import sys
+import argparse
+import xml.etree.ElementTree as ET
+
+import layout
+from layout import BPMN_MODEL_NS, qname, split_tag
+
+# Element kinds of the format and the BPMN elements they compile to
+ELEMENT_KINDS = {
+    "start": "startEvent",
+    "end": "endEvent",
+    "catch": "intermediateCatchEvent",
+    "throw": "intermediateThrowEvent",
+    "boundary": "boundaryEvent",
+    "task": "task",
+    "user": "userTask",
+    "service": "serviceTask",
+    "manual": "manualTask",
+    "send": "sendTask",
+    "receive": "receiveTask",
+    "script": "scriptTask",
+    "rule": "businessRuleTask",
+    "sub": "subProcess",
+    "call": "callActivity",
+    "xor": "exclusiveGateway",
+    "and": "parallelGateway",
+    "or": "inclusiveGateway",
+    "event": "eventBasedGateway",
+    "complex": "complexGateway",
+}
+ELEMENT_TAGS = {tag: kind for kind, tag in ELEMENT_KINDS.items()}
+
+# Event definitions allowed after the kind, e.g. "start:timer" or "boundary:error"
+EVENT_DEFINITIONS = ("message", "timer", "signal", "error", "escalation", "conditional", "compensate", "terminate", "link", "cancel")
+
+ID_PATTERN = r"[A-Za-z_][\w.-]*"
+ELEMENT_LINE = re.compile(rf"^(?P<kind>[a-z]+)(?::(?P<definition>[a-z]+))?\s+(?P<id>{ID_PATTERN})(?:\s+@(?P<host>{ID_PATTERN}))?(?:\s+(?P<name>.*))?$")
+# Arrows are separated by whitespace, ids may contain "-"
+FLOW_LINE = re.compile(rf"^{ID_PATTERN}\s+-(?:\[[^\]]*\]-)?>")
+FLOW_STEP = re.compile(rf"\s+-(?:\[(?P<label>[^\]]*)\]-)?>\s*(?P<id>{ID_PATTERN})")
+
+
+class DslError(Exception):
+    """Raised for descriptions that are not valid in the process format; line is 1-based or None."""
+
+    def __init__(self, message, line=None):
+        super().__init__(f"line {line}: {message}" if line else message)
+        self.line = line
+
+
+def parse_element(line, line_number=None):
+    """
+    Parse an element line "<kind>[:<definition>] <id> [@<host>] <name>".
+    Returns (id, element attributes without lane); raises DslError.
+    """
+    match = ELEMENT_LINE.match(line)
+    if not match:
+        raise DslError(f"cannot parse '{line[:60]}'", line_number)
+
+    kind, definition, element_id = match.group("kind"), match.group("definition"), match.group("id")
+    if kind not in ELEMENT_KINDS:
+        raise DslError(f"unknown element kind '{kind}'", line_number)
+    if definition and (definition not in EVENT_DEFINITIONS or not ELEMENT_KINDS[kind].endswith("Event")):
+        raise DslError(f"'{kind}:{definition}' is not a valid event", line_number)
+    if kind == "boundary" and not match.group("host"):
+        raise DslError(f"boundary event '{element_id}' needs '@<activity id>'", line_number)
+
+    return element_id, {
+        "tag": ELEMENT_KINDS[kind],
+        "name": (match.group("name") or "").strip(),
+        "definition": definition,
+        "host": match.group("host"),
+        "line": line_number,
+    }
+
+def parse_flow(line, line_number=None):
+    """Parse a flow chain "A -> B -[label]-> C" into a list of (source, target, label); raises DslError."""
+    match = re.match(ID_PATTERN, line)
+    if not match:
+        raise DslError(f"cannot parse flow '{line[:60]}'", line_number)
+
+    flows = []
+    source, position = match.group(0), match.end()
+    while position < len(line):
+        step = FLOW_STEP.match(line, position)
+        if not step:
+            raise DslError(f"cannot parse flow '{line[:60]}'", line_number)
+        flows.append((source, step.group("id"), (step.group("label") or "").strip()))
+        source, position = step.group("id"), step.end()
+    if not flows:
+        raise DslError(f"flow '{line[:60]}' has no target", line_number)
+    return flows
+
+
+class ProcessModel:
+    """Parsed process description: pool name, lanes, elements and flows."""
+
+    def __init__(self):
+        self.name = ""
+        self.lanes = []  # [lane name, [element ids]]
+        self.elements = {}  # id -> {"tag", "name", "definition", "host", "lane"}
+        self.flows = []  # (source id, target id, label, line number)
+
+
+class DslParser:
+    """
+    Line-by-line parser of the process format.
+    Lines can be fed one at a time while the description is streamed; syntax errors are raised
+    right away, references between elements are checked by finish() when all lines are known.
+    """
+
+    def __init__(self):
+        self.model = ProcessModel()
+        self.line_number = 0
+
+    def feed_line(self, line):
+        """Parse one line. Returns "process", "lane", "element", "flow" or None for ignored lines."""
+        self.line_number += 1
+        line = line.strip()
+
+        # Empty lines, comments, section headers and code fences around the description are ignored
+        if not line or line.startswith(("#", "```")) or line in ("flow", "flows", "flow:", "flows:"):
+            return None
+
+        keyword, _, rest = line.partition(" ")
+        if keyword in ("process", "process:"):
+            self.model.name = rest.strip()
+            return "process"
+        if keyword in ("lane", "lane:"):
+            self.model.lanes.append([rest.strip().rstrip(":"), []])
+            return "lane"
+        if FLOW_LINE.match(line):
+            self._parse_flow(line)
+            return "flow"
+
+        self._add_element(line)
+        return "element"
+
+    def _add_element(self, line):
+        element_id, element = parse_element(line, self.line_number)
+        if element_id in self.model.elements:
+            raise DslError(f"duplicate element id '{element_id}'", self.line_number)
+
+        element["lane"] = len(self.model.lanes) - 1 if self.model.lanes else None
+        self.model.elements[element_id] = element
+        if element["lane"] is not None:
+            self.model.lanes[element["lane"]][1].append(element_id)
+
+    def _parse_flow(self, line):
+        for source, target, label in parse_flow(line, self.line_number):
+            self.model.flows.append((source, target, label, self.line_number))
+
+    def finish(self):
+        """Check references between elements and return the parsed ProcessModel."""
+        if not self.model.elements:
+            raise DslError("description contains no elements")
+        if not self.model.lanes:
+            raise DslError("description contains no lanes")
+
+        for element_id, element in self.model.elements.items():
+            if element["host"] and element["host"] not in self.model.elements:
+                raise DslError(f"boundary event '{element_id}' is attached to unknown element '{element['host']}'", element["line"])
+        for source, target, _, line in self.model.flows:
+            for element_id in (source, target):
+                if element_id not in self.model.elements:
+                    raise DslError(f"flow references unknown element '{element_id}'", line)
+
+        # Elements written before the first lane stay outside of all lanes (like in the document
+        # they were decompiled from) - layout.py draws them in the lane of their predecessor
+        return self.model
+
+
+def parse_dsl(text):
+    """Parse a complete process description into a ProcessModel. Raises DslError."""
+    parser = DslParser()
+    for line in text.splitlines():
+        parser.feed_line(line)
+    return parser.finish()
+
+
+def build_document(model):
+    """Build the semantic part of a BPMN document (no diagram section) for a ProcessModel."""
+    root = ET.Element(qname(BPMN_MODEL_NS, "definitions"), {
+        "id": "Definitions_1",
+        "targetNamespace": "http://bpmn.io/bpmn",
+    })
+    collaboration = ET.SubElement(root, qname(BPMN_MODEL_NS, "collaboration"), id="Collaboration_1")
+    ET.SubElement(collaboration, qname(BPMN_MODEL_NS, "participant"), id="Participant_1", name=model.name or "Proces", processRef="Process_1")
+    process = ET.SubElement(root, qname(BPMN_MODEL_NS, "process"), id="Process_1", isExecutable="false")
+
+    lane_set = ET.SubElement(process, qname(BPMN_MODEL_NS, "laneSet"), id="LaneSet_1")
+    for index, (lane_name, element_ids) in enumerate(model.lanes, start=1):
+        lane = ET.SubElement(lane_set, qname(BPMN_MODEL_NS, "lane"), id=f"Lane_{index}", name=lane_name)
+        for element_id in element_ids:
+            ET.SubElement(lane, qname(BPMN_MODEL_NS, "flowNodeRef")).text = element_id
+
+    # Flow ids must not collide with element ids chosen by the model
+    flow_ids = []
+    for index in range(1, len(model.flows) + 1):
+        flow_id = f"Flow_{index}"
+        while flow_id in model.elements:
+            flow_id += "_"
+        flow_ids.append(flow_id)
+
+    incoming, outgoing = {}, {}
+    for flow_id, (source, target, _, _) in zip(flow_ids, model.flows):
+        outgoing.setdefault(source, []).append(flow_id)
+        incoming.setdefault(target, []).append(flow_id)
+
+    for element_id, element in model.elements.items():
+        attributes = {"id": element_id}
+        if element["name"]:
+            attributes["name"] = element["name"]
+        if element["host"]:
+            attributes["attachedToRef"] = element["host"]
+        node = ET.SubElement(process, qname(BPMN_MODEL_NS, element["tag"]), attributes)
+        for flow_id in incoming.get(element_id, []):
+            ET.SubElement(node, qname(BPMN_MODEL_NS, "incoming")).text = flow_id
+        for flow_id in outgoing.get(element_id, []):
+            ET.SubElement(node, qname(BPMN_MODEL_NS, "outgoing")).text = flow_id
+        if element["definition"]:
+            ET.SubElement(node, qname(BPMN_MODEL_NS, f"{element['definition']}EventDefinition"), id=f"{element_id}_definition")
+
+    for flow_id, (source, target, label, _) in zip(flow_ids, model.flows):
+        attributes = {"id": flow_id, "sourceRef": source, "targetRef": target}
+        if label:
+            attributes["name"] = label
+        ET.SubElement(process, qname(BPMN_MODEL_NS, "sequenceFlow"), attributes)
+
+    return root
+
+def compile_dsl(text, with_layout=True):
+    """
+    Compile a process description to BPMN 2.0 XML.
+    With with_layout the diagram section is computed by layout.py, otherwise only the process model is written.
+    Raises DslError for invalid descriptions.
+    """
+    root = build_document(parse_dsl(text))
+    if with_layout:
+        return layout.layout_tree(root)
+    ET.indent(root, space="  ")
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding="unicode")
+
+
+def _clean_name(name):
+    """Names are written on one line."""
+    return " ".join((name or "").split())
+
+def _element_line(element):
+    """Return the description line of a flow node element, or None for unsupported elements."""
+    _, tag = split_tag(element.tag)
+    kind = ELEMENT_TAGS.get(tag)
+    if kind is None:
+        return None
+
+    for child in element:
+        _, child_tag = split_tag(child.tag)
+        if child_tag.endswith("EventDefinition") and child_tag[:-len("EventDefinition")] in EVENT_DEFINITIONS:
+            kind += ":" + child_tag[:-len("EventDefinition")]
+            break
+
+    parts = [kind, element.get("id")]
+    if element.get("attachedToRef"):
+        parts.append("@" + element.get("attachedToRef"))
+    if element.get("name"):
+        parts.append(_clean_name(element.get("name")))
+    return " ".join(parts)
+
+def decompile_bpmn(xml_text):
+    """Convert a BPMN document to the process format. Only the first process is converted."""
+    try:
+        root = ET.fromstring(xml_text.encode("utf-8"))
+    except ET.ParseError as e:
+        raise DslError(f"malformed XML: {str(e)}")
+
+    process = root.find(qname(BPMN_MODEL_NS, "process"))
+    if process is None:
+        raise DslError("document has no process")
+
+    participant = next((p for p in root.iter(qname(BPMN_MODEL_NS, "participant")) if p.get("processRef") == process.get("id")), None)
+    name = (participant.get("name") if participant is not None else None) or process.get("name") or ""
+    lines = [f"process {_clean_name(name)}"]
+
+    elements = {}
+    for child in process:
+        line = _element_line(child)
+        if line:
+            elements[child.get("id")] = line
+
+    lanes = []
+    lane_set = process.find(qname(BPMN_MODEL_NS, "laneSet"))
+    if lane_set is not None:
+        for lane in lane_set.findall(qname(BPMN_MODEL_NS, "lane")):
+            refs = {(ref.text or "").strip() for ref in lane.iter(qname(BPMN_MODEL_NS, "flowNodeRef"))}
+            lanes.append((_clean_name(lane.get("name")), [element_id for element_id in elements if element_id in refs]))
+
+    # Elements outside of all lanes come first, so they are not assigned to a lane
+    in_lanes = {element_id for _, element_ids in lanes for element_id in element_ids}
+    lines += [elements[element_id] for element_id in elements if element_id not in in_lanes]
+    for lane_name, element_ids in lanes:
+        lines.append(f"lane {lane_name}")
+        lines += [f"  {elements[element_id]}" for element_id in element_ids]
+
+    lines.append("flow")
+    lines += [f"  {chain}" for chain in _flow_chains(process, elements)]
+    return "\n".join(lines) + "\n"
+
+def _flow_chains(process, elements):
+    """Join sequence flows into chains "A -> B -> C" where an element has exactly one outgoing flow."""
+    flows = [
+        (flow.get("sourceRef"), flow.get("targetRef"), _clean_name(flow.get("name")).replace("]", ")"))
+        for flow in process.findall(qname(BPMN_MODEL_NS, "sequenceFlow"))
+        if flow.get("sourceRef") in elements and flow.get("targetRef") in elements
+    ]
+    outgoing = {}
+    for index, (source, _, _) in enumerate(flows):
+        outgoing.setdefault(source, []).append(index)
+
+    # Chains are written in the order the process is walked from its start elements
+    targets = {target for _, target, _ in flows}
+    visit_order = {}
+    queue = [element_id for element_id in elements if element_id not in targets] + list(elements)
+    while queue:
+        element_id = queue.pop(0)
+        if element_id in visit_order:
+            continue
+        visit_order[element_id] = len(visit_order)
+        queue[0:0] = [flows[index][1] for index in outgoing.get(element_id, [])]
+    order = sorted(range(len(flows)), key=lambda index: (visit_order[flows[index][0]], index))
+
+    used = set()
+    chains = []
+    for index in order:
+        if index in used:
+            continue
+        source, target, label = flows[index]
+        used.add(index)
+        chain = source + (f" -[{label}]-> " if label else " -> ") + target
+
+        # Continue through elements with a single outgoing flow
+        while len(outgoing.get(target, [])) == 1 and outgoing[target][0] not in used:
+            next_index = outgoing[target][0]
+            used.add(next_index)
+            _, target, label = flows[next_index]
+            chain += (f" -[{label}]-> " if label else " -> ") + target
+        chains.append(chain)
+    return chains
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert between the compact process format and BPMN 2.0 XML.")
+    parser.add_argument("command", choices=("compile", "decompile"))
+    parser.add_argument("file", help="Process description (compile) or BPMN file (decompile)")
+    parser.add_argument("--no-layout", action="store_true", help="compile: write only the process model without diagram")
+    args = parser.parse_args(argv)
+
+    with open(args.file, "r", encoding="utf-8") as f:
+        content = f.read()
+
+    try:
+        if args.command == "compile":
+            output = compile_dsl(content, with_layout=not args.no_layout)
+        else:
+            output = decompile_bpmn(content)
+    except DslError as e:
+        print(f"ERROR: {str(e)}", file=sys.stderr)
+        return 1
+
+    sys.stdout.write(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
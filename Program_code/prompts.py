@@ -0,0 +1,114 @@
+"""
+Named variants of the system prompts of the generation modes.
+
+The prompt of every generation mode (main.SYSTEM_PROMPT_FILES) is its "default" variant. Further
+variants are text files in the variant directory, one subdirectory per mode:
+
+    prompts/full/compact.txt      -> variant "compact" of the "full" mode
+    prompts/semantic/short.txt    -> variant "short" of the "semantic" mode
+
+A variant is selected per request (form field prompt_variant, batch.py --prompt-variant); unknown
+variants fall back to the default one, which PROMPT_VARIANT can switch for the whole server once a
+variant has proven itself. Generations are counted per variant in the metrics (label "prompt"), and
+compare_prompts.py measures tokens, latency and validation rate of the variants on the evaluation
+corpus - so a shorter prompt can be tried without replacing the file in production.
+"""
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VARIANT = "default"
+# Label of system prompts that are neither a default prompt nor a registered variant
+CUSTOM_VARIANT = "custom"
+
+VARIANT_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,39}$")
+
+# Rough characters per token of the (mostly Slovak) prompts, same estimate as main.CHARS_PER_TOKEN
+CHARS_PER_TOKEN = 3.5
+
+
+class PromptRegistry:
+    """
+    System prompt files by generation mode and variant name.
+    Variant files are looked up on every call, so a new file is usable without a restart.
+    """
+
+    def __init__(self, base_dir, default_files, variant_dir="prompts", default_variant=DEFAULT_VARIANT):
+        self.base_dir = base_dir
+        self.default_files = {mode: os.path.join(base_dir, filename) for mode, filename in default_files.items()}
+        self.variant_dir = os.path.join(base_dir, variant_dir)
+        self.default_variant = default_variant
+
+    def _variant_path(self, mode, variant):
+        return os.path.join(self.variant_dir, mode, variant + ".txt")
+
+    def variants(self, mode):
+        """Return variant names of a generation mode, "default" first."""
+        directory = os.path.join(self.variant_dir, mode)
+        names = []
+        if os.path.isdir(directory):
+            names = sorted(os.path.splitext(filename)[0] for filename in os.listdir(directory)
+                           if filename.endswith(".txt") and VARIANT_NAME.match(os.path.splitext(filename)[0]))
+        return [DEFAULT_VARIANT] + [name for name in names if name != DEFAULT_VARIANT]
+
+    def has_variant(self, mode, variant):
+        if mode not in self.default_files or not variant or not VARIANT_NAME.match(variant):
+            return False
+        return variant == DEFAULT_VARIANT or os.path.isfile(self._variant_path(mode, variant))
+
+    def resolve(self, mode, variant=None):
+        """
+        Return (variant name, path of the prompt file) for a generation mode.
+        Without a variant, and for variants that do not exist for the mode, the server default is used.
+        """
+        if not self.has_variant(mode, variant):
+            if variant:
+                logger.warning(f"Unknown prompt variant '{variant}' of mode '{mode}', using '{self.default_variant}'")
+            variant = self.default_variant if self.has_variant(mode, self.default_variant) else DEFAULT_VARIANT
+        if variant == DEFAULT_VARIANT:
+            return variant, self.default_files[mode]
+        return variant, self._variant_path(mode, variant)
+
+    def path(self, mode, variant=None):
+        """Return the path of the prompt file of a generation mode and variant."""
+        return self.resolve(mode, variant)[1]
+
+    def variant_of(self, system_prompt_file):
+        """Return the variant name of a prompt file path - "custom" for files outside the registry."""
+        if not system_prompt_file:
+            return CUSTOM_VARIANT
+        path = os.path.abspath(system_prompt_file)
+        if path in {os.path.abspath(default) for default in self.default_files.values()}:
+            return DEFAULT_VARIANT
+        directory, filename = os.path.split(path)
+        if os.path.dirname(directory) == os.path.abspath(self.variant_dir) and filename.endswith(".txt"):
+            return os.path.splitext(filename)[0]
+        return CUSTOM_VARIANT
+
+    def paths(self):
+        """Return paths of all prompt files (default prompts and variants)."""
+        return [self.path(mode, variant) for mode in self.default_files for variant in self.variants(mode)]
+
+    def describe(self):
+        """Return {mode: [{"name", "file", "chars", "estimated_tokens"}]} of all variants, for the /prompts route."""
+        description = {}
+        for mode in self.default_files:
+            entries = []
+            for variant in self.variants(mode):
+                path = self.path(mode, variant)
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        chars = len(f.read())
+                except OSError:
+                    continue
+                entries.append({
+                    "name": variant,
+                    "file": os.path.relpath(path, self.base_dir),
+                    "chars": chars,
+                    "estimated_tokens": int(chars / CHARS_PER_TOKEN),
+                    "active": variant == self.resolve(mode)[0],
+                })
+            description[mode] = entries
+        return description
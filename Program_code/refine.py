@@ -0,0 +1,525 @@
+"""
+Refinement of an existing diagram with edit operations.
+
+When the user changes a description of an already generated diagram, the model gets the current
+diagram in the compact process format (process_dsl.py) together with the new description and
+answers only with the changes, one operation per line:
+
+    lane Recenzent                      select the lane for following add/move lines (created if missing)
+    add task T9 Over úplnosť dokumentu  add an element (element line of process_dsl.py)
+    move T4                             move an element to the selected lane
+    remove T5                           remove an element with its sequence flows
+    rename T2 Skontroluj obsah          rename an element
+    connect T2 -> T9 -[Áno]-> G1        add sequence flows (flow chain of process_dsl.py)
+    disconnect T2 -> G1                 remove sequence flows
+    process Schválenie zmluvy           rename the pool
+
+apply_edits applies the operations to the stored BPMN document. The diagram drawn so far is kept,
+including changes the user made in the modeler: added elements are placed next to their neighbours,
+moved elements are shifted into their new lane, new lanes are added below the others and only the
+edges of changed flows are drawn again. The diagram section is computed by layout.py only for
+documents without one, or when lanes are added to a diagram drawn without lanes.
+
+Usage:
+    python refine.py diagram.bpmn edits.txt > refined.bpmn
+"""
+import re
+import sys
+import argparse
+import xml.etree.ElementTree as ET
+
+import layout
+import process_dsl
+from layout import BPMN_MODEL_NS, BPMN_DI_NS, DC_NS, qname, split_tag
+from process_dsl import DslError, ID_PATTERN
+
+OPERATIONS = ("lane", "add", "move", "remove", "rename", "connect", "disconnect", "process")
+
+# Free space kept around a shape placed into the kept diagram (px)
+SHAPE_GAP = 20
+
+# Children of a flow node that precede incoming/outgoing references
+LEADING_CHILDREN = ("documentation", "extensionElements")
+
+# Process children that must follow all flow elements
+ARTIFACT_TAGS = ("textAnnotation", "association", "group")
+
+ID_LINE = re.compile(rf"^(?P<id>{ID_PATTERN})(?:\s+(?P<rest>.*))?$")
+
+
+class EditParser:
+    """
+    Line-by-line parser of edit operations, usable while the answer is streamed (same interface
+    as process_dsl.DslParser). Parsed operations are collected as (operation, arguments, line number).
+    """
+
+    def __init__(self):
+        self.operations = []
+        self.line_number = 0
+        self.lane = None
+
+    def feed_line(self, line):
+        """Parse one line. Returns the operation name or None for ignored lines."""
+        self.line_number += 1
+        line = line.strip()
+
+        # Empty lines, comments and code fences around the answer are ignored
+        if not line or line.startswith(("#", "```")):
+            return None
+
+        operation, _, rest = line.partition(" ")
+        rest = rest.strip()
+        if operation not in OPERATIONS:
+            raise DslError(f"unknown operation '{operation[:30]}'", self.line_number)
+
+        if operation in ("lane", "process"):
+            if not rest and operation == "lane":
+                raise DslError("lane needs a name", self.line_number)
+            arguments = rest.rstrip(":")
+            if operation == "lane":
+                self.lane = arguments
+        elif operation == "add":
+            arguments = process_dsl.parse_element(rest, self.line_number)
+        elif operation in ("connect", "disconnect"):
+            arguments = process_dsl.parse_flow(rest, self.line_number)
+        else:
+            match = ID_LINE.match(rest)
+            if not match or (operation == "rename") != bool(match.group("rest")):
+                raise DslError(f"cannot parse '{line[:60]}'", self.line_number)
+            arguments = (match.group("id"), (match.group("rest") or "").strip())
+
+        if operation in ("add", "move") and self.lane is None:
+            raise DslError(f"'{operation}' needs a preceding lane line", self.line_number)
+
+        self.operations.append((operation, arguments, self.line_number))
+        return operation
+
+    def finish(self):
+        """Return the parsed operations."""
+        return self.operations
+
+
+def parse_edits(text):
+    """Parse a complete answer with edit operations. Raises DslError."""
+    parser = EditParser()
+    for line in text.splitlines():
+        parser.feed_line(line)
+    return parser.finish()
+
+
+def describe_diagram(xml_text):
+    """Return the diagram in the compact process format, as it is sent to the model."""
+    return process_dsl.decompile_bpmn(xml_text)
+
+
+class DiagramEditor:
+    """Applies edit operations to the first process of a parsed BPMN document."""
+
+    def __init__(self, root):
+        self.root = root
+        self.process = root.find(qname(BPMN_MODEL_NS, "process"))
+        if self.process is None:
+            raise DslError("document has no process")
+
+        self.participant = next((p for p in root.iter(qname(BPMN_MODEL_NS, "participant")) if p.get("processRef") == self.process.get("id")), None)
+        self.ids = {element.get("id") for element in root.iter() if element.get("id")}
+        # Dangling flow references must not be matched by new flow ids
+        self.ids.update((element.text or "").strip() for element in root.iter() if split_tag(element.tag)[1] in ("incoming", "outgoing"))
+        self.plane = root.find(f"{qname(BPMN_DI_NS, 'BPMNDiagram')}/{qname(BPMN_DI_NS, 'BPMNPlane')}")
+        self.relayout = self.plane is None
+        self.new_flows = []
+        self.moved = []
+        self.lane = None
+
+    # Lookups
+
+    def nodes(self):
+        """Flow nodes of the process by id."""
+        return {child.get("id"): child for child in self.process if layout.is_flow_node(split_tag(child.tag)[1])}
+
+    def node(self, element_id, line):
+        node = self.nodes().get(element_id)
+        if node is None:
+            raise DslError(f"unknown element '{element_id}'", line)
+        return node
+
+    def flows(self):
+        return self.process.findall(qname(BPMN_MODEL_NS, "sequenceFlow"))
+
+    def lanes(self):
+        return list(self.process.iter(qname(BPMN_MODEL_NS, "lane")))
+
+    def lane_of(self, node_id):
+        for lane in self.lanes():
+            if any((reference.text or "").strip() == node_id for reference in lane.findall(qname(BPMN_MODEL_NS, "flowNodeRef"))):
+                return lane
+        return None
+
+    def unique_id(self, prefix):
+        index = 1
+        while f"{prefix}_{index}" in self.ids:
+            index += 1
+        self.ids.add(f"{prefix}_{index}")
+        return f"{prefix}_{index}"
+
+    # Document changes
+
+    def insert_flow_element(self, element):
+        """Add a flow element to the process before its artifacts (BPMN schema order)."""
+        for index, child in enumerate(self.process):
+            if split_tag(child.tag)[1] in ARTIFACT_TAGS:
+                self.process.insert(index, element)
+                return
+        self.process.append(element)
+
+    def remove_diagram_element(self, element_id):
+        if self.plane is None:
+            return
+        for element in list(self.plane):
+            if element.get("bpmnElement") == element_id:
+                self.plane.remove(element)
+
+    def add_reference(self, node, kind, flow_id):
+        """Add an incoming/outgoing reference at its schema position."""
+        preceding = LEADING_CHILDREN + (("incoming",) if kind == "incoming" else ("incoming", "outgoing"))
+        index = 0
+        while index < len(node) and split_tag(node[index].tag)[1] in preceding:
+            index += 1
+        reference = ET.Element(qname(BPMN_MODEL_NS, kind))
+        reference.text = flow_id
+        node.insert(index, reference)
+
+    def remove_flow(self, flow):
+        flow_id = flow.get("id")
+        for node in self.nodes().values():
+            for reference in list(node):
+                if split_tag(reference.tag)[1] in ("incoming", "outgoing") and (reference.text or "").strip() == flow_id:
+                    node.remove(reference)
+        self.process.remove(flow)
+        self.remove_diagram_element(flow_id)
+
+    def set_lane(self, node_id):
+        """Put a flow node into the selected lane (and out of all others)."""
+        for lane in self.lanes():
+            for reference in lane.findall(qname(BPMN_MODEL_NS, "flowNodeRef")):
+                if (reference.text or "").strip() == node_id:
+                    lane.remove(reference)
+        ET.SubElement(self.lane, qname(BPMN_MODEL_NS, "flowNodeRef")).text = node_id
+
+    # Operations
+
+    def apply(self, operation, arguments, line):
+        getattr(self, f"op_{operation}")(arguments, line)
+
+    def op_process(self, name, line):
+        target = self.participant if self.participant is not None else self.process
+        target.set("name", name)
+
+    def op_lane(self, name, line):
+        self.lane = next((lane for lane in self.lanes() if " ".join((lane.get("name") or "").split()) == name), None)
+        if self.lane is None:
+            lane_set = self.process.find(qname(BPMN_MODEL_NS, "laneSet"))
+            if lane_set is None:
+                lane_set = ET.Element(qname(BPMN_MODEL_NS, "laneSet"), id=self.unique_id("LaneSet"))
+                self.process.insert(0, lane_set)
+            self.lane = ET.SubElement(lane_set, qname(BPMN_MODEL_NS, "lane"), id=self.unique_id("Lane"), name=name)
+
+    def op_add(self, arguments, line):
+        element_id, element = arguments
+        if element_id in self.ids:
+            raise DslError(f"duplicate element id '{element_id}'", line)
+        if element["host"]:
+            self.node(element["host"], line)
+
+        attributes = {"id": element_id}
+        if element["name"]:
+            attributes["name"] = element["name"]
+        if element["host"]:
+            attributes["attachedToRef"] = element["host"]
+        node = ET.Element(qname(BPMN_MODEL_NS, element["tag"]), attributes)
+        if element["definition"]:
+            ET.SubElement(node, qname(BPMN_MODEL_NS, f"{element['definition']}EventDefinition"), id=f"{element_id}_definition")
+
+        self.ids.add(element_id)
+        self.insert_flow_element(node)
+        self.set_lane(element_id)
+
+    def op_move(self, arguments, line):
+        element_id, _ = arguments
+        self.node(element_id, line)
+        self.set_lane(element_id)
+        self.moved.append(element_id)
+
+    def op_remove(self, arguments, line):
+        element_id, _ = arguments
+        node = self.node(element_id, line)
+
+        # Boundary events cannot exist without their activity
+        for attached in [n for n in self.nodes().values() if n.get("attachedToRef") == element_id]:
+            self.op_remove((attached.get("id"), ""), line)
+        for flow in self.flows():
+            if element_id in (flow.get("sourceRef"), flow.get("targetRef")):
+                self.remove_flow(flow)
+        for lane in self.lanes():
+            for reference in lane.findall(qname(BPMN_MODEL_NS, "flowNodeRef")):
+                if (reference.text or "").strip() == element_id:
+                    lane.remove(reference)
+
+        self.process.remove(node)
+        self.remove_diagram_element(element_id)
+        self.new_flows = [flow for flow in self.new_flows if element_id not in (flow.get("sourceRef"), flow.get("targetRef"))]
+
+    def op_rename(self, arguments, line):
+        element_id, name = arguments
+        self.node(element_id, line).set("name", name)
+
+    def op_connect(self, flows, line):
+        for source, target, label in flows:
+            source_node, target_node = self.node(source, line), self.node(target, line)
+            attributes = {"id": self.unique_id("Flow"), "sourceRef": source, "targetRef": target}
+            if label:
+                attributes["name"] = label
+            flow = ET.Element(qname(BPMN_MODEL_NS, "sequenceFlow"), attributes)
+            self.insert_flow_element(flow)
+            self.add_reference(source_node, "outgoing", attributes["id"])
+            self.add_reference(target_node, "incoming", attributes["id"])
+            self.new_flows.append(flow)
+
+    def op_disconnect(self, flows, line):
+        for source, target, _ in flows:
+            matching = [flow for flow in self.flows() if flow.get("sourceRef") == source and flow.get("targetRef") == target]
+            if not matching:
+                raise DslError(f"there is no flow {source} -> {target}", line)
+            for flow in matching:
+                self.remove_flow(flow)
+            self.new_flows = [flow for flow in self.new_flows if flow not in matching]
+
+    # Diagram
+
+    def shapes(self):
+        """BPMNShape elements of the kept diagram by element id."""
+        return {shape.get("bpmnElement"): shape for shape in self.plane.findall(qname(BPMN_DI_NS, "BPMNShape"))}
+
+    def insert_shape(self, shape):
+        """Move a shape appended to the plane before the edges, so edges are drawn on top."""
+        edges = [index for index, child in enumerate(self.plane) if split_tag(child.tag)[1] == "BPMNEdge"]
+        if edges:
+            self.plane.remove(shape)
+            self.plane.insert(edges[0], shape)
+
+    @staticmethod
+    def read_bounds(shape):
+        box = shape.find(qname(DC_NS, "Bounds"))
+        if box is None:
+            return None
+        return tuple(int(float(box.get(key, 0))) for key in ("x", "y", "width", "height"))
+
+    @staticmethod
+    def shift_shape(shape, dx, dy):
+        """Move a shape with its label."""
+        for box in shape.iter(qname(DC_NS, "Bounds")):
+            box.set("x", str(int(float(box.get("x", 0))) + dx))
+            box.set("y", str(int(float(box.get("y", 0))) + dy))
+
+    @staticmethod
+    def resize_shape(shape, width=None, height=None):
+        box = shape.find(qname(DC_NS, "Bounds"))
+        if width is not None:
+            box.set("width", str(width))
+        if height is not None:
+            box.set("height", str(height))
+
+    def lane_band(self, node_id, bounds):
+        """Bounds of the lane of a flow node, or of the pool for nodes outside of all lanes."""
+        lane = self.lane_of(node_id)
+        if lane is not None and lane.get("id") in bounds:
+            return bounds[lane.get("id")]
+        if self.participant is not None:
+            return bounds.get(self.participant.get("id"))
+        return None
+
+    @staticmethod
+    def free_x(x, y, width, height, bounds, node_ids):
+        """Shift a shape to the right until it keeps SHAPE_GAP from all other shapes."""
+        shifted = True
+        while shifted:
+            shifted = False
+            for other in node_ids:
+                ox, oy, ow, oh = bounds[other]
+                if x < ox + ow + SHAPE_GAP and ox < x + width + SHAPE_GAP and y < oy + oh + SHAPE_GAP and oy < y + height + SHAPE_GAP:
+                    x = ox + ow + SHAPE_GAP
+                    shifted = True
+        return x
+
+    def neighbour_position(self, node_id, width, height, bounds, node_ids):
+        """
+        Return (x, y) for a new shape: one column right of its predecessor, one column left of its
+        successor, or after the last shape of its lane - vertically centered on the neighbour when it is
+        in the same lane, otherwise in the middle of the lane.
+        """
+        band = self.lane_band(node_id, bounds)
+        flows = self.flows()
+        sources = [flow.get("sourceRef") for flow in flows if flow.get("targetRef") == node_id and flow.get("sourceRef") in node_ids]
+        targets = [flow.get("targetRef") for flow in flows if flow.get("sourceRef") == node_id and flow.get("targetRef") in node_ids]
+
+        if sources:
+            nx, ny, nw, nh = bounds[sources[0]]
+            x, cy = nx + nw // 2 + layout.COLUMN_WIDTH - width // 2, ny + nh // 2
+        elif targets:
+            nx, ny, nw, nh = bounds[targets[0]]
+            x, cy = nx + nw // 2 - layout.COLUMN_WIDTH - width // 2, ny + nh // 2
+        else:
+            in_band = [bounds[other] for other in node_ids
+                       if band is None or band[1] <= bounds[other][1] + bounds[other][3] // 2 < band[1] + band[3]]
+            x = max((ox + ow for ox, _, ow, _ in in_band), default=band[0] + layout.LANE_HEADER if band else layout.POOL_X) + layout.CONTENT_MARGIN
+            cy = band[1] + band[3] // 2 if band else min(oy + oh // 2 for _, oy, _, oh in in_band)
+
+        if band is not None:
+            if not band[1] <= cy < band[1] + band[3]:
+                cy = band[1] + band[3] // 2
+            x = max(x, band[0] + layout.LANE_HEADER + SHAPE_GAP)
+        return x, cy - height // 2
+
+    def update_diagram(self):
+        """
+        Update the kept diagram section for the applied operations - all shapes that were not added
+        or moved keep their bounds. Returns False when the diagram cannot be kept (no shapes at all,
+        or lanes added to a diagram drawn without lanes).
+        """
+        shapes = self.shapes()
+        bounds = {element_id: self.read_bounds(shape) for element_id, shape in shapes.items() if self.read_bounds(shape)}
+        nodes = self.nodes()
+        node_ids = [node_id for node_id in nodes if node_id in bounds]
+        if not node_ids:
+            return False
+
+        # New lanes below the lowest one, as wide as the others
+        lane_ids = [lane.get("id") for lane in self.lanes()]
+        drawn_lanes = [lane_id for lane_id in lane_ids if lane_id in bounds]
+        for lane_id in lane_ids:
+            if lane_id in bounds:
+                continue
+            if not drawn_lanes:
+                return False
+            x, _, width, _ = bounds[drawn_lanes[0]]
+            y = max(bounds[other][1] + bounds[other][3] for other in drawn_lanes)
+            bounds[lane_id] = (x, y, width, layout.ROW_HEIGHT + 2 * layout.LANE_PADDING)
+            shape = ET.SubElement(self.plane, qname(BPMN_DI_NS, "BPMNShape"), id=f"{lane_id}_di", bpmnElement=lane_id, isHorizontal="true")
+            ET.SubElement(shape, qname(DC_NS, "Bounds"), **{key: str(value) for key, value in zip(("x", "y", "width", "height"), bounds[lane_id])})
+            ET.SubElement(shape, qname(BPMN_DI_NS, "BPMNLabel"))
+            self.insert_shape(shape)
+            shapes[lane_id] = shape
+            drawn_lanes.append(lane_id)
+
+        # Moved elements (with their boundary events) are shifted into the middle of their new lane
+        changed = set()
+        for node_id in dict.fromkeys(self.moved):
+            band = self.lane_band(node_id, bounds)
+            if node_id not in bounds or band is None:
+                continue
+            x, y, width, height = bounds[node_id]
+            if band[1] <= y + height // 2 < band[1] + band[3]:
+                continue
+            others = [other for other in node_ids if other != node_id and nodes[other].get("attachedToRef") != node_id]
+            new_y = band[1] + (band[3] - height) // 2
+            new_x = self.free_x(x, new_y, width, height, bounds, others)
+            for moved_id in [node_id] + [other for other in node_ids if nodes[other].get("attachedToRef") == node_id]:
+                self.shift_shape(shapes[moved_id], new_x - x, new_y - y)
+                mx, my, mw, mh = bounds[moved_id]
+                bounds[moved_id] = (mx + new_x - x, my + new_y - y, mw, mh)
+                changed.add(moved_id)
+
+        # Elements without a shape (added ones) are placed next to their neighbours
+        for node_id, node in nodes.items():
+            if node_id in bounds:
+                continue
+            kind = split_tag(node.tag)[1]
+            width, height = layout.shape_size(kind)
+            host = node.get("attachedToRef")
+            if host in bounds:
+                hx, hy, hw, hh = bounds[host]
+                x, y = hx + hw - width - SHAPE_GAP // 2, hy + hh - height // 2
+            else:
+                x, y = self.neighbour_position(node_id, width, height, bounds, node_ids)
+                x = self.free_x(x, y, width, height, bounds, node_ids)
+            self.insert_shape(layout.add_node_shape(self.plane, node_id, kind, node.get("name") or "", x, y))
+            bounds[node_id] = (x, y, width, height)
+            node_ids.append(node_id)
+            changed.add(node_id)
+
+        # The pool and its lanes grow to the right and down to hold new shapes and lanes
+        right = max(bounds[node_id][0] + bounds[node_id][2] for node_id in node_ids) + layout.CONTENT_MARGIN
+        for lane_id in drawn_lanes:
+            x, _, width, _ = bounds[lane_id]
+            if x + width < right:
+                self.resize_shape(shapes[lane_id], width=right - x)
+        pool_id = self.participant.get("id") if self.participant is not None else None
+        if pool_id in bounds:
+            x, y, width, height = bounds[pool_id]
+            bottom = max([y + height] + [bounds[lane_id][1] + bounds[lane_id][3] for lane_id in drawn_lanes])
+            self.resize_shape(shapes[pool_id], width=max(width, right - x), height=bottom - y)
+
+        # Edges of new flows and of flows at placed or moved elements are drawn again
+        for flow in self.flows():
+            source, target = flow.get("sourceRef"), flow.get("targetRef")
+            if flow not in self.new_flows and source not in changed and target not in changed:
+                continue
+            if source not in bounds or target not in bounds:
+                continue
+            self.remove_diagram_element(flow.get("id"))
+            layout.add_flow_edge(self.plane, flow.get("id"), bounds[source], bounds[target], flow.get("name") or "")
+        return True
+
+    def to_xml(self):
+        if self.relayout or not self.update_diagram():
+            return layout.layout_tree(self.root)
+        ET.indent(self.root, space="  ")
+        return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(self.root, encoding="unicode")
+
+
+def apply_edits(xml_text, edits):
+    """
+    Apply edit operations (text or the result of parse_edits) to a BPMN document and return the new document.
+    Raises DslError for invalid operations or documents.
+    """
+    operations = parse_edits(edits) if isinstance(edits, str) else edits
+    try:
+        root = layout.parse_document(xml_text)
+    except ET.ParseError as e:
+        raise DslError(f"malformed XML: {str(e)}")
+
+    editor = DiagramEditor(root)
+    for operation, arguments, line in operations:
+        editor.apply(operation, arguments, line)
+
+    if not editor.nodes():
+        raise DslError("refined process contains no elements")
+    try:
+        return editor.to_xml()
+    except layout.LayoutError as e:
+        raise DslError(str(e))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply edit operations to a BPMN diagram.")
+    parser.add_argument("diagram", help="BPMN file")
+    parser.add_argument("edits", help="File with edit operations")
+    args = parser.parse_args(argv)
+
+    with open(args.diagram, "r", encoding="utf-8") as f:
+        xml_text = f.read()
+    with open(args.edits, "r", encoding="utf-8") as f:
+        edits = f.read()
+
+    try:
+        output = apply_edits(xml_text, edits)
+    except DslError as e:
+        print(f"ERROR: {str(e)}", file=sys.stderr)
+        return 1
+
+    sys.stdout.write(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text):
+    """
+    Normalize process description so that cosmetic differences do not produce different cache keys.
+    Unifies line endings and Unicode form, strips trailing whitespace and collapses blank lines.
+    """
+    text = unicodedata.normalize("NFC", text or "")
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+
+    lines = []
+    for line in text.split("\n"):
+        line = " ".join(line.split())
+        # Keep at most one empty line between paragraphs
+        if not line and (not lines or not lines[-1]):
+            continue
+        lines.append(line)
+
+    return "\n".join(lines).strip()
+
+def make_cache_key(system_prompt, text, model, temperature, max_tokens, variant=""):
+    """
+    Build a content-addressed cache key from everything that influences the model output.
+    variant distinguishes different post-processing of the same model output (e.g. automatic layout).
+    """
+    fields = {
+        "system_prompt": hashlib.sha256((system_prompt or "").encode("utf-8")).hexdigest(),
+        "text": normalize_text(text),
+        "model": model,
+        "temperature": float(temperature),
+        "max_tokens": int(max_tokens),
+    }
+    # Keys of entries without a variant stay the same as before variants existed
+    if variant:
+        fields["variant"] = variant
+    payload = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache for generated diagrams.
+
+    Memory tier: bounded LRU dictionary local to the process.
+    Disk tier: SQLite database shared by all processes using the same file,
+    bounded by total size of stored diagrams and by entry age (TTL).
+
+    Entries are served only for temperature 0 (deterministic output) unless forced.
+    """
+
+    def __init__(self, db_path, memory_entries=128, max_disk_bytes=200 * 1024 * 1024, ttl=7 * 24 * 3600, enabled=True):
+        self.db_path = db_path
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "bypassed": 0}
+
+        self._db_ready = False
+        self._db_lock = threading.Lock()
+
+    def _connect(self):
+        """Open a new SQLite connection; the database is created on first use, not when the object is made."""
+        if not self._db_ready:
+            with self._db_lock:
+                if not self._db_ready:
+                    self._init_db()
+                    self._db_ready = True
+        return self._open()
+
+    def _open(self):
+        """Open a new SQLite connection - one per operation keeps it safe across threads and processes."""
+        connection = sqlite3.connect(self.db_path, timeout=10)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def _init_db(self):
+        """Create the cache database and table if they do not exist yet."""
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._open() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    entry TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)")
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def can_serve(self, temperature, force=False):
+        """Return True if a cached entry may be returned for the given temperature."""
+        return self.enabled and (force or float(temperature) == 0)
+
+    def get(self, key, temperature=0, force=False):
+        """
+        Look up a stored result.
+        Returns the stored entry dictionary, or None on miss or when serving is not allowed.
+        """
+        if not self.can_serve(temperature, force):
+            self._count("bypassed")
+            return None
+
+        now = time.time()
+
+        # Memory tier
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                entry, created_at = item
+                if now - created_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return dict(entry)
+                del self._memory[key]
+
+        # Disk tier
+        if self.db_path:
+            try:
+                with self._connect() as connection:
+                    row = connection.execute(
+                        "SELECT entry, created_at FROM results WHERE key = ? AND created_at >= ?",
+                        (key, now - self.ttl)
+                    ).fetchone()
+                    if row is not None:
+                        connection.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+                        entry = json.loads(row["entry"])
+                        self._remember(key, entry, row["created_at"])
+                        self._count("disk_hits")
+                        return dict(entry)
+            except sqlite3.Error as e:
+                logger.warning(f"Result cache read failed: {str(e)}")
+
+        self._count("misses")
+        return None
+
+    def put(self, key, entry):
+        """Store a result in both tiers and evict old entries if limits are exceeded."""
+        if not self.enabled:
+            return
+
+        now = time.time()
+        self._remember(key, entry, now)
+        self._count("stores")
+
+        if not self.db_path:
+            return
+
+        serialized = json.dumps(entry, ensure_ascii=False)
+        try:
+            with self._connect() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO results (key, entry, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, serialized, len(serialized), now, now)
+                )
+                self._evict(connection, now)
+        except sqlite3.Error as e:
+            logger.warning(f"Result cache write failed: {str(e)}")
+
+    def _remember(self, key, entry, created_at):
+        """Insert entry into the memory tier, dropping least recently used entries over the limit."""
+        with self._lock:
+            self._memory[key] = (dict(entry), created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _evict(self, connection, now):
+        """Remove expired entries and least recently used entries over the size limit from disk tier."""
+        connection.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl,))
+
+        total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total_size <= self.max_disk_bytes:
+            return
+
+        excess = total_size - self.max_disk_bytes
+        removed = 0
+        for row in connection.execute("SELECT key, size FROM results ORDER BY accessed_at ASC").fetchall():
+            if removed >= excess:
+                break
+            connection.execute("DELETE FROM results WHERE key = ?", (row["key"],))
+            removed += row["size"]
+
+    def clear(self):
+        """Remove all entries from both tiers."""
+        with self._lock:
+            self._memory.clear()
+        if self.db_path:
+            with self._connect() as connection:
+                connection.execute("DELETE FROM results")
+
+    def stats(self):
+        """Return hit/miss counters and current tier sizes."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+
+        if self.enabled and self.db_path:
+            try:
+                with self._connect() as connection:
+                    row = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+                    stats["disk_entries"], stats["disk_bytes"] = row[0], row[1]
+            except sqlite3.Error:
+                pass
+
+        return stats
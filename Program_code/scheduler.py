@@ -0,0 +1,534 @@
+"""
+Resilient scheduling of streaming model calls: retries, timeouts, hedging and model fallback.
+
+A generation is one or more attempts, each a streaming API call running in its own thread:
+- failed attempts (overloaded, rate limited, server errors, timeouts, lost connection) are
+  repeated after an exponential backoff with full jitter, or Retry-After if the API sends it
+- an attempt that does not stream its first text in time is cancelled; the time limit follows
+  the observed time-to-first-token percentiles of the model
+- for models with hedging enabled, when the first text does not arrive within the usual time
+  (hedge delay), a second attempt is started, optionally on a faster model; the attempt that
+  starts writing first is used and the other one is cancelled
+- after the retries of a model are used up, the next model of its fallback chain is tried
+
+The caller gets events of the attempt that is being used. ("attempt", info) marks the start
+of an attempt's output - after a failure in the middle of a response the output starts again
+with a new ("attempt", info), so everything received before it must be discarded.
+"""
+import time
+import queue
+import random
+import logging
+import threading
+from collections import deque
+
+import httpx
+from anthropic import AnthropicError, APIConnectionError, APIStatusError, APITimeoutError
+
+from admission import CHARS_PER_TOKEN, estimate_input_tokens
+
+logger = logging.getLogger(__name__)
+
+# HTTP status codes worth another attempt: rate limit, server errors, overloaded
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504, 529)
+# Error types sent in the body (also inside a stream that already started with status 200)
+RETRYABLE_ERROR_TYPES = ("overloaded_error", "rate_limit_error", "api_error", "timeout_error")
+# Errors after which the same model is not tried again, but the fallback models are
+SKIP_MODEL_STATUS_CODES = (404,)
+
+
+class FirstTokenTimeout(AnthropicError):
+    """Raised when the model did not start writing within the first token timeout."""
+
+
+def error_type(error):
+    """Return the API error type ("overloaded_error", ...) of an APIStatusError, if known."""
+    body = getattr(error, "body", None)
+    if isinstance(body, dict):
+        details = body.get("error", body)
+        if isinstance(details, dict):
+            return details.get("type")
+    return None
+
+def is_retryable(error):
+    """Return True for errors that another attempt may not run into."""
+    if isinstance(error, (FirstTokenTimeout, APITimeoutError, APIConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error_type(error) in RETRYABLE_ERROR_TYPES
+    return False
+
+def retry_after(error):
+    """Return the delay requested by the API (Retry-After header) in seconds, or None."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_hedge_models(value):
+    """
+    Parse the models with hedging enabled from "model,model=hedge model,..." - a model without
+    "=hedge model" is hedged with a second attempt on the same model.
+    """
+    hedge_models = {}
+    for entry in (value or "").split(","):
+        model, _, hedge_model = entry.partition("=")
+        if model.strip():
+            hedge_models[model.strip()] = hedge_model.strip() or model.strip()
+    return hedge_models
+
+def _input_usage(usage):
+    """Input tokens of a usage object that count towards the rate limits (without prompt cache reads)."""
+    return (usage.input_tokens or 0) + (getattr(usage, "cache_creation_input_tokens", 0) or 0)
+
+def _request_input_tokens(request):
+    """Estimate input tokens of a messages request from its system prompt (text or blocks) and messages."""
+    system = request.get("system")
+    if isinstance(system, list):
+        system = "".join(block.get("text", "") for block in system if isinstance(block, dict))
+    contents = [message.get("content") for message in request.get("messages", [])]
+    return estimate_input_tokens(system, *(content if isinstance(content, str) else str(content) for content in contents))
+
+
+class LatencyTracker:
+    """Recent time-to-first-token and total durations of successful calls per model."""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, metric, seconds):
+        with self._lock:
+            key = (model, metric)
+            if key not in self._samples:
+                self._samples[key] = deque(maxlen=self.window)
+            self._samples[key].append(seconds)
+
+    def percentile(self, model, metric, q, min_samples=1):
+        """Return the q-th percentile (0-100) of a metric, or None with fewer than min_samples samples."""
+        with self._lock:
+            samples = sorted(self._samples.get((model, metric), ()))
+        if len(samples) < max(min_samples, 1):
+            return None
+        return samples[min(len(samples) - 1, int(round(q / 100 * (len(samples) - 1))))]
+
+    def summary(self):
+        """Return {model: {metric: {"count", "p50", "p95", "p99"}}} in seconds."""
+        with self._lock:
+            keys = list(self._samples)
+        summary = {}
+        for model, metric in keys:
+            summary.setdefault(model, {})[metric] = {
+                "count": len(self._samples[(model, metric)]),
+                **{f"p{q}": round(self.percentile(model, metric, q), 3) for q in (50, 95, 99)},
+            }
+        return summary
+
+
+class _Attempt:
+    """
+    One streaming API call running in a background thread; its events are put into a shared queue.
+    The admission ticket of the attempt is released when the thread ends, with the tokens the call
+    consumed - the usage of a finished call, the input and the streamed text of an aborted one.
+    """
+
+    def __init__(self, number, model, client, request, events, first_token_timeout, hedge=False, on_response=None,
+                 admission=None, ticket=None):
+        self.number = number
+        self.model = model
+        self.hedge = hedge
+        self.started_at = time.monotonic()
+        self.deadline = self.started_at + first_token_timeout
+        self.buffer = []
+        self.cancelled = threading.Event()
+        self.input_tokens = 0
+        self.input_usage = None
+        self.output_chars = 0
+        self.output_tokens = None
+        self.discarded = False
+        self._stream = None
+        self._client = client
+        self._request = request
+        self._events = events
+        self._on_response = on_response
+        self._admission = admission
+        self._ticket = ticket
+        self._ticket_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"model-attempt-{number}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            with self._client.messages.stream(model=self.model, **self._request) as stream:
+                self._stream = stream
+                self._report(stream.response)
+                for event in stream:
+                    self._consume(event)
+                    if self.cancelled.is_set():
+                        return
+                    self._events.put((self, "event", event))
+                final_message = stream.get_final_message()
+            self._consume_usage(final_message.usage)
+            # Released before the caller gets the result, so its next call sees the refund
+            self.release()
+            self._events.put((self, "final", final_message))
+        except Exception as e:
+            if isinstance(e, APIStatusError):
+                self._report(e.response)
+            self.release()
+            if not self.cancelled.is_set():
+                self._events.put((self, "error", e))
+        finally:
+            self.release()
+
+    def _consume(self, event):
+        """Follow the tokens consumed by the call (prompt cache reads do not count towards the limits)."""
+        if event.type == "message_start":
+            self.input_usage = event.message.usage
+            self.input_tokens = _input_usage(event.message.usage)
+        elif event.type == "text":
+            self.output_chars += len(event.text)
+
+    def _consume_usage(self, usage):
+        """Exact usage of a finished call."""
+        self.input_usage = usage
+        self.input_tokens = _input_usage(usage)
+        self.output_tokens = usage.output_tokens or 0
+
+    def consumed(self):
+        """Token counts of the call so far, as in API usage - output estimated from the streamed text until it finished."""
+        usage = self.input_usage
+        return {
+            "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+            "output_tokens": self.output_tokens if self.output_tokens is not None else int(self.output_chars / CHARS_PER_TOKEN),
+            "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+            "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", 0) or 0,
+        }
+
+    def release(self):
+        """Return the admission ticket with the tokens consumed so far (once)."""
+        with self._ticket_lock:
+            ticket, self._ticket = self._ticket, None
+        if ticket is None or self._admission is None:
+            return
+        try:
+            self._admission.release(ticket, self.input_tokens, self.consumed()["output_tokens"])
+        except Exception as e:
+            logger.warning(f"Admission release failed: {str(e)}")
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _report(self, response):
+        """Pass the response headers (rate limits) to the on_response callback."""
+        if self._on_response is None or response is None:
+            return
+        try:
+            self._on_response(self.model, response.headers)
+        except Exception as e:
+            logger.warning(f"Response callback failed: {str(e)}")
+
+    def cancel(self):
+        """Stop the attempt; closing the response makes the API stop generating."""
+        self.cancelled.set()
+        stream = self._stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+
+class ModelCallScheduler:
+    """
+    Runs streaming model calls with retries, per-model timeouts, hedging and a fallback chain.
+
+    fallbacks maps a model id to the models tried when it keeps failing, hedge_models maps
+    a model id to the model used for its hedged attempt - a hedge is a second paid call, so only
+    the models listed there are hedged.
+    Timeouts and the hedge delay follow the time-to-first-token percentiles observed for the model;
+    the default values are used until min_samples calls of the model have started writing. Attempts
+    that lost to a hedge or timed out are recorded with the time they waited, a lower bound of their
+    time to first token, so slow calls are not left out of the percentiles.
+    on_response(model, headers) is called with the headers of every API response, also of
+    failed attempts (e.g. to follow the rate limits of the account).
+    With admission (an AdmissionController), every attempt is admitted through the rate limits
+    of its model: retries and fallback attempts wait in the queue, a hedged attempt is only
+    started when it fits right away.
+    """
+
+    def __init__(self, fallbacks=None, hedge_models=None, attempts_per_model=2, max_attempts=4,
+                 backoff_base=1.0, backoff_max=20.0, first_token_timeout=60.0, timeout_factor=3.0,
+                 min_first_token_timeout=15.0, stream_idle_timeout=60.0,
+                 hedge_delay=10.0, hedge_percentile=95, min_hedge_delay=2.0, min_samples=10, on_response=None,
+                 admission=None, queue_event_interval=1.0):
+        self.fallbacks = fallbacks or {}
+        self.hedge_models = hedge_models or {}
+        self.attempts_per_model = attempts_per_model
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.first_token_timeout_default = first_token_timeout
+        self.timeout_factor = timeout_factor
+        self.min_first_token_timeout = min_first_token_timeout
+        self.stream_idle_timeout = stream_idle_timeout
+        self.hedge_delay_default = hedge_delay
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+        self.on_response = on_response
+        self.admission = admission
+        self.queue_event_interval = queue_event_interval
+        self.latency = LatencyTracker()
+
+        self._counters = {"calls": 0, "attempts": 0, "retries": 0, "fallbacks": 0, "hedges": 0, "hedge_wins": 0,
+                          "hedges_skipped": 0, "timeouts": 0, "failures": 0}
+        self._counters_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._counters_lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        """Return call counters and observed latency percentiles per model."""
+        with self._counters_lock:
+            counters = dict(self._counters)
+        return {**counters, "latency": self.latency.summary()}
+
+    # Policy
+
+    def model_chain(self, model):
+        """Return the model followed by its fallback models (each model once)."""
+        chain = [model]
+        for fallback in self.fallbacks.get(model, []):
+            if fallback not in chain:
+                chain.append(fallback)
+        return chain
+
+    def first_token_timeout(self, model):
+        """Time limit for the first text of an attempt - a multiple of the observed p99, within bounds."""
+        p99 = self.latency.percentile(model, "first_token", 99, self.min_samples)
+        if p99 is None:
+            return self.first_token_timeout_default
+        return min(self.first_token_timeout_default, max(self.min_first_token_timeout, p99 * self.timeout_factor))
+
+    def hedge_delay(self, model):
+        """Time after which a hedged attempt is started when no text has arrived yet."""
+        observed = self.latency.percentile(model, "first_token", self.hedge_percentile, self.min_samples)
+        if observed is None:
+            return self.hedge_delay_default
+        return max(self.min_hedge_delay, observed)
+
+    def backoff(self, retry, error):
+        """Exponential backoff with full jitter; Retry-After from the API takes precedence."""
+        requested = retry_after(error)
+        if requested is not None:
+            return min(requested, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** retry))
+
+    def _plan(self, model):
+        """Models of the attempts in order: every model of the chain attempts_per_model times."""
+        plan = [m for m in self.model_chain(model) for _ in range(self.attempts_per_model)]
+        return deque(plan[:self.max_attempts])
+
+    # Execution
+
+    def _admit(self, model, client_id, input_tokens, output_tokens):
+        """
+        Wait until an attempt on the model is admitted, yielding ("queued", {"position", "wait"})
+        meanwhile. Returns the admission ticket (None without admission control).
+        """
+        if self.admission is None:
+            return None
+        ticket = self.admission.enqueue(model, client_id, input_tokens, output_tokens)
+        try:
+            while not ticket.admitted:
+                yield "queued", {"position": ticket.position, "wait": round(ticket.wait, 1)}
+                self.admission.wait(ticket, timeout=self.queue_event_interval)
+        finally:
+            # Also when the caller stops reading while the attempt waits
+            if not ticket.admitted:
+                self.admission.release(ticket)
+        return ticket
+
+    def stream(self, client, model, ticket=None, client_id=None, expected_tokens=None, on_discarded=None, **request):
+        """
+        Generator of ("attempt", info), ("event", stream event) and ("final", final message) for
+        a streaming messages call, and ("queued", info) while a retry waits for admission.
+        Raises the last error when all attempts failed. Closing the generator cancels all running attempts.
+        ticket is the admission ticket of the first attempt - from then on owned by the scheduler,
+        which releases it when the attempt ends. Further attempts are admitted for client_id with
+        expected_tokens of output (max_tokens if not given).
+        on_discarded(model, usage) is called with the tokens of every attempt whose output is not the
+        final message - failed, timed out, losing hedged attempts and attempts cancelled by closing -
+        as they are paid for all the same.
+        """
+        self._count("calls")
+        client = client.with_options(max_retries=0)
+        request = {**request, "timeout": httpx.Timeout(self.stream_idle_timeout, connect=10.0)}
+        input_tokens = _request_input_tokens(request)
+        output_tokens = expected_tokens or request.get("max_tokens") or 0
+        plan = self._plan(model)
+        events = queue.Queue()
+        running = []
+        winner = None
+        hedge_at = None
+        pending = None
+        retries = 0
+        numbers = iter(range(1, 1000))
+
+        def start(attempt_model, hedge=False, ticket=None):
+            nonlocal hedge_at
+            attempt = _Attempt(next(numbers), attempt_model, client, request, events, self.first_token_timeout(attempt_model), hedge,
+                               self.on_response, self.admission, ticket)
+            running.append(attempt)
+            self._count("attempts")
+            if not hedge:
+                hedge_at = attempt.started_at + self.hedge_delay(attempt_model) if attempt_model in self.hedge_models else None
+            logger.info(f"Model call attempt {attempt.number} on {attempt_model}" + (" (hedged)" if hedge else ""))
+            return attempt
+
+        def discard(attempt):
+            """Report the tokens of an attempt whose output is not used (once)."""
+            if attempt.discarded or on_discarded is None:
+                return
+            attempt.discarded = True
+            try:
+                on_discarded(attempt.model, attempt.consumed())
+            except Exception as e:
+                logger.warning(f"Discarded usage callback failed: {str(e)}")
+
+        def fail(attempt, error):
+            """Handle a failed attempt; returns the error to raise, or None when work continues."""
+            nonlocal winner, retries, pending
+            discard(attempt)
+            if attempt in running:
+                running.remove(attempt)
+            if attempt is winner:
+                winner = None
+            logger.warning(f"Model call attempt {attempt.number} on {attempt.model} failed: {str(error)[:200]}")
+
+            # A parallel attempt is still running - wait for it
+            if running:
+                return None
+            if not is_retryable(error) and not (isinstance(error, APIStatusError) and error.status_code in SKIP_MODEL_STATUS_CODES):
+                return error
+            if isinstance(error, APIStatusError) and error.status_code in SKIP_MODEL_STATUS_CODES:
+                while plan and plan[0] == attempt.model:
+                    plan.popleft()
+            if not plan:
+                return error
+
+            next_model = plan.popleft()
+            delay = self.backoff(retries, error)
+            retries += 1
+            self._count("retries")
+            if next_model != attempt.model:
+                self._count("fallbacks")
+                logger.warning(f"Falling back from {attempt.model} to {next_model}")
+            logger.info(f"Retrying in {delay:.1f}s")
+            time.sleep(delay)
+            pending = next_model
+            return None
+
+        try:
+            start(plan.popleft(), ticket=ticket)
+            ticket = None
+            while True:
+                if pending is not None:
+                    # The retry waits for the rate limits of its model like any other call
+                    next_model, pending = pending, None
+                    start(next_model, ticket=(yield from self._admit(next_model, client_id, input_tokens, output_tokens)))
+
+                timeout = None
+                if winner is None:
+                    deadlines = [attempt.deadline for attempt in running]
+                    if hedge_at is not None:
+                        deadlines.append(hedge_at)
+                    timeout = max(0.0, min(deadlines) - time.monotonic())
+
+                try:
+                    attempt, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    now = time.monotonic()
+                    if hedge_at is not None and now >= hedge_at and winner is None:
+                        hedge_at = None
+                        primary = running[0].model if running else model
+                        hedge_model = self.hedge_models.get(primary, primary)
+                        # A hedge is an extra paid call - only started when the rate limits have room for it
+                        hedge_ticket = None
+                        if self.admission is not None:
+                            hedge_ticket = self.admission.try_admit(hedge_model, client_id, input_tokens, output_tokens)
+                        if self.admission is not None and hedge_ticket is None:
+                            self._count("hedges_skipped")
+                            logger.info(f"Hedged attempt on {hedge_model} skipped, rate limits used up")
+                        else:
+                            self._count("hedges")
+                            start(hedge_model, hedge=True, ticket=hedge_ticket)
+                    for late in [a for a in running if a.deadline <= now]:
+                        late.cancel()
+                        self._count("timeouts")
+                        self.latency.record(late.model, "first_token", now - late.started_at)
+                        error = fail(late, FirstTokenTimeout(f"No response from model {late.model} within {late.deadline - late.started_at:.0f}s"))
+                        if error is not None:
+                            raise error
+                    continue
+
+                if attempt.cancelled.is_set() or (winner is not None and attempt is not winner):
+                    continue
+
+                if kind == "error":
+                    error = fail(attempt, payload)
+                    if error is not None:
+                        raise error
+                    continue
+
+                if winner is None:
+                    if kind == "event":
+                        attempt.buffer.append(payload)
+                        if payload.type != "text":
+                            continue
+
+                    # First text (or a response without any) - this attempt is used, the others are stopped
+                    winner = attempt
+                    hedge_at = None
+                    now = time.monotonic()
+                    for other in [a for a in running if a is not attempt]:
+                        other.cancel()
+                        discard(other)
+                        running.remove(other)
+                        # An attempt that waited longer than the winner would have needed at least that long
+                        if other.started_at < attempt.started_at:
+                            self.latency.record(other.model, "first_token", now - other.started_at)
+                    if attempt.hedge:
+                        self._count("hedge_wins")
+                    self.latency.record(attempt.model, "first_token", now - attempt.started_at)
+                    yield "attempt", {"number": attempt.number, "model": attempt.model, "hedge": attempt.hedge}
+                    buffered, attempt.buffer = attempt.buffer, []
+                else:
+                    buffered = [payload] if kind == "event" else []
+
+                for item in buffered:
+                    yield "event", item
+
+                if kind == "final":
+                    running.remove(attempt)
+                    self.latency.record(attempt.model, "total", time.monotonic() - attempt.started_at)
+                    yield "final", payload
+                    return
+        except Exception:
+            self._count("failures")
+            raise
+        finally:
+            # Also reached when the caller stops reading (e.g. invalid output) - no attempt keeps generating
+            for attempt in running:
+                attempt.cancel()
+                discard(attempt)
+            if ticket is not None and self.admission is not None:
+                # The first attempt was never started
+                self.admission.release(ticket)
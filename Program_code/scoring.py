@@ -0,0 +1,471 @@
+"""
+Automatic quality scoring of generated BPMN diagrams.
+
+Answers the questions of Evaluation_data/evaluating_questions.txt that can be checked without
+a human, for every generated .bpmn file of a directory:
+
+- layout (from the diagram section): shapes outside the pool, unnamed elements, crossing
+  sequence flows, flows running through other shapes, overlapping shapes, too little spacing
+- structure (against the reference solution *_OPRAVENE.bpmn in the same directory): pool name,
+  number and names of lanes, activities of the reference found in the diagram (by name),
+  activities in the right lanes, added activities, start and end events, traceable flow
+
+Shape bounds and flow segments are loaded into NumPy arrays and every geometric check is
+computed for all pairs at once, so a diagram is scored in about a millisecond and a whole
+prompt or model change can be checked before deploy. Requires numpy (requirements.txt).
+
+Usage:
+    python scoring.py ../Evaluation_data/AI_data --suffix _generated --min-score 0.8
+"""
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import argparse
+import difflib
+import unicodedata
+import functools
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from layout import BPMN_MODEL_NS, BPMN_DI_NS, DC_NS, DI_NS, ACTIVITY_TAGS, qname, split_tag, is_flow_node
+
+REFERENCE_SUFFIX = "_OPRAVENE"
+
+# Shapes closer than this (px) do not have enough space between them
+MIN_SPACING = 15
+# Flows may touch the border of a shape they pass by - shapes are shrunk by this margin first
+EDGE_MARGIN = 2
+# Names with at least this similarity (0-1, after normalization) are considered the same
+NAME_SIMILARITY = 0.75
+
+# Checks of the score, in the order of evaluating_questions.txt (True = passed)
+LAYOUT_CHECKS = ("pool_bounds", "named", "no_crossings", "no_overlaps", "spacing")
+STRUCTURE_CHECKS = ("pool_name", "lane_count", "lane_names", "activity_lanes", "coverage", "no_extra",
+                    "start_event", "end_events", "traceable")
+
+# Columns of the CSV summary, in order
+SUMMARY_FIELDS = [
+    "file", "reference", "score", "error",
+    *LAYOUT_CHECKS, *STRUCTURE_CHECKS,
+    "shapes", "outside_pool", "unnamed", "crossings", "edges_through_shapes", "overlaps", "too_close",
+    "lanes", "reference_lanes", "activities", "reference_activities", "matched_activities", "extra_activities",
+]
+
+
+def normalize_name(name):
+    """Lowercase name without diacritics, punctuation and repeated whitespace."""
+    text = unicodedata.normalize("NFKD", name or "")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = "".join(char if char.isalnum() else " " for char in text.lower())
+    return " ".join(text.split())
+
+@functools.lru_cache(maxsize=65536)
+def name_similarity(name, reference_name):
+    """Similarity (0-1) of two normalized names; pairs that cannot reach NAME_SIMILARITY are not compared in full."""
+    if name == reference_name:
+        return 1.0
+    matcher = difflib.SequenceMatcher(None, name, reference_name)
+    if matcher.real_quick_ratio() < NAME_SIMILARITY or matcher.quick_ratio() < NAME_SIMILARITY:
+        return 0.0
+    return matcher.ratio()
+
+def match_names(names, reference_names):
+    """
+    Pair names with reference names greedily by similarity (best pairs first).
+    Returns [(index, reference index)] of pairs with similarity of at least NAME_SIMILARITY.
+    """
+    if not names or not reference_names:
+        return []
+    normalized = [normalize_name(name) for name in names]
+    reference = [normalize_name(name) for name in reference_names]
+    similarity = np.array([[name_similarity(a, b) for b in reference] for a in normalized])
+
+    pairs = []
+    while True:
+        index, reference_index = np.unravel_index(np.argmax(similarity), similarity.shape)
+        if similarity[index, reference_index] < NAME_SIMILARITY:
+            return pairs
+        pairs.append((int(index), int(reference_index)))
+        similarity[index, :] = -1
+        similarity[:, reference_index] = -1
+
+
+class Diagram:
+    """
+    Process model and diagram section of a BPMN document as arrays.
+
+    boxes: (n, 4) x1, y1, x2, y2 of the flow node shapes (ids in shape_ids)
+    pools, lanes: (k, 4) bounds of pool and lane shapes
+    segments: (m, 4) x1, y1, x2, y2 of the sequence flow waypoint segments, segment_edges: (m,) flow index
+    """
+
+    def __init__(self, xml_text):
+        root = ET.fromstring(xml_text.encode("utf-8"))
+
+        self.pool_names = [participant.get("name") or "" for participant in root.iter(qname(BPMN_MODEL_NS, "participant"))]
+        self.nodes = {}  # id -> (tag, name)
+        self.hosts = {}  # boundary event id -> activity id
+        self.lane_names = []
+        self.lane_of = {}  # flow node id -> lane index
+        self.flows = []  # (id, source, target)
+        for process in root.iter(qname(BPMN_MODEL_NS, "process")):
+            if not self.pool_names and process.get("name"):
+                self.pool_names.append(process.get("name"))
+            for element in process:
+                _, tag = split_tag(element.tag)
+                if is_flow_node(tag):
+                    self.nodes[element.get("id")] = (tag, element.get("name") or "")
+                    if element.get("attachedToRef"):
+                        self.hosts[element.get("id")] = element.get("attachedToRef")
+                elif tag == "sequenceFlow":
+                    self.flows.append((element.get("id"), element.get("sourceRef"), element.get("targetRef")))
+            for lane in process.iter(qname(BPMN_MODEL_NS, "lane")):
+                # Only the lowest level of nested lanes holds the flow nodes
+                if lane.find(qname(BPMN_MODEL_NS, "childLaneSet")) is not None:
+                    continue
+                for ref in lane.findall(qname(BPMN_MODEL_NS, "flowNodeRef")):
+                    self.lane_of[(ref.text or "").strip()] = len(self.lane_names)
+                self.lane_names.append(lane.get("name") or "")
+
+        self._read_diagram(root)
+
+    def _read_diagram(self, root):
+        participants = {element.get("id") for element in root.iter(qname(BPMN_MODEL_NS, "participant"))}
+        lanes = {element.get("id") for element in root.iter(qname(BPMN_MODEL_NS, "lane"))}
+        pools, lane_boxes, boxes, shape_ids = [], [], [], []
+        for shape in root.iter(qname(BPMN_DI_NS, "BPMNShape")):
+            bounds = shape.find(qname(DC_NS, "Bounds"))
+            if bounds is None:
+                continue
+            x, y = float(bounds.get("x", 0)), float(bounds.get("y", 0))
+            box = (x, y, x + float(bounds.get("width", 0)), y + float(bounds.get("height", 0)))
+            element_id = shape.get("bpmnElement")
+            if element_id in participants:
+                pools.append(box)
+            elif element_id in lanes:
+                lane_boxes.append(box)
+            elif element_id in self.nodes:
+                boxes.append(box)
+                shape_ids.append(element_id)
+
+        flow_index = {flow_id: index for index, (flow_id, _, _) in enumerate(self.flows)}
+        segments, segment_edges = [], []
+        for edge in root.iter(qname(BPMN_DI_NS, "BPMNEdge")):
+            index = flow_index.get(edge.get("bpmnElement"))
+            if index is None:
+                continue
+            points = [(float(point.get("x", 0)), float(point.get("y", 0))) for point in edge.findall(qname(DI_NS, "waypoint"))]
+            for start, end in zip(points, points[1:]):
+                segments.append(start + end)
+                segment_edges.append(index)
+
+        self.shape_ids = shape_ids
+        self.boxes = np.array(boxes, dtype=float).reshape(-1, 4)
+        self.pools = np.array(pools, dtype=float).reshape(-1, 4)
+        self.lanes = np.array(lane_boxes, dtype=float).reshape(-1, 4)
+        self.segments = np.array(segments, dtype=float).reshape(-1, 4)
+        self.segment_edges = np.array(segment_edges, dtype=int)
+
+    def activities(self):
+        """Return ids of the activities (tasks, sub-processes, call activities)."""
+        return [node_id for node_id, (tag, _) in self.nodes.items() if tag in ACTIVITY_TAGS or tag.endswith("Task")]
+
+    def has_diagram(self):
+        return len(self.boxes) > 0
+
+
+# Geometric checks - each works on all pairs at once
+
+def pairwise_overlaps(boxes):
+    """Return (n, n) boolean matrix of shapes whose interiors intersect."""
+    width = np.minimum(boxes[:, None, 2], boxes[None, :, 2]) - np.maximum(boxes[:, None, 0], boxes[None, :, 0])
+    height = np.minimum(boxes[:, None, 3], boxes[None, :, 3]) - np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+    return (width > 0) & (height > 0)
+
+def pairwise_gaps(boxes):
+    """Return (n, n) matrix of distances between the borders of shapes (0 for touching or overlapping shapes)."""
+    dx = np.maximum(0, np.maximum(boxes[None, :, 0] - boxes[:, None, 2], boxes[:, None, 0] - boxes[None, :, 2]))
+    dy = np.maximum(0, np.maximum(boxes[None, :, 1] - boxes[:, None, 3], boxes[:, None, 1] - boxes[None, :, 3]))
+    return np.hypot(dx, dy)
+
+def _orientation(ax, ay, bx, by, cx, cy):
+    return np.sign((bx - ax) * (cy - ay) - (by - ay) * (cx - ax))
+
+def pairwise_crossings(segments):
+    """
+    Return (m, m) boolean matrix of segments that properly cross each other.
+    Segments that only touch (a shared end point, a flow joining another at a shape) do not cross.
+    """
+    x1, y1, x2, y2 = (segments[:, index] for index in range(4))
+    a = _orientation(x1[:, None], y1[:, None], x2[:, None], y2[:, None], x1[None, :], y1[None, :])
+    b = _orientation(x1[:, None], y1[:, None], x2[:, None], y2[:, None], x2[None, :], y2[None, :])
+    c = _orientation(x1[None, :], y1[None, :], x2[None, :], y2[None, :], x1[:, None], y1[:, None])
+    d = _orientation(x1[None, :], y1[None, :], x2[None, :], y2[None, :], x2[:, None], y2[:, None])
+    return (a * b < 0) & (c * d < 0)
+
+def segments_through_boxes(segments, boxes, margin=EDGE_MARGIN):
+    """Return (m, n) boolean matrix of segments passing through the interior of shapes (Liang-Barsky clipping)."""
+    inner = boxes + np.array([margin, margin, -margin, -margin])
+    x1, y1 = segments[:, None, 0], segments[:, None, 1]
+    dx, dy = segments[:, None, 2] - x1, segments[:, None, 3] - y1
+    enter = np.zeros((len(segments), len(boxes)))
+    leave = np.ones((len(segments), len(boxes)))
+    inside = np.ones((len(segments), len(boxes)), dtype=bool)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in ((-dx, x1 - inner[None, :, 0]), (dx, inner[None, :, 2] - x1),
+                     (-dy, y1 - inner[None, :, 1]), (dy, inner[None, :, 3] - y1)):
+            p = np.broadcast_to(p, enter.shape)
+            ratio = q / p
+            inside &= ~((p == 0) & (q < 0))
+            enter = np.where(p < 0, np.maximum(enter, ratio), enter)
+            leave = np.where(p > 0, np.minimum(leave, ratio), leave)
+    return inside & (enter < leave)
+
+def score_layout(diagram, row):
+    """Count layout problems of the diagram section into row and return the layout checks."""
+    boxes = diagram.boxes
+    count = len(boxes)
+    index = {shape_id: position for position, shape_id in enumerate(diagram.shape_ids)}
+
+    # A boundary event sits on the border of its activity - that pair is not an overlap
+    exempt = np.eye(count, dtype=bool)
+    for event_id, host_id in diagram.hosts.items():
+        if event_id in index and host_id in index:
+            exempt[index[event_id], index[host_id]] = exempt[index[host_id], index[event_id]] = True
+    upper = np.triu(~exempt, k=1)
+
+    overlaps = pairwise_overlaps(boxes) & upper
+    too_close = (pairwise_gaps(boxes) < MIN_SPACING) & ~pairwise_overlaps(boxes) & upper
+
+    if len(diagram.pools):
+        contained = ((boxes[:, None, 0] >= diagram.pools[None, :, 0]) & (boxes[:, None, 1] >= diagram.pools[None, :, 1])
+                     & (boxes[:, None, 2] <= diagram.pools[None, :, 2]) & (boxes[:, None, 3] <= diagram.pools[None, :, 3]))
+        outside = int(np.count_nonzero(~contained.any(axis=1)))
+    else:
+        outside = 0
+
+    segments, edges = diagram.segments, diagram.segment_edges
+    crossing_pairs = set()
+    through = 0
+    if len(segments):
+        crossings = pairwise_crossings(segments) & (edges[:, None] != edges[None, :])
+        first, second = np.nonzero(crossings)
+        crossing_pairs = {tuple(sorted(pair)) for pair in zip(edges[first].tolist(), edges[second].tolist())}
+
+        # A flow may start and end in its own source and target (and their boundary events' hosts)
+        own = np.zeros((len(segments), count), dtype=bool)
+        for position, flow_index in enumerate(edges):
+            _, source, target = diagram.flows[flow_index]
+            for node_id in (source, target, diagram.hosts.get(source)):
+                if node_id in index:
+                    own[position, index[node_id]] = True
+        through = len({int(edges[position]) for position in np.nonzero((segments_through_boxes(segments, boxes) & ~own).any(axis=1))[0]})
+
+    # Gateways that only join flows and parallel gateways do not need a name
+    unnamed = [node_id for node_id, (tag, name) in diagram.nodes.items()
+             if not name.strip() and not (tag.endswith("Gateway") and (tag == "parallelGateway" or _outgoing(diagram, node_id) < 2))]
+
+    row.update({
+        "shapes": count,
+        "outside_pool": outside,
+        "unnamed": len(unnamed),
+        "crossings": len(crossing_pairs),
+        "edges_through_shapes": through,
+        "overlaps": int(np.count_nonzero(overlaps)),
+        "too_close": int(np.count_nonzero(too_close)),
+    })
+    return {
+        "pool_bounds": outside == 0,
+        "named": not unnamed,
+        "no_crossings": not crossing_pairs and through == 0,
+        "no_overlaps": row["overlaps"] == 0,
+        "spacing": row["too_close"] == 0,
+    }
+
+def _outgoing(diagram, node_id):
+    return sum(1 for _, source, _ in diagram.flows if source == node_id)
+
+
+# Structure checks - comparison with the reference solution
+
+def is_traceable(diagram):
+    """Return True if every flow node is reachable from a start event and leads to an end event."""
+    successors, predecessors = {}, {}
+    for _, source, target in diagram.flows:
+        successors.setdefault(source, []).append(target)
+        predecessors.setdefault(target, []).append(source)
+    # Boundary events continue the flow of their activity
+    for event_id, host_id in diagram.hosts.items():
+        successors.setdefault(host_id, []).append(event_id)
+        predecessors.setdefault(event_id, []).append(host_id)
+
+    def reach(starts, graph):
+        seen, stack = set(starts), list(starts)
+        while stack:
+            for next_id in graph.get(stack.pop(), []):
+                if next_id not in seen:
+                    seen.add(next_id)
+                    stack.append(next_id)
+        return seen
+
+    starts = [node_id for node_id, (tag, _) in diagram.nodes.items() if tag == "startEvent"]
+    ends = [node_id for node_id, (tag, _) in diagram.nodes.items() if tag == "endEvent"]
+    if not starts or not ends:
+        return False
+    nodes = set(diagram.nodes)
+    return nodes <= reach(starts, successors) and nodes <= reach(ends, predecessors)
+
+def score_structure(diagram, reference, row):
+    """Compare the process model with the reference solution and return the structure checks."""
+    pool_name = diagram.pool_names[0] if diagram.pool_names else ""
+    reference_pool = reference.pool_names[0] if reference.pool_names else ""
+    lane_pairs = dict(match_names(diagram.lane_names, reference.lane_names))
+
+    activities, reference_activities = diagram.activities(), reference.activities()
+    activity_pairs = match_names([diagram.nodes[node_id][1] for node_id in activities],
+                                 [reference.nodes[node_id][1] for node_id in reference_activities])
+    # An activity is in the right lane if its lane matches the lane of its reference activity
+    in_right_lane = sum(
+        1 for index, reference_index in activity_pairs
+        if lane_pairs.get(diagram.lane_of.get(activities[index])) == reference.lane_of.get(reference_activities[reference_index])
+    )
+
+    def count(model, tag):
+        return sum(1 for node_tag, _ in model.nodes.values() if node_tag == tag)
+
+    row.update({
+        "lanes": len(diagram.lane_names),
+        "reference_lanes": len(reference.lane_names),
+        "activities": len(activities),
+        "reference_activities": len(reference_activities),
+        "matched_activities": len(activity_pairs),
+        "extra_activities": len(activities) - len(activity_pairs),
+    })
+    return {
+        "pool_name": bool(match_names([pool_name], [reference_pool])),
+        "lane_count": len(diagram.lane_names) == len(reference.lane_names),
+        "lane_names": len(lane_pairs) == len(reference.lane_names),
+        "activity_lanes": in_right_lane == len(activity_pairs),
+        "coverage": len(activity_pairs) == len(reference_activities),
+        "no_extra": len(activities) == len(activity_pairs),
+        "start_event": count(diagram, "startEvent") == count(reference, "startEvent"),
+        "end_events": count(diagram, "endEvent") == count(reference, "endEvent"),
+        "traceable": is_traceable(diagram),
+    }
+
+
+def find_reference(path):
+    """Return the reference solution in the directory of a generated diagram, or None."""
+    references = sorted(glob.glob(os.path.join(os.path.dirname(path), f"*{REFERENCE_SUFFIX}.bpmn")))
+    return references[0] if references else None
+
+def score_file(path, reference_path=None):
+    """
+    Score one generated diagram. Returns the summary row; checks that cannot be evaluated
+    (no diagram section, no reference) are left out, errors are recorded in the row.
+    """
+    row = {"file": path, "reference": reference_path or "", "error": ""}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return score_document(f.read(), reference_path, row)
+    except (ET.ParseError, OSError, ValueError) as e:
+        row.update({"score": 0.0, "error": str(e)})
+        return row
+
+def score_document(xml_text, reference_path=None, row=None):
+    """
+    Score a BPMN document given as text and return the row with its checks, counts and score.
+    Raises ET.ParseError, OSError (reference) and ValueError.
+    """
+    row = row if row is not None else {"reference": reference_path or "", "error": ""}
+    diagram = Diagram(xml_text)
+    checks = score_layout(diagram, row) if diagram.has_diagram() else {}
+    if reference_path:
+        with open(reference_path, "r", encoding="utf-8") as f:
+            checks.update(score_structure(diagram, Diagram(f.read()), row))
+
+    row.update(checks)
+    row["score"] = round(sum(checks.values()) / len(checks), 4) if checks else 0.0
+    return row
+
+def _score_path(item):
+    return score_file(*item)
+
+
+def find_diagrams(directory, suffix=""):
+    """Return sorted generated diagrams (*<suffix>.bpmn) in directory, without reference solutions."""
+    paths = glob.glob(os.path.join(directory, "**", f"*{suffix}.bpmn"), recursive=True)
+    return sorted(path for path in paths if not path.endswith(f"{REFERENCE_SUFFIX}.bpmn"))
+
+def summarize(rows, wall_time):
+    """Return mean score and pass rate of every check over all rows."""
+    scored = [row for row in rows if not row["error"]]
+    pass_rates = {}
+    for check in LAYOUT_CHECKS + STRUCTURE_CHECKS:
+        values = [row[check] for row in scored if check in row]
+        if values:
+            pass_rates[check] = round(sum(values) / len(values), 4)
+    return {
+        "files": len(rows),
+        "failed": len(rows) - len(scored),
+        "mean_score": round(float(np.mean([row["score"] for row in rows])), 4) if rows else 0.0,
+        "pass_rates": pass_rates,
+        "wall_time": round(wall_time, 2),
+    }
+
+def write_summary(rows, totals, csv_path=None, json_path=None):
+    """Write per-file rows to CSV and rows with totals to JSON."""
+    if csv_path:
+        with open(csv_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"totals": totals, "files": rows}, f, ensure_ascii=False, indent=2)
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Score generated BPMN diagrams against the evaluation checks and reference solutions.")
+    parser.add_argument("directory", help="Directory with generated diagrams and *_OPRAVENE.bpmn reference solutions")
+    parser.add_argument("--suffix", default="", help="Score only diagrams ending with this suffix, e.g. _generated from batch.py")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Scoring processes")
+    parser.add_argument("--summary", default=None, help="Summary file path without extension (default: <directory>/scoring_summary)")
+    parser.add_argument("--min-score", type=float, default=None, help="Exit with status 2 if the mean score is lower")
+    args = parser.parse_args(argv)
+
+    paths = find_diagrams(args.directory, args.suffix)
+    if not paths:
+        print(f"WARNING: No diagrams found in {args.directory}")
+        return 1
+
+    start_time = time.time()
+    items = [(path, find_reference(path)) for path in paths]
+    if args.workers > 1 and len(items) > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            rows = list(executor.map(_score_path, items, chunksize=max(1, len(items) // (args.workers * 4))))
+    else:
+        rows = [_score_path(item) for item in items]
+    totals = summarize(rows, time.time() - start_time)
+
+    summary_base = args.summary or os.path.join(args.directory, "scoring_summary")
+    write_summary(rows, totals, summary_base + ".csv", summary_base + ".json")
+    print(f"INFO: Scored {totals['files']} diagrams in {totals['wall_time']}s, mean score {totals['mean_score']:.3f} "
+          f"- summary in {summary_base}.csv/.json")
+    for check, rate in totals["pass_rates"].items():
+        print(f"  {check:<16} {rate:.0%}")
+
+    if args.min_score is not None and totals["mean_score"] < args.min_score:
+        print(f"ERROR: Mean score {totals['mean_score']:.3f} is below {args.min_score}")
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
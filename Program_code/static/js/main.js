@@ -57,6 +57,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Global variables
     let bpmnModeler;
+    let diagramLoaded = false;
     let activeTab = 'input';
     let savedViewbox = null;
 
@@ -219,9 +220,12 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         });
         
-        // If we have a BPMN file from the server, load it
-        if (bpmnFilename) {
-            loadBpmnDiagram(bpmnFilename);
+        // If the server generated a diagram, show it - inlined in the page or stored at /bpmn/<id>
+        if (inlineBpmnXml) {
+            importBpmnXml(inlineBpmnXml);
+            switchTab('diagram');
+        } else if (bpmnDiagramId) {
+            loadBpmnDiagram(bpmnDiagramId);
             switchTab('diagram');
         }
         
@@ -353,10 +357,9 @@ document.addEventListener('DOMContentLoaded', function() {
             function validateTokens() {
                 let value = maxTokensInput.value.trim();
                 
-                // If empty, set to default value
+                // If empty, the limit is estimated by the server
                 if (value === '') {
-                    maxTokensInput.value = DEFAULT_VALUE;
-                    sessionStorage.setItem('maxTokensSetting', DEFAULT_VALUE.toString());
+                    sessionStorage.setItem('maxTokensSetting', '');
                     return;
                 }
                 
@@ -886,6 +889,249 @@ document.addEventListener('DOMContentLoaded', function() {
 
         // Add additional hidden inputs for advanced options
         appendHiddenInputs();
+
+        // Stream the generation when the browser supports reading response bodies,
+        // otherwise fall back to the regular form POST
+        if (window.fetch && window.ReadableStream && window.TextDecoder) {
+            event.preventDefault();
+            attachPreviousDiagram().then(streamGeneration);
+        }
+    }
+
+    /**
+     * Put the diagram shown in the modeler into the form when the current diagram should be refined
+     */
+    function attachPreviousDiagram() {
+        let previousInput = document.getElementById('hidden-previous-bpmn');
+        if (!previousInput) {
+            previousInput = document.createElement('input');
+            previousInput.type = 'hidden';
+            previousInput.id = 'hidden-previous-bpmn';
+            previousInput.name = 'previous_bpmn';
+            bpmnForm.appendChild(previousInput);
+        }
+        previousInput.value = '';
+
+        const refineSetting = document.getElementById('refine-setting');
+        if (!refineSetting || !refineSetting.checked || !diagramLoaded) {
+            return Promise.resolve();
+        }
+
+        // The diagram includes manual changes made in the modeler
+        return bpmnModeler.saveXML()
+            .then(({ xml }) => {
+                previousInput.value = xml;
+            })
+            .catch(err => {
+                console.error('Current diagram could not be exported:', err);
+            });
+    }
+
+    /**
+     * Generate BPMN diagram through the streaming endpoint and show progress while the model writes
+     */
+    function streamGeneration() {
+        const loadingOverlayElement = document.getElementById('loading-overlay');
+        const loadingProgress = document.getElementById('loading-progress');
+        if (loadingProgress) {
+            loadingProgress.textContent = 'Connecting to AI model...';
+        }
+
+        let finished = false;
+        // Once an event has arrived the generation runs (and is paid for) on the server
+        let received = false;
+
+        function hideOverlay() {
+            if (loadingOverlayElement) {
+                loadingOverlayElement.classList.add('hidden');
+            }
+        }
+
+        function handleEvent(type, data) {
+            received = true;
+            if (type === 'start') {
+                updateLoadingProgress({ elements: 0, lanes: [], output_tokens: 0, section: 'process' });
+            } else if (type === 'queued') {
+                if (loadingProgress) {
+                    loadingProgress.textContent = `Waiting for the AI model rate limit (position ${data.position}, about ${Math.ceil(data.wait)}s)...`;
+                }
+            } else if (type === 'plan') {
+                if (loadingProgress) {
+                    loadingProgress.textContent = `Process split into ${data.segments.length} parts, generating them in parallel...`;
+                }
+            } else if (type === 'progress') {
+                updateLoadingProgress(data);
+            } else if (type === 'result') {
+                finished = true;
+                hideOverlay();
+                renderGenerationStats(data.stats);
+                switchTab('diagram');
+                importBpmnXml(data.bpmn_content);
+            } else if (type === 'error') {
+                finished = true;
+                hideOverlay();
+                showFlashMessage(data.message, 'error');
+            }
+        }
+
+        fetch('/generate-stream', {
+            method: 'POST',
+            body: new FormData(bpmnForm)
+        })
+            .then(response => {
+                if (!response.ok) {
+                    finished = true;
+                    hideOverlay();
+                    return response.json()
+                        .then(data => showFlashMessage(data.message || 'Error generating BPMN diagram.', 'error'))
+                        .catch(() => showFlashMessage('Error generating BPMN diagram.', 'error'));
+                }
+
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+
+                // Read Server-Sent Events - each message ends with an empty line
+                function readChunk() {
+                    return reader.read().then(({ done, value }) => {
+                        if (done) {
+                            if (!finished) {
+                                hideOverlay();
+                                showFlashMessage('Connection to server was interrupted.', 'error');
+                            }
+                            return;
+                        }
+
+                        buffer += decoder.decode(value, { stream: true });
+                        let separatorIndex;
+                        while ((separatorIndex = buffer.indexOf('\n\n')) !== -1) {
+                            const rawMessage = buffer.slice(0, separatorIndex);
+                            buffer = buffer.slice(separatorIndex + 2);
+
+                            let eventType = 'message';
+                            let eventData = '';
+                            rawMessage.split('\n').forEach(line => {
+                                if (line.startsWith('event:')) {
+                                    eventType = line.slice(6).trim();
+                                } else if (line.startsWith('data:')) {
+                                    eventData += line.slice(5).trim();
+                                }
+                            });
+
+                            if (eventData) {
+                                handleEvent(eventType, JSON.parse(eventData));
+                            }
+                        }
+                        return readChunk();
+                    });
+                }
+
+                return readChunk();
+            })
+            .catch(error => {
+                console.error('Streaming generation failed:', error);
+                if (finished) {
+                    return;
+                }
+                if (!received) {
+                    // Streaming is not available - fall back to the classic form submission
+                    // (does not trigger the submit handler again)
+                    bpmnForm.submit();
+                } else {
+                    // The generation already started on the server - submitting again would run (and pay for) it twice
+                    finished = true;
+                    hideOverlay();
+                    showFlashMessage('Connection to server was interrupted during generation. Please try again.', 'error');
+                }
+            });
+    }
+
+    /**
+     * Show streaming progress in the loading overlay
+     */
+    function updateLoadingProgress(data) {
+        const loadingProgress = document.getElementById('loading-progress');
+        if (!loadingProgress) return;
+
+        const lanes = data.lanes || [];
+        let text = `Elements: ${data.elements || 0}, lanes: ${lanes.length}, tokens: ~${data.output_tokens || 0}`;
+        if (data.segments) {
+            text = `Parts: ${data.segments_done || 0}/${data.segments} finished\n` + text;
+        }
+        if (lanes.length) {
+            text += `\nRoles: ${lanes.join(', ')}`;
+        }
+        if (data.section === 'layout') {
+            text += '\nPlacing elements in diagram...';
+        }
+        loadingProgress.textContent = text;
+    }
+
+    /**
+     * Render generation statistics dropdown for a diagram generated without page reload
+     */
+    function renderGenerationStats(stats) {
+        const existingWrapper = document.getElementById('stats-wrapper');
+        if (existingWrapper) {
+            existingWrapper.remove();
+        }
+
+        const rows = [
+            ['Model:', stats.selected_model_name || 'Claude'],
+            ['Input tokens (uncached):', stats.input_tokens],
+            ['Input tokens (cache write):', stats.cache_write_tokens || 0],
+            ['Input tokens (cache read):', stats.cache_read_tokens || 0],
+            ['Output tokens:', stats.output_tokens],
+            ['Total tokens:', stats.total_tokens],
+            ['Temperature:', stats.temperature || 0],
+            ['Generation time:', `${stats.generation_time} s`],
+            ['Estimated cost:', `$${Number(stats.estimated_cost).toFixed(4)}`]
+        ];
+        if (stats.continuations) {
+            rows.push(['Continuations:', stats.continuations]);
+        }
+        if (stats.discarded_tokens) {
+            rows.push(['Discarded attempts:', `${stats.discarded_tokens} tokens ($${Number(stats.discarded_cost).toFixed(4)})`]);
+        }
+        if (stats.segments) {
+            rows.push(['Parallel parts:', stats.segments]);
+        }
+        if (stats.cached) {
+            rows.push(['Cache:', `Hit (saved $${Number(stats.saved_cost).toFixed(4)})`]);
+        }
+
+        const wrapper = document.createElement('div');
+        wrapper.className = 'stats-dropdown-wrapper hidden';
+        wrapper.id = 'stats-wrapper';
+        wrapper.innerHTML = `
+            <button id="toggle-stats" class="stats-toggle-button">
+                <span class="button-icon">📊</span>
+                <span class="button-text">Statistics</span>
+            </button>
+            <div id="generation-stats" class="stats-dropdown hidden">
+                <div class="stats-dropdown-content">
+                    <div class="stats-table"></div>
+                </div>
+            </div>`;
+
+        const table = wrapper.querySelector('.stats-table');
+        rows.forEach(([label, value]) => {
+            const row = document.createElement('div');
+            row.className = 'stats-row';
+            const labelSpan = document.createElement('span');
+            labelSpan.className = 'stats-label';
+            labelSpan.textContent = label;
+            const valueSpan = document.createElement('span');
+            valueSpan.className = 'stats-value';
+            valueSpan.textContent = value;
+            row.appendChild(labelSpan);
+            row.appendChild(valueSpan);
+            table.appendChild(row);
+        });
+
+        const tabsRight = document.querySelector('.tabs-right');
+        tabsRight.insertBefore(wrapper, tabsRight.firstChild);
+        initStatsDropdown();
     }
 
     /**
@@ -919,13 +1165,69 @@ document.addEventListener('DOMContentLoaded', function() {
             }
             tokensInput.value = tokensValue;
         }
+        
+        // Add cache bypass flag - empty value means the cache may be used
+        if (document.getElementById('bypass-cache-setting')) {
+            const bypassCache = document.getElementById('bypass-cache-setting').checked;
+            let bypassInput = document.getElementById('hidden-bypass-cache');
+            if (!bypassInput) {
+                bypassInput = document.createElement('input');
+                bypassInput.type = 'hidden';
+                bypassInput.id = 'hidden-bypass-cache';
+                bypassInput.name = 'bypass_cache';
+                bpmnForm.appendChild(bypassInput);
+            }
+            bypassInput.value = bypassCache ? '1' : '';
+        }
+
+        // Add refinement flag - empty value means a new diagram is generated
+        if (document.getElementById('refine-setting')) {
+            const refine = document.getElementById('refine-setting').checked;
+            let refineInput = document.getElementById('hidden-refine');
+            if (!refineInput) {
+                refineInput = document.createElement('input');
+                refineInput.type = 'hidden';
+                refineInput.id = 'hidden-refine';
+                refineInput.name = 'refine';
+                bpmnForm.appendChild(refineInput);
+            }
+            refineInput.value = refine ? '1' : '';
+        }
+
+        // Add generation mode - automatic layout or layout written by the AI model
+        if (document.getElementById('generation-mode-setting')) {
+            const generationMode = document.getElementById('generation-mode-setting').value;
+            let modeInput = document.getElementById('hidden-generation-mode');
+            if (!modeInput) {
+                modeInput = document.createElement('input');
+                modeInput.type = 'hidden';
+                modeInput.id = 'hidden-generation-mode';
+                modeInput.name = 'generation_mode';
+                bpmnForm.appendChild(modeInput);
+            }
+            modeInput.value = generationMode;
+        }
+
+        // Add prompt variant - offered only when the server has variants of the system prompts
+        if (document.getElementById('prompt-variant-setting')) {
+            const promptVariant = document.getElementById('prompt-variant-setting').value;
+            let variantInput = document.getElementById('hidden-prompt-variant');
+            if (!variantInput) {
+                variantInput = document.createElement('input');
+                variantInput.type = 'hidden';
+                variantInput.id = 'hidden-prompt-variant';
+                variantInput.name = 'prompt_variant';
+                bpmnForm.appendChild(variantInput);
+            }
+            variantInput.value = promptVariant;
+        }
     }
 
     /**
-     * Load BPMN diagram from server
+     * Load BPMN diagram stored on the server (expires there on its own)
      */
-    function loadBpmnDiagram(filename) {
-        fetch(`/bpmn/${filename}`)
+    function loadBpmnDiagram(diagramId) {
+        fetch(`/bpmn/${diagramId}`)
             .then(response => {
                 if (!response.ok) {
                     throw new Error('Network response was not ok');
@@ -933,26 +1235,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 return response.text();
             })
             .then(bpmnXML => {
-                bpmnModeler.importXML(bpmnXML)
-                    .then(({ warnings }) => {
-                        if (warnings.length) {
-                            console.warn('BPMN import warnings:', warnings);
-                        }
-                        bpmnModeler.get('canvas').zoom('fit-viewport');
-                        
-                        // After successful import, delete the BPMN file from the server
-                        deleteBpmnFile(filename);
-                        
-                        // Show success message
-                        showFlashMessage('BPMN diagram was successfully generated and loaded', 'success');
-                    })
-                    .catch(err => {
-                        showFlashMessage('Error displaying BPMN model.', 'error');
-                        console.error('Error rendering BPMN diagram:', err);
-                        
-                        // Prepnúť späť na kartu Input pri chybe
-                        switchTab('input');
-                    });
+                importBpmnXml(bpmnXML);
             })
             .catch(error => {
                 showFlashMessage('Error displaying BPMN model.', 'error');
@@ -964,23 +1247,31 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     /**
-     * Delete BPMN file from the server
+     * Import BPMN XML into the modeler
      */
-    function deleteBpmnFile(filename) {
-        fetch(`/delete-bpmn/${filename}`, {
-            method: 'POST'
-        })
-        .then(response => response.json())
-        .then(data => {
-            if (data.success) {
-                console.log('BPMN file deleted from server:', filename);
-            } else {
-                console.warn('Failed to delete BPMN file:', data.message);
-            }
-        })
-        .catch(error => {
-            console.error('Error deleting BPMN file:', error);
-        });
+    function importBpmnXml(bpmnXML, onSuccess) {
+        bpmnModeler.importXML(bpmnXML)
+            .then(({ warnings }) => {
+                if (warnings.length) {
+                    console.warn('BPMN import warnings:', warnings);
+                }
+                bpmnModeler.get('canvas').zoom('fit-viewport');
+                diagramLoaded = true;
+                
+                if (onSuccess) {
+                    onSuccess();
+                }
+                
+                // Show success message
+                showFlashMessage('BPMN diagram was successfully generated and loaded', 'success');
+            })
+            .catch(err => {
+                showFlashMessage('Error displaying BPMN model.', 'error');
+                console.error('Error rendering BPMN diagram:', err);
+                
+                // Prepnúť späť na kartu Input pri chybe
+                switchTab('input');
+            });
     }
 
     /**
@@ -0,0 +1,175 @@
+import xml.etree.ElementTree as ET
+
+from process_dsl import DslParser, DslError
+from layout import BPMN_MODEL_NS, split_tag
+
+# Text the model returns instead of a diagram when it cannot create the process model
+PROBLEM_MARKER = "PROBLÉM"
+
+# How much text may precede the XML document before the response is considered unusable
+MAX_PREAMBLE_CHARS = 4000
+
+XML_START_MARKERS = ("<?xml", "<bpmn:definitions", "<definitions")
+
+
+class StreamValidationError(Exception):
+    """
+    Raised by the incremental validators when the streamed response can no longer become a valid diagram.
+    `problem` is True when the model answered with the PROBLÉM message instead of a diagram.
+    """
+
+    def __init__(self, message, problem=False):
+        super().__init__(message)
+        self.problem = problem
+
+
+class IncrementalBpmnValidator:
+    """
+    Validates a BPMN document while it is being streamed, chunk by chunk.
+
+    Text before the XML document is checked for the PROBLÉM answer. The document itself is fed
+    to an incremental XML parser, so malformed XML, a wrong root namespace or a missing
+    pool/process/lane structure is detected as soon as the relevant part arrives - the caller
+    can then cancel the API stream instead of paying for the rest of the output.
+    Truncated documents (max_tokens reached) are not an error here; they are reported by the
+    final validation when the stream ends.
+    """
+
+    def __init__(self):
+        self.preamble = ""
+        self.parser = None
+        self.depth = 0
+        self.complete = False
+        self.chars = 0
+
+        # Structure found so far
+        self.participants = []
+        self.processes = []
+        self.lanes_in_process = 0
+
+    def feed(self, chunk):
+        """Process next chunk of streamed text. Raises StreamValidationError on unrecoverable problems."""
+        self.chars += len(chunk)
+        if self.complete:
+            return
+
+        if self.parser is None:
+            self._feed_preamble(chunk)
+        else:
+            self._feed_xml(chunk)
+
+    def _feed_preamble(self, chunk):
+        """Collect text until the XML document starts."""
+        self.preamble += chunk
+
+        if PROBLEM_MARKER in self.preamble:
+            raise StreamValidationError("Model reported a problem instead of a diagram", problem=True)
+
+        positions = [self.preamble.find(marker) for marker in XML_START_MARKERS]
+        positions = [position for position in positions if position != -1]
+        if not positions:
+            if len(self.preamble) > MAX_PREAMBLE_CHARS:
+                raise StreamValidationError("Response does not contain BPMN XML")
+            return
+
+        document_start = self.preamble[min(positions):]
+        self.preamble = self.preamble[:min(positions)]
+        self.parser = ET.XMLPullParser(events=("start", "end"))
+        self._feed_xml(document_start)
+
+    def _feed_xml(self, text):
+        """Feed XML text to the incremental parser and check structure of completed parts."""
+        try:
+            self.parser.feed(text)
+            for event, element in self.parser.read_events():
+                if event == "start":
+                    self._on_start(element)
+                else:
+                    self._on_end(element)
+                    if self.complete:
+                        return
+        except ET.ParseError as e:
+            if self.complete:
+                # Text after the closing root tag (e.g. closing code fence) is ignored
+                return
+            raise StreamValidationError(f"Malformed XML: {str(e)}")
+
+    def _on_start(self, element):
+        self.depth += 1
+        namespace, name = split_tag(element.tag)
+
+        if self.depth == 1:
+            if name != "definitions":
+                raise StreamValidationError(f"Unexpected root element '{name}', expected 'definitions'")
+            if namespace != BPMN_MODEL_NS:
+                raise StreamValidationError(f"Root element has wrong namespace '{namespace}'")
+
+        if namespace == BPMN_MODEL_NS and name == "process":
+            self.lanes_in_process = 0
+
+    def _on_end(self, element):
+        self.depth -= 1
+        namespace, name = split_tag(element.tag)
+
+        if namespace == BPMN_MODEL_NS:
+            if name == "participant":
+                self.participants.append(element.get("processRef"))
+            elif name == "lane":
+                self.lanes_in_process += 1
+            elif name == "process":
+                self.processes.append(element.get("id"))
+                if self.lanes_in_process == 0:
+                    raise StreamValidationError(f"Process '{element.get('id')}' has no lanes")
+                # Finished process elements are not needed any more - keep memory flat
+                element.clear()
+
+        if self.depth == 0:
+            self._check_document()
+            self.complete = True
+
+    def _check_document(self):
+        """Checks that need the whole document."""
+        if not self.participants:
+            raise StreamValidationError("Document has no pool (collaboration participant)")
+        if not self.processes:
+            raise StreamValidationError("Document has no process")
+        missing = [ref for ref in self.participants if ref and ref not in self.processes]
+        if missing:
+            raise StreamValidationError(f"Pool references unknown process '{missing[0]}'")
+
+
+class IncrementalDslValidator:
+    """
+    Validates a compact process description (process_dsl.py) while it is being streamed.
+
+    Complete lines are parsed as soon as they arrive, so a PROBLÉM answer, unknown element kinds
+    or broken flow lines stop the stream early. References between elements are checked when
+    the whole description is compiled. Other line formats (e.g. edit operations of refine.py)
+    are validated by passing their parser, which must provide feed_line and raise DslError.
+    """
+
+    def __init__(self, parser=None):
+        self.parser = parser or DslParser()
+        self.buffer = ""
+        self.chars = 0
+
+    def feed(self, chunk):
+        """Process next chunk of streamed text. Raises StreamValidationError on unrecoverable problems."""
+        self.chars += len(chunk)
+        self.buffer += chunk
+
+        if PROBLEM_MARKER in self.buffer:
+            raise StreamValidationError("Model reported a problem instead of a diagram", problem=True)
+
+        *lines, self.buffer = self.buffer.split("\n")
+        for line in lines:
+            self._feed_line(line)
+
+        if len(self.buffer) > MAX_PREAMBLE_CHARS:
+            raise StreamValidationError("Response does not contain a process description")
+
+    def _feed_line(self, line):
+        try:
+            self.parser.feed_line(line)
+        except DslError as e:
+            raise StreamValidationError(f"Invalid process description: {str(e)}")
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Modules of the application are imported from Program_code, like app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Databases and batch files of main.py and app.py are created in a temporary directory instead of Program_code/cache
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="processflow-tests-"))
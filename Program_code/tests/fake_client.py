@@ -0,0 +1,50 @@
+"""Stand-in for the streaming messages API of the Anthropic client, used by the scheduler tests."""
+import time
+from types import SimpleNamespace
+
+
+class FakeStream:
+    """Stream of a messages call: message_start, text events, then an error or the final message."""
+
+    def __init__(self, texts, error=None, delay=0.0):
+        self.texts = texts
+        self.error = error
+        self.delay = delay
+        self.response = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        usage = SimpleNamespace(input_tokens=700, cache_creation_input_tokens=0, output_tokens=1)
+        yield SimpleNamespace(type="message_start", message=SimpleNamespace(usage=usage))
+        for text in self.texts:
+            time.sleep(self.delay)
+            yield SimpleNamespace(type="text", text=text)
+        if self.error:
+            raise self.error
+
+    def get_final_message(self):
+        usage = SimpleNamespace(input_tokens=700, cache_creation_input_tokens=0, output_tokens=50)
+        return SimpleNamespace(usage=usage, stop_reason="end_turn")
+
+class FakeClient:
+    """Client answering the calls with the given streams in order; models of the calls are recorded."""
+
+    def __init__(self, *streams):
+        self.streams = list(streams)
+        self.models = []
+        self.messages = self
+
+    def with_options(self, **options):
+        return self
+
+    def stream(self, **request):
+        self.models.append(request["model"])
+        return self.streams.pop(0)
@@ -0,0 +1,124 @@
+import time
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+from scheduler import ModelCallScheduler
+from fake_client import FakeClient, FakeStream
+
+MODEL = "test-model"
+
+
+def make_controller(tmp_path, output_tokens=8000, **options):
+    limits = {MODEL: {"requests": 50, "input-tokens": 40000, "output-tokens": output_tokens}}
+    return AdmissionController(str(tmp_path / "admission.sqlite3"), limits, poll_interval=0.01, **options)
+
+def available(controller, kind="output-tokens"):
+    return controller.stats()["models"][MODEL][kind]["available"]
+
+
+def test_finished_call_is_charged_its_usage(tmp_path):
+    controller = make_controller(tmp_path)
+    ticket = controller.enqueue(MODEL, "a", 1000, 3000)
+    assert ticket.admitted
+    assert available(controller) == pytest.approx(5000, abs=5)
+
+    controller.release(ticket, 900, 2000)
+    assert available(controller) == pytest.approx(6000, abs=5)
+    assert available(controller, "input-tokens") == pytest.approx(39100, abs=5)
+
+def test_aborted_call_gets_unused_reservation_back(tmp_path):
+    controller = make_controller(tmp_path)
+    ticket = controller.enqueue(MODEL, "a", 1000, 6000)
+    controller.release(ticket)
+    assert available(controller) == pytest.approx(8000, abs=5)
+
+    # A second release of the same ticket does not refund again
+    controller.release(ticket, 0, 0)
+    assert available(controller) == pytest.approx(8000, abs=5)
+
+def test_queued_call_waits_instead_of_being_rejected(tmp_path):
+    # 600 output tokens per minute refill 10 tokens per second
+    controller = make_controller(tmp_path, output_tokens=600)
+    first = controller.enqueue(MODEL, "a", 10, 595)
+    second = controller.enqueue(MODEL, "b", 10, 10)
+    assert first.admitted and not second.admitted
+    assert second.position == 1
+    assert 0 < second.wait < 2
+
+    assert controller.wait(second, timeout=5)
+    assert second.admitted
+    assert controller.stats()["rejected"] == 0
+
+def test_continuation_is_admitted_when_buckets_are_used_up(tmp_path):
+    controller = make_controller(tmp_path, output_tokens=600)
+    controller.enqueue(MODEL, "a", 10, 2000)
+    waiting = controller.enqueue(MODEL, "b", 10, 100)
+    continuation = controller.enqueue(MODEL, "a", 10, 100, priority=True)
+    assert not waiting.admitted
+    assert continuation.admitted
+
+def test_max_wait_rejects_by_time_actually_waited(tmp_path):
+    controller = make_controller(tmp_path, output_tokens=600, max_wait=0.2)
+    controller.enqueue(MODEL, "a", 10, 2000)
+    ticket = controller.enqueue(MODEL, "b", 10, 100)
+    with pytest.raises(AdmissionRejected):
+        controller.wait(ticket, timeout=5)
+    assert controller.stats()["models"][MODEL]["waiting"] == 0
+
+def test_optional_call_is_not_queued(tmp_path):
+    controller = make_controller(tmp_path, output_tokens=600)
+    assert controller.try_admit(MODEL, "a", 10, 100) is not None
+    assert controller.enqueue(MODEL, "a", 10, 400).admitted
+    assert controller.try_admit(MODEL, "a", 10, 200) is None
+    assert controller.stats()["models"][MODEL]["waiting"] == 0
+
+
+# Scheduler attempts release their tickets with the tokens they consumed
+
+def wait_for_release(controller):
+    """Wait until no call of the model is running (attempts release their tickets in their threads)."""
+    deadline = time.monotonic() + 5
+    while controller.stats()["models"][MODEL]["running"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert controller.stats()["models"][MODEL]["running"] == 0
+
+def test_scheduler_releases_finished_attempt_with_usage(tmp_path):
+    controller = make_controller(tmp_path)
+    scheduler = ModelCallScheduler(admission=controller)
+    ticket = controller.enqueue(MODEL, "a", 1000, 4000)
+
+    kinds = [kind for kind, _ in scheduler.stream(FakeClient(FakeStream(["<bpmn"])), MODEL, ticket=ticket, max_tokens=20000, messages=[])]
+    assert kinds[-1] == "final"
+    wait_for_release(controller)
+    assert available(controller) == pytest.approx(7950, abs=5)
+
+def test_scheduler_refunds_aborted_attempt(tmp_path):
+    controller = make_controller(tmp_path)
+    scheduler = ModelCallScheduler(admission=controller)
+    ticket = controller.enqueue(MODEL, "a", 1000, 4000)
+
+    # 10 output tokens per text event, the attempt is cancelled long before the end of the response
+    stream = scheduler.stream(FakeClient(FakeStream(["x" * 35] * 100, delay=0.01)), MODEL, ticket=ticket, max_tokens=20000, messages=[])
+    for kind, event in stream:
+        if kind == "event" and event.type == "text":
+            break
+    # The caller stops reading (e.g. the validator rejected the output)
+    stream.close()
+    wait_for_release(controller)
+    assert 8000 - 500 < available(controller) < 8000
+
+def test_scheduler_admits_retries(tmp_path):
+    from anthropic import APIConnectionError
+
+    controller = make_controller(tmp_path)
+    scheduler = ModelCallScheduler(admission=controller, backoff_base=0.01)
+    ticket = controller.enqueue(MODEL, "a", 1000, 4000)
+    error = APIConnectionError(request=None)
+    client = FakeClient(FakeStream([], error=error), FakeStream(["<bpmn"]))
+
+    list(scheduler.stream(client, MODEL, ticket=ticket, client_id="a", expected_tokens=4000, max_tokens=20000, messages=[]))
+    # The failed attempt was refunded, the retry was admitted and charged 50 output tokens
+    wait_for_release(controller)
+    assert controller.stats()["admitted"] == 2
+    assert available(controller) == pytest.approx(7950, abs=5)
@@ -0,0 +1,64 @@
+import re
+
+import app as app_module
+from assets import AssetManifest, CachedResponse, IMMUTABLE_CACHE_CONTROL, MIN_COMPRESS_BYTES
+
+SCRIPT = "console.log('ProcessFlow');\n" * 100
+
+
+class Accept(dict):
+    """Parsed Accept-Encoding header: encoding -> quality, 0 for encodings not listed."""
+
+    def __getitem__(self, encoding):
+        return self.get(encoding, 0)
+
+
+def write_static(folder, files):
+    for name, content in files.items():
+        path = folder / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+
+
+def test_url_contains_the_content_hash(tmp_path):
+    write_static(tmp_path, {"js/main.js": SCRIPT.encode()})
+    manifest = AssetManifest(str(tmp_path))
+
+    url = manifest.url("js/main.js")
+    assert re.fullmatch(r"/assets/js/main\.[0-9a-f]{12}\.js", url)
+    assert manifest.get(url[len("/assets/"):]).variants["identity"] == SCRIPT.encode()
+
+def test_url_changes_with_the_content(tmp_path):
+    write_static(tmp_path, {"js/main.js": SCRIPT.encode()})
+    manifest = AssetManifest(str(tmp_path))
+    before = manifest.url("js/main.js")
+
+    write_static(tmp_path, {"js/main.js": (SCRIPT + "// changed\n").encode()})
+    manifest.build()
+    assert manifest.url("js/main.js") != before
+    assert manifest.get(before[len("/assets/"):]) is None
+
+def test_unknown_file_keeps_the_static_url(tmp_path):
+    assert AssetManifest(str(tmp_path)).url("js/missing.js") == "/static/js/missing.js"
+
+def test_smallest_accepted_variant_is_chosen():
+    cached = CachedResponse(SCRIPT.encode(), "application/javascript; charset=utf-8")
+    assert cached.negotiate(Accept())[0] == "identity"
+    assert cached.negotiate(Accept(gzip=1))[0] == "gzip"
+
+def test_small_and_compressed_files_have_no_variants():
+    assert list(CachedResponse(b"x" * (MIN_COMPRESS_BYTES - 1), "text/css").variants) == ["identity"]
+    assert list(CachedResponse(b"x" * MIN_COMPRESS_BYTES, "image/png").variants) == ["identity"]
+
+def test_page_links_fingerprinted_assets_served_as_immutable():
+    client = app_module.app.test_client()
+    page = client.get("/").get_data(as_text=True)
+
+    url = app_module.assets.url("js/main.js")
+    assert url.startswith("/assets/") and url in page
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == IMMUTABLE_CACHE_CONTROL
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert client.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["ETag"]}).status_code == 304
@@ -0,0 +1,88 @@
+import io
+import os
+import time
+import zipfile
+
+import pytest
+
+import main
+import fake_api
+import app as app_module
+
+CORPUS = os.path.join(os.path.dirname(__file__), "..", "..", "Evaluation_data", "AI_data", "1_Jednoduche_linearne_procesy")
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+@pytest.fixture
+def replay():
+    main.set_client(fake_api.make_replay_client(fake_api.ReplayCorpus(CORPUS)))
+    yield
+    main.set_client(None)
+
+def zip_upload(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for name, content in files.items():
+            zip_file.writestr(name, content)
+    buffer.seek(0)
+    return {"archive": (buffer, "descriptions.zip")}
+
+def corpus_descriptions():
+    descriptions = {}
+    for directory in sorted(os.listdir(CORPUS)):
+        with open(os.path.join(CORPUS, directory, directory.split("_", 1)[1] + ".txt"), "r", encoding="utf-8") as f:
+            descriptions[directory + ".txt"] = f.read()
+    return descriptions
+
+
+def test_batch_runs_as_a_job_and_serves_the_archive(client, replay):
+    response = client.post("/batch", data={**zip_upload(corpus_descriptions()), "bypass_cache": "1"}, content_type="multipart/form-data")
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+
+    deadline = time.monotonic() + 30
+    while client.get(f"/jobs/{job_id}").get_json()["status"] not in ("done", "failed") and time.monotonic() < deadline:
+        time.sleep(0.05)
+    job = client.get(f"/jobs/{job_id}").get_json()
+    assert job["status"] == "done", job["error"]
+    assert job["result"]["totals"]["succeeded"] == 3
+    assert job["progress"] == {"files": 3, "finished": 3}
+
+    archive = client.get(job["result"]["archive_url"])
+    assert archive.status_code == 200
+    names = zipfile.ZipFile(io.BytesIO(archive.data)).namelist()
+    assert "batch_summary.csv" in names
+    assert sum(name.endswith("_generated.bpmn") for name in names) == 3
+    # The uploaded descriptions are removed once the job has ended
+    assert not [name for name in os.listdir(app_module.BATCH_DIR) if name.startswith("upload-")]
+
+def test_unknown_batch_archive_is_not_found(client):
+    assert client.get("/batch/0123456789abcdef0123456789abcdef/archive").status_code == 404
+    assert client.get("/batch/..%2Fjobs/archive").status_code == 404
+
+def test_too_many_files_are_rejected(client, monkeypatch):
+    monkeypatch.setattr(app_module, "BATCH_MAX_FILES", 2)
+    response = client.post("/batch", data=zip_upload({f"{index}.txt": "Popis" for index in range(3)}), content_type="multipart/form-data")
+    assert response.status_code == 400
+    assert "Too many descriptions" in response.get_json()["message"]
+
+def test_archive_expanding_beyond_the_limit_is_rejected(client, monkeypatch):
+    monkeypatch.setattr(app_module, "BATCH_MAX_EXTRACTED_BYTES", 1000)
+    response = client.post("/batch", data=zip_upload({"bomb.txt": "a" * 1_000_000}), content_type="multipart/form-data")
+    assert response.status_code == 400
+    assert "too large" in response.get_json()["message"]
+    assert not [name for name in os.listdir(app_module.BATCH_DIR) if name.startswith("upload-")]
+
+def test_oversized_upload_is_rejected(client, monkeypatch):
+    monkeypatch.setattr(app_module, "BATCH_MAX_UPLOAD_BYTES", 100)
+    response = client.post("/batch", data=zip_upload({"process.txt": "Popis procesu " * 20}), content_type="multipart/form-data")
+    assert response.status_code == 413
+
+@pytest.mark.parametrize("temperature", ["warm", "1.5", "-0.1", "nan"])
+def test_invalid_temperature_is_rejected(client, temperature):
+    response = client.post("/batch", data={**zip_upload({"process.txt": "Popis"}), "temperature": temperature}, content_type="multipart/form-data")
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "Temperature must be a number between 0 and 1."
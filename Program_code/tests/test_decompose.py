@@ -0,0 +1,123 @@
+import pytest
+
+import main
+import decompose
+import process_dsl
+from process_dsl import DslError
+
+PLAN = """process Zavedenie produktu
+lane Produktový manažér
+lane Vedenie
+segment A Návrh konceptu
+  scope Kroky 1 až 3
+  in H2
+  out H1 Koncept hotový
+segment B Posúdenie
+  scope Kroky 4 až 5
+  in H1
+  out H2 Koncept zamietnutý
+"""
+
+SEGMENT_A = """process Návrh
+lane Produktový manažér
+  start S1 Začiatok procesu
+  start H2 Koncept zamietnutý
+  task T1 Navrhni koncept
+  end H1 Koncept hotový
+flow
+  S1 -> T1 -> H1
+  H2 -> T1
+"""
+
+SEGMENT_B = """process Posúdenie
+and J1
+lane  produktový  MANAŽÉR
+  start H1 Koncept hotový
+  task T1 Priprav prezentáciu
+lane Vedenie
+  xor G1 Schválené?
+  end E1 Koniec procesu
+  end H2 Koncept zamietnutý
+flow
+  H1 -> J1 -> T1 -> G1
+  G1 -[Áno]-> E1
+  G1 -[Nie]-> H2
+"""
+
+
+def segments(*texts):
+    plan = decompose.parse_plan(PLAN)
+    return plan, [(segment, process_dsl.compile_dsl(text)) for segment, text in zip(plan.segments, texts)]
+
+def flow_set(model):
+    return {(source, target, label) for source, target, label, _ in model.flows}
+
+
+def test_handoffs_become_flows_between_segments():
+    model, unconnected = decompose.merge_segments(*segments(SEGMENT_A, SEGMENT_B))
+
+    assert unconnected == []
+    # Hand-off events are replaced by flows from the element before the end event to the one after the start event
+    assert {"A_H1", "A_H2", "B_H1", "B_H2"}.isdisjoint(model.elements)
+    assert ("A_T1", "B_J1", "") in flow_set(model)
+    # The label of the flow into the outgoing hand-off is kept
+    assert ("B_G1", "A_T1", "Nie") in flow_set(model)
+    assert not any(source.endswith(("H1", "H2")) or target.endswith(("H1", "H2")) for source, target, _ in flow_set(model))
+
+def test_lanes_with_the_same_name_are_shared():
+    model, _ = decompose.merge_segments(*segments(SEGMENT_A, SEGMENT_B))
+
+    assert [name for name, _ in model.lanes] == ["Produktový manažér", "Vedenie"]
+    assert model.lanes[0][1] == ["A_S1", "A_T1", "B_T1"]
+    assert model.elements["B_T1"]["lane"] == 0
+    assert model.elements["B_G1"]["lane"] == 1
+    # An element outside of all lanes of its segment stays outside
+    assert model.elements["B_J1"]["lane"] is None
+
+def test_missing_handoff_is_kept_as_start_and_end_event():
+    without_start = SEGMENT_B.replace("  start H1 Koncept hotový\n", "  start S2 Pokračovanie\n").replace("H1 -> J1", "S2 -> J1")
+    model, unconnected = decompose.merge_segments(*segments(SEGMENT_A, without_start))
+    assert unconnected == ["H1"]
+
+    # The flow into the hand-off is not lost - the end event of segment A stays an end event
+    assert model.elements["A_H1"]["tag"] == "endEvent"
+    assert ("A_T1", "A_H1", "") in flow_set(model)
+    assert "A_H1" in model.lanes[0][1]
+    # The other hand-off is connected as usual
+    assert "B_H2" not in model.elements and ("B_G1", "A_T1", "Nie") in flow_set(model)
+
+def test_merged_process_is_compiled_with_layout():
+    document, _ = decompose.merge_to_bpmn(*segments(SEGMENT_A, SEGMENT_B))
+    description = process_dsl.decompile_bpmn(document)
+    assert "A_T1 -> B_J1 -> B_T1 -> B_G1" in description
+    assert "BPMNShape" in document
+
+def test_merged_process_needs_start_and_end_events():
+    segment_a = """process Návrh
+lane Produktový manažér
+  start H2 Koncept zamietnutý
+  task T1 Navrhni koncept
+  end H1 Koncept hotový
+flow
+  H2 -> T1 -> H1
+"""
+    segment_b = """process Posúdenie
+lane Vedenie
+  start H1 Koncept hotový
+  task T1 Posúď
+  end H2 Koncept zamietnutý
+flow
+  H1 -> T1 -> H2
+"""
+    # Both hand-offs are connected, so only a loop without start and end events is left
+    with pytest.raises(DslError):
+        decompose.merge_segments(*segments(segment_a, segment_b))
+
+def test_segments_are_compiled_without_layout(monkeypatch):
+    calls = []
+    monkeypatch.setattr(main.layout, "layout_tree", lambda root: calls.append(root) or "")
+    document = main.compile_dsl_response(SEGMENT_A, "end_turn", with_layout=False)
+    assert calls == [] and "BPMNDiagram" not in document
+    plan = decompose.parse_plan(PLAN)
+    model, _ = decompose.merge_segments(plan, [(plan.segments[0], document), (plan.segments[1], process_dsl.compile_dsl(SEGMENT_B, with_layout=False))])
+    assert ("A_T1", "B_J1", "") in flow_set(model)
@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+import app as app_module
+from diagram_store import DiagramStore, MemoryBackend, SqliteBackend, MIN_COMPRESS_BYTES
+
+SMALL = '<?xml version="1.0" encoding="UTF-8"?><definitions />'
+LARGE = '<?xml version="1.0" encoding="UTF-8"?><definitions>' + "<task />" * MIN_COMPRESS_BYTES + "</definitions>"
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    return MemoryBackend() if request.param == "memory" else SqliteBackend(str(tmp_path / "diagrams.sqlite3"))
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+@pytest.mark.parametrize("content", [SMALL, LARGE], ids=["plain", "compressed"])
+def test_stored_diagram_is_returned_unchanged(backend, content):
+    store = DiagramStore(backend, reap_interval=3600)
+    diagram = store.get(store.put(content))
+
+    assert diagram.text() == content
+    assert diagram.compressed == (content is LARGE)
+
+def test_etag_follows_the_content(backend):
+    store = DiagramStore(backend, reap_interval=3600)
+    first, second, other = store.put(SMALL), store.put(SMALL), store.put(LARGE)
+
+    assert first != second
+    assert store.get(first).etag == store.get(second).etag
+    assert store.get(first).etag != store.get(other).etag
+
+def test_expired_diagram_is_not_served_and_is_reaped(backend):
+    store = DiagramStore(backend, ttl=0, reap_interval=3600)
+    diagram_id = store.put(SMALL)
+    time.sleep(0.01)
+
+    assert store.get(diagram_id) is None
+    assert store.reap() == 1
+    assert backend.get(diagram_id) is None
+    assert store.stats()["expired"] == 1
+
+def test_unknown_diagram_is_a_miss(backend):
+    store = DiagramStore(backend, reap_interval=3600)
+    assert store.get("0" * 32) is None
+    assert store.stats()["misses"] == 1
+
+def test_served_diagram_is_conditional_on_its_etag(client):
+    diagram_id = app_module.diagram_store.put(LARGE)
+
+    response = client.get(f"/bpmn/{diagram_id}", headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == LARGE
+    etag = response.headers["ETag"]
+
+    assert client.get(f"/bpmn/{diagram_id}", headers={"Accept-Encoding": "identity", "If-None-Match": etag}).status_code == 304
+
+    gzipped = client.get(f"/bpmn/{diagram_id}", headers={"Accept-Encoding": "gzip"})
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert gzipped.headers["ETag"] != etag
+
+def test_deleted_diagram_is_not_found(client):
+    diagram_id = app_module.diagram_store.put(SMALL)
+    app_module.diagram_store.delete(diagram_id)
+    assert client.get(f"/bpmn/{diagram_id}").status_code == 404
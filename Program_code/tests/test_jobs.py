@@ -0,0 +1,63 @@
+import time
+import threading
+
+import pytest
+
+import jobs
+from jobs import JobManager, JobQueueFull
+
+
+def make_manager(tmp_path, **options):
+    return JobManager(str(tmp_path / "jobs.sqlite3"), workers=1, **options)
+
+def insert_job(manager, job_id, status, heartbeat, owner="other-host:1"):
+    with manager._connect() as connection:
+        connection.execute(
+            "INSERT INTO jobs (id, status, created_at, owner, heartbeat) VALUES (?, ?, ?, ?, ?)",
+            (job_id, status, heartbeat, owner, heartbeat)
+        )
+
+def wait_for_status(manager, job_id, statuses):
+    deadline = time.monotonic() + 5
+    while manager.get(job_id)["status"] not in statuses and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return manager.get(job_id)
+
+
+def test_job_runs_to_completion(tmp_path):
+    manager = make_manager(tmp_path)
+    job_id = manager.submit(lambda job_id, report_progress, value: {"value": value}, 42)
+    job = wait_for_status(manager, job_id, jobs.FINISHED_STATES)
+    assert job["status"] == jobs.DONE
+    assert job["result"] == {"value": 42}
+    assert "owner" not in job
+
+def test_jobs_of_stopped_process_are_failed(tmp_path):
+    manager = make_manager(tmp_path)
+    stale = time.time() - jobs.STALE_AFTER - 1
+    insert_job(manager, "running", jobs.RUNNING, stale)
+    insert_job(manager, "queued", jobs.QUEUED, stale)
+    insert_job(manager, "alive", jobs.RUNNING, time.time())
+
+    for job_id in ("running", "queued"):
+        job = manager.get(job_id)
+        assert job["status"] == jobs.FAILED
+        assert job["error"] == jobs.ORPHANED_MESSAGE
+    assert manager.get("alive")["status"] == jobs.RUNNING
+
+def test_queue_limit_counts_jobs_of_all_processes(tmp_path):
+    manager = make_manager(tmp_path, max_queue=2)
+    insert_job(manager, "a", jobs.QUEUED, time.time())
+    insert_job(manager, "b", jobs.QUEUED, time.time())
+    with pytest.raises(JobQueueFull):
+        manager.submit(lambda job_id, report_progress: None)
+
+def test_unfinished_jobs_are_failed_when_the_process_exits(tmp_path):
+    manager = make_manager(tmp_path)
+    release = threading.Event()
+    job_id = manager.submit(lambda job_id, report_progress: release.wait(5))
+    wait_for_status(manager, job_id, (jobs.RUNNING,))
+
+    manager._abandon()
+    assert manager.get(job_id)["status"] == jobs.FAILED
+    release.set()
@@ -0,0 +1,48 @@
+import os
+import glob
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import layout
+from layout import BPMN_MODEL_NS, BPMN_DI_NS, DC_NS, qname, split_tag
+
+CORPUS = os.path.join(os.path.dirname(__file__), "..", "..", "Evaluation_data", "AI_data")
+REFERENCES = sorted(glob.glob(os.path.join(CORPUS, "**", "*_OPRAVENE.bpmn"), recursive=True))
+
+
+def read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+def node_bounds(xml_text):
+    """Bounds of the flow node shapes (boundary events sit on their activity and are left out)."""
+    root = ET.fromstring(xml_text.encode("utf-8"))
+    kinds = {element.get("id"): split_tag(element.tag)[1]
+             for process in root.iter(qname(BPMN_MODEL_NS, "process")) for element in process.iter()}
+    bounds = {}
+    for shape in root.iter(qname(BPMN_DI_NS, "BPMNShape")):
+        kind = kinds.get(shape.get("bpmnElement"))
+        if kind and layout.is_flow_node(kind) and kind != "boundaryEvent":
+            box = shape.find(qname(DC_NS, "Bounds"))
+            bounds[shape.get("bpmnElement")] = tuple(float(box.get(name)) for name in ("x", "y", "width", "height"))
+    return kinds, bounds
+
+def overlaps(a, b):
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+@pytest.mark.parametrize("path", REFERENCES, ids=os.path.basename)
+def test_corpus_document_has_no_overlapping_shapes(path):
+    kinds, bounds = node_bounds(layout.layout_bpmn(read(path)))
+
+    drawn = {element_id for element_id, kind in kinds.items() if layout.is_flow_node(kind) and kind != "boundaryEvent"}
+    assert set(bounds) == drawn
+    boxes = sorted(bounds.items())
+    for index, (first_id, first) in enumerate(boxes):
+        for second_id, second in boxes[index + 1:]:
+            assert not overlaps(first, second), f"{first_id} overlaps {second_id}"
+
+def test_layout_is_deterministic():
+    text = read(REFERENCES[0])
+    assert layout.layout_bpmn(text) == layout.layout_bpmn(layout.layout_bpmn(text))
@@ -0,0 +1,26 @@
+import main
+from app import format_generation_error, format_message_by_sentences
+from stream_validator import StreamValidationError
+
+
+def test_reason_with_punctuation_is_kept_whole():
+    error = main.stream_validation_error(StreamValidationError("Unexpected text '<?xml version=\"1.0\"?>'. Expected <bpmn:definitions>"))
+    message = format_generation_error(error)
+
+    assert message.splitlines() == [
+        "The selected AI model created an invalid process model "
+        "(Unexpected text '<?xml version=\"1.0\"?>'; Expected <bpmn:definitions>).",
+        "Please try again or switch to better available AI model.",
+    ]
+
+def test_reason_with_colons_and_newlines_stays_in_one_sentence():
+    reason = main.problem_reason("Invalid process description: line 3:\nunknown lane.")
+    error = ValueError(f"model_problem:{main.INVALID_STRUCTURE_MESSAGE.format(reason=reason)}")
+    message = format_generation_error(error)
+
+    assert message.splitlines()[0] == "The selected AI model created an invalid process model (Invalid process description: line 3: unknown lane)."
+    assert main.error_class(error) == "invalid_structure"
+
+def test_sentences_without_ending_are_not_dropped():
+    assert format_message_by_sentences("See bpmn.io for details. Then try again") == "See bpmn.io for details.\nThen try again"
+    assert format_message_by_sentences("first, second") == "first,\nsecond,"
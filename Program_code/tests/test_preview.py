@@ -0,0 +1,81 @@
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import preview
+import app as app_module
+from preview import PreviewCache, PreviewError
+
+REFERENCE = os.path.join(os.path.dirname(__file__), "..", "..", "Evaluation_data", "AI_data", "2_Jednoduche_vetvenie",
+                         "3_Schvalovanie_dovolenky", "Schvalovanie_dovolenky_OPRAVENE.bpmn")
+SVG_NS = "http://www.w3.org/2000/svg"
+
+
+def read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+def svg_texts(svg):
+    """Text of every <text> element, lines joined by spaces."""
+    return [" ".join(span.text or "" for span in text) for text in ET.fromstring(svg).iter(f"{{{SVG_NS}}}text")]
+
+
+def test_svg_shows_every_shape_and_flow():
+    text = read(REFERENCE)
+    svg = preview.render_svg(text)
+    root = ET.fromstring(svg)
+
+    assert root.tag == f"{{{SVG_NS}}}svg"
+    assert len(root.findall(f".//{{{SVG_NS}}}polyline")) == text.count("<bpmndi:BPMNEdge")
+    texts = svg_texts(svg)
+    for name in ("Schvaľovanie dovolenky", "Personalista", "Prepracuj žiadosť", "Schválená?", "Koniec procesu"):
+        assert name in texts
+
+def test_width_scales_the_svg():
+    root = ET.fromstring(preview.render_svg(read(REFERENCE), width=480))
+    view_width, view_height = (float(value) for value in root.get("viewBox").split()[2:])
+
+    assert root.get("width") == "480"
+    assert int(root.get("height")) == round(480 * view_height / view_width)
+
+def test_names_are_escaped():
+    svg = preview.render_svg(read(REFERENCE).replace('name="Prepracuj žiadosť"', 'name="Prepracuj &lt;žiadosť&gt; &amp; pošli"'))
+    assert "Prepracuj <žiadosť> & pošli" in svg_texts(svg)
+
+@pytest.mark.parametrize("text, message", [
+    ("<definitions", "not valid XML"),
+    ('<definitions xmlns="http://www.omg.org/spec/BPMN/20100524/MODEL"><process id="P" /></definitions>', "no diagram"),
+])
+def test_document_without_diagram_is_rejected(text, message):
+    with pytest.raises(PreviewError, match=message):
+        preview.render_svg(text)
+
+def test_previews_are_rendered_once_per_document():
+    cache = PreviewCache()
+    loads = []
+
+    def load_xml():
+        loads.append(1)
+        return read(REFERENCE)
+
+    first = cache.get("hash", load_xml, "svg", 480)
+    assert cache.get("hash", load_xml, "svg", 480) is first
+    cache.get("hash", load_xml, "svg", None)
+    assert len(loads) == 2
+    assert cache.stats()["hits"] == 1
+
+def test_stored_diagram_preview_is_served():
+    client = app_module.app.test_client()
+    diagram_id = app_module.diagram_store.put(read(REFERENCE))
+
+    response = client.get(f"/preview/{diagram_id}.svg?width=10", headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert response.content_type.startswith("image/svg+xml")
+    assert ET.fromstring(response.get_data()).get("width") == str(preview.MIN_WIDTH)
+
+    assert client.get(f"/preview/{diagram_id}.gif").status_code == 404
+
+@pytest.mark.skipif(preview.cairosvg is None, reason="needs cairosvg and the cairo library")
+def test_png_preview():
+    assert preview.render_png(read(REFERENCE), width=320).startswith(b"\x89PNG")
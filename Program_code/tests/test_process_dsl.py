@@ -0,0 +1,55 @@
+import os
+import glob
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import process_dsl
+from layout import BPMN_MODEL_NS, qname
+from process_dsl import DslError
+
+CORPUS = os.path.join(os.path.dirname(__file__), "..", "..", "Evaluation_data")
+DOCUMENTS = sorted(glob.glob(os.path.join(CORPUS, "**", "*.bpmn"), recursive=True))
+
+
+def read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+def lane_members(xml_text):
+    root = ET.fromstring(xml_text.encode("utf-8"))
+    return {lane.get("name"): {(ref.text or "").strip() for ref in lane.iter(qname(BPMN_MODEL_NS, "flowNodeRef"))}
+            for lane in root.iter(qname(BPMN_MODEL_NS, "lane"))}
+
+
+@pytest.mark.parametrize("path", DOCUMENTS, ids=os.path.basename)
+def test_corpus_document_round_trips(path):
+    description = process_dsl.decompile_bpmn(read(path))
+    compiled = process_dsl.compile_dsl(description)
+    assert process_dsl.decompile_bpmn(compiled) == description
+
+def test_elements_outside_of_lanes_stay_outside():
+    description = """process Test
+and G1
+lane Autor
+  start S1 Začiatok
+  task T1 Napíš
+lane Recenzent
+  task T2 Skontroluj
+  end E1 Koniec
+flow
+  S1 -> G1 -> T1 -> T2 -> E1
+"""
+    compiled = process_dsl.compile_dsl(description)
+    assert lane_members(compiled) == {"Autor": {"S1", "T1"}, "Recenzent": {"T2", "E1"}}
+    assert process_dsl.decompile_bpmn(compiled) == description
+
+def test_unknown_flow_reference_is_reported_with_its_line():
+    with pytest.raises(DslError) as error:
+        process_dsl.parse_dsl("process Test\nlane A\n  start S1\n  end E1\nflow\n  S1 -> X1 -> E1\n")
+    assert "X1" in str(error.value)
+    assert error.value.line == 6
+
+def test_description_without_lanes_is_rejected():
+    with pytest.raises(DslError):
+        process_dsl.parse_dsl("process Test\nstart S1\nend E1\nflow\n  S1 -> E1\n")
@@ -0,0 +1,107 @@
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import main
+import refine
+from layout import BPMN_MODEL_NS, BPMN_DI_NS, DC_NS, qname
+from process_dsl import DslError
+
+REFERENCE = os.path.join(os.path.dirname(__file__), "..", "..", "Evaluation_data", "AI_data", "2_Jednoduche_vetvenie",
+                         "3_Schvalovanie_dovolenky", "Schvalovanie_dovolenky_OPRAVENE.bpmn")
+
+
+@pytest.fixture
+def diagram():
+    with open(REFERENCE, "r", encoding="utf-8") as f:
+        return f.read()
+
+def element(xml_text, element_id):
+    root = ET.fromstring(xml_text.encode("utf-8"))
+    return next((e for e in root.iter() if e.get("id") == element_id), None)
+
+def bounds(xml_text, element_id):
+    root = ET.fromstring(xml_text.encode("utf-8"))
+    shape = next(s for s in root.iter(qname(BPMN_DI_NS, "BPMNShape")) if s.get("bpmnElement") == element_id)
+    return {name: float(value) for name, value in shape.find(qname(DC_NS, "Bounds")).attrib.items()}
+
+def flows(xml_text):
+    root = ET.fromstring(xml_text.encode("utf-8"))
+    return {(f.get("sourceRef"), f.get("targetRef")) for f in root.iter(qname(BPMN_MODEL_NS, "sequenceFlow"))}
+
+
+def test_rename_keeps_the_layout(diagram):
+    refined = refine.apply_edits(diagram, refine.parse_edits("rename Task_3 Over žiadosť\nprocess Dovolenka"))
+    assert element(refined, "Task_3").get("name") == "Over žiadosť"
+    assert bounds(refined, "Task_3") == bounds(diagram, "Task_3")
+    assert "process Dovolenka" in refine.describe_diagram(refined)
+
+def test_added_element_is_connected_and_drawn(diagram):
+    edits = "lane Personalista\nadd task T9 Archivuj žiadosť\ndisconnect Task_8 -> EndEvent_1\nconnect Task_8 -> T9 -> EndEvent_1"
+    refined = refine.apply_edits(diagram, refine.parse_edits(edits))
+
+    assert {("Task_8", "T9"), ("T9", "EndEvent_1")} <= flows(refined)
+    assert ("Task_8", "EndEvent_1") not in flows(refined)
+    assert bounds(refined, "T9")["width"] > 0
+
+def all_bounds(xml_text):
+    root = ET.fromstring(xml_text.encode("utf-8"))
+    return {shape.get("bpmnElement"): bounds(xml_text, shape.get("bpmnElement")) for shape in root.iter(qname(BPMN_DI_NS, "BPMNShape"))}
+
+def overlaps(a, b):
+    return a["x"] < b["x"] + b["width"] and b["x"] < a["x"] + a["width"] and a["y"] < b["y"] + b["height"] and b["y"] < a["y"] + a["height"]
+
+def test_added_element_keeps_the_other_shapes(diagram):
+    edits = "lane Personalista\nadd task T9 Archivuj žiadosť\ndisconnect Task_8 -> EndEvent_1\nconnect Task_8 -> T9 -> EndEvent_1"
+    refined = refine.apply_edits(diagram, refine.parse_edits(edits))
+    before, after = all_bounds(diagram), all_bounds(refined)
+
+    pool_and_lanes = {"Participant_1", "Lane_1", "Lane_2", "Lane_3"}
+    assert {key: after[key] for key in before if key not in pool_and_lanes} == {key: before[key] for key in before if key not in pool_and_lanes}
+    # Placed in the lane of Personalista right of its predecessor, without overlapping other shapes
+    lane = after["Lane_3"]
+    assert lane["y"] <= after["T9"]["y"] and after["T9"]["y"] + after["T9"]["height"] <= lane["y"] + lane["height"]
+    assert after["T9"]["x"] > after["Task_8"]["x"] + after["Task_8"]["width"]
+    assert not any(overlaps(after["T9"], after[key]) for key in after if key not in pool_and_lanes | {"T9"})
+    # The pool and its lanes grow to hold the new shape
+    assert after["T9"]["x"] + after["T9"]["width"] < after["Participant_1"]["x"] + after["Participant_1"]["width"]
+    assert after["Lane_3"]["x"] + after["Lane_3"]["width"] == after["Participant_1"]["x"] + after["Participant_1"]["width"]
+
+def test_moved_element_is_shifted_into_the_new_lane(diagram):
+    refined = refine.apply_edits(diagram, refine.parse_edits("lane Zamestnanec\nmove Task_8\nlane Archív\nadd end E9 Archivované\nconnect Task_7 -> E9"))
+    before, after = all_bounds(diagram), all_bounds(refined)
+
+    lane = after["Lane_1"]
+    assert lane["y"] <= after["Task_8"]["y"] and after["Task_8"]["y"] + after["Task_8"]["height"] <= lane["y"] + lane["height"]
+    assert all(after[key] == before[key] for key in ("Task_1", "Task_7", "EndEvent_1", "Gateway_1"))
+    # The new lane is added below the others and the pool grows down to hold it
+    new_lane = next(key for key in after if key not in before and key != "E9")
+    assert after[new_lane]["y"] == before["Lane_3"]["y"] + before["Lane_3"]["height"]
+    assert after["Participant_1"]["y"] + after["Participant_1"]["height"] == after[new_lane]["y"] + after[new_lane]["height"]
+    assert after[new_lane]["y"] <= after["E9"]["y"] < after[new_lane]["y"] + after[new_lane]["height"]
+
+def test_remove_drops_the_flows_of_the_element(diagram):
+    refined = refine.apply_edits(diagram, refine.parse_edits("remove Task_6\nconnect Gateway_1 -[Nie]-> Task_5"))
+    assert element(refined, "Task_6") is None
+    assert not any("Task_6" in flow for flow in flows(refined))
+
+def test_operation_on_unknown_element_is_rejected(diagram):
+    with pytest.raises(DslError):
+        refine.apply_edits(diagram, refine.parse_edits("rename Task_99 Nový názov"))
+
+def test_cached_edits_are_applied_to_the_current_layout(diagram):
+    edits = "rename Task_1 Vyplň žiadosť"
+    cached = {"bpmn_content": refine.apply_edits(diagram, refine.parse_edits(edits)), "edits": edits, "model": main.DEFAULT_MODEL}
+
+    # The user moved Task_1 before refining again - same content, other layout
+    moved = diagram.replace(f'x="{bounds(diagram, "Task_1")["x"]:g}"', f'x="{bounds(diagram, "Task_1")["x"] + 40:g}"', 1)
+    assert bounds(moved, "Task_1") != bounds(diagram, "Task_1")
+
+    result = main.apply_cached_edits(cached, moved)
+    assert "edits" not in result
+    assert element(result["bpmn_content"], "Task_1").get("name") == "Vyplň žiadosť"
+    assert bounds(result["bpmn_content"], "Task_1") == bounds(moved, "Task_1")
+
+def test_cached_entry_without_edits_is_a_miss(diagram):
+    assert main.apply_cached_edits({"bpmn_content": diagram}, diagram) is None
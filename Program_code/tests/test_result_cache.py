@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+import time
+import subprocess
+
+from result_cache import ResultCache
+
+PROGRAM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_database_is_created_on_first_use(tmp_path):
+    db_path = tmp_path / "data" / "results.sqlite3"
+    cache = ResultCache(str(db_path))
+    assert not db_path.parent.exists()
+
+    cache.put("key", {"bpmn_xml": "<definitions/>"})
+    assert db_path.exists()
+
+def test_import_writes_nothing_and_paths_follow_the_application_directory(tmp_path):
+    env = {name: value for name, value in os.environ.items() if name != "DATA_DIR" and not name.endswith("_DB")}
+    env["PYTHONPATH"] = PROGRAM_DIR
+    script = "import main; print(main.DATA_DIR); print(main.RESULT_CACHE.db_path)"
+    output = subprocess.run(
+        [sys.executable, "-c", script], cwd=tmp_path, env=env, capture_output=True, text=True, check=True
+    ).stdout.split()
+
+    assert output == [os.path.join(PROGRAM_DIR, "cache"), os.path.join(PROGRAM_DIR, "cache", "results.sqlite3")]
+    assert list(tmp_path.iterdir()) == []
+
+def test_miss_then_hit_from_memory_and_disk(tmp_path):
+    cache = ResultCache(str(tmp_path / "results.sqlite3"))
+    assert cache.get("key") is None
+
+    cache.put("key", {"bpmn_xml": "<definitions/>"})
+    assert cache.get("key") == {"bpmn_xml": "<definitions/>"}
+
+    # A second process shares only the disk tier
+    other = ResultCache(str(tmp_path / "results.sqlite3"))
+    assert other.get("key") == {"bpmn_xml": "<definitions/>"}
+
+    assert cache.stats()["memory_hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert other.stats()["disk_hits"] == 1
+
+def test_only_temperature_zero_is_served_unless_forced(tmp_path):
+    cache = ResultCache(str(tmp_path / "results.sqlite3"))
+    cache.put("key", {"bpmn_xml": "<definitions/>"})
+
+    assert cache.get("key", temperature=0.5) is None
+    assert cache.get("key", temperature=0.5, force=True) is not None
+    assert cache.stats()["bypassed"] == 1
+
+def test_memory_tier_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(None, memory_entries=2)
+    cache.put("a", {"value": 1})
+    cache.put("b", {"value": 2})
+    cache.get("a")
+    cache.put("c", {"value": 3})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"value": 1}
+    assert cache.get("c") == {"value": 3}
+
+def test_disk_tier_evicts_least_recently_read_over_the_size_limit(tmp_path):
+    entry = {"bpmn_xml": "x" * 100}
+    size = len(json.dumps(entry))
+    cache = ResultCache(str(tmp_path / "results.sqlite3"), memory_entries=0, max_disk_bytes=2 * size)
+
+    cache.put("a", entry)
+    time.sleep(0.01)
+    cache.put("b", entry)
+    time.sleep(0.01)
+    cache.get("a")
+    time.sleep(0.01)
+    cache.put("c", entry)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == entry
+    assert cache.get("c") == entry
+    assert cache.stats()["disk_entries"] == 2
+
+def test_expired_entries_are_not_served(tmp_path):
+    cache = ResultCache(str(tmp_path / "results.sqlite3"), ttl=0)
+    cache.put("key", {"bpmn_xml": "<definitions/>"})
+    time.sleep(0.01)
+
+    assert cache.get("key") is None
@@ -0,0 +1,56 @@
+from scheduler import ModelCallScheduler, parse_hedge_models
+from fake_client import FakeClient, FakeStream
+
+MODEL = "test-model"
+FAST_MODEL = "fast-model"
+
+
+def run(scheduler, client):
+    return [(kind, event) for kind, event in scheduler.stream(client, MODEL, max_tokens=1000, messages=[])]
+
+
+def test_parse_hedge_models():
+    assert parse_hedge_models("") == {}
+    assert parse_hedge_models(f"{MODEL}, other={FAST_MODEL}") == {MODEL: MODEL, "other": FAST_MODEL}
+
+def test_models_without_hedging_are_not_hedged():
+    scheduler = ModelCallScheduler(hedge_delay=0.02, min_hedge_delay=0.01)
+    client = FakeClient(FakeStream(["<bpmn"], delay=0.2))
+
+    events = run(scheduler, client)
+    assert events[-1][0] == "final"
+    assert client.models == [MODEL]
+    assert scheduler.stats()["hedges"] == 0
+
+def test_hedged_attempt_wins_and_loser_wait_is_recorded():
+    scheduler = ModelCallScheduler(hedge_models={MODEL: FAST_MODEL}, hedge_delay=0.05, min_hedge_delay=0.01)
+    client = FakeClient(FakeStream(["<bpmn"], delay=1.0), FakeStream(["<bpmn"]))
+
+    events = run(scheduler, client)
+    attempt = next(event for kind, event in events if kind == "attempt")
+    assert attempt == {"number": 2, "model": FAST_MODEL, "hedge": True}
+    assert client.models == [MODEL, FAST_MODEL]
+    assert scheduler.stats()["hedge_wins"] == 1
+
+    # The primary attempt waited at least the hedge delay without writing - counted as a lower bound
+    waited = scheduler.latency.percentile(MODEL, "first_token", 100)
+    assert waited is not None and waited >= 0.05
+
+def test_losing_and_failed_attempts_are_reported_as_discarded():
+    import httpx
+
+    scheduler = ModelCallScheduler(hedge_models={MODEL: FAST_MODEL}, hedge_delay=0.05, min_hedge_delay=0.01, backoff_base=0.0)
+    client = FakeClient(FakeStream(["<bpmn", "abcdefg"], error=httpx.ReadError("connection lost")),
+                        FakeStream(["<bpmn"], delay=1.0), FakeStream(["<bpmn"]))
+    discarded = []
+
+    events = list(scheduler.stream(client, MODEL, max_tokens=1000, messages=[],
+                                   on_discarded=lambda model, usage: discarded.append((model, usage))))
+    assert events[-1][0] == "final"
+    assert client.models == [MODEL, MODEL, FAST_MODEL]
+
+    # The attempt that failed while writing and the losing primary of the retry are paid for as well
+    assert [model for model, _ in discarded] == [MODEL, MODEL]
+    failed, loser = discarded[0][1], discarded[1][1]
+    assert failed["input_tokens"] == 700 and failed["output_tokens"] == 3  # 12 characters streamed
+    assert loser["input_tokens"] == 700 and loser["output_tokens"] == 0
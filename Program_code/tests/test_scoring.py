@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+
+import scoring
+
+REFERENCE = os.path.join(os.path.dirname(__file__), "..", "..", "Evaluation_data", "AI_data", "2_Jednoduche_vetvenie",
+                         "3_Schvalovanie_dovolenky", "Schvalovanie_dovolenky_OPRAVENE.bpmn")
+
+
+def read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def test_reference_scored_against_itself_passes_every_check():
+    row = scoring.score_document(read(REFERENCE), REFERENCE)
+
+    assert row["score"] == 1.0
+    assert all(row[check] for check in (*scoring.LAYOUT_CHECKS, *scoring.STRUCTURE_CHECKS))
+    assert (row["shapes"], row["lanes"], row["activities"], row["matched_activities"]) == (11, 3, 8, 8)
+
+def test_renamed_activity_is_missing_and_extra():
+    text = read(REFERENCE).replace('name="Prepracuj žiadosť"', 'name="Objednaj kávu"')
+    row = scoring.score_document(text, REFERENCE)
+
+    assert (row["matched_activities"], row["extra_activities"]) == (7, 1)
+    assert not row["coverage"] and not row["no_extra"]
+    assert row["score"] == round(12 / 14, 4)
+
+def test_document_without_diagram_is_scored_on_structure_only():
+    text = read(REFERENCE)
+    text = text[:text.index("<bpmndi:BPMNDiagram")] + "</bpmn:definitions>"
+    row = scoring.score_document(text, REFERENCE)
+
+    assert "no_overlaps" not in row
+    assert row["score"] == 1.0
+
+def test_malformed_file_is_recorded_as_error(tmp_path):
+    path = tmp_path / "broken.bpmn"
+    path.write_text("<definitions>", encoding="utf-8")
+    row = scoring.score_file(str(path))
+
+    assert row["score"] == 0.0 and row["error"]
+
+def test_pairwise_geometry():
+    boxes = np.array([[0, 0, 100, 80], [50, 40, 150, 120], [110, 0, 210, 80], [400, 0, 500, 80]], dtype=float)
+    overlaps = scoring.pairwise_overlaps(boxes)
+    assert overlaps[0, 1] and not overlaps[0, 2] and not overlaps[0, 3]
+    assert scoring.pairwise_gaps(boxes)[0, 2] == 10
+
+    segments = np.array([[0, 50, 100, 50], [50, 0, 50, 100], [100, 50, 200, 50]], dtype=float)
+    crossings = scoring.pairwise_crossings(segments)
+    assert crossings[0, 1] and not crossings[0, 2]
+
+    through = scoring.segments_through_boxes(segments, np.array([[140, 0, 160, 100]], dtype=float))
+    assert through[:, 0].tolist() == [False, False, True]
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from stream_validator import IncrementalBpmnValidator, IncrementalDslValidator, StreamValidationError, MAX_PREAMBLE_CHARS
+
+REFERENCE = os.path.join(os.path.dirname(__file__), "..", "..", "Evaluation_data", "AI_data", "2_Jednoduche_vetvenie",
+                         "3_Schvalovanie_dovolenky", "Schvalovanie_dovolenky_OPRAVENE.bpmn")
+
+DOCUMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL" id="Definitions_1">
+  <bpmn:collaboration id="Collaboration_1">
+    <bpmn:participant id="Participant_1" name="Pool" processRef="{process_ref}" />
+  </bpmn:collaboration>
+  <bpmn:process id="Process_1">
+    {lanes}
+  </bpmn:process>
+</bpmn:definitions>"""
+
+LANES = '<bpmn:laneSet id="LaneSet_1"><bpmn:lane id="Lane_1" name="Role" /></bpmn:laneSet>'
+
+
+def read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+def stream(validator, text, chunk_size=50):
+    for start in range(0, len(text), chunk_size):
+        validator.feed(text[start:start + chunk_size])
+    return validator
+
+
+def test_corpus_document_streamed_in_chunks_is_complete():
+    validator = stream(IncrementalBpmnValidator(), "Here is the diagram:\n```xml\n" + read(REFERENCE) + "\n```")
+    assert validator.complete
+    assert validator.processes
+
+def test_truncated_document_is_not_complete():
+    text = read(REFERENCE)
+    validator = stream(IncrementalBpmnValidator(), text[:len(text) // 2])
+    assert not validator.complete
+
+@pytest.mark.parametrize("text, message", [
+    (DOCUMENT.format(process_ref="Process_1", lanes="<bpmn:task id='Task_1'></bpmn:lane>"), "Malformed XML"),
+    ('<definitions xmlns="http://example.com/other"></definitions>', "wrong namespace"),
+    ('<?xml version="1.0"?><bpmn:process xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL" />', "Unexpected root"),
+    (DOCUMENT.format(process_ref="Process_1", lanes=""), "has no lanes"),
+    (DOCUMENT.format(process_ref="Process_2", lanes=LANES), "unknown process"),
+], ids=["malformed", "namespace", "root", "lanes", "pool"])
+def test_invalid_document_is_rejected(text, message):
+    with pytest.raises(StreamValidationError, match=message):
+        stream(IncrementalBpmnValidator(), text)
+
+def test_valid_document_passes():
+    assert stream(IncrementalBpmnValidator(), DOCUMENT.format(process_ref="Process_1", lanes=LANES)).complete
+
+def test_problem_answer_is_reported():
+    with pytest.raises(StreamValidationError) as error:
+        stream(IncrementalBpmnValidator(), "PROBLÉM: popis neobsahuje žiadny proces.")
+    assert error.value.problem
+
+def test_response_without_xml_is_rejected():
+    with pytest.raises(StreamValidationError, match="does not contain BPMN XML"):
+        stream(IncrementalBpmnValidator(), "x" * (MAX_PREAMBLE_CHARS + 1), chunk_size=1000)
+
+def test_invalid_dsl_line_is_rejected():
+    validator = IncrementalDslValidator()
+    validator.feed("process Test\nlane Role\n  start S1 Začiatok\n")
+    with pytest.raises(StreamValidationError, match="unknown element kind"):
+        validator.feed("  widget W1 Niečo\n")
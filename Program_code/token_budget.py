@@ -0,0 +1,212 @@
+"""
+Prediction of the output token limit (max_tokens) for a generation.
+
+The size of a generated diagram grows with the number of steps, branches and roles of the
+described process. The prediction starts from per-format coefficients calibrated on the
+evaluation data and is corrected by the output token counts of past generations stored in
+SQLite, so it follows the models and prompts actually in use.
+"""
+import os
+import re
+import math
+import time
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Numbered ("1.", "4.2.1.") or bulleted list items of a process description
+STEP_PATTERN = re.compile(r"^\s*(?:\d+(?:\.\d+)*\.?|[-*•])\s+(\S.*)$")
+# Words announcing a decision, alternative or parallel branches (Slovak and English descriptions)
+BRANCH_PATTERN = re.compile(
+    r"\b(?:ak|ak nie|inak|v prípade|pri|v opačnom prípade|alebo|súbežne|paralelne|zároveň|podľa potreby|"
+    r"if|otherwise|else|in case|in parallel|simultaneously|either)\b",
+    re.IGNORECASE
+)
+# Leading words of a step that are not a role ("Po dokončení ...", "V prípade ...")
+NON_ROLE_WORDS = {
+    "po", "pri", "v", "ak", "na", "súbežne", "paralelne", "následne", "potom", "zároveň", "podľa", "inak",
+    "after", "if", "when", "then", "in", "otherwise", "once", "the", "a", "an",
+}
+
+# Output tokens per process feature by response format: (base, per step, per branch, per role).
+# Calibrated on Evaluation_data/AI_data - the full BPMN XML includes the diagram section,
+# the compact format and edit operations are about an order of magnitude smaller. A segment of
+# a decomposed process ("segment") gets the whole description, so its prior is that of the whole
+# process and the history of segment generations scales it down.
+FORMAT_COEFFICIENTS = {
+    "xml": (700, 180, 30, 100),
+    "dsl": (60, 14, 3, 8),
+    "edits": (60, 6, 2, 2),
+    "plan": (60, 8, 2, 10),
+    "segment": (60, 14, 3, 8),
+}
+
+# Generations kept in the history database
+MAX_HISTORY_ROWS = 5000
+
+
+def count_features(text):
+    """
+    Count steps, branches and roles of a process description.
+    Steps are list items (sentences for free text), branches are items introducing sub-items
+    and branching words, roles are the distinct subjects that steps start with.
+    """
+    lines = [line for line in (text or "").splitlines() if line.strip()]
+    items = [match.group(1) for match in map(STEP_PATTERN.match, lines) if match]
+    if not items:
+        items = [s.strip() for s in re.split(r"(?<=[.!?])\s+", " ".join(lines)) if len(s.strip()) > 3]
+
+    roles = set()
+    for item in items:
+        words = item.split()
+        if words and words[0].lower().strip(",:") not in NON_ROLE_WORDS and words[0][0].isupper():
+            roles.add(words[0].lower())
+
+    branches = sum(1 for item in items if item.rstrip().endswith(":"))
+    branches += len(BRANCH_PATTERN.findall(text or ""))
+    return {"steps": len(items), "branches": branches, "roles": max(1, len(roles))}
+
+def estimate_tokens(features, output_format="xml"):
+    """Prior estimate of the output tokens for process features, before any history."""
+    base, per_step, per_branch, per_role = FORMAT_COEFFICIENTS.get(output_format, FORMAT_COEFFICIENTS["xml"])
+    return base + per_step * features["steps"] + per_branch * features["branches"] + per_role * features["roles"]
+
+
+class TokenBudgetPredictor:
+    """
+    Predicts max_tokens for a generation from the process description and past generations.
+
+    The prior estimate is multiplied by a high quantile of the actual/estimated ratios of recent
+    generations with the same response format (and model, when it has enough of them) and by
+    a safety margin, then rounded up to a multiple of step and kept within the bounds.
+    """
+
+    def __init__(self, db_path, margin=1.2, quantile=0.9, history=50, min_samples=5,
+                 min_tokens=1000, max_tokens=32000, step=500, enabled=True):
+        self.db_path = db_path
+        self.margin = margin
+        self.quantile = quantile
+        self.history = history
+        self.min_samples = min_samples
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.step = step
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._counters = {"predictions": 0, "from_history": 0, "records": 0}
+
+        self._db_ready = False
+        self._db_lock = threading.Lock()
+
+    def _connect(self):
+        """Open a new SQLite connection; the database is created on first use, not when the object is made."""
+        if not self._db_ready:
+            with self._db_lock:
+                if not self._db_ready:
+                    self._init_db()
+                    self._db_ready = True
+        return self._open()
+
+    def _open(self):
+        """Open a new SQLite connection - one per operation keeps it safe across threads and processes."""
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def _init_db(self):
+        """Create the history database and table if they do not exist yet."""
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._open() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS generations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    output_format TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    estimate INTEGER NOT NULL,
+                    output_tokens INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS generations_format ON generations (output_format, model)")
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _ratios(self, output_format, model):
+        """Actual/estimated ratios of recent generations, of the model if it has enough of them."""
+        if not (self.enabled and self.db_path):
+            return []
+        try:
+            with self._connect() as connection:
+                for query, args in (
+                    ("output_format = ? AND model = ?", (output_format, model or "")),
+                    ("output_format = ?", (output_format,)),
+                ):
+                    rows = connection.execute(
+                        f"SELECT output_tokens, estimate FROM generations WHERE {query} ORDER BY id DESC LIMIT ?",
+                        (*args, self.history)
+                    ).fetchall()
+                    if len(rows) >= self.min_samples:
+                        return [output_tokens / estimate for output_tokens, estimate in rows if estimate > 0]
+        except sqlite3.Error as e:
+            logger.warning(f"Token history read failed: {str(e)}")
+        return []
+
+    def _ratio(self, output_format, model, quantile):
+        """Quantile of the actual/estimated ratios of recent generations, None without history."""
+        ratios = sorted(self._ratios(output_format, model))
+        if not ratios:
+            return None
+        return ratios[min(len(ratios) - 1, int(quantile * len(ratios)))]
+
+    def predict(self, text, output_format="xml", model=None, limit=None):
+        """Return max_tokens for a generation of the description; limit is the model's maximum output."""
+        estimate = estimate_tokens(count_features(text), output_format)
+        self._count("predictions")
+
+        ratio = self._ratio(output_format, model, self.quantile)
+        if ratio is None:
+            ratio = 1.0
+        else:
+            self._count("from_history")
+
+        tokens = math.ceil(estimate * ratio * self.margin / self.step) * self.step
+        upper = min(self.max_tokens, limit) if limit else self.max_tokens
+        return max(min(self.min_tokens, upper), min(tokens, upper))
+
+    def expected(self, text, output_format="xml", model=None):
+        """
+        Return the expected output tokens of a generation - the median of the history without the
+        safety margin, as opposed to the limit returned by predict (used to reserve rate limits).
+        """
+        estimate = estimate_tokens(count_features(text), output_format)
+        ratio = self._ratio(output_format, model, 0.5)
+        return max(1, int(estimate * (ratio if ratio is not None else 1.0)))
+
+    def record(self, text, output_format, model, output_tokens):
+        """Store the output token count of a finished generation for later predictions."""
+        if not (self.enabled and self.db_path) or output_tokens <= 0:
+            return
+        estimate = estimate_tokens(count_features(text), output_format)
+        try:
+            with self._connect() as connection:
+                connection.execute(
+                    "INSERT INTO generations (output_format, model, estimate, output_tokens, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (output_format, model or "", estimate, output_tokens, time.time())
+                )
+                # Only recent generations are used, older ones are dropped
+                connection.execute("DELETE FROM generations WHERE id <= (SELECT MAX(id) FROM generations) - ?", (MAX_HISTORY_ROWS,))
+            self._count("records")
+        except sqlite3.Error as e:
+            logger.warning(f"Token history write failed: {str(e)}")
+
+    def stats(self):
+        """Return prediction counters."""
+        with self._lock:
+            return dict(self._counters)